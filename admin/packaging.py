@@ -621,6 +621,8 @@ def omnibus_package_builder(
                      flocker_node_path),
                     (FilePath('/opt/flocker/bin/flocker-changestate'),
                      flocker_node_path),
+                    (FilePath('/opt/flocker/bin/flocker-relay'),
+                     flocker_node_path),
                     (FilePath('/opt/flocker/bin/flocker-volume'),
                      flocker_node_path),
                 ]
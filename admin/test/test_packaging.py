@@ -802,6 +802,8 @@ class OmnibusPackageBuilderTests(TestCase):
                          flocker_node_path),
                         (FilePath('/opt/flocker/bin/flocker-changestate'),
                          flocker_node_path),
+                        (FilePath('/opt/flocker/bin/flocker-relay'),
+                         flocker_node_path),
                         (FilePath('/opt/flocker/bin/flocker-volume'),
                          flocker_node_path),
                     ]
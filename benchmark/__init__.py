@@ -0,0 +1,8 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Benchmarks for Flocker which are not shipped with Flocker.
+
+Each benchmark is a module which can be run from the top-level of the
+repository using ``python -m benchmark.<name>``.
+"""
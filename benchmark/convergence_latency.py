@@ -0,0 +1,248 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time converging a node by running ``flocker-changestate`` in a new process,
+as ``flocker-deploy`` does by default, against posting the configuration to
+a running ``flocker-serve``, as it does with ``--api-port``::
+
+    python -m benchmark.convergence_latency --nodes 20 --applications 20
+
+Both paths parse the same configuration and run the real ``Deployer``, but
+against in-memory Docker and networking which already match the
+configuration and a volume pool in a temporary directory.  What is measured
+is therefore the overhead each path adds to a convergence: starting Python,
+importing, parsing and discovery for ``flocker-changestate``, and an HTTP
+request for ``flocker-serve``.  ZFS pool startup, which only
+``flocker-changestate`` pays, is not included, and neither is the SSH
+connection both paths need in a real cluster.
+"""
+
+from __future__ import print_function
+
+import pickle
+import sys
+from subprocess import PIPE, Popen
+from tempfile import mkdtemp
+from time import time
+
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+HOSTNAME = u"node0.example.com"
+
+
+class ConvergenceLatencyOptions(Options):
+    """
+    Command line options for the ``convergence_latency`` benchmark.
+    """
+    optParameters = [
+        ["nodes", None, 20, "The number of nodes in the cluster.", int],
+        ["applications", None, 20,
+         "The number of applications on each node.", int],
+        ["repeat", None, 10, "The number of convergences to time.", int],
+        ["changestate", None, None,
+         "Internal: converge as flocker-changestate does, with the fake "
+         "node state pickled in this file."],
+    ]
+
+
+def make_configuration(nodes, applications):
+    """
+    Generate the configuration ``flocker-deploy`` gives each node.
+
+    :return: A three-tuple of the YAML deployment and application
+        configurations as ``bytes`` and the current cluster state, which is
+        the desired state on every node but ``HOSTNAME``.
+    """
+    from flocker.common import safe_dump
+
+    application_config = {}
+    deployment_config = {}
+    cluster_state = {}
+    for node in range(nodes):
+        hostname = u"node{}.example.com".format(node)
+        node_state = {}
+        for i in range(applications):
+            name = u"app-{}-{}".format(node, i)
+            application_config[name] = node_state[name] = {
+                u"image": u"clusterhq/example-{}:v1".format(i % 10),
+                u"ports": [{u"internal": 80,
+                            u"external": 10000 + node * applications + i}],
+            }
+            deployment_config.setdefault(hostname, []).append(name)
+        cluster_state[hostname] = {
+            u"version": 1, u"applications": node_state,
+            u"not_running": [], u"proxied_ports": [],
+        }
+    cluster_state[HOSTNAME][u"applications"] = {}
+    return (
+        safe_dump({u"version": 1, u"nodes": deployment_config}),
+        safe_dump({u"version": 1, u"applications": application_config}),
+        cluster_state,
+    )
+
+
+def volume_service(reactor, directory):
+    """
+    Create and start a volume service with its pool in ``directory``.
+    """
+    from flocker.volume.service import VolumeService
+    from flocker.volume.filesystems.memory import FilesystemStoragePool
+
+    service = VolumeService(
+        directory.child(b"volume.json"),
+        FilesystemStoragePool(directory.child(b"pool")), reactor)
+    service.startService()
+    return service
+
+
+def changestate(reactor, state_path):
+    """
+    Converge ``HOSTNAME`` on the configuration on standard input, as
+    ``flocker-changestate --stdin`` does.
+
+    :param bytes state_path: The file ``serve`` pickled the Docker units,
+        proxies and volume directory of the node to.
+    """
+    from flocker.node.script import ChangeStateOptions
+    from flocker.node import Deployer
+    from flocker.node._docker import FakeDockerClient
+    from flocker.route import make_memory_network
+
+    with open(state_path, "rb") as state_file:
+        units, proxies, directory = pickle.load(state_file)
+    options = ChangeStateOptions()
+    options.parseOptions([b"--stdin", HOSTNAME.encode("ascii")])
+    network = make_memory_network()
+    for proxy in proxies:
+        network.create_proxy_to(proxy.ip, proxy.port)
+    deployer = Deployer(
+        volume_service(reactor, FilePath(directory)),
+        FakeDockerClient(units), network)
+    return deployer.change_node_state(
+        desired_state=options["deployment"],
+        current_cluster_state=options["current"],
+        hostname=options["hostname"])
+
+
+def run_sequentially(function, times):
+    """
+    Call a function returning a ``Deferred`` a number of times, waiting for
+    each call to finish before making the next.
+
+    :return: A ``Deferred`` which fires with a ``list`` of the elapsed wall
+        clock time of each call.
+    """
+    from twisted.internet.defer import succeed
+
+    elapsed = []
+    d = succeed(None)
+    for _ in range(times):
+        def call(_):
+            start = time()
+            calling = function()
+            calling.addCallback(lambda _: elapsed.append(time() - start))
+            return calling
+        d.addCallback(call)
+    d.addCallback(lambda _: elapsed)
+    return d
+
+
+def serve(reactor, options):
+    """
+    Converge ``HOSTNAME`` through ``flocker-changestate`` processes, then
+    through the API of an in-process ``flocker-serve``, and print how long
+    each convergence took.
+    """
+    import treq
+    from twisted.web.server import Site
+
+    from flocker.cli.script import api_configuration, changestate_input
+    from flocker.node import Deployer
+    from flocker.node._converge import ConvergenceService
+    from flocker.node._docker import FakeDockerClient
+    from flocker.node.httpapi import ConvergenceAPIUser
+    from flocker.route import make_memory_network
+
+    deployment_config, application_config, cluster_state = (
+        make_configuration(options["nodes"], options["applications"]))
+    directory = FilePath(mkdtemp())
+    docker_client = FakeDockerClient()
+    network = make_memory_network()
+    deployer = Deployer(
+        volume_service(reactor, directory), docker_client, network)
+    convergence = ConvergenceService(reactor, deployer, interval=3600)
+    convergence.startService()
+    port = reactor.listenTCP(
+        0, Site(ConvergenceAPIUser(convergence).app.resource()),
+        interface="127.0.0.1")
+    body = api_configuration(
+        deployment_config, application_config, cluster_state)(HOSTNAME)
+    stdin = changestate_input(
+        deployment_config, application_config, cluster_state)([HOSTNAME])
+    state_path = directory.child(b"state.pickle")
+
+    def post():
+        posting = treq.post(
+            "http://127.0.0.1:{}/v1/configuration".format(
+                port.getHost().port),
+            body, headers={b"content-type": [b"application/json"]},
+            persistent=False)
+        posting.addCallback(treq.json_content)
+
+        def got_result(result):
+            if result[u"error"]:
+                raise SystemExit("Convergence failed: {}".format(
+                    result[u"result"]))
+        posting.addCallback(got_result)
+        return posting
+
+    def spawn():
+        start = time()
+        process = Popen(
+            [sys.executable, b"-m", b"benchmark.convergence_latency",
+             b"--changestate", state_path.path], stdin=PIPE)
+        process.communicate(stdin)
+        if process.returncode:
+            raise SystemExit("flocker-changestate failed")
+        return time() - start
+
+    def report(name, elapsed):
+        print("{}: mean {:.3f}s, best {:.3f}s".format(
+            name, sum(elapsed) / len(elapsed), min(elapsed)))
+
+    # The first convergence starts every application; time the ones after.
+    d = post()
+
+    def converged(_):
+        state_path.setContent(pickle.dumps(
+            (docker_client._units, network.enumerate_proxies(),
+             directory.path)))
+        print("{} nodes with {} applications each, {} convergences".format(
+            options["nodes"], options["applications"], options["repeat"]))
+        report("flocker-changestate process",
+               [spawn() for i in range(options["repeat"])])
+        return run_sequentially(post, options["repeat"])
+    d.addCallback(converged)
+    d.addCallback(lambda elapsed: report("flocker-serve API", elapsed))
+    d.addCallback(lambda _: port.stopListening())
+    return d
+
+
+def main(argv):
+    from twisted.internet.task import react
+
+    options = ConvergenceLatencyOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    if options["changestate"] is not None:
+        react(changestate, [options["changestate"]])
+    else:
+        react(serve, [options])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
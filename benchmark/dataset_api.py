@@ -0,0 +1,115 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time creating many volumes through the dataset API of ``flocker-serve``,
+with one request per volume and with a single bulk request, against the
+cost of starting a ``flocker-volume`` process for each::
+
+    python -m benchmark.dataset_api --volumes 100
+
+The API manages a volume pool in a temporary directory, so what is measured
+is the overhead each way adds rather than the time ZFS takes.  For
+``flocker-volume`` only starting Python and importing the command is
+timed, which is a lower bound on what running it over SSH costs.
+"""
+
+from __future__ import print_function
+
+import sys
+from json import dumps
+from subprocess import check_call
+from tempfile import mkdtemp
+from time import time
+
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+
+class DatasetAPIOptions(Options):
+    """
+    Command line options for the ``dataset_api`` benchmark.
+    """
+    optParameters = [
+        ["volumes", None, 100, "The number of volumes to create.", int],
+    ]
+
+
+def serve(reactor, options):
+    """
+    Create volumes through an in-process dataset API and print how long
+    each way took.
+    """
+    import treq
+    from twisted.internet.defer import gatherResults
+    from twisted.web.server import Site
+
+    from flocker.volume.httpapi import DatasetAPIUser
+    from flocker.volume.service import VolumeService
+    from flocker.volume.filesystems.memory import FilesystemStoragePool
+
+    directory = FilePath(mkdtemp())
+    volume_service = VolumeService(
+        directory.child(b"volume.json"),
+        FilesystemStoragePool(directory.child(b"pool")), reactor)
+    volume_service.startService()
+    port = reactor.listenTCP(
+        0, Site(DatasetAPIUser(volume_service).app.resource()),
+        interface="127.0.0.1")
+    url = "http://127.0.0.1:{}/v1/".format(port.getHost().port)
+    count = options["volumes"]
+
+    def post(path, body):
+        posting = treq.post(
+            url + path, dumps(body),
+            headers={b"content-type": [b"application/json"]},
+            persistent=False)
+        posting.addCallback(treq.json_content)
+        return posting
+
+    def report(name, elapsed):
+        print("{}: {:.3f}s, {:.2f}ms per volume".format(
+            name, elapsed, elapsed / count * 1000))
+
+    start = time()
+    for i in range(count):
+        check_call([sys.executable, b"-c", b"import flocker.volume.script"])
+    report("flocker-volume process startup", time() - start)
+
+    start = [time()]
+    d = gatherResults([
+        post("datasets", {u"namespace": u"single", u"dataset_id": unicode(i)})
+        for i in range(count)])
+
+    def singles_done(_):
+        report("One request per volume", time() - start[0])
+        start[0] = time()
+        return post("bulk/create", {u"datasets": [
+            {u"namespace": u"bulk", u"dataset_id": unicode(i)}
+            for i in range(count)]})
+    d.addCallback(singles_done)
+
+    def bulk_done(response):
+        report("One bulk request", time() - start[0])
+        failed = [item for item in response[u"result"] if item[u"error"]]
+        if failed:
+            raise SystemExit("Bulk creation failed: {}".format(failed))
+    d.addCallback(bulk_done)
+    d.addBoth(lambda result: port.stopListening().addCallback(
+        lambda _: result))
+    return d
+
+
+def main(argv):
+    from twisted.internet.task import react
+
+    options = DatasetAPIOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    react(serve, [options])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Compare running a command on many nodes with a blocking ``ProcessNode`` per
+node in the reactor's thread pool against a ``SpawnProcessNode`` per node.
+
+A fake ``ssh`` script stands in for each connection; it ignores its arguments,
+sleeps to simulate the latency of a remote command and prints a small YAML
+document::
+
+    python -m benchmark.deploy_fanout --nodes 200 --latency 0.5
+"""
+
+from __future__ import print_function
+
+import sys
+from tempfile import mkdtemp
+from time import time
+
+from twisted.internet.defer import DeferredSemaphore, gatherResults
+from twisted.internet.task import react
+from twisted.internet.threads import deferToThread
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+from flocker.common import ProcessNode, SpawnProcessNode
+
+FAKE_SSH = b"""#!/bin/sh
+sleep %(latency)s
+echo '{}'
+"""
+
+
+class DeployFanoutOptions(Options):
+    """
+    Command line options for the ``deploy_fanout`` benchmark.
+    """
+    optParameters = [
+        ["nodes", None, 200, "The number of nodes to run the command on.",
+         int],
+        ["latency", None, 0.5,
+         "The number of seconds each fake command takes.", float],
+        ["max-connections", None, 100,
+         "The maximum number of fake commands to run at once.", int],
+    ]
+
+
+def make_fake_ssh(latency):
+    """
+    Create the fake ``ssh`` script.
+
+    :return: The ``FilePath`` of the script.
+    """
+    ssh = FilePath(mkdtemp()).child(b"ssh")
+    ssh.setContent(FAKE_SSH % dict(latency=latency))
+    ssh.chmod(0755)
+    return ssh
+
+
+def threaded(reactor, ssh, options):
+    """
+    Run the command the way ``flocker-deploy`` used to, with
+    ``deferToThread`` for each node.
+    """
+    nodes = [ProcessNode(initial_command_arguments=[ssh.path])
+             for i in range(options["nodes"])]
+    return gatherResults([
+        deferToThread(node.get_output, [b"flocker-reportstate"])
+        for node in nodes])
+
+
+def spawned(reactor, ssh, options):
+    """
+    Run the command with a ``SpawnProcessNode`` for each node, sharing a
+    limit on concurrent processes.
+    """
+    semaphore = DeferredSemaphore(options["max-connections"])
+    nodes = [SpawnProcessNode(reactor, initial_command_arguments=[ssh.path],
+                              semaphore=semaphore)
+             for i in range(options["nodes"])]
+    return gatherResults([
+        node.get_output([b"flocker-reportstate"]) for node in nodes])
+
+
+def main(reactor, *argv):
+    options = DeployFanoutOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    ssh = make_fake_ssh(options["latency"])
+    strategies = [("deferToThread", threaded), ("spawnProcess", spawned)]
+    d = gatherResults([])
+
+    for name, strategy in strategies:
+        def run(ignored, name=name, strategy=strategy):
+            start = time()
+            running = strategy(reactor, ssh, options)
+
+            def finished(outputs):
+                print("{}: {} nodes in {:.2f}s".format(
+                    name, len(outputs), time() - start))
+            running.addCallback(finished)
+            return running
+        d.addCallback(run)
+    return d
+
+
+if __name__ == '__main__':
+    react(main, sys.argv[1:])
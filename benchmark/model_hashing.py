@@ -0,0 +1,149 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time creating, hashing and comparing the models of a large deployment and
+planning the changes to it, and measure how much memory the model objects
+take::
+
+    python -m benchmark.model_hashing --applications 10000 --nodes 100
+"""
+
+from __future__ import print_function
+
+import sys
+from time import time
+
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+from flocker.node import (
+    Application, AttachedVolume, Deployment, DockerImage, Link, Node, Port,
+)
+from flocker.node._deploy import find_affected_nodes, find_volume_changes
+
+
+class ModelHashingOptions(Options):
+    """
+    Command line options for the ``model_hashing`` benchmark.
+    """
+    optParameters = [
+        ["applications", None, 10000,
+         "The number of applications in the deployment.", int],
+        ["nodes", None, 100, "The number of nodes in the deployment.", int],
+    ]
+
+
+def make_deployment(applications, nodes, offset=0):
+    """
+    Create a deployment with a volume, a port and a link for every
+    application.
+
+    :param int offset: Move each application this many nodes along, so
+        deployments with different offsets have all their volumes moving.
+
+    :return: A ``Deployment``.
+    """
+    images = [DockerImage.from_string(u"clusterhq/example-{}".format(i))
+              for i in range(10)]
+    by_node = [[] for i in range(nodes)]
+    for i in range(applications):
+        name = u"app-{}".format(i)
+        by_node[(i + offset) % nodes].append(Application(
+            name=name,
+            image=images[i % len(images)],
+            ports=frozenset([Port(internal_port=80,
+                                  external_port=10000 + i)]),
+            links=frozenset([Link(local_port=3306, remote_port=20000 + i,
+                                  alias=u"db")]),
+            volume=AttachedVolume(
+                name=name, mountpoint=FilePath(b"/var/lib/app"),
+                maximum_size=1024 * 1024 * 1024),
+        ))
+    return Deployment(nodes=frozenset(
+        Node(hostname=u"node{}.example.com".format(i),
+             applications=frozenset(node_applications))
+        for (i, node_applications) in enumerate(by_node)))
+
+
+def footprint(deployment):
+    """
+    Add up the memory taken by the model objects of a deployment, excluding
+    the values they share such as strings.
+
+    :return: The size in bytes.
+    """
+    seen = set()
+    total = 0
+    pending = [deployment]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, frozenset):
+            pending.extend(obj)
+            continue
+        if hasattr(obj, "__dict__"):
+            total += sys.getsizeof(obj.__dict__)
+        for attribute in getattr(type(obj), "characteristic_attributes", ()):
+            pending.append(getattr(obj, attribute.name))
+    return total
+
+
+def timed(function, *args):
+    """
+    Call ``function`` with ``args``.
+
+    :return: A two-tuple of the result and the elapsed wall clock time.
+    """
+    start = time()
+    result = function(*args)
+    return result, time() - start
+
+
+def main(argv):
+    options = ModelHashingOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    applications, nodes = options["applications"], options["nodes"]
+    desired, elapsed = timed(make_deployment, applications, nodes)
+    print("Created {} applications on {} nodes in {:.2f}s".format(
+        applications, nodes, elapsed))
+    print("Model objects take {:.1f} MB".format(
+        footprint(desired) / 1024.0 / 1024))
+
+    _, elapsed = timed(lambda: set(
+        application for node in desired.nodes
+        for application in node.applications))
+    print("Set of all applications: {:.3f}s".format(elapsed))
+
+    equal = make_deployment(applications, nodes)
+    _, elapsed = timed(lambda: desired == equal)
+    print("Comparing with an equal deployment: {:.3f}s".format(elapsed))
+
+    current = make_deployment(applications, nodes, offset=1)
+    _, elapsed = timed(lambda: [
+        find_volume_changes(node.hostname, current, desired)
+        for node in desired.nodes])
+    print("find_volume_changes for every node: {:.2f}s".format(elapsed))
+
+    # Nothing changes between equal deployments, so every check is made for
+    # every node.
+    proxied_ports = {
+        node.hostname: [port.external_port
+                        for other in desired.nodes if other != node
+                        for application in other.applications
+                        for port in application.ports]
+        for node in desired.nodes}
+    affected, elapsed = timed(
+        find_affected_nodes, desired, equal, {}, proxied_ports)
+    print("find_affected_nodes with nothing changed: {:.2f}s ({} affected)"
+          .format(elapsed, len(affected)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time loading and parsing a large application configuration, as
+``flocker-deploy`` and ``flocker-changestate`` do::
+
+    python -m benchmark.parse_configuration --applications 5000
+
+The YAML is loaded with both the pure Python loader and the loader from
+``flocker.common``, which uses libyaml when it is available.
+"""
+
+from __future__ import print_function
+
+import sys
+from time import time
+
+from twisted.python.usage import Options, UsageError
+
+import yaml
+
+from flocker.common import safe_dump, safe_load
+from flocker.node import FlockerConfiguration, model_from_configuration
+
+
+class ParseConfigurationOptions(Options):
+    """
+    Command line options for the ``parse_configuration`` benchmark.
+    """
+    optParameters = [
+        ["applications", None, 5000,
+         "The number of applications to configure.", int],
+        ["nodes", None, 100,
+         "The number of nodes to spread the applications over.", int],
+    ]
+
+
+def make_configuration(applications, nodes):
+    """
+    Generate application and deployment configurations.
+
+    Each application uses every feature of the configuration format so that
+    all of the validation is exercised.
+
+    :return: A two-tuple of the YAML application and deployment
+        configurations as ``bytes``.
+    """
+    application_config = {}
+    deployment_config = {}
+    for i in range(applications):
+        name = u"app-{}".format(i)
+        application_config[name] = {
+            u"image": u"clusterhq/example-{}:v1".format(i % 10),
+            u"ports": [{u"internal": 80, u"external": 10000 + i}],
+            u"links": [{u"local_port": 3306, u"remote_port": 20000 + i,
+                        u"alias": u"db"}],
+            u"environment": {u"NAME": name, u"MODE": u"production"},
+            u"volume": {u"mountpoint": u"/var/lib/app",
+                        u"maximum_size": u"1G",
+                        u"properties": {u"compression": u"lz4"}},
+            u"mem_limit": 100000000,
+            u"cpu_shares": 512,
+            u"restart_policy": {u"name": u"on-failure",
+                                u"maximum_retry_count": 3},
+        }
+        deployment_config.setdefault(
+            u"node{}.example.com".format(i % nodes), []).append(name)
+    return (
+        safe_dump({u"version": 1, u"applications": application_config}),
+        safe_dump({u"version": 1, u"nodes": deployment_config}),
+    )
+
+
+def timed(function, *args):
+    """
+    Call ``function`` with ``args``.
+
+    :return: A two-tuple of the result and the elapsed wall clock time.
+    """
+    start = time()
+    result = function(*args)
+    return result, time() - start
+
+
+def parse(application_yaml, deployment_yaml, load):
+    """
+    Load and parse configuration the way ``DeployOptions`` does.
+    """
+    applications = FlockerConfiguration(load(application_yaml)).applications()
+    return model_from_configuration(applications, load(deployment_yaml))
+
+
+def main(argv):
+    options = ParseConfigurationOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    application_yaml, deployment_yaml = make_configuration(
+        options["applications"], options["nodes"])
+    print("{} applications, {} bytes of YAML".format(
+        options["applications"], len(application_yaml)))
+
+    for name, load in [("pure Python yaml.safe_load", yaml.safe_load),
+                       ("flocker.common.safe_load", safe_load)]:
+        loaded, elapsed = timed(load, application_yaml)
+        print("{}: loaded in {:.2f}s".format(name, elapsed))
+
+    _, elapsed = timed(FlockerConfiguration(loaded).applications)
+    print("FlockerConfiguration: parsed in {:.2f}s".format(elapsed))
+
+    _, elapsed = timed(parse, application_yaml, deployment_yaml, safe_load)
+    print("Total: loaded and parsed in {:.2f}s".format(elapsed))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
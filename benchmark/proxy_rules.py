@@ -0,0 +1,99 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Measure the cost of building and applying proxy rules with ``HostNetwork``,
+independently of ``iptables`` itself.
+
+The ``iptables`` and ``iptables-restore`` runners are replaced with fakes
+which only record what they are given and the host preparation uses a
+temporary directory, so this does not need root::
+
+    python -m benchmark.proxy_rules --proxies 1000
+"""
+
+from __future__ import print_function
+
+import sys
+from tempfile import mkdtemp
+from time import time
+
+from ipaddr import IPAddress
+from twisted.python.filepath import FilePath
+from twisted.python.usage import Options, UsageError
+
+from flocker.route import Proxy
+from flocker.route import _iptables
+from flocker.route._iptables import HostNetwork, HostPreparation
+
+
+class ProxyRulesOptions(Options):
+    """
+    Command line options for the ``proxy_rules`` benchmark.
+    """
+    optParameters = [
+        ["proxies", None, 1000, "The number of proxies to configure.", int],
+        ["interfaces", None, 20,
+         "The number of network interfaces the host appears to have.", int],
+    ]
+
+
+class Recorder(object):
+    """
+    Record calls in place of ``iptables`` or ``iptables_restore``.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, logger, argv):
+        self.calls += 1
+
+
+def make_conf(interfaces):
+    """
+    Create a temporary directory like ``/proc/sys/net/ipv4/conf``.
+    """
+    conf = FilePath(mkdtemp())
+    for i in range(interfaces):
+        for name in [b"default", b"eth%d" % (i,)]:
+            interface = conf.child(name)
+            if not interface.exists():
+                interface.makedirs()
+            interface.child(b"forwarding").setContent(b"0\n")
+            interface.child(b"route_localnet").setContent(b"0\n")
+    return conf
+
+
+def main(argv):
+    options = ProxyRulesOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    _iptables.enumerate_proxies = lambda: []
+
+    count = options["proxies"]
+    proxies = [
+        Proxy(ip=IPAddress("10.1.0.1"), port=10000 + i) for i in range(count)]
+
+    for name, configure in [
+            ("create_proxy_to", lambda network: [
+                network.create_proxy_to(proxy.ip, proxy.port)
+                for proxy in proxies]),
+            ("set_proxies", lambda network: network.set_proxies(proxies))]:
+        iptables = Recorder()
+        iptables_restore = Recorder()
+        network = HostNetwork(
+            run_iptables=iptables, run_iptables_restore=iptables_restore,
+            preparation=HostPreparation(make_conf(options["interfaces"])))
+        start = time()
+        configure(network)
+        elapsed = time() - start
+        print("{}: {} proxies in {:.3f}s ({} iptables runs, "
+              "{} iptables-restore runs)".format(
+                  name, count, elapsed, iptables.calls,
+                  iptables_restore.calls))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
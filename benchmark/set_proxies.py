@@ -0,0 +1,93 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Compare replacing every proxy one ``iptables`` command at a time with applying
+only the difference using ``HostNetwork.set_proxies``.
+
+This manipulates the real ``nat`` table, so it must be run as root.  It runs
+inside a fresh network namespace so the host's configuration is unaffected::
+
+    sudo python -m benchmark.set_proxies --proxies 1000
+"""
+
+from __future__ import print_function
+
+import sys
+from time import time
+
+from ipaddr import IPAddress
+from twisted.python.usage import Options, UsageError
+
+from flocker.route import make_host_network, Proxy
+from flocker.route.functional.iptables import create_network_namespace
+
+
+class SetProxiesOptions(Options):
+    """
+    Command line options for the ``set_proxies`` benchmark.
+    """
+    optParameters = [
+        ["proxies", None, 1000, "The number of proxies to configure.", int],
+    ]
+
+
+def replace_all(network, proxies):
+    """
+    Configure ``proxies`` the way ``SetProxies`` used to: delete every
+    existing proxy and then create every desired one.
+    """
+    for proxy in network.enumerate_proxies():
+        network.delete_proxy(proxy)
+    for proxy in proxies:
+        network.create_proxy_to(proxy.ip, proxy.port)
+
+
+def timed(function, *args):
+    """
+    Call ``function`` with ``args`` and return the elapsed wall clock time.
+    """
+    start = time()
+    function(*args)
+    return time() - start
+
+
+def benchmark(strategy, count):
+    """
+    Time ``strategy`` configuring ``count`` proxies from scratch and then
+    changing one of them, inside an isolated network namespace.
+
+    :return: A two-tuple of the elapsed times in seconds.
+    """
+    namespace = create_network_namespace()
+    try:
+        network = make_host_network()
+        proxies = [
+            Proxy(ip=IPAddress("10.1.0.1"), port=10000 + i)
+            for i in range(count)]
+        initial = timed(strategy, network, proxies)
+        proxies[-1] = Proxy(ip=IPAddress("10.1.0.2"), port=10000 + count)
+        change = timed(strategy, network, proxies)
+        return initial, change
+    finally:
+        namespace.restore()
+
+
+def main(argv):
+    options = SetProxiesOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    count = options["proxies"]
+    for name, strategy in [
+            ("replace all", replace_all),
+            ("set_proxies", lambda network, proxies:
+             network.set_proxies(proxies))]:
+        initial, change = benchmark(strategy, count)
+        print("{}: {} proxies created in {:.2f}s, one changed in {:.2f}s"
+              .format(name, count, initial, change))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
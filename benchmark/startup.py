@@ -0,0 +1,110 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time how long the modules behind the command line tools take to import in a
+new process, and fail if any of them has become slower than its budget or
+loads a module it should not::
+
+    python -m benchmark.startup --repeat 10
+
+``flocker-changestate``, ``flocker-reportstate`` and ``flocker-volume`` are
+run over SSH several times per node on every ``flocker-deploy``, so the
+time it takes to import them is paid again and again.  The best of several
+runs is compared to the budget to keep noise from other processes out.
+"""
+
+from __future__ import print_function
+
+import sys
+from subprocess import check_output
+from time import time
+
+from twisted.python.usage import Options, UsageError
+
+# Each entry point module, the largest number of seconds it may take to
+# import, and the packages it must not load.  The budgets are about half as
+# much again as the imports took on a developer laptop, which is less than
+# ``flocker.node.script`` and ``flocker.cli.script`` took when they still
+# loaded docker-py and the HTTP libraries.  Use ``--scale`` on slower
+# machines; a module loading one of the listed packages is a regression
+# however fast the machine is.
+ENTRY_POINTS = [
+    (b"flocker.node.script", 0.35,
+     [b"docker", b"requests", b"klein", b"werkzeug", b"jsonschema", b"treq",
+      b"twisted.web"]),
+    (b"flocker.volume.script", 0.3,
+     [b"docker", b"requests", b"klein", b"treq", b"twisted.web"]),
+    (b"flocker.cli.script", 0.35,
+     [b"docker", b"requests", b"klein", b"treq", b"twisted.web"]),
+]
+
+# Run in the new process: import the module and write the time that took
+# and the modules which were loaded.
+IMPORT_SCRIPT = b"""\
+import sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(repr(elapsed))
+print(' '.join(name for name in sys.modules if sys.modules[name] is not None))
+"""
+
+
+class StartupOptions(Options):
+    """
+    Command line options for the ``startup`` benchmark.
+    """
+    optParameters = [
+        ["repeat", None, 10,
+         "The number of times to import each module.", int],
+        ["scale", None, 1.0,
+         "Multiply every budget by this factor, for slow machines.", float],
+    ]
+
+
+def time_import(module):
+    """
+    Import a module in a new Python process.
+
+    :param bytes module: The fully qualified name of the module.
+
+    :return: A three-tuple of the seconds the import took, the seconds the
+        whole process took and the ``set`` of names of the modules loaded.
+    """
+    start = time()
+    output = check_output(
+        [sys.executable, b"-c", IMPORT_SCRIPT.format(module=module)])
+    process_elapsed = time() - start
+    elapsed, modules = output.splitlines()
+    return float(elapsed), process_elapsed, set(modules.split())
+
+
+def main(argv):
+    options = StartupOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    problems = []
+    for module, budget, unwanted in ENTRY_POINTS:
+        budget *= options["scale"]
+        runs = [time_import(module) for i in range(options["repeat"])]
+        best = min(elapsed for (elapsed, _, _) in runs)
+        best_process = min(process for (_, process, _) in runs)
+        modules = runs[-1][2]
+        print("{}: import best {:.3f}s (budget {:.3f}s), process best "
+              "{:.3f}s, {} modules".format(
+                  module, best, budget, best_process, len(modules)))
+        if best > budget:
+            problems.append("{} took {:.3f}s to import, over its budget of "
+                            "{:.3f}s".format(module, best, budget))
+        loaded = sorted(name for name in unwanted if name in modules)
+        if loaded:
+            problems.append("{} loaded {}".format(module, ", ".join(loaded)))
+    if problems:
+        raise SystemExit("\n".join(problems))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
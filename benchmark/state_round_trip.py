@@ -0,0 +1,128 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Time the round trip of node state between ``flocker-reportstate``,
+``flocker-deploy`` and ``flocker-changestate`` in each of the formats
+``flocker-reportstate`` can write::
+
+    python -m benchmark.state_round_trip --nodes 100 --applications 50
+
+For each format this times every node serializing its state, the deploy
+parsing all of them, serializing the whole cluster state for a node and
+that node parsing it back.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+from time import time
+
+from twisted.python.usage import Options, UsageError
+
+from flocker.common import safe_load
+from flocker.node import STATE_FORMATS, current_from_configuration
+
+# Map the formats to the functions which parse them.
+PARSERS = {
+    "yaml": safe_load,
+    "json": json.loads,
+}
+
+
+class StateRoundTripOptions(Options):
+    """
+    Command line options for the ``state_round_trip`` benchmark.
+    """
+    optParameters = [
+        ["nodes", None, 100, "The number of nodes.", int],
+        ["applications", None, 50,
+         "The number of applications on each node.", int],
+    ]
+
+
+def make_state(node, applications):
+    """
+    Generate the state ``flocker-reportstate`` would describe a node with.
+
+    :param int node: The index of the node.
+    :param int applications: The number of applications on the node.
+
+    :return: A ``dict`` like the output of ``flocker-reportstate``.
+    """
+    state = {}
+    for i in range(applications):
+        name = u"app-{}-{}".format(node, i)
+        state[name] = {
+            u"image": u"clusterhq/example-{}:v1".format(i % 10),
+            u"ports": [{u"internal": 80, u"external": 10000 + i}],
+            u"environment": {u"NAME": name},
+            u"volume": {u"mountpoint": u"/var/lib/app",
+                        u"maximum_size": u"1G"},
+            u"restart_policy": {u"name": u"never"},
+        }
+    return {
+        u"version": 1,
+        u"applications": state,
+        u"used_ports": range(10000, 10000 + applications),
+        u"not_running": [],
+        u"proxied_ports": [],
+    }
+
+
+def round_trip(states, dump, load):
+    """
+    Send node state through a format the way it travels between the
+    commands.
+
+    :param dict states: Map hostnames to node states.
+    :param dump: The function serializing state in the format.
+    :param load: The function parsing the format.
+
+    :return: A ``dict`` mapping the name of each step to its elapsed wall
+        clock time in seconds.
+    """
+    times = {}
+
+    start = time()
+    outputs = {hostname: dump(state) for (hostname, state) in states.items()}
+    times["reportstate"] = time() - start
+
+    start = time()
+    cluster_state = {hostname: load(output)
+                     for (hostname, output) in outputs.items()}
+    times["deploy parse"] = time() - start
+
+    start = time()
+    current = dump(cluster_state)
+    times["deploy serialize"] = time() - start
+
+    start = time()
+    current_from_configuration(load(current))
+    times["changestate parse"] = time() - start
+    return times
+
+
+def main(argv):
+    options = StateRoundTripOptions()
+    try:
+        options.parseOptions(argv)
+    except UsageError as e:
+        raise SystemExit("{}\n{}".format(options, e))
+
+    states = {u"node{}.example.com".format(node):
+              make_state(node, options["applications"])
+              for node in range(options["nodes"])}
+    print("{} nodes with {} applications each".format(
+        options["nodes"], options["applications"]))
+    for name in sorted(STATE_FORMATS):
+        times = round_trip(states, STATE_FORMATS[name], PARSERS[name])
+        print("{}: {}, total {:.2f}s".format(
+            name,
+            ", ".join("{} {:.2f}s".format(step, elapsed)
+                      for (step, elapsed) in sorted(times.items())),
+            sum(times.values())))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
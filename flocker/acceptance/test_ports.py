@@ -5,7 +5,7 @@ Tests for communication to applications across nodes.
 """
 from twisted.trial.unittest import TestCase
 
-from flocker.node._model import Port
+from flocker.node._model import Application, Port
 
 from .testtools import (assert_expected_deployment, flocker_deploy,
                         get_mongo_client, get_mongo_application, get_nodes,
@@ -70,8 +70,10 @@ class PortsTests(TestCase):
                  external_port=self.external_port)
         ])
 
-        application = get_mongo_application()
-        application.ports = ports
+        mongo = get_mongo_application()
+        application = Application(
+            name=mongo.name, image=mongo.image, volume=mongo.volume,
+            ports=ports)
 
         d = assert_expected_deployment(self, {
             self.node_1: set([application]),
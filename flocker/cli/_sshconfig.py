@@ -9,6 +9,7 @@ environment, such as a laptop or desktop, not on Flocker nodes themselves (it
 may accidentally work on the Flocker nodes but this is not the expected use).
 """
 
+from hashlib import sha256
 from os import devnull
 from os.path import expanduser
 from subprocess import check_call, check_output, STDOUT
@@ -78,6 +79,56 @@ class OpenSSHConfiguration(object):
                     stdout=discard, stderr=discard
                 )
 
+    def _fingerprint(self):
+        """
+        :return: A ``bytes`` hex digest identifying the local public key.
+        """
+        public_key = self.ssh_config_path.child(b"id_rsa_flocker.pub")
+        return sha256(public_key.getContent().strip()).hexdigest()
+
+    def _configured_record(self):
+        """
+        :return: The ``FilePath`` of the file which records the nodes which
+            have been configured, one ``<fingerprint> <host> <port>`` line
+            per node.
+        """
+        return self.ssh_config_path.child(b"flocker_configured_nodes")
+
+    def configured_nodes(self):
+        """
+        Find the nodes which ``configure_ssh`` has already configured with the
+        current key pair.
+
+        Nodes recorded with a different key pair (for example, because the
+        local key was regenerated) are not included.
+
+        :return: A ``frozenset`` of (``bytes`` host, ``int`` port) tuples.
+        """
+        record = self._configured_record()
+        if not record.exists():
+            return frozenset()
+        fingerprint = self._fingerprint()
+        nodes = set()
+        for line in record.getContent().splitlines():
+            fields = line.split()
+            if len(fields) == 3 and fields[0] == fingerprint:
+                nodes.add((fields[1], int(fields[2])))
+        return frozenset(nodes)
+
+    def record_configured(self, host, port):
+        """
+        Record that a node has been configured with the current key pair so
+        that later deployments need not configure it again.
+
+        :param bytes host: The hostname or IP address of the node.
+
+        :param int port: The port number of the SSH server on that node.
+        """
+        if isinstance(host, (IPv4Address, unicode)):
+            host = unicode(host).encode("ascii")
+        with self._configured_record().open(b"a") as record:
+            record.write(b"%s %s %d\n" % (self._fingerprint(), host, port))
+
     def configure_ssh(self, host, port):
         """
         Configure a node to be able to connect to other similarly configured
@@ -1,19 +1,24 @@
 # Copyright Hybrid Logic Ltd.  See LICENSE file for details.
 
 """
-The command-line ``flocker-deploy`` tool.
+The command-line ``flocker-deploy`` and ``flocker-relay`` tools.
 """
 
+import json
+import sys
+from io import BytesIO
+from os import environ
+from os.path import expanduser
 from subprocess import CalledProcessError
 
-from twisted.internet.defer import DeferredList
+from twisted.internet.defer import Deferred, DeferredList, DeferredSemaphore
+from twisted.internet.protocol import ProcessProtocol
 from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
 from twisted.python.usage import Options, UsageError
 
 from zope.interface import implementer
 
-from yaml import safe_load, safe_dump
 from yaml.error import YAMLError
 
 from characteristic import attributes
@@ -22,17 +27,388 @@ from ..common.script import (flocker_standard_options, ICommandLineScript,
                              FlockerScriptRunner)
 from ..node import (FlockerConfiguration, ConfigurationError,
                     FigConfiguration, applications_to_flocker_yaml,
-                    model_from_configuration)
-
-from ..common import ProcessNode, gather_deferreds
+                    model_from_configuration, volume_configuration,
+                    state_report, apply_state_report, Deployment,
+                    current_from_configuration, find_affected_nodes,
+                    STATE_FORMATS, dump_state_json)
+
+from ..common import (
+    IAsyncNode, SpawnProcessNode, gather_deferreds, encode_frame,
+    join_frames, split_frames, safe_dump, safe_load, ssh_forward_command,
+)
 from ._sshconfig import DEFAULT_SSH_DIRECTORY, OpenSSHConfiguration
 
 
+# The default maximum number of nodes ``flocker-deploy`` runs commands on at
+# once.
+DEFAULT_MAX_CONNECTIONS = 100
+
+# Where ``flocker-deploy`` remembers the last known configuration of each
+# node.
+DEFAULT_STATE_CACHE = FilePath(expanduser(b"~/.flocker/cluster-state.json"))
+
+
 @attributes(['node', 'hostname'])
 class NodeTarget(object):
     """
-    A record for matching an ``INode`` implementation to its target host.
+    A record for matching an ``INode`` or ``IAsyncNode`` implementation to its
+    target host.
+    """
+
+
+def get_output(node, remote_command):
+    """
+    Run a command on a node without blocking the reactor.
+
+    :param node: An ``IAsyncNode`` provider, or an ``INode`` provider whose
+        blocking ``get_output`` will be called in a thread.
+    :param remote_command: ``list`` of ``bytes``, the command to run.
+
+    :return: ``Deferred`` that fires with the output of the command.
+    """
+    if IAsyncNode.providedBy(node):
+        return node.get_output(remote_command)
+    return deferToThread(node.get_output, remote_command)
+
+
+def ssh_targets(reactor, hostnames, semaphore,
+                private_key=DEFAULT_SSH_DIRECTORY.child(b"id_rsa_flocker")):
+    """
+    Create ``NodeTarget``\ s which run commands on nodes over SSH.
+
+    :param IReactorProcess reactor: The reactor to run ``ssh`` with.
+    :param hostnames: An iterable of the hostnames of the nodes.
+    :param DeferredSemaphore semaphore: The limit on how many of the nodes
+        run commands at once.
+    :param FilePath private_key: The key to authenticate with.
+
+    :return: Iterable of ``NodeTarget``\ s with ``IAsyncNode`` providers.
+    """
+    for hostname in hostnames:
+        yield NodeTarget(
+            node=SpawnProcessNode.using_ssh(
+                reactor, hostname, 22, b"root", private_key,
+                semaphore=semaphore),
+            hostname=hostname
+        )
+
+
+def full_report(state):
+    """
+    Wrap a full node configuration as a report, as if from ``state_report``.
+
+    :param dict state: The configuration reported by ``flocker-reportstate``
+        without ``--since``.
+
+    :return: The report ``dict``.
+    """
+    return state_report(None, None, state)
+
+
+def reportstate_on_targets(targets, tokens=None):
+    """
+    Run ``flocker-reportstate`` on some nodes.
+
+    :param targets: An iterable of ``NodeTarget``\ s.
+    :param dict tokens: If not ``None``, maps hostnames to the tokens of the
+        last known configuration of those nodes, and reports relative to them
+        (see ``state_report``) are gathered instead of full configurations.
+        These are gathered as JSON, which is much faster to parse than YAML.
+        Nodes which do not provide ``IAsyncNode`` always report their full
+        configuration, as YAML, wrapped as a report.
+
+    :return: ``Deferred`` that fires with a ``dict`` mapping the hostname of
+        each node to its parsed state or report, or fails if any of them
+        failed.
+    """
+    results = []
+    for target in targets:
+        if tokens is not None and IAsyncNode.providedBy(target.node):
+            d = target.node.get_output(
+                [b"flocker-reportstate", b"--format", b"json", b"--since",
+                 tokens.get(target.hostname, b"none")])
+            d.addCallback(json.loads)
+        else:
+            d = get_output(target.node, [b"flocker-reportstate"])
+            d.addCallback(safe_load)
+            if tokens is not None:
+                d.addCallback(full_report)
+        d.addCallback(lambda val, key=target.hostname: (key, val))
+        results.append(d)
+    d = DeferredList(results, fireOnOneErrback=False, consumeErrors=True)
+
+    def got_results(node_states):
+        # Bail on errors:
+        for succeeded, value in node_states:
+            if not succeeded:
+                return value
+        return dict(pair for (_, pair) in node_states)
+    d.addCallback(got_results)
+    return d
+
+
+def changestate_input(deployment_config, application_config, cluster_state):
+    """
+    Prepare the framed standard input of ``flocker-changestate --stdin`` and
+    ``flocker-relay changestate --stdin``.
+
+    The configurations every node needs are framed (and compressed) once and
+    shared between the inputs for all of the nodes.  Each node is then only
+    given the full current configuration of the nodes it is responsible for,
+    since the applications with volumes are all it needs to know about the
+    rest.
+
+    :param bytes deployment_config: YAML-encoded deployment configuration.
+    :param bytes application_config: YAML-encoded application
+        configuration.
+    :param dict cluster_state: The current cluster configuration, mapping
+        hostnames to the state reported by ``flocker-reportstate``.
+
+    :return: A callable which takes an iterable of hostnames and returns the
+        ``bytes`` to write to standard input for those nodes.
+    """
+    shared = [
+        encode_frame(deployment_config),
+        encode_frame(application_config),
+        encode_frame(dump_state_json(volume_configuration(cluster_state))),
+    ]
+
+    def for_nodes(hostnames):
+        nodes = {hostname: cluster_state[hostname]
+                 for hostname in hostnames if hostname in cluster_state}
+        return join_frames(shared + [encode_frame(dump_state_json(nodes))])
+    return for_nodes
+
+
+def changestate_on_targets(targets, deployment_config, application_config,
+                           cluster_state):
+    """
+    Run ``flocker-changestate`` on some nodes.
+
+    ``IAsyncNode`` providers are given the configuration on standard input.
+    Other nodes are given it on the command line.
+
+    :param targets: An iterable of ``NodeTarget``\ s.
+    :param bytes deployment_config: YAML-encoded deployment configuration.
+    :param bytes application_config: YAML-encoded application
+        configuration.
+    :param dict cluster_state: The current cluster configuration, mapping
+        hostnames to the state reported by ``flocker-reportstate``.
+
+    :return: ``list`` of ``Deferred``\ s, one for each node, which fire
+        when the remote call on that node is finished.
+    """
+    stdin_for = changestate_input(
+        deployment_config, application_config, cluster_state)
+    cluster_config = None
+    results = []
+    for target in targets:
+        if IAsyncNode.providedBy(target.node):
+            result = target.node.get_output(
+                [b"flocker-changestate", b"--stdin", target.hostname],
+                stdin=stdin_for([target.hostname]))
+        else:
+            if cluster_config is None:
+                cluster_config = safe_dump(cluster_state)
+            result = get_output(
+                target.node,
+                [b"flocker-changestate", deployment_config,
+                 application_config, cluster_config, target.hostname])
+        results.append(result)
+    return results
+
+
+class NodeConfigurationError(Exception):
+    """
+    ``flocker-serve`` on a node did not converge on the configuration it was
+    given.
+
+    :ivar unicode hostname: The hostname of the node.
+    :ivar result: The ``result`` of the error response of the API.
+    """
+    def __init__(self, hostname, result):
+        Exception.__init__(self, hostname, result)
+        self.hostname = hostname
+        self.result = result
+
+
+def api_configuration(deployment_config, application_config, cluster_state):
+    """
+    Prepare the bodies of the requests which give ``flocker-serve`` its
+    configuration.
+
+    They hold the same configuration ``changestate_input`` frames for
+    ``flocker-changestate``, and likewise the parts every node needs are
+    encoded once and shared between the requests for all of the nodes.
+
+    :param bytes deployment_config: YAML-encoded deployment configuration.
+    :param bytes application_config: YAML-encoded application
+        configuration.
+    :param dict cluster_state: The current cluster configuration, mapping
+        hostnames to the state reported by ``flocker-reportstate``.
+
+    :return: A callable which takes a hostname and returns the JSON
+        ``bytes`` to post to ``flocker-serve`` on that node.
+    """
+    shared = b",".join([
+        b'"deployment":' + dump_state_json(deployment_config.decode("utf-8")),
+        b'"application":' + dump_state_json(
+            application_config.decode("utf-8")),
+        b'"current":[' + dump_state_json(volume_configuration(cluster_state)),
+    ])
+
+    def for_node(hostname):
+        nodes = {}
+        if hostname in cluster_state:
+            nodes[hostname] = cluster_state[hostname]
+        return (b'{"hostname":' + dump_state_json(hostname) + b"," + shared +
+                b"," + dump_state_json(nodes) + b"]}")
+    return for_node
+
+
+class _ProcessClientProtocol(ProcessProtocol):
+    """
+    Connect a client protocol to the standard input and output of a
+    process, which is then its transport.
+
+    :ivar _protocol: The ``IProtocol`` provider to connect.
+    :ivar Deferred ended: Fires with ``None`` when the process has ended.
+    """
+    def __init__(self, protocol):
+        self._protocol = protocol
+        self.ended = Deferred()
+
+    def connectionMade(self):
+        self._protocol.makeConnection(self.transport)
+
+    def outReceived(self, data):
+        self._protocol.dataReceived(data)
+
+    def processEnded(self, reason):
+        self._protocol.connectionLost(reason)
+        self.ended.callback(None)
+
+
+def post_through(reactor, argv, path, body):
+    """
+    POST JSON to an HTTP server reached through the standard input and
+    output of a process, such as ``ssh -W``.
+
+    :param IReactorProcess reactor: The reactor to run the process with.
+    :param argv: ``tuple`` of ``bytes``, the command line of the process.
+    :param bytes path: The path to post to.
+    :param bytes body: The JSON-encoded request body.
+
+    :return: A ``Deferred`` which fires with the decoded JSON response
+        once the process has ended.
+    """
+    # Most of twisted.web is only needed by ``--api-port`` deploys.
+    from twisted.web.client import (
+        FileBodyProducer, HTTP11ClientProtocol, Request, readBody)
+    from twisted.web.http_headers import Headers
+
+    protocol = HTTP11ClientProtocol()
+    process_protocol = _ProcessClientProtocol(protocol)
+    reactor.spawnProcess(process_protocol, argv[0], argv, env=environ)
+    # The request is not persistent, so the process's standard input is
+    # only closed once the response has been received.
+    posting = protocol.request(Request(
+        b"POST", path,
+        Headers({b"content-type": [b"application/json"],
+                 b"host": [b"localhost"]}),
+        FileBodyProducer(BytesIO(body)), persistent=False))
+    posting.addCallback(readBody)
+    posting.addCallback(json.loads)
+    posting.addCallback(
+        lambda result: process_protocol.ended.addCallback(lambda _: result))
+    return posting
+
+
+def post_configuration(reactor, hostname, port, body,
+                       private_key=DEFAULT_SSH_DIRECTORY.child(
+                           b"id_rsa_flocker")):
+    """
+    Give ``flocker-serve`` on a node the configuration to converge on.
+
+    ``flocker-serve`` only listens on the node's loopback interface, so the
+    request is forwarded over SSH with the same key and user
+    ``flocker-deploy`` runs commands with.
+
+    :param IReactorProcess reactor: The reactor to run ``ssh`` with.
+    :param unicode hostname: The hostname of the node.
+    :param int port: The port ``flocker-serve`` listens on.
+    :param bytes body: The request body, as prepared by
+        ``api_configuration``.
+    :param FilePath private_key: The key to authenticate with.
+
+    :return: A ``Deferred`` which fires with ``None`` once the node has
+        converged, or fails with ``NodeConfigurationError`` if it did not.
+    """
+    posting = post_through(
+        reactor,
+        ssh_forward_command(
+            hostname.encode("ascii"), 22, b"root", private_key, port),
+        b"/v1/configuration", body)
+
+    def got_result(result):
+        if result[u"error"]:
+            raise NodeConfigurationError(hostname, result[u"result"])
+    posting.addCallback(got_result)
+    return posting
+
+
+def affected_deployment(deployment, cluster_state):
+    """
+    Restrict a deployment to the nodes which may need changing to reach it.
+
+    :param Deployment deployment: The desired configuration.
+    :param dict cluster_state: The current cluster configuration, mapping
+        hostnames to the state reported by ``flocker-reportstate``.
+
+    :return: A ``Deployment`` of the nodes in ``deployment`` found by
+        ``find_affected_nodes``, or ``deployment`` itself if the current
+        configuration cannot be understood.
+    """
+    try:
+        current = current_from_configuration(cluster_state)
+    except ConfigurationError:
+        return deployment
+    affected = find_affected_nodes(
+        deployment, current,
+        not_running={hostname: state.get("not_running", ())
+                     for (hostname, state) in cluster_state.items()},
+        proxied_ports={hostname: state["proxied_ports"]
+                       for (hostname, state) in cluster_state.items()
+                       if "proxied_ports" in state})
+    return Deployment(nodes=frozenset(
+        node for node in deployment.nodes if node.hostname in affected))
+
+
+@attributes(['node', 'hostnames'])
+class RelayTarget(object):
+    """
+    A record for matching an ``INode`` or ``IAsyncNode`` implementation of a
+    relay node to the hosts it runs commands on with ``flocker-relay``.
+
+    :ivar list hostnames: The hostnames of the nodes in the relay's subtree,
+        including the relay itself.
+    """
+
+
+def relay_groups(hostnames, fanout):
+    """
+    Divide nodes between relays.
+
+    :param hostnames: An iterable of the hostnames of all of the nodes.
+    :param int fanout: The greatest number of nodes a relay is responsible
+        for.
+
+    :return: A ``list`` of ``list``\ s of hostnames.  The first hostname of
+        each is the relay.
     """
+    hostnames = sorted(hostnames)
+    return [hostnames[i:i + fanout]
+            for i in range(0, len(hostnames), fanout)]
 
 
 @flocker_standard_options
@@ -53,6 +429,29 @@ class DeployOptions(Options):
                 "http://docs.clusterhq.com/en/latest/gettinginvolved/"
                 "contributing.html#talk-to-us")
 
+    optFlags = [
+        ["reconfigure-ssh", None,
+         "Configure SSH on every node, including nodes which an earlier "
+         "deployment has already configured."],
+        ["converge-all", None,
+         "Change the state of every node, not only the nodes affected by "
+         "differences between the current and the desired configuration."],
+    ]
+
+    optParameters = [
+        ["max-connections", None, DEFAULT_MAX_CONNECTIONS,
+         "The maximum number of nodes to run commands on at once.", int],
+        ["relay-fanout", None, 0,
+         "If greater than zero, run commands on nodes through relay nodes "
+         "which are each responsible for up to this many nodes, instead of "
+         "connecting to every node.", int],
+        ["api-port", None, None,
+         "Give the configuration to flocker-serve listening on this port on "
+         "each node's loopback interface, reached over SSH, which converges "
+         "the node without starting a new process, instead of running "
+         "flocker-changestate.", int],
+    ]
+
     def parseArgs(self, deployment_config, application_config):
         deployment_config = FilePath(deployment_config)
         application_config = FilePath(application_config)
@@ -116,26 +515,50 @@ class DeployScript(object):
     """
     A script to start configured deployments on a Flocker cluster.
     """
-    def __init__(self, ssh_configuration=None, ssh_port=22):
+    def __init__(self, ssh_configuration=None, ssh_port=22,
+                 state_cache=DEFAULT_STATE_CACHE,
+                 post_configuration=post_configuration):
         if ssh_configuration is None:
             ssh_configuration = OpenSSHConfiguration.defaults()
         self.ssh_configuration = ssh_configuration
         self.ssh_port = ssh_port
-
-    def _configure_ssh(self, deployment):
+        self.state_cache = state_cache
+        self.post_configuration = post_configuration
+        self._reactor = None
+        self._connections = DeferredSemaphore(DEFAULT_MAX_CONNECTIONS)
+        self._relay_fanout = 0
+        self._api_port = None
+
+    def _configure_ssh(self, deployment, reconfigure=False):
         """
+        Nodes which an earlier run has recorded as configured with the current
+        key pair are skipped, unless ``reconfigure`` is true.
+
+        :param Deployment deployment: The deployment whose nodes to configure.
+        :param bool reconfigure: Whether to configure every node regardless of
+            the local record.
+
         :return: A ``Deferred`` which fires when all nodes have been configured
             with ssh keys.
         """
         self.ssh_configuration.create_keypair()
+        if reconfigure:
+            configured = frozenset()
+        else:
+            configured = self.ssh_configuration.configured_nodes()
         results = []
         for node in deployment.nodes:
-            results.append(
-                deferToThread(
-                    self.ssh_configuration.configure_ssh,
-                    node.hostname, self.ssh_port
-                )
+            if (node.hostname, self.ssh_port) in configured:
+                continue
+            configuring = deferToThread(
+                self.ssh_configuration.configure_ssh,
+                node.hostname, self.ssh_port
             )
+            configuring.addCallback(
+                lambda _, hostname=node.hostname:
+                self.ssh_configuration.record_configured(
+                    hostname, self.ssh_port))
+            results.append(configuring)
         d = gather_deferreds(results)
 
         # Exit with ssh's output if it failed for some reason:
@@ -157,17 +580,25 @@ class DeployScript(object):
         :return: A ``Deferred`` which fires when the deployment is complete or
                  has encountered an error.
         """
+        self._reactor = reactor
+        self._connections = DeferredSemaphore(options["max-connections"])
+        self._relay_fanout = options["relay-fanout"]
+        self._api_port = options["api-port"]
         deployment = options['deployment']
-        configuring = self._configure_ssh(deployment)
+        configuring = self._configure_ssh(
+            deployment, reconfigure=options["reconfigure-ssh"])
         configuring.addCallback(
             lambda _: self._reportstate_on_nodes(deployment))
 
-        def configured(current_config):
+        def configured(cluster_state):
+            changing = deployment
+            if not options["converge-all"]:
+                changing = affected_deployment(deployment, cluster_state)
             return self._changestate_on_nodes(
-                deployment,
+                changing,
                 options["deployment_config"],
                 options["application_config"],
-                current_config)
+                cluster_state)
         configuring.addCallback(configured)
         configuring.addCallback(lambda _: None)
         return configuring
@@ -180,73 +611,168 @@ class DeployScript(object):
             configuration.
 
         :return: Iterable of ``NodeTarget``\ s containing the node hostname and
-            corresponding ``INode`` provider with which to issue remote
-            procedures on that node.
+            corresponding ``IAsyncNode`` provider with which to issue remote
+            procedures on that node.  The nodes share a limit on how many of
+            them run commands at once.
         """
-        private_key = DEFAULT_SSH_DIRECTORY.child(b"id_rsa_flocker")
+        return ssh_targets(
+            self._reactor, (node.hostname for node in deployment.nodes),
+            self._connections)
 
-        for node in deployment.nodes:
-            yield NodeTarget(
-                node=ProcessNode.using_ssh(
-                    node.hostname, 22, b"root", private_key),
-                hostname=node.hostname
-            )
+    def _get_relays(self, deployment):
+        """
+        Return iterable of ``RelayTarget``\ s to connect to for given
+        deployment, or ``None`` if commands are run on every node directly.
+
+        :param Deployment deployment: The requested already parsed
+            configuration.
+        """
+        if not self._relay_fanout:
+            return None
+        groups = relay_groups(
+            (node.hostname for node in deployment.nodes), self._relay_fanout)
+        relays = ssh_targets(
+            self._reactor, (group[0] for group in groups), self._connections)
+        return [RelayTarget(node=relay.node, hostnames=group)
+                for relay, group in zip(relays, groups)]
+
+    def _load_known_states(self):
+        """
+        :return: A ``dict`` mapping hostnames to the last known configuration
+            of those nodes, each a ``dict`` with ``token`` and ``state`` keys.
+        """
+        if not self.state_cache.exists():
+            return {}
+        try:
+            return json.loads(self.state_cache.getContent())
+        except ValueError:
+            # A damaged cache only costs a full gathering of state:
+            return {}
+
+    def _save_known_states(self, known):
+        """
+        Remember the last known configuration of some nodes.
+
+        :param dict known: See ``_load_known_states``.
+        """
+        if not self.state_cache.parent().exists():
+            self.state_cache.parent().makedirs()
+        self.state_cache.setContent(json.dumps(known))
 
     def _reportstate_on_nodes(self, deployment):
         """
-        Connect to all nodes and run ``flocker-reportstate``.
+        Connect to all nodes, or to the relays, and run
+        ``flocker-reportstate``.
+
+        Only the changes since the configuration of each node last seen by
+        ``flocker-deploy`` are gathered, and the configurations are then
+        remembered for next time.
 
         :param Deployment deployment: The requested already parsed
             configuration.
 
-        :return: ``Deferred`` that fires with a ``bytes`` in YAML format
-            describing the current configuration.
+        :return: ``Deferred`` that fires with a ``dict`` mapping the hostname
+            of each node to its current configuration.
         """
-        command = [b"flocker-reportstate"]
-        results = []
-        for target in self._get_destinations(deployment):
-            d = deferToThread(target.node.get_output, command)
-            d.addCallback(safe_load)
-            d.addCallback(lambda val, key=target.hostname: (key, val))
-            results.append(d)
-        d = DeferredList(results, fireOnOneErrback=False, consumeErrors=True)
-
-        def got_results(node_states):
-            # Bail on errors:
-            for succeeded, value in node_states:
-                if not succeeded:
-                    return value
-            return safe_dump(dict(pair for (_, pair) in node_states))
-        d.addCallback(got_results)
+        known = self._load_known_states()
+        tokens = {hostname: entry["token"]
+                  for (hostname, entry) in known.items()}
+        relays = self._get_relays(deployment)
+        if relays is None:
+            d = reportstate_on_targets(
+                self._get_destinations(deployment), tokens)
+        else:
+            results = []
+            for relay in relays:
+                if IAsyncNode.providedBy(relay.node):
+                    result = relay.node.get_output(
+                        [b"flocker-relay", b"reportstate", b"--stdin",
+                         b"--format", b"json"] + relay.hostnames,
+                        stdin=safe_dump({
+                            hostname: tokens[hostname]
+                            for hostname in relay.hostnames
+                            if hostname in tokens}))
+                    result.addCallback(json.loads)
+                else:
+                    result = get_output(
+                        relay.node,
+                        [b"flocker-relay", b"reportstate"] +
+                        relay.hostnames)
+                    result.addCallback(safe_load)
+                    result.addCallback(lambda states: {
+                        hostname: full_report(state)
+                        for (hostname, state) in states.items()})
+                results.append(result)
+            d = gather_deferreds(results)
+
+            def merge(reports):
+                merged = {}
+                for report in reports:
+                    merged.update(report)
+                return merged
+            d.addCallback(merge)
+
+        def got_reports(reports):
+            updated = known.copy()
+            states = {}
+            for hostname, report in reports.items():
+                updated[hostname] = apply_state_report(
+                    known.get(hostname), report)
+                states[hostname] = updated[hostname]["state"]
+            if updated != known:
+                self._save_known_states(updated)
+            return states
+        d.addCallback(got_reports)
         return d
 
     def _changestate_on_nodes(self, deployment, deployment_config,
-                              application_config, cluster_config):
+                              application_config, cluster_state):
         """
-        Connect to all nodes and run ``flocker-changestate``.
+        Connect to all nodes, or to the relays, and run
+        ``flocker-changestate``.
 
         :param Deployment deployment: The requested already parsed
             configuration.
         :param bytes deployment_config: YAML-encoded deployment configuration.
         :param bytes application_config: YAML-encoded application
             configuration.
-        :param bytes current_config: YAML-encoded current cluster
-            configuration.
+        :param dict cluster_state: The current cluster configuration, mapping
+            hostnames to the state reported by ``flocker-reportstate``.
+
+        With ``--api-port`` the configuration is instead posted to
+        ``flocker-serve`` on every node.
 
         :return: ``Deferred`` that fires when all remote calls are finished.
         """
-        command = [b"flocker-changestate",
-                   deployment_config,
-                   application_config,
-                   cluster_config]
+        if self._api_port is not None:
+            body_for = api_configuration(
+                deployment_config, application_config, cluster_state)
+            return DeferredList([
+                self._connections.run(
+                    self.post_configuration, self._reactor, node.hostname,
+                    self._api_port, body_for(node.hostname))
+                for node in deployment.nodes])
+        relays = self._get_relays(deployment)
+        if relays is None:
+            return DeferredList(changestate_on_targets(
+                self._get_destinations(deployment), deployment_config,
+                application_config, cluster_state))
+        stdin_for = changestate_input(
+            deployment_config, application_config, cluster_state)
         results = []
-        for target in self._get_destinations(deployment):
-            # XXX if number of nodes is bigger than number of available
-            # threads we won't get the required parallelism...
-            # https://clusterhq.atlassian.net/browse/FLOC-347
-            results.append(
-                deferToThread(
-                    target.node.get_output, command + [target.hostname]))
+        for relay in relays:
+            if IAsyncNode.providedBy(relay.node):
+                result = relay.node.get_output(
+                    [b"flocker-relay", b"changestate", b"--stdin"] +
+                    relay.hostnames,
+                    stdin=stdin_for(relay.hostnames))
+            else:
+                result = get_output(
+                    relay.node,
+                    [b"flocker-relay", b"changestate", deployment_config,
+                     application_config, safe_dump(cluster_state)] +
+                    relay.hostnames)
+            results.append(result)
         return DeferredList(results)
 
 
@@ -255,3 +781,174 @@ def flocker_deploy_main():
         script=DeployScript(),
         options=DeployOptions()
     ).main()
+
+
+class RelayReportStateOptions(Options):
+    """
+    Command line options for ``flocker-relay reportstate``.
+    """
+    synopsis = "<hostname> [<hostname> ...]"
+
+    optFlags = [
+        ["stdin", None,
+         "Read a YAML mapping of hostnames to the tokens of their last known "
+         "configurations from standard input, and gather reports relative "
+         "to them instead of full configurations."],
+    ]
+
+    optParameters = [
+        ["format", None, "yaml",
+         "The format to write the configurations in: one of " +
+         ", ".join(sorted(STATE_FORMATS)) + "."],
+    ]
+
+    def parseArgs(self, *hostnames):
+        if not hostnames:
+            raise UsageError("At least one hostname is required.")
+        self["hostnames"] = list(hostnames)
+
+    def postOptions(self):
+        if self["format"] not in STATE_FORMATS:
+            raise UsageError(
+                "Unknown format {!r}, use one of: {}.".format(
+                    self["format"], ", ".join(sorted(STATE_FORMATS))))
+
+
+class RelayChangeStateOptions(Options):
+    """
+    Command line options for ``flocker-relay changestate``.
+    """
+    synopsis = ("[<deployment configuration> <application configuration> "
+                "<cluster configuration>] <hostname> [<hostname> ...]")
+
+    optFlags = [
+        ["stdin", None,
+         "Read the configurations from standard input, framed as written "
+         "by flocker-deploy, instead of from the command line."],
+    ]
+
+    def parseArgs(self, *arguments):
+        if not self["stdin"]:
+            if len(arguments) < 3:
+                raise UsageError("Wrong number of arguments.")
+            (self["deployment_config"], self["application_config"],
+             self["cluster_config"]) = arguments[:3]
+            arguments = arguments[3:]
+        if not arguments:
+            raise UsageError("At least one hostname is required.")
+        self["hostnames"] = list(arguments)
+
+
+@flocker_standard_options
+class RelayOptions(Options):
+    """
+    Command line options for ``flocker-relay``.
+
+    :ivar subCommand: The name of the command given.
+    :ivar subOptions: The ``Options`` for the command given.
+    """
+    longdesc = """flocker-relay is called by flocker-deploy on relay nodes to
+    run flocker-reportstate or flocker-changestate on a group of nodes and
+    aggregate the results.
+
+    * reportstate <hostname>...: Write the state of the nodes as a YAML
+        mapping of hostname to state.  With --stdin, the tokens of the last
+        known states are read from standard input and a mapping of hostname
+        to report relative to them is written instead.
+
+    * changestate <deployment configuration> <application configuration>
+        <cluster configuration> <hostname>...: Change the state of the nodes.
+        With --stdin only the hostnames are given and the configurations are
+        read from standard input.
+    """
+    synopsis = "Usage: flocker-relay [OPTIONS] <command> [ARGUMENTS]"
+
+    optParameters = [
+        ["max-connections", None, DEFAULT_MAX_CONNECTIONS,
+         "The maximum number of nodes to run commands on at once.", int],
+    ]
+
+    _commands = {
+        "reportstate": RelayReportStateOptions,
+        "changestate": RelayChangeStateOptions,
+    }
+
+    def parseArgs(self, command, *arguments):
+        try:
+            parser = self._commands[command]
+        except KeyError:
+            raise UsageError("Unknown command: {}".format(command))
+        self.subCommand = command
+        self.subOptions = parser()
+        self.subOptions.parseOptions(arguments)
+
+
+@implementer(ICommandLineScript)
+class RelayScript(object):
+    """
+    A script which runs ``flocker-reportstate`` or ``flocker-changestate`` on
+    a group of nodes on behalf of ``flocker-deploy``.
+    """
+    _stdout = sys.stdout
+    _stdin = sys.stdin
+
+    def _get_destinations(self, reactor, hostnames, semaphore):
+        """
+        Return iterable of ``NodeTarget``\ s to connect to, authenticating
+        with the key ``flocker-deploy`` installs on every node.  See
+        ``ssh_targets`` for parameter documentation.
+        """
+        return ssh_targets(
+            reactor, hostnames, semaphore,
+            OpenSSHConfiguration.defaults().flocker_path.child(
+                b"id_rsa_flocker"))
+
+    def main(self, reactor, options):
+        """
+        See :py:meth:`ICommandLineScript.main` for parameter documentation.
+
+        :return: A ``Deferred`` which fires when the command has finished on
+            all of the nodes, or fails if it failed on any of them.
+        """
+        command = options.subOptions
+        targets = list(self._get_destinations(
+            reactor, command["hostnames"],
+            DeferredSemaphore(options["max-connections"])))
+        if options.subCommand == "reportstate":
+            tokens = None
+            if command["stdin"]:
+                tokens = safe_load(self._stdin.read()) or {}
+            d = reportstate_on_targets(targets, tokens)
+            d.addCallback(STATE_FORMATS[command["format"]])
+            d.addCallback(self._stdout.write)
+            return d
+
+        if command["stdin"]:
+            (deployment_config, application_config, volumes,
+             nodes) = split_frames(self._stdin.read())
+            cluster_state = json.loads(volumes)
+            cluster_state.update(json.loads(nodes))
+        else:
+            deployment_config = command["deployment_config"]
+            application_config = command["application_config"]
+            cluster_state = safe_load(command["cluster_config"])
+        d = DeferredList(
+            changestate_on_targets(
+                targets, deployment_config, application_config,
+                cluster_state),
+            consumeErrors=True)
+
+        def changed(results):
+            # Bail on errors:
+            for succeeded, value in results:
+                if not succeeded:
+                    return value
+        d.addCallback(changed)
+        return d
+
+
+def flocker_relay_main():
+    return FlockerScriptRunner(
+        script=RelayScript(),
+        options=RelayOptions()
+    ).main()
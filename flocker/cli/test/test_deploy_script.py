@@ -4,21 +4,51 @@
 Unit tests for the implementation ``flocker-deploy``.
 """
 
+import json
+import sys
+from io import BytesIO
 from yaml import safe_dump, safe_load
 from threading import current_thread
 
+from zope.interface import implementer
+
 from twisted.python.filepath import FilePath
 from twisted.python.usage import UsageError
 from twisted.trial.unittest import TestCase, SynchronousTestCase
-from twisted.internet.defer import succeed
+from twisted.internet.defer import DeferredSemaphore, succeed
 from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.client import ResponseNeverReceived
 
 from ...testtools import (
-    FlockerScriptTestsMixin, StandardOptionsTestsMixin, make_with_init_tests)
-from ..script import DeployScript, DeployOptions, NodeTarget
+    FlockerScriptTestsMixin, StandardOptionsTestsMixin, make_with_init_tests,
+    assert_not_imported)
+from .. import script as script_module
+from ..script import (
+    DeployScript, DeployOptions, NodeTarget, RelayOptions, RelayScript,
+    RelayTarget, relay_groups, full_report, NodeConfigurationError,
+    post_configuration, post_through,
+)
 from .._sshconfig import DEFAULT_SSH_DIRECTORY
-from ...node import Application, Deployment, DockerImage, Node
-from ...common import ProcessNode, FakeNode
+from ...node import (
+    Application, Deployment, DockerImage, Node, state_report,
+    volume_configuration,
+)
+from ...common import (
+    FakeAsyncNode, FakeNode, IAsyncNode, SpawnProcessNode, encode_frame,
+    join_frames, split_frames, ssh_forward_command,
+)
+
+
+def report(state):
+    """
+    :param dict state: A node configuration.
+
+    :return: The output of ``flocker-reportstate --format json --since``
+        for a node with that configuration and an unknown token.
+    """
+    return json.dumps(full_report(state))
 
 
 class NodeTargetInitTests(
@@ -52,6 +82,16 @@ class FlockerDeployTests(FlockerScriptTestsMixin, TestCase):
     options = DeployOptions
     command_name = u'flocker-deploy'
 
+    def test_lazy_imports(self):
+        """
+        Importing ``flocker.cli.script`` loads neither docker-py, which
+        ``flocker-deploy`` never uses, nor ``twisted.web``, whose HTTP client
+        it only uses with ``--api-port``.
+        """
+        assert_not_imported(
+            self, b"flocker.cli.script",
+            [b"docker", b"requests", b"treq", b"klein", b"twisted.web"])
+
 
 class DeployOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
     """Tests for :class:`DeployOptions`."""
@@ -295,7 +335,7 @@ class FlockerDeployMainTests(TestCase):
         options.parseOptions([
             deployment_config_path.path, application_config_path.path])
 
-        script = DeployScript()
+        script = DeployScript(state_cache=FilePath(self.mktemp()))
         dummy_reactor = object()
 
         self.assertEqual(
@@ -328,21 +368,66 @@ class FlockerDeployMainTests(TestCase):
 
         def node(hostname):
             return NodeTarget(
-                node=ProcessNode.using_ssh(
-                    hostname, 22, b"root", id_rsa_flocker),
+                node=SpawnProcessNode.using_ssh(
+                    reactor, hostname, 22, b"root", id_rsa_flocker),
                 hostname=hostname)
 
         self.assertEqual(
             {node(node1.hostname), node(node2.hostname)},
             set(destinations))
 
-    def run_script(self, alternate_destinations):
+    def test_destinations_share_connection_limit(self):
+        """
+        The nodes returned by ``DeployScript._get_destinations`` share a
+        limit on concurrent commands of the size given by the
+        ``--max-connections`` option.
+        """
+        temp = FilePath(self.mktemp())
+        temp.makedirs()
+        application_config_path = temp.child(b"app.yml")
+        application_config_path.setContent(safe_dump({
+            u"version": 1,
+            u"applications": {},
+        }))
+        deployment_config_path = temp.child(b"deploy.yml")
+        deployment_config_path.setContent(safe_dump({
+            u"version": 1,
+            u"nodes": {},
+        }))
+        options = DeployOptions()
+        options.parseOptions([
+            b"--max-connections", b"7",
+            deployment_config_path.path, application_config_path.path])
+
+        script = DeployScript()
+        script._configure_ssh = lambda deployment, reconfigure: succeed(None)
+        self.successResultOf(script.main(reactor, options))
+
+        deployment = Deployment(nodes={
+            Node(hostname=u"node101.example.com",
+                 applications=frozenset()),
+            Node(hostname=u"node102.example.com",
+                 applications=frozenset()),
+        })
+        semaphores = set(
+            target.node._semaphore
+            for target in script._get_destinations(deployment))
+        self.assertEqual(
+            [7], [semaphore.limit for semaphore in semaphores])
+
+    def run_script(self, alternate_destinations, extra_arguments=(),
+                   post_configuration=None):
         """
         Run ``DeployScript.main`` with overridden destinations for
         ``flocker-changestate`` and ``flocker-reportstate``.
 
         :param list alternate_destinations: ``INode`` providers to connect
              to instead of the default SSH-based ``ProcessNode``.
+        :param extra_arguments: Further command line arguments to parse
+             before the configuration files.
+        :param post_configuration: If not ``None``, a replacement for
+             ``post_configuration`` to give ``flocker-serve`` its
+             configuration with.
 
         :return: ``Deferred`` that fires with result of ``DeployScript.main``.
         """
@@ -378,15 +463,21 @@ class FlockerDeployMainTests(TestCase):
         deployment_config_path.setContent(self.deployment_config)
 
         options = DeployOptions()
-        options.parseOptions([
+        options.parseOptions(list(extra_arguments) + [
             deployment_config_path.path, application_config_path.path])
 
         # Change destination of commands:
-        script = DeployScript()
-        script._get_destinations = lambda nodes: alternate_destinations
+        script = DeployScript(state_cache=FilePath(self.mktemp()))
+        script._get_destinations = lambda deployment: [
+            target for target in alternate_destinations
+            if target.hostname in
+            {node.hostname for node in deployment.nodes}]
 
         # Disable SSH configuration:
-        script._configure_ssh = lambda deployment: succeed(None)
+        script._configure_ssh = lambda deployment, reconfigure: succeed(None)
+
+        if post_configuration is not None:
+            script.post_configuration = post_configuration
 
         return script.main(reactor, options)
 
@@ -443,6 +534,197 @@ class FlockerDeployMainTests(TestCase):
         running.addCallback(ran)
         return running
 
+    def test_calls_reportstate_async(self):
+        """
+        ``DeployScript.main`` calls ``flocker-reportstate`` on destination
+        nodes which provide ``IAsyncNode`` without using a thread.
+        """
+        self.patch(DeployScript, "_changestate_on_nodes", lambda *args: None)
+        self.patch(script_module, "deferToThread", lambda *args: 1/0)
+
+        destinations = [
+            NodeTarget(node=FakeAsyncNode([report({})]),
+                       hostname=b'node101.example.com'),
+            NodeTarget(node=FakeAsyncNode([report({})]),
+                       hostname=b'node102.example.com'),
+        ]
+        running = self.run_script(destinations)
+
+        def ran(ignored):
+            command = [b"flocker-reportstate", b"--format", b"json",
+                       b"--since", b"none"]
+            self.assertEqual(
+                [command, command],
+                [target.node.remote_command for target in destinations])
+        running.addCallback(ran)
+        return running
+
+    def test_calls_changestate_async(self):
+        """
+        ``DeployScript.main`` calls ``flocker-changestate`` on destination
+        nodes which provide ``IAsyncNode`` without using a thread.
+        """
+        self.patch(script_module, "deferToThread", lambda *args: 1/0)
+
+        destinations = [
+            NodeTarget(node=FakeAsyncNode([report({}), b""]),
+                       hostname=b'node101.example.com'),
+            NodeTarget(node=FakeAsyncNode([report({}), b""]),
+                       hostname=b'node102.example.com'),
+        ]
+        running = self.run_script(destinations)
+
+        def ran(ignored):
+            self.assertEqual(
+                [[b"flocker-changestate", target.hostname]
+                 for target in destinations],
+                [[target.node.remote_command[0],
+                  target.node.remote_command[-1]]
+                 for target in destinations])
+        running.addCallback(ran)
+        return running
+
+    def test_changestate_stdin(self):
+        """
+        ``DeployScript.main`` gives ``flocker-changestate`` on nodes which
+        provide ``IAsyncNode`` the configurations on standard input, with
+        the full current configuration of only that node and the
+        applications with volumes of every node.
+        """
+        site = {u"image": u"clusterhq/example-site"}
+        db = {u"image": u"clusterhq/example-db",
+              u"volume": {u"mountpoint": u"/var/lib/db"}}
+        state1 = {u"version": 1, u"applications": {u"db-example.com": db}}
+        state2 = {u"version": 1, u"applications": {u"site-example.com": site}}
+        destinations = [
+            NodeTarget(node=FakeAsyncNode([report(state1), b""]),
+                       hostname=u'node101.example.com'),
+            NodeTarget(node=FakeAsyncNode([report(state2), b""]),
+                       hostname=u'node102.example.com'),
+        ]
+        running = self.run_script(destinations)
+
+        def ran(ignored):
+            volumes = {
+                u'node101.example.com': state1,
+                u'node102.example.com': {u"version": 1,
+                                         u"applications": {}},
+            }
+            received = []
+            for target in destinations:
+                frames = split_frames(target.node.stdin)
+                received.append(
+                    [target.node.remote_command] + map(safe_load, frames))
+            self.assertEqual(
+                [[[b"flocker-changestate", b"--stdin", target.hostname],
+                  safe_load(self.deployment_config),
+                  safe_load(self.application_config),
+                  volumes, {target.hostname: state}]
+                 for (target, state) in zip(destinations, [state1, state2])],
+                received)
+        running.addCallback(ran)
+        return running
+
+    def converged_destinations(self):
+        """
+        :return: A ``list`` of ``NodeTarget`` whose ``flocker-reportstate``
+            output says they already match the configuration used by
+            ``run_script``, apart from ``node102.example.com`` which is not
+            yet running ``db-example.com``.
+        """
+        def state(name, image, not_running=()):
+            return report({
+                u"version": 1,
+                u"applications": {name: {u"image": image}},
+                u"not_running": list(not_running),
+                u"proxied_ports": [],
+            })
+        return [
+            NodeTarget(node=FakeAsyncNode([
+                state(u"site-example.com", u"clusterhq/example-site"), b""]),
+                hostname=u'node101.example.com'),
+            NodeTarget(node=FakeAsyncNode([
+                state(u"db-example.com", u"clusterhq/example-db",
+                      not_running=[u"db-example.com"]), b""]),
+                hostname=u'node102.example.com'),
+        ]
+
+    def test_changestate_affected_only(self):
+        """
+        ``DeployScript.main`` only calls ``flocker-changestate`` on nodes
+        whose current configuration differs from the desired one.
+        """
+        destinations = self.converged_destinations()
+        running = self.run_script(destinations)
+
+        def ran(ignored):
+            self.assertEqual(
+                [[b"flocker-reportstate", b"--format", b"json", b"--since",
+                  b"none"],
+                 [b"flocker-changestate", b"--stdin", b"node102.example.com"]],
+                [destinations[0].node.remote_command,
+                 destinations[1].node.remote_command])
+        running.addCallback(ran)
+        return running
+
+    def test_changestate_converge_all(self):
+        """
+        When the ``--converge-all`` option is given ``DeployScript.main``
+        calls ``flocker-changestate`` on every node.
+        """
+        destinations = self.converged_destinations()
+        running = self.run_script(destinations, [b"--converge-all"])
+
+        def ran(ignored):
+            self.assertEqual(
+                [b"flocker-changestate", b"flocker-changestate"],
+                [target.node.remote_command[0] for target in destinations])
+        running.addCallback(ran)
+        return running
+
+    def test_api_port(self):
+        """
+        When the ``--api-port`` option is given ``DeployScript.main`` posts
+        the configuration to ``flocker-serve`` on that port of each affected
+        node instead of calling ``flocker-changestate``.
+        """
+        destinations = self.converged_destinations()
+        posted = []
+        running = self.run_script(
+            destinations, [b"--api-port", b"4523"],
+            lambda reactor, hostname, port, body: succeed(
+                posted.append((hostname, port, json.loads(body)))))
+
+        def ran(ignored):
+            def state(name, image, not_running=()):
+                return {u"version": 1,
+                        u"applications": {name: {u"image": image}},
+                        u"not_running": list(not_running),
+                        u"proxied_ports": []}
+            cluster_state = {
+                u"node101.example.com": state(
+                    u"site-example.com", u"clusterhq/example-site"),
+                u"node102.example.com": state(
+                    u"db-example.com", u"clusterhq/example-db",
+                    not_running=[u"db-example.com"]),
+            }
+            self.assertEqual(
+                ([[b"flocker-reportstate", b"--format", b"json",
+                   b"--since", b"none"]] * 2,
+                 [(u"node102.example.com", 4523, {
+                     u"hostname": u"node102.example.com",
+                     u"deployment": self.deployment_config,
+                     u"application": self.application_config,
+                     u"current": [
+                         volume_configuration(cluster_state),
+                         {u"node102.example.com":
+                          cluster_state[u"node102.example.com"]}],
+                 })]),
+                ([target.node.remote_command for target in destinations],
+                 posted))
+        running.addCallback(ran)
+        return running
+
     def test_reportstate_failure_means_no_changestate(self):
         """
         If ``flocker-reportstate`` fails to respond for some reason,
@@ -538,3 +820,763 @@ class FlockerDeployMainTests(TestCase):
                 set([current_thread().ident]))
         running.addCallback(ran)
         return running
+
+
+class KnownStatesTests(TestCase):
+    """
+    Tests for ``DeployScript._reportstate_on_nodes``'s use of the last known
+    configuration of each node.
+    """
+    state = {u"version": 1, u"applications": {
+        u"site": {u"image": u"clusterhq/site"}}}
+
+    def setUp(self):
+        self.state_cache = FilePath(self.mktemp()).child(b"state.json")
+        self.deployment = Deployment(nodes=frozenset([
+            Node(hostname=u"node1.example.com", applications=frozenset())]))
+
+    def reportstate(self, output):
+        """
+        Gather the state of one node with a fake ``flocker-reportstate``.
+
+        :param bytes output: The output of ``flocker-reportstate``.
+
+        :return: A two-tuple of the ``FakeAsyncNode`` and the result of
+            ``_reportstate_on_nodes``.
+        """
+        node = FakeAsyncNode([output])
+        script = DeployScript(state_cache=self.state_cache)
+        script._get_destinations = lambda deployment: [
+            NodeTarget(node=node, hostname=u"node1.example.com")]
+        return node, self.successResultOf(
+            script._reportstate_on_nodes(self.deployment))
+
+    def test_remembered(self):
+        """
+        The reported configuration is remembered, and its token is given to
+        ``flocker-reportstate`` the next time.
+        """
+        first = full_report(self.state)
+        self.reportstate(json.dumps(first))
+        node, states = self.reportstate(
+            json.dumps({u"token": first[u"token"], u"unchanged": True}))
+        self.assertEqual(
+            ([b"flocker-reportstate", b"--format", b"json", b"--since",
+              first[u"token"]],
+             {u"node1.example.com": self.state}),
+            (node.remote_command, states))
+
+    def test_changes(self):
+        """
+        Changes reported relative to the remembered configuration are applied
+        to it.
+        """
+        first = full_report(self.state)
+        self.reportstate(json.dumps(first))
+        changed = {u"version": 1, u"applications": {
+            u"site": {u"image": u"clusterhq/site:2"}}}
+        second = state_report(
+            first[u"token"],
+            {u"token": first[u"token"], u"state": self.state}, changed)
+        node, states = self.reportstate(json.dumps(second))
+        self.assertEqual({u"node1.example.com": changed}, states)
+
+    def test_damaged_cache(self):
+        """
+        If the remembered configurations cannot be read, every node is asked
+        for its full configuration.
+        """
+        self.state_cache.parent().makedirs()
+        self.state_cache.setContent(b"{")
+        node, states = self.reportstate(json.dumps(full_report(self.state)))
+        self.assertEqual(
+            ([b"flocker-reportstate", b"--format", b"json", b"--since",
+              b"none"],
+             {u"node1.example.com": self.state}),
+            (node.remote_command, states))
+
+
+class ConfigurationResource(Resource):
+    """
+    A stand-in for the ``flocker-serve`` configuration API.
+
+    :ivar result: The decoded JSON to respond with.
+    :ivar list requests: Three-tuples of the path, content type and body of
+        each request.
+    """
+    isLeaf = True
+
+    def __init__(self, result):
+        Resource.__init__(self)
+        self.result = result
+        self.requests = []
+
+    def render_POST(self, request):
+        self.requests.append((
+            request.path,
+            request.requestHeaders.getRawHeaders(b"content-type"),
+            request.content.read()))
+        return json.dumps(self.result)
+
+
+# Forward standard input and output to a TCP port on the loopback
+# interface, as ``ssh -W`` does on a node.
+FORWARDER = b"""
+import os, select, socket, sys
+connection = socket.create_connection(("127.0.0.1", int(sys.argv[1])))
+readers = [0, connection]
+while True:
+    for reader in select.select(readers, [], [])[0]:
+        if reader == 0:
+            data = os.read(0, 65536)
+            if data:
+                connection.sendall(data)
+            else:
+                readers.remove(0)
+        else:
+            data = connection.recv(65536)
+            if not data:
+                sys.exit(0)
+            os.write(1, data)
+"""
+
+
+class PostThroughTests(TestCase):
+    """
+    Tests for ``post_through``.
+    """
+    def test_posts(self):
+        """
+        ``post_through`` posts the JSON body to the given path of the HTTP
+        server the process is connected to and fires with the decoded
+        response.
+        """
+        resource = ConfigurationResource({u"error": False, u"result": None})
+        port = reactor.listenTCP(0, Site(resource), interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        posting = post_through(
+            reactor,
+            (sys.executable, b"-c", FORWARDER, b"%d" % (port.getHost().port,)),
+            b"/v1/configuration", b'{"hostname":"node"}')
+        posting.addCallback(lambda result: self.assertEqual(
+            ({u"error": False, u"result": None},
+             [(b"/v1/configuration", [b"application/json"],
+               b'{"hostname":"node"}')]),
+            (result, resource.requests)))
+        return posting
+
+    def test_process_exits(self):
+        """
+        ``post_through`` fails with ``ResponseNeverReceived`` if the process
+        exits without a response, as ``ssh`` does when it cannot connect.
+        """
+        posting = post_through(
+            reactor, (sys.executable, b"-c", b"raise SystemExit(255)"),
+            b"/v1/configuration", b'{"hostname":"node"}')
+        return self.assertFailure(posting, ResponseNeverReceived)
+
+
+class PostConfigurationTests(SynchronousTestCase):
+    """
+    Tests for ``post_configuration``.
+    """
+    def post(self, result):
+        """
+        Post a configuration with ``post_through`` replaced by a fake.
+
+        :param result: The decoded JSON for the fake to respond with.
+
+        :return: A two-tuple of the list of arguments the fake was called
+            with and the ``Deferred`` returned by ``post_configuration``.
+        """
+        calls = []
+
+        def fake_post_through(reactor, argv, path, body):
+            calls.append((reactor, argv, path, body))
+            return succeed(result)
+        self.patch(script_module, "post_through", fake_post_through)
+        return calls, post_configuration(
+            reactor, u"node1.example.com", 4523, b'{"hostname":"node"}',
+            private_key=FilePath(b"/key"))
+
+    def test_posts_over_ssh(self):
+        """
+        ``post_configuration`` posts the JSON body to ``/v1/configuration``
+        through ``ssh`` forwarding to the port on the node's loopback
+        interface, and fires with ``None`` when the response is successful.
+        """
+        calls, posting = self.post({u"error": False, u"result": None})
+        self.assertEqual(
+            (None, [(reactor, ssh_forward_command(
+                b"node1.example.com", 22, b"root", FilePath(b"/key"), 4523),
+                b"/v1/configuration", b'{"hostname":"node"}')]),
+            (self.successResultOf(posting), calls))
+
+    def test_error(self):
+        """
+        ``post_configuration`` fails with ``NodeConfigurationError`` when
+        the response is an error.
+        """
+        _, posting = self.post({u"error": True, u"result": u"incident"})
+        error = self.failureResultOf(posting, NodeConfigurationError).value
+        self.assertEqual(
+            (u"node1.example.com", u"incident"),
+            (error.hostname, error.result))
+
+
+class RecordingSSHConfiguration(object):
+    """
+    A stand-in for ``OpenSSHConfiguration`` which records the nodes it is
+    asked to configure instead of connecting to them.
+
+    :ivar list configured: The (host, port) tuples ``configure_ssh`` has been
+        called with.
+    :ivar set recorded: The (host, port) tuples recorded as configured.
+    """
+    def __init__(self, recorded=()):
+        self.configured = []
+        self.recorded = set(recorded)
+
+    def create_keypair(self):
+        pass
+
+    def configure_ssh(self, host, port):
+        self.configured.append((host, port))
+
+    def configured_nodes(self):
+        return frozenset(self.recorded)
+
+    def record_configured(self, host, port):
+        self.recorded.add((host, port))
+
+
+class ConfigureSSHTests(TestCase):
+    """
+    Tests for ``DeployScript._configure_ssh``'s use of the record of
+    configured nodes.
+    """
+    def setUp(self):
+        self.deployment = Deployment(nodes=frozenset([
+            Node(hostname=u"node1.example.com", applications=frozenset()),
+            Node(hostname=u"node2.example.com", applications=frozenset()),
+        ]))
+
+    def test_records_configured_nodes(self):
+        """
+        Each node which is configured is recorded as configured.
+        """
+        configuration = RecordingSSHConfiguration()
+        script = DeployScript(ssh_configuration=configuration, ssh_port=2222)
+        configuring = script._configure_ssh(self.deployment)
+
+        def configured(ignored):
+            expected = {(u"node1.example.com", 2222),
+                        (u"node2.example.com", 2222)}
+            self.assertEqual(
+                (expected, expected),
+                (set(configuration.configured), configuration.recorded))
+        configuring.addCallback(configured)
+        return configuring
+
+    def test_skips_recorded_nodes(self):
+        """
+        Nodes which are already recorded as configured are not configured
+        again.
+        """
+        configuration = RecordingSSHConfiguration(
+            recorded=[(u"node1.example.com", 22)])
+        script = DeployScript(ssh_configuration=configuration)
+        configuring = script._configure_ssh(self.deployment)
+
+        def configured(ignored):
+            self.assertEqual(
+                [(u"node2.example.com", 22)], configuration.configured)
+        configuring.addCallback(configured)
+        return configuring
+
+    def test_different_port_not_skipped(self):
+        """
+        A node recorded as configured through a different SSH port is
+        configured again.
+        """
+        configuration = RecordingSSHConfiguration(
+            recorded=[(u"node1.example.com", 22),
+                      (u"node2.example.com", 22)])
+        script = DeployScript(ssh_configuration=configuration, ssh_port=2222)
+        configuring = script._configure_ssh(self.deployment)
+
+        def configured(ignored):
+            self.assertEqual(2, len(configuration.configured))
+        configuring.addCallback(configured)
+        return configuring
+
+    def test_reconfigure(self):
+        """
+        If ``reconfigure`` is true, nodes which are recorded as configured are
+        configured again.
+        """
+        configuration = RecordingSSHConfiguration(
+            recorded=[(u"node1.example.com", 22)])
+        script = DeployScript(ssh_configuration=configuration)
+        configuring = script._configure_ssh(
+            self.deployment, reconfigure=True)
+
+        def configured(ignored):
+            self.assertEqual(
+                {(u"node1.example.com", 22), (u"node2.example.com", 22)},
+                set(configuration.configured))
+        configuring.addCallback(configured)
+        return configuring
+
+    def test_main_reconfigure_option(self):
+        """
+        ``DeployScript.main`` configures every node when the
+        ``--reconfigure-ssh`` option is given.
+        """
+        script = DeployScript()
+        calls = []
+        script._configure_ssh = (
+            lambda deployment, reconfigure:
+            calls.append(reconfigure) or succeed(None))
+        script._reportstate_on_nodes = lambda deployment: succeed({})
+        script._changestate_on_nodes = (
+            lambda deployment, deployment_config, application_config,
+            current_config: succeed(None))
+        options = {"deployment": Deployment(nodes=frozenset()),
+                   "deployment_config": b"", "application_config": b"",
+                   "max-connections": 10, "relay-fanout": 0,
+                   "reconfigure-ssh": True, "converge-all": True,
+                   "api-port": None}
+        self.successResultOf(script.main(object(), options))
+        self.assertEqual([True], calls)
+
+
+@implementer(IAsyncNode)
+class InProcessRelayNode(object):
+    """
+    A relay node which runs ``flocker-relay`` commands in-process with
+    ``RelayScript``, against in-memory nodes instead of over SSH.
+
+    :ivar list commands: The ``flocker-relay`` commands which were run.
+    """
+    def __init__(self, nodes):
+        """
+        :param dict nodes: Map hostnames to the ``INode`` providers to run
+            commands on for them.
+        """
+        self._nodes = nodes
+        self.commands = []
+
+    def get_output(self, remote_command, stdin=None):
+        self.commands.append(remote_command)
+        options = RelayOptions()
+        options.parseOptions(remote_command[1:])
+        script = RelayScript()
+        script._stdout = BytesIO()
+        script._stdin = BytesIO(stdin or b"")
+        script._get_destinations = lambda reactor, hostnames, semaphore: [
+            NodeTarget(node=self._nodes[hostname], hostname=hostname)
+            for hostname in hostnames]
+        d = script.main(reactor, options)
+        d.addCallback(lambda _: script._stdout.getvalue())
+        return d
+
+
+class RelayGroupsTests(SynchronousTestCase):
+    """
+    Tests for ``relay_groups``.
+    """
+    def test_groups(self):
+        """
+        ``relay_groups`` divides the sorted hostnames into groups no larger
+        than the fanout.
+        """
+        self.assertEqual(
+            [[u"a", u"b"], [u"c", u"d"], [u"e"]],
+            relay_groups([u"e", u"d", u"c", u"b", u"a"], 2))
+
+    def test_empty(self):
+        """
+        ``relay_groups`` returns no groups if there are no nodes.
+        """
+        self.assertEqual([], relay_groups([], 2))
+
+
+class FlockerRelayTests(FlockerScriptTestsMixin, TestCase):
+    """Tests for ``flocker-relay``."""
+    script = RelayScript
+    options = RelayOptions
+    command_name = u'flocker-relay'
+
+
+class RelayOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
+    """Tests for :class:`RelayOptions`."""
+    options = RelayOptions
+
+    def test_command_required(self):
+        """
+        A ``UsageError`` is raised if no command is given.
+        """
+        self.assertRaises(UsageError, RelayOptions().parseOptions, [])
+
+    def test_unknown_command(self):
+        """
+        A ``UsageError`` is raised if an unknown command is given.
+        """
+        self.assertRaises(
+            UsageError, RelayOptions().parseOptions, [b"dance", b"node1"])
+
+    def test_hostnames_required(self):
+        """
+        A ``UsageError`` is raised if no hostnames are given.
+        """
+        self.assertRaises(
+            UsageError, RelayOptions().parseOptions, [b"reportstate"])
+
+    def test_reportstate(self):
+        """
+        The hostnames given to the ``reportstate`` command are parsed.
+        """
+        options = RelayOptions()
+        options.parseOptions([b"reportstate", b"node1", b"node2"])
+        self.assertEqual(
+            ("reportstate", [b"node1", b"node2"]),
+            (options.subCommand, options.subOptions["hostnames"]))
+
+    def test_reportstate_stdin(self):
+        """
+        The ``reportstate`` command accepts ``--stdin``.
+        """
+        options = RelayOptions()
+        options.parseOptions([b"reportstate", b"--stdin", b"node1"])
+        self.assertEqual(
+            (True, [b"node1"]),
+            (options.subOptions["stdin"], options.subOptions["hostnames"]))
+
+    def test_reportstate_format(self):
+        """
+        The ``reportstate`` command writes YAML unless another format is
+        given with ``--format``.
+        """
+        default = RelayOptions()
+        default.parseOptions([b"reportstate", b"node1"])
+        json_format = RelayOptions()
+        json_format.parseOptions(
+            [b"reportstate", b"--format", b"json", b"node1"])
+        self.assertEqual(
+            ("yaml", "json"),
+            (default.subOptions["format"], json_format.subOptions["format"]))
+
+    def test_reportstate_unknown_format(self):
+        """
+        The ``reportstate`` command rejects unknown formats.
+        """
+        self.assertRaises(
+            UsageError, RelayOptions().parseOptions,
+            [b"reportstate", b"--format", b"xml", b"node1"])
+
+    def test_changestate(self):
+        """
+        The configurations and hostnames given to the ``changestate`` command
+        are parsed.
+        """
+        options = RelayOptions()
+        options.parseOptions(
+            [b"changestate", b"deploy", b"app", b"cluster", b"node1"])
+        self.assertEqual(
+            ("changestate", b"deploy", b"app", b"cluster", [b"node1"]),
+            (options.subCommand,
+             options.subOptions["deployment_config"],
+             options.subOptions["application_config"],
+             options.subOptions["cluster_config"],
+             options.subOptions["hostnames"]))
+
+    def test_changestate_stdin(self):
+        """
+        With ``--stdin``, only hostnames are given to the ``changestate``
+        command.
+        """
+        options = RelayOptions()
+        options.parseOptions(
+            [b"changestate", b"--stdin", b"node1", b"node2"])
+        self.assertEqual(
+            (True, [b"node1", b"node2"]),
+            (options.subOptions["stdin"], options.subOptions["hostnames"]))
+
+    def test_changestate_stdin_hostnames_required(self):
+        """
+        A ``UsageError`` is raised if no hostnames are given to the
+        ``changestate --stdin`` command.
+        """
+        self.assertRaises(
+            UsageError, RelayOptions().parseOptions,
+            [b"changestate", b"--stdin"])
+
+
+class RelayScriptTests(TestCase):
+    """
+    Tests for ``RelayScript.main``.
+    """
+    def test_get_destinations(self):
+        """
+        ``RelayScript._get_destinations`` connects to the nodes over SSH
+        using the key ``flocker-deploy`` installs on every node.
+        """
+        key = FilePath(b"/etc/flocker/id_rsa_flocker")
+        self.assertEqual(
+            [NodeTarget(
+                node=SpawnProcessNode.using_ssh(
+                    reactor, u"node1", 22, b"root", key),
+                hostname=u"node1")],
+            list(RelayScript()._get_destinations(
+                reactor, [u"node1"], DeferredSemaphore(1))))
+
+    def run_relay(self, nodes, arguments):
+        """
+        Run ``flocker-relay`` in-process against some in-memory nodes.
+
+        :return: A two-tuple of the ``InProcessRelayNode`` and the
+            ``Deferred`` result of running the command.
+        """
+        relay = InProcessRelayNode(nodes)
+        return relay, relay.get_output([b"flocker-relay"] + arguments)
+
+    def test_reportstate(self):
+        """
+        ``flocker-relay reportstate`` writes a YAML mapping of each hostname
+        to the output of ``flocker-reportstate`` on that node.
+        """
+        nodes = {u"node1": FakeNode([safe_dump({u"a": 1})]),
+                 u"node2": FakeNode([safe_dump({u"b": 2})])}
+        relay, d = self.run_relay(
+            nodes, [b"reportstate", u"node1", u"node2"])
+        d.addCallback(safe_load)
+        d.addCallback(
+            self.assertEqual, {u"node1": {u"a": 1}, u"node2": {u"b": 2}})
+        return d
+
+    def test_reportstate_stdin(self):
+        """
+        ``flocker-relay reportstate --stdin`` gives each node the token read
+        from standard input for it and writes a mapping of each hostname to
+        its report in the requested format.
+        """
+        unchanged = {u"token": u"abc", u"unchanged": True}
+        full = full_report({u"version": 1, u"applications": {}})
+        nodes = {u"node1": FakeAsyncNode([json.dumps(unchanged)]),
+                 u"node2": FakeAsyncNode([json.dumps(full)])}
+        relay = InProcessRelayNode(nodes)
+        d = relay.get_output(
+            [b"flocker-relay", b"reportstate", b"--stdin", b"--format",
+             b"json", u"node1", u"node2"],
+            stdin=safe_dump({u"node1": u"abc"}))
+        d.addCallback(json.loads)
+
+        def ran(reports):
+            self.assertEqual(
+                ({u"node1": unchanged, u"node2": full},
+                 [b"flocker-reportstate", b"--format", b"json", b"--since",
+                  u"abc"],
+                 [b"flocker-reportstate", b"--format", b"json", b"--since",
+                  b"none"]),
+                (reports, nodes[u"node1"].remote_command,
+                 nodes[u"node2"].remote_command))
+        d.addCallback(ran)
+        return d
+
+    def test_reportstate_failure(self):
+        """
+        ``flocker-relay reportstate`` fails if ``flocker-reportstate`` fails
+        on any of the nodes.
+        """
+        nodes = {u"node1": FakeNode([IOError()]),
+                 u"node2": FakeNode([b"{}"])}
+        relay, d = self.run_relay(
+            nodes, [b"reportstate", u"node1", u"node2"])
+        return self.assertFailure(d, IOError)
+
+    def test_changestate(self):
+        """
+        ``flocker-relay changestate`` runs ``flocker-changestate`` on each of
+        the nodes with the configurations and that node's hostname.
+        """
+        cluster = safe_dump({u"node1": {u"version": 1, u"applications": {}}})
+        nodes = {u"node1": FakeNode([b""]), u"node2": FakeNode([b""])}
+        relay, d = self.run_relay(
+            nodes,
+            [b"changestate", b"deploy", b"app", cluster,
+             u"node1", u"node2"])
+
+        def ran(ignored):
+            self.assertEqual(
+                {hostname: [b"flocker-changestate", b"deploy", b"app",
+                            cluster, hostname]
+                 for hostname in nodes},
+                {hostname: node.remote_command
+                 for (hostname, node) in nodes.items()})
+        d.addCallback(ran)
+        return d
+
+    def test_changestate_stdin(self):
+        """
+        ``flocker-relay changestate --stdin`` reads the configurations from
+        standard input and runs ``flocker-changestate --stdin`` on each of
+        the nodes, giving each only its own full configuration.
+        """
+        site = {u"image": u"clusterhq/site"}
+        volumes = {u"node1": {u"version": 1, u"applications": {}},
+                   u"node2": {u"version": 1, u"applications": {}},
+                   u"node3": {u"version": 1, u"applications": {}}}
+        full = {u"node1": {u"version": 1, u"applications": {}},
+                u"node2": {u"version": 1, u"applications": {u"site": site}}}
+        stdin = join_frames(map(encode_frame, [
+            b"deploy", b"app", json.dumps(volumes), json.dumps(full)]))
+        nodes = {u"node1": FakeAsyncNode([b""]),
+                 u"node2": FakeAsyncNode([b""])}
+        relay = InProcessRelayNode(nodes)
+        d = relay.get_output(
+            [b"flocker-relay", b"changestate", b"--stdin", u"node1",
+             u"node2"], stdin=stdin)
+
+        def ran(ignored):
+            received = {}
+            for hostname, node in nodes.items():
+                deploy, app, node_volumes, node_full = split_frames(
+                    node.stdin)
+                received[hostname] = (
+                    node.remote_command, deploy, app,
+                    json.loads(node_volumes), json.loads(node_full))
+            self.assertEqual(
+                {hostname: ([b"flocker-changestate", b"--stdin", hostname],
+                            b"deploy", b"app", volumes,
+                            {hostname: full[hostname]})
+                 for hostname in nodes},
+                received)
+        d.addCallback(ran)
+        return d
+
+    def test_changestate_failure(self):
+        """
+        ``flocker-relay changestate`` fails if ``flocker-changestate`` fails
+        on any of the nodes.
+        """
+        nodes = {u"node1": FakeNode([IOError()])}
+        relay, d = self.run_relay(
+            nodes, [b"changestate", b"deploy", b"app", b"{}", u"node1"])
+        return self.assertFailure(d, IOError)
+
+
+class DeployRelayTests(TestCase):
+    """
+    Tests for ``DeployScript`` running commands through relays.
+    """
+    def test_get_relays(self):
+        """
+        ``DeployScript._get_relays`` divides the nodes between relays
+        according to the ``--relay-fanout`` option, connecting to the first
+        node of each group over SSH.
+        """
+        script = DeployScript()
+        script._relay_fanout = 2
+        deployment = Deployment(nodes={
+            Node(hostname=u"node%d.example.com" % (i,),
+                 applications=frozenset())
+            for i in range(3)})
+        id_rsa_flocker = DEFAULT_SSH_DIRECTORY.child(b"id_rsa_flocker")
+
+        def relay(hostnames):
+            return RelayTarget(
+                node=SpawnProcessNode.using_ssh(
+                    reactor, hostnames[0], 22, b"root", id_rsa_flocker),
+                hostnames=hostnames)
+
+        self.assertEqual(
+            [relay([u"node0.example.com", u"node1.example.com"]),
+             relay([u"node2.example.com"])],
+            script._get_relays(deployment))
+
+    def test_no_relays(self):
+        """
+        ``DeployScript._get_relays`` returns ``None`` if relays are not
+        enabled.
+        """
+        self.assertIsNone(DeployScript()._get_relays(
+            Deployment(nodes=frozenset())))
+
+    def test_through_relays(self):
+        """
+        With relays, ``DeployScript.main`` gathers the state of every node
+        through the relays and then changes the state of every node through
+        them.
+        """
+        site = u"site-example.com"
+        state1 = {u"version": 1, u"applications": {}}
+        state2 = {u"version": 1, u"applications": {
+            site: {u"image": u"clusterhq/example-site"}}}
+        nodes = {
+            u"node101.example.com": FakeNode([safe_dump(state1), b""]),
+            u"node102.example.com": FakeNode([safe_dump(state2), b""]),
+            u"node103.example.com": FakeNode([safe_dump(state1), b""]),
+        }
+        relays = [
+            RelayTarget(node=InProcessRelayNode(nodes),
+                        hostnames=[u"node101.example.com",
+                                   u"node102.example.com"]),
+            RelayTarget(node=InProcessRelayNode(nodes),
+                        hostnames=[u"node103.example.com"]),
+        ]
+
+        temp = FilePath(self.mktemp())
+        temp.makedirs()
+        application_config_path = temp.child(b"app.yml")
+        application_config_path.setContent(safe_dump({
+            u"version": 1,
+            u"applications": {site: {u"image": u"clusterhq/example-site"}},
+        }))
+        deployment_config_path = temp.child(b"deploy.yml")
+        deployment_config_path.setContent(safe_dump({
+            u"version": 1,
+            u"nodes": {hostname: [] for hostname in nodes},
+        }))
+        options = DeployOptions()
+        options.parseOptions([
+            b"--relay-fanout", b"2",
+            deployment_config_path.path, application_config_path.path])
+
+        script = DeployScript(state_cache=FilePath(self.mktemp()))
+        script._configure_ssh = lambda deployment, reconfigure: succeed(None)
+        script._get_relays = lambda deployment: relays
+        running = script.main(reactor, options)
+
+        def ran(ignored):
+            # Each relay only has the full state of its own nodes; the site
+            # on node102 has no volume so the second relay is not told
+            # about it.
+            cluster = {u"node101.example.com": state1,
+                       u"node102.example.com": state2,
+                       u"node103.example.com": state1}
+            reduced = dict(cluster)
+            reduced[u"node102.example.com"] = state1
+            self.assertEqual(
+                ([[b"reportstate", b"--stdin", b"--format", b"json",
+                   u"node101.example.com", u"node102.example.com"],
+                  [b"reportstate", b"--stdin", b"--format", b"json",
+                   u"node103.example.com"]],
+                 [[b"changestate", b"--stdin", u"node101.example.com",
+                   u"node102.example.com"],
+                  [b"changestate", b"--stdin", u"node103.example.com"]],
+                 {u"node101.example.com": (
+                     b"flocker-changestate", cluster, u"node101.example.com"),
+                  u"node102.example.com": (
+                      b"flocker-changestate", cluster, u"node102.example.com"),
+                  u"node103.example.com": (
+                      b"flocker-changestate", reduced,
+                      u"node103.example.com")}),
+                ([relay.node.commands[0][1:] for relay in relays],
+                 [relay.node.commands[1][1:] for relay in relays],
+                 {hostname: (node.remote_command[0],
+                             safe_load(node.remote_command[3]),
+                             node.remote_command[4])
+                  for (hostname, node) in nodes.items()}))
+        running.addCallback(ran)
+        return running
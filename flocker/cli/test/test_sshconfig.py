@@ -0,0 +1,60 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for the record of nodes configured by ``OpenSSHConfiguration``.
+"""
+
+from ipaddr import IPv4Address
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._sshconfig import OpenSSHConfiguration
+
+
+class ConfiguredNodesTests(SynchronousTestCase):
+    """
+    Tests for ``OpenSSHConfiguration.configured_nodes`` and
+    ``OpenSSHConfiguration.record_configured``.
+    """
+    def setUp(self):
+        self.ssh_config = FilePath(self.mktemp())
+        self.ssh_config.makedirs()
+        self.public_key = self.ssh_config.child(b"id_rsa_flocker.pub")
+        self.public_key.setContent(b"ssh-rsa AAAA first@example\n")
+        self.configuration = OpenSSHConfiguration(
+            flocker_path=FilePath(self.mktemp()),
+            ssh_config_path=self.ssh_config)
+
+    def test_nothing_recorded(self):
+        """
+        ``configured_nodes`` returns an empty set if no node has been
+        recorded.
+        """
+        self.assertEqual(frozenset(), self.configuration.configured_nodes())
+
+    def test_recorded(self):
+        """
+        ``configured_nodes`` includes each node passed to
+        ``record_configured``.
+        """
+        self.configuration.record_configured(b"node1.example.com", 22)
+        self.configuration.record_configured(u"node2.example.com", 2222)
+        self.configuration.record_configured(IPv4Address(b"10.0.0.1"), 22)
+        self.assertEqual(
+            frozenset([(b"node1.example.com", 22),
+                       (b"node2.example.com", 2222),
+                       (b"10.0.0.1", 22)]),
+            self.configuration.configured_nodes())
+
+    def test_different_key(self):
+        """
+        Nodes recorded while a different key pair was in place are not
+        included by ``configured_nodes``.
+        """
+        self.configuration.record_configured(b"node1.example.com", 22)
+        self.public_key.setContent(b"ssh-rsa BBBB second@example\n")
+        self.configuration.record_configured(b"node2.example.com", 22)
+        self.assertEqual(
+            frozenset([(b"node2.example.com", 22)]),
+            self.configuration.configured_nodes())
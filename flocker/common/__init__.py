@@ -4,7 +4,18 @@
 Shared flocker components.
 """
 
-__all__ = ['INode', 'FakeNode', 'ProcessNode', 'gather_deferreds']
+__all__ = [
+    'INode', 'FakeNode', 'ProcessNode',
+    'IAsyncNode', 'FakeAsyncNode', 'SpawnProcessNode', 'ssh_forward_command',
+    'gather_deferreds',
+    'encode_frame', 'join_frames', 'split_frames',
+    'safe_load', 'safe_dump',
+]
 
-from ._ipc import INode, FakeNode, ProcessNode
+from ._ipc import (
+    INode, FakeNode, ProcessNode, IAsyncNode, FakeAsyncNode, SpawnProcessNode,
+    ssh_forward_command,
+)
 from ._defer import gather_deferreds
+from ._framing import encode_frame, join_frames, split_frames
+from ._yaml import safe_load, safe_dump
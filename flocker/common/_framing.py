@@ -0,0 +1,88 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_framing -*-
+
+"""
+A stream of separately framed, optionally compressed, byte strings.
+
+This is how ``flocker-deploy`` sends configuration to the standard input of
+the commands it runs on nodes.  Frames are length prefixed so no quoting is
+necessary, and each frame is compressed on its own so a frame shared by many
+streams only needs to be compressed once.
+"""
+
+import re
+import zlib
+
+# The first line of every stream.
+_HEADER = b"flocker-frames 1\n"
+
+# Frames smaller than this are not worth compressing.
+COMPRESSION_THRESHOLD = 1024
+
+_RAW = b"r"
+_ZLIB = b"z"
+
+_FRAME_PREFIX = re.compile(br"([rz])(\d+):")
+
+
+def encode_frame(data):
+    """
+    Frame some bytes, compressing them if they are large enough for that to
+    be worthwhile.
+
+    :param bytes data: The data to frame.
+
+    :return: ``bytes`` which can be passed to ``join_frames``.
+    """
+    encoding = _RAW
+    if len(data) >= COMPRESSION_THRESHOLD:
+        data = zlib.compress(data)
+        encoding = _ZLIB
+    return b"%s%d:%s," % (encoding, len(data), data)
+
+
+def join_frames(frames):
+    """
+    Combine frames into a stream.
+
+    :param frames: An iterable of ``bytes`` returned by ``encode_frame``.
+
+    :return: ``bytes`` which can be passed to ``split_frames``.
+    """
+    return _HEADER + b"".join(frames)
+
+
+def split_frames(stream):
+    """
+    Extract the data from a stream of frames.
+
+    :param bytes stream: Data created by ``join_frames``.
+
+    :raise ValueError: If ``stream`` is not a valid stream of frames.
+
+    :return: A ``list`` of ``bytes``, the data of each frame in order.
+    """
+    if not stream.startswith(_HEADER):
+        raise ValueError("Not a stream of frames.")
+    parts = []
+    position = len(_HEADER)
+    while position < len(stream):
+        prefix = _FRAME_PREFIX.match(stream, position)
+        if prefix is None:
+            raise ValueError("Bad frame at offset {}.".format(position))
+        encoding, length = prefix.group(1), int(prefix.group(2))
+        start = prefix.end()
+        end = start + length
+        if stream[end:end + 1] != b",":
+            raise ValueError("Truncated frame at offset {}.".format(position))
+        data = stream[start:end]
+        if encoding == _ZLIB:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error as e:
+                raise ValueError(
+                    "Bad compressed frame at offset {}: {}".format(
+                        position, e))
+        parts.append(data)
+        position = end + 1
+    return parts
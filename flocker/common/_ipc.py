@@ -10,10 +10,16 @@ from io import BytesIO
 from threading import current_thread
 from pipes import quote
 
+from os import environ
+
 from zope.interface import Interface, implementer
 
 from characteristic import with_cmp, with_repr
 
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.error import ProcessDone
+from twisted.internet.protocol import ProcessProtocol
+
 
 class INode(Interface):
     """
@@ -43,6 +49,74 @@ class INode(Interface):
         """
 
 
+class IAsyncNode(Interface):
+    """
+    A remote node with which this node can communicate without blocking.
+    """
+
+    def get_output(remote_command, stdin=None):
+        """Run a remote command and return its stdout.
+
+        :param remote_command: ``list`` of ``bytes``, the command to run
+            remotely along with its arguments.
+
+        :param bytes stdin: Data to write to the standard input of the
+            remote command, or ``None`` to write nothing.  Standard input is
+            closed afterwards either way.
+
+        :return: ``Deferred`` that fires with ``bytes`` of stdout from the
+            remote command, or fails with ``IOError`` if it exits with a
+            non-zero exit code.
+        """
+
+
+def _ssh_command(host, port, username, private_key, options=()):
+    """
+    :param options: ``tuple`` of ``bytes``, further options to give ``ssh``.
+
+    :return: ``tuple`` of ``bytes``, the initial command arguments which
+        run a command on a node over SSH.  See ``ProcessNode.using_ssh``
+        for the other parameters.
+    """
+    return (
+        b"ssh",
+        b"-q",  # suppress warnings
+        b"-i", private_key.path,
+        b"-l", username,
+        # We're ok with unknown hosts; we'll be switching away from
+        # SSH by the time Flocker is production-ready and security is
+        # a concern.
+        b"-o", b"StrictHostKeyChecking=no",
+        # The tests hang if ControlMaster is set, since OpenSSH won't
+        # ever close the connection to the test server.
+        b"-oControlMaster=no",
+        # On some Ubuntu versions (and perhaps elsewhere) not
+        # disabling this leads for mDNS lookups on every SSH, which
+        # can slow down connections very noticeably:
+        b"-o", b"IgnoreUnknown=GSSAPIAuthentication",
+        b"-o", b"GSSAPIAuthentication=no",
+        b"-p", b"%d" % (port,)) + tuple(options) + (host,)
+
+
+def ssh_forward_command(host, port, username, private_key, target_port):
+    """
+    Create the command line of an ``ssh`` process which connects its
+    standard input and output to a TCP port on the loopback interface of a
+    node, so that a service the node only exposes locally can be used with
+    the same trust as running commands on it.
+
+    See ``ProcessNode.using_ssh`` for the meaning of ``host``, ``port``,
+    ``username`` and ``private_key``.
+
+    :param int target_port: The port on the node to connect to.
+
+    :return: ``tuple`` of ``bytes``, the command line.
+    """
+    return _ssh_command(
+        host, port, username, private_key,
+        options=(b"-W", b"127.0.0.1:%d" % (target_port,)))
+
+
 @with_cmp(["initial_command_arguments"])
 @with_repr(["initial_command_arguments"])
 @implementer(INode)
@@ -101,24 +175,111 @@ class ProcessNode(object):
 
         :return: ``ProcessNode`` instance that communicates over SSH.
         """
-        return cls(initial_command_arguments=(
-            b"ssh",
-            b"-q",  # suppress warnings
-            b"-i", private_key.path,
-            b"-l", username,
-            # We're ok with unknown hosts; we'll be switching away from
-            # SSH by the time Flocker is production-ready and security is
-            # a concern.
-            b"-o", b"StrictHostKeyChecking=no",
-            # The tests hang if ControlMaster is set, since OpenSSH won't
-            # ever close the connection to the test server.
-            b"-oControlMaster=no",
-            # On some Ubuntu versions (and perhaps elsewhere) not
-            # disabling this leads for mDNS lookups on every SSH, which
-            # can slow down connections very noticeably:
-            b"-o", b"IgnoreUnknown=GSSAPIAuthentication",
-            b"-o", b"GSSAPIAuthentication=no",
-            b"-p", b"%d" % (port,), host), quote=quote)
+        return cls(
+            initial_command_arguments=_ssh_command(
+                host, port, username, private_key),
+            quote=quote)
+
+
+class _OutputCollector(ProcessProtocol):
+    """
+    Write some bytes to the standard input of a child process and collect its
+    standard output.
+    """
+    def __init__(self, deferred, stdin):
+        """
+        :param Deferred deferred: Fired with a two-tuple of the output and
+            the reason the process ended when it does.
+        :param bytes stdin: Data to write to standard input, or ``None``.
+        """
+        self._deferred = deferred
+        self._stdin = stdin
+        self._output = []
+
+    def connectionMade(self):
+        if self._stdin is not None:
+            self.transport.write(self._stdin)
+        self.transport.closeStdin()
+
+    def outReceived(self, data):
+        self._output.append(data)
+
+    def processEnded(self, reason):
+        self._deferred.callback((b"".join(self._output), reason))
+
+
+@with_cmp(["initial_command_arguments"])
+@with_repr(["initial_command_arguments"])
+@implementer(IAsyncNode)
+class SpawnProcessNode(object):
+    """
+    Communicate with a remote node using a child process run by the reactor,
+    so that many nodes can be talked to at once without a thread for each.
+    """
+    def __init__(self, reactor, initial_command_arguments,
+                 quote=lambda d: d, semaphore=None):
+        """
+        :param IReactorProcess reactor: The reactor to run processes with.
+
+        :param initial_command_arguments: ``tuple`` of ``bytes``, initial
+            command arguments to prefix to whatever arguments get passed to
+           ``get_output()``.
+
+        :param quote: Callable that transforms the non-initial command
+            arguments, converting a list of ``bytes`` to a list of
+            ``bytes``. By default does nothing.
+
+        :param semaphore: A ``DeferredSemaphore`` limiting how many processes
+            run at once, typically shared by many nodes, or ``None`` for no
+            limit.
+        """
+        self._reactor = reactor
+        self.initial_command_arguments = tuple(initial_command_arguments)
+        self._quote = quote
+        self._semaphore = semaphore
+
+    def _get_output(self, remote_command, stdin):
+        argv = (self.initial_command_arguments +
+                tuple(map(self._quote, remote_command)))
+        running = Deferred()
+        self._reactor.spawnProcess(
+            _OutputCollector(running, stdin), argv[0], argv, env=environ)
+
+        def finished(result):
+            output, reason = result
+            if not reason.check(ProcessDone):
+                # We should really capture this and stderr better:
+                # https://clusterhq.atlassian.net/browse/FLOC-155
+                raise IOError("Bad exit", remote_command,
+                              reason.value.exitCode, output)
+            return output
+        running.addCallback(finished)
+        return running
+
+    def get_output(self, remote_command, stdin=None):
+        if self._semaphore is None:
+            return self._get_output(remote_command, stdin)
+        return self._semaphore.run(self._get_output, remote_command, stdin)
+
+    @classmethod
+    def using_ssh(cls, reactor, host, port, username, private_key,
+                  semaphore=None):
+        """Create a ``SpawnProcessNode`` that communicate over SSH.
+
+        See ``ProcessNode.using_ssh`` for the meaning of ``host``, ``port``,
+        ``username`` and ``private_key``.
+
+        :param IReactorProcess reactor: The reactor to run ``ssh`` with.
+        :param semaphore: A ``DeferredSemaphore`` limiting how many ``ssh``
+            processes run at once, or ``None`` for no limit.
+
+        :return: ``SpawnProcessNode`` instance that communicates over SSH.
+        """
+        return cls(
+            reactor=reactor,
+            initial_command_arguments=_ssh_command(
+                host, port, username, private_key),
+            quote=quote, semaphore=semaphore)
 
 
 @implementer(INode)
@@ -167,3 +328,37 @@ class FakeNode(object):
             raise result
         else:
             return result
+
+
+@implementer(IAsyncNode)
+class FakeAsyncNode(object):
+    """
+    Pretend to run a command without blocking.
+
+    This is useful for testing.
+
+    :ivar remote_command: The arguments to the last call to ``get_output()``.
+
+    :ivar stdin: The standard input given to the last call to
+        ``get_output()``.
+    """
+    def __init__(self, outputs=()):
+        """
+        :param outputs: Sequence of results for ``get_output()``, either
+            exceptions or ``bytes``. The ``Deferred`` returned by
+            ``get_output()`` fails with exceptions and otherwise fires with
+            the object.
+        """
+        self._outputs = list(outputs)
+
+    def get_output(self, remote_command, stdin=None):
+        """
+        Return a ``Deferred`` with the next remaining output of the ones
+        passed to the constructor.
+        """
+        self.remote_command = remote_command
+        self.stdin = stdin
+        result = self._outputs.pop(0)
+        if isinstance(result, Exception):
+            return fail(result)
+        return succeed(result)
@@ -0,0 +1,37 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_yaml -*-
+
+"""
+Load and dump YAML with libyaml when it is available.
+
+PyYAML's pure Python loader and dumper are an order of magnitude slower than
+the ones implemented on top of libyaml, which matters for the configuration
+of large clusters.  Both produce the same objects and documents, so the
+pure Python implementations are only used if PyYAML was built without
+libyaml.
+"""
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as _SafeLoader, CSafeDumper as _SafeDumper
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader, SafeDumper as _SafeDumper
+
+
+def safe_load(stream):
+    """
+    Parse a YAML document, constructing only basic Python objects.
+
+    :see: ``yaml.safe_load``
+    """
+    return yaml.load(stream, Loader=_SafeLoader)
+
+
+def safe_dump(data, stream=None, **kwargs):
+    """
+    Serialize basic Python objects to a YAML document.
+
+    :see: ``yaml.safe_dump``
+    """
+    return yaml.dump_all([data], stream, Dumper=_SafeDumper, **kwargs)
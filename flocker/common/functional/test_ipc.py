@@ -4,12 +4,14 @@
 Functional tests for IPC.
 """
 
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore, gatherResults
 from twisted.internet.threads import deferToThread
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import TestCase
 
-from .. import ProcessNode
-from ..test.test_ipc import make_inode_tests
+from .. import ProcessNode, SpawnProcessNode
+from ..test.test_ipc import make_inode_tests, make_iasyncnode_tests
 from ...testtools.ssh import create_ssh_server
 
 
@@ -94,6 +96,94 @@ class ProcessNodeTests(TestCase):
         self.assertRaises(IOError, node.get_output, [b"ls", nonexistent])
 
 
+class SpawnProcessIAsyncNodeTests(make_iasyncnode_tests(
+        lambda t: SpawnProcessNode(reactor, initial_command_arguments=[]))):
+    """``IAsyncNode`` tests for ``SpawnProcessNode``."""
+
+
+class SpawnProcessNodeTests(TestCase):
+    """Tests for ``SpawnProcessNode``."""
+
+    def test_get_output_runs_command(self):
+        """
+        ``SpawnProcessNode.get_output()`` runs a command that is the
+        combination of the initial arguments and the ones given to
+        ``get_output()``.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[b"sh"])
+        temp_file = FilePath(self.mktemp())
+        d = node.get_output([b"-c", b"echo -n hello > " + temp_file.path])
+        d.addCallback(lambda _: self.assertEqual(
+            temp_file.getContent(), b"hello"))
+        return d
+
+    def test_get_output_result(self):
+        """
+        ``get_output()`` returns a ``Deferred`` that fires with the output of
+        the command.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[])
+        d = node.get_output([b"echo", b"-n", b"hello"])
+        d.addCallback(self.assertEqual, b"hello")
+        return d
+
+    def test_get_output_stdin(self):
+        """
+        ``get_output()`` writes the given ``stdin`` to the standard input of
+        the command and then closes it.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[])
+        d = node.get_output([b"cat"], stdin=b"hello")
+        d.addCallback(self.assertEqual, b"hello")
+        return d
+
+    def test_get_output_no_stdin(self):
+        """
+        If no ``stdin`` is given, the standard input of the command is closed
+        without anything being written to it.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[])
+        d = node.get_output([b"cat"])
+        d.addCallback(self.assertEqual, b"")
+        return d
+
+    def test_get_output_bad_exit(self):
+        """
+        ``get_output()`` returns a ``Deferred`` that fails with ``IOError``
+        if the process has a non-zero exit code.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[])
+        nonexistent = self.mktemp()
+        return self.assertFailure(
+            node.get_output([b"ls", nonexistent]), IOError)
+
+    def test_quoted(self):
+        """
+        The arguments given to ``get_output()`` are transformed by the
+        ``quote`` callable.
+        """
+        node = SpawnProcessNode(reactor, initial_command_arguments=[b"echo"],
+                                quote=lambda argument: argument.upper())
+        d = node.get_output([b"hello"])
+        d.addCallback(self.assertEqual, b"HELLO\n")
+        return d
+
+    def test_semaphore(self):
+        """
+        No more processes run at once than the ``semaphore`` allows.
+        """
+        semaphore = DeferredSemaphore(1)
+        node = SpawnProcessNode(reactor, initial_command_arguments=[],
+                                semaphore=semaphore)
+        results = [node.get_output([b"echo", b"-n", b"%d" % (i,)])
+                   for i in range(3)]
+        waiting = len(semaphore.waiting)
+        d = gatherResults(results)
+        d.addCallback(lambda outputs: self.assertEqual(
+            (2, [b"0", b"1", b"2"]), (waiting, outputs)))
+        return d
+
+
 def make_sshnode(test_case):
     """
     Create a ``ProcessNode`` that can SSH into the local machine.
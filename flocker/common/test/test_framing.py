@@ -0,0 +1,75 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._framing``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+from .._framing import (
+    COMPRESSION_THRESHOLD, encode_frame, join_frames, split_frames,
+)
+
+
+class FramingTests(SynchronousTestCase):
+    """
+    Tests for ``encode_frame``, ``join_frames`` and ``split_frames``.
+    """
+    def test_roundtrip(self):
+        """
+        ``split_frames`` returns the data of each frame passed to
+        ``join_frames``, in order.
+        """
+        parts = [b"", b"hello", b"x" * COMPRESSION_THRESHOLD * 3, b"1:2,3"]
+        self.assertEqual(
+            parts, split_frames(join_frames(map(encode_frame, parts))))
+
+    def test_no_frames(self):
+        """
+        A stream can contain no frames.
+        """
+        self.assertEqual([], split_frames(join_frames([])))
+
+    def test_small_not_compressed(self):
+        """
+        Frames smaller than ``COMPRESSION_THRESHOLD`` are not compressed.
+        """
+        self.assertEqual(b"r5:hello,", encode_frame(b"hello"))
+
+    def test_large_compressed(self):
+        """
+        Frames of at least ``COMPRESSION_THRESHOLD`` bytes are compressed.
+        """
+        data = b"x" * COMPRESSION_THRESHOLD
+        self.assertLess(len(encode_frame(data)), len(data))
+
+    def test_missing_header(self):
+        """
+        ``split_frames`` raises ``ValueError`` if the stream does not start
+        with the header.
+        """
+        self.assertRaises(ValueError, split_frames, encode_frame(b"hello"))
+
+    def test_truncated(self):
+        """
+        ``split_frames`` raises ``ValueError`` if a frame is shorter than its
+        length prefix says.
+        """
+        stream = join_frames([encode_frame(b"hello")])
+        self.assertRaises(ValueError, split_frames, stream[:-2])
+
+    def test_bad_prefix(self):
+        """
+        ``split_frames`` raises ``ValueError`` if a frame does not start with
+        a valid prefix.
+        """
+        stream = join_frames([b"q5:hello,"])
+        self.assertRaises(ValueError, split_frames, stream)
+
+    def test_bad_compressed_data(self):
+        """
+        ``split_frames`` raises ``ValueError`` if a compressed frame cannot be
+        decompressed.
+        """
+        stream = join_frames([b"z5:hello,"])
+        self.assertRaises(ValueError, split_frames, stream)
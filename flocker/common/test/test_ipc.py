@@ -10,7 +10,12 @@ from unittest import TestCase as PyTestCase
 
 from zope.interface.verify import verifyObject
 
-from .. import INode, FakeNode
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import TestCase, SynchronousTestCase
+
+from .. import (
+    INode, FakeNode, IAsyncNode, FakeAsyncNode, ssh_forward_command)
+from .._ipc import _ssh_command
 from ...testtools import assertNoFDsLeaked
 
 
@@ -95,3 +100,95 @@ def make_inode_tests(fixture):
 
 class FakeINodeTests(make_inode_tests(lambda t: FakeNode([b"hello"]))):
     """``INode`` tests for ``FakeNode``."""
+
+
+def make_iasyncnode_tests(fixture):
+    """
+    Create a TestCase for ``IAsyncNode``.
+
+    :param fixture: A fixture that returns a :class:`IAsyncNode` provider
+        which will work with any arbitrary valid program with arguments.
+    """
+    class IAsyncNodeTests(TestCase):
+        """Tests for :class:`IAsyncNode` implementors.
+
+        May be functional tests depending on the fixture.
+        """
+        def test_interface(self):
+            """
+            The tested object provides :class:`IAsyncNode`.
+            """
+            node = fixture(self)
+            self.assertTrue(verifyObject(IAsyncNode, node))
+
+        def test_get_output_result_bytes(self):
+            """
+            ``get_output()`` returns a ``Deferred`` that fires with
+            ``bytes``.
+            """
+            node = fixture(self)
+            d = node.get_output([b"echo", b"hello"])
+            d.addCallback(self.assertIsInstance, bytes)
+            return d
+
+        def test_get_output_with_stdin(self):
+            """
+            ``get_output()`` accepts bytes to write to the standard input of
+            the command.
+            """
+            node = fixture(self)
+            d = node.get_output([b"cat"], stdin=b"hello")
+            d.addCallback(self.assertIsInstance, bytes)
+            return d
+
+    return IAsyncNodeTests
+
+
+class FakeIAsyncNodeTests(
+        make_iasyncnode_tests(lambda t: FakeAsyncNode([b"hello"]))):
+    """``IAsyncNode`` tests for ``FakeAsyncNode``."""
+
+
+class FakeAsyncNodeTests(TestCase):
+    """Tests for ``FakeAsyncNode``."""
+
+    def test_remote_command(self):
+        """
+        ``FakeAsyncNode.get_output`` records the command it was given.
+        """
+        node = FakeAsyncNode([b"hello"])
+        node.get_output([b"echo", b"hello"])
+        self.assertEqual([b"echo", b"hello"], node.remote_command)
+
+    def test_stdin(self):
+        """
+        ``FakeAsyncNode.get_output`` records the standard input it was given.
+        """
+        node = FakeAsyncNode([b"hello"])
+        node.get_output([b"cat"], stdin=b"hello")
+        self.assertEqual(b"hello", node.stdin)
+
+    def test_failure(self):
+        """
+        ``FakeAsyncNode.get_output`` returns a failed ``Deferred`` if the
+        next output is an exception.
+        """
+        node = FakeAsyncNode([IOError()])
+        self.failureResultOf(node.get_output([b"false"]), IOError)
+
+
+class SSHForwardCommandTests(SynchronousTestCase):
+    """
+    Tests for ``ssh_forward_command``.
+    """
+    def test_command(self):
+        """
+        ``ssh_forward_command`` returns the ``ssh`` command line used to run
+        commands on the node, with ``-W`` forwarding standard input and
+        output to the port on the node's loopback interface.
+        """
+        key = FilePath(b"/key")
+        self.assertEqual(
+            _ssh_command(b"node", 22, b"root", key)[:-1] +
+            (b"-W", b"127.0.0.1:4523", b"node"),
+            ssh_forward_command(b"node", 22, b"root", key, 4523))
@@ -0,0 +1,70 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._yaml``.
+"""
+
+from twisted.trial.unittest import SynchronousTestCase
+
+import yaml
+from yaml.error import YAMLError
+
+from .._yaml import safe_dump, safe_load
+
+
+class YAMLTests(SynchronousTestCase):
+    """
+    Tests for ``safe_load`` and ``safe_dump``.
+    """
+    document = {
+        u"version": 1,
+        u"applications": {
+            u"site": {u"image": u"clusterhq/site", u"mem_limit": 100,
+                      u"ports": [{u"internal": 80, u"external": 8080}],
+                      u"name": u"\N{SNOWMAN}"},
+        },
+    }
+
+    def test_roundtrip(self):
+        """
+        ``safe_load`` loads the document dumped by ``safe_dump``.
+        """
+        self.assertEqual(self.document, safe_load(safe_dump(self.document)))
+
+    def test_compatible_load(self):
+        """
+        ``safe_load`` loads the same objects, including their types, as
+        ``yaml.safe_load``.
+        """
+        document = yaml.safe_dump(self.document)
+        loaded = safe_load(document)
+        expected = yaml.safe_load(document)
+        self.assertEqual(
+            (expected, type(expected[u"applications"][u"site"][u"image"])),
+            (loaded, type(loaded[u"applications"][u"site"][u"image"])))
+
+    def test_compatible_dump(self):
+        """
+        ``safe_dump`` produces a document ``yaml.safe_load`` loads.
+        """
+        self.assertEqual(
+            self.document, yaml.safe_load(safe_dump(self.document)))
+
+    def test_unsafe_rejected(self):
+        """
+        ``safe_load`` does not construct arbitrary Python objects.
+        """
+        self.assertRaises(
+            YAMLError, safe_load, b"!!python/object/apply:os.getcwd []")
+
+    def test_stream(self):
+        """
+        ``safe_dump`` writes to a stream if given one.
+        """
+        written = []
+
+        class Stream(object):
+            write = written.append
+
+        safe_dump(self.document, Stream())
+        self.assertEqual(self.document, safe_load(b"".join(written)))
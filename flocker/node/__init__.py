@@ -7,12 +7,13 @@ Local node manager for Flocker.
 from ._config import (
     FlockerConfiguration, ConfigurationError, FigConfiguration,
     applications_to_flocker_yaml, model_from_configuration,
-    current_from_configuration,
+    current_from_configuration, volume_configuration, configuration_token,
+    state_report, apply_state_report, STATE_FORMATS, dump_state_json,
     )
 from ._model import (
     Application, Deployment, DockerImage, Node, Port, Link, AttachedVolume,
     NodeState)
-from ._deploy import Deployer
+from ._deploy import Deployer, find_affected_nodes
 
 __all__ = [
     'FlockerConfiguration',
@@ -20,9 +21,16 @@ __all__ = [
     'applications_to_flocker_yaml',
     'current_from_configuration',
     'model_from_configuration',
+    'volume_configuration',
+    'configuration_token',
+    'state_report',
+    'apply_state_report',
+    'STATE_FORMATS',
+    'dump_state_json',
     'Application',
     'Deployment',
     'Deployer',
+    'find_affected_nodes',
     'DockerImage',
     'FigConfiguration',
     'Node',
@@ -7,16 +7,19 @@ APIs for parsing and validating configuration.
 
 from __future__ import unicode_literals, absolute_import
 
+import json
 import math
 import os
 import re
 import types
+from hashlib import sha256
 
 from twisted.python.filepath import FilePath
 
-from yaml import safe_dump
 from zope.interface import Interface, implementer
 
+from ..common import safe_dump
+
 from ._model import (
     Application, AttachedVolume, Deployment, Link,
     DockerImage, Node, Port, RestartAlways, RestartNever, RestartOnFailure,
@@ -35,6 +38,28 @@ FLOCKER_RESTART_POLICY_NAME_TO_POLICY = {
     for policy, name in FLOCKER_RESTART_POLICY_POLICY_TO_NAME.items()
 }
 
+# Map the tunable ZFS properties which may appear in the ``properties`` of a
+# ``volume`` in Flocker's application.yml file to the values they may have.
+# ``recordsize`` is absent since it is a size rather than a choice.
+FLOCKER_VOLUME_PROPERTY_VALUES = {
+    'compression': {
+        'on', 'off', 'lzjb', 'zle', 'lz4', 'gzip',
+    } | {'gzip-{}'.format(level) for level in range(1, 10)},
+    'atime': {'on', 'off'},
+    'logbias': {'latency', 'throughput'},
+    'primarycache': {'all', 'none', 'metadata'},
+}
+
+# The bounds of the ``recordsize`` property, in bytes.
+MINIMUM_RECORDSIZE = 512
+MAXIMUM_RECORDSIZE = 128 * 1024
+
+# The keys allowed in the ``ports``, ``links`` and ``volume`` of an
+# application in Flocker's application.yml file.
+_PORT_KEYS = frozenset({'internal', 'external'})
+_LINK_KEYS = frozenset({'local_port', 'remote_port', 'alias'})
+_VOLUME_KEYS = frozenset({'mountpoint', 'maximum_size', 'properties'})
+
 
 class IApplicationConfiguration(Interface):
     """
@@ -105,7 +130,7 @@ class ApplicationConfigurationError(ConfigurationError):
         return unicode(self).encode('ascii')
 
 
-def _check_type(value, types, description, application_name):
+def _check_type(value, types, description, application_name, **details):
     """
     Checks ``value`` has type in ``types``.
 
@@ -114,6 +139,9 @@ def _check_type(value, types, description, application_name):
     :param str description: Description of expected type.
     :param application_name unicode: Name of application whose config
         contains ``value``.
+    :param details: Values to format ``description`` with.  The description
+        is only formatted if the check fails, so checks of many values do
+        not format a message for each of them.
 
     :raises ConfigurationError: If ``value`` is not of type in ``types``.
     """
@@ -122,7 +150,7 @@ def _check_type(value, types, description, application_name):
             "Application '{application_name}' has a config "
             "error. {description}; got type '{type}'.".format(
                 application_name=application_name,
-                description=description,
+                description=description.format(**details),
                 type=type(value).__name__,
             ))
 
@@ -205,6 +233,8 @@ class ApplicationMarshaller(object):
         if volume:
             config['volume'] = volume
         config['restart_policy'] = self.convert_restart_policy()
+        if self._application.host_network:
+            config['network'] = 'host'
         return config
 
     def convert_restart_policy(self):
@@ -295,6 +325,9 @@ class ApplicationMarshaller(object):
                 volume_dict[u'maximum_size'] = (
                     unicode(self._application.volume.maximum_size)
                 )
+            if self._application.volume.properties:
+                volume_dict[u'properties'] = dict(
+                    self._application.volume.properties)
             return volume_dict
         return None
 
@@ -336,7 +369,7 @@ class FigConfiguration(object):
         self._application_configuration: the application_configuration
             parameter
 
-        self._application_names: A ``list`` of keys in
+        self._application_names: A ``set`` of keys in
             application_configuration representing all application
             names.
 
@@ -365,7 +398,7 @@ class FigConfiguration(object):
                 format(type=type(application_configuration).__name__)
             )
         self._application_configuration = application_configuration
-        self._application_names = self._application_configuration.keys()
+        self._application_names = set(self._application_configuration)
         self._applications = {}
         self._application_links = {}
         self._validated = False
@@ -493,9 +526,8 @@ class FigConfiguration(object):
             for item in environment:
                 _check_type(
                     item, (str, unicode,),
-                    ("'environment' value '{item}' must be a string"
-                     .format(item=item)),
-                    application
+                    "'environment' value '{item}' must be a string",
+                    application, item=item
                 )
                 try:
                     label, value = item.split('=')
@@ -508,9 +540,8 @@ class FigConfiguration(object):
         for var, val in environment_dict.items():
             _check_type(
                 val, (str, unicode,),
-                ("'environment' value for '{var}' must be a string"
-                 .format(var=var)),
-                application
+                "'environment' value for '{var}' must be a string",
+                application, var=var
             )
         return frozenset(environment_dict.items())
 
@@ -688,8 +719,16 @@ class FigConfiguration(object):
                              remote_port=remote_port,
                              alias=link_definition['alias'])
                     )
-            self._applications[application_name].links = frozenset(
-                app_links)
+            application = self._applications[application_name]
+            self._applications[application_name] = Application(
+                name=application.name,
+                image=application.image,
+                volume=application.volume,
+                ports=application.ports,
+                links=frozenset(app_links),
+                environment=application.environment,
+                memory_limit=application.memory_limit,
+            )
 
     def _parse(self):
         """
@@ -779,8 +818,9 @@ def _parse_restart_policy(application_name, config):
             "'restart_policy' must be a dict, "
             "got {}".format(config)
         )
+    arguments = dict(config)
     try:
-        policy_name = config.pop('name')
+        policy_name = arguments.pop('name')
     except KeyError:
         raise ApplicationConfigurationError(
             application_name,
@@ -799,12 +839,12 @@ def _parse_restart_policy(application_name, config):
         )
 
     try:
-        policy = policy_factory(**config)
+        policy = policy_factory(**arguments)
     except TypeError:
         raise ApplicationConfigurationError(
             application_name,
             "Invalid 'restart_policy' arguments for {}. "
-            "Got {}".format(policy_factory.__name__, config)
+            "Got {}".format(policy_factory.__name__, arguments)
         )
     else:
         return policy
@@ -832,7 +872,7 @@ class FlockerConfiguration(object):
         self._allowed_keys = {
             "image", "environment", "ports",
             "links", "volume", "mem_limit", "cpu_shares",
-            "restart_policy",
+            "restart_policy", "network",
         }
         self._applications = {}
 
@@ -939,7 +979,7 @@ class FlockerConfiguration(object):
             (key, value)
 
         """
-        environment = config.pop('environment', None)
+        environment = config.get('environment')
         if environment:
             _check_type(value=environment, types=(dict,),
                         description="'environment' must be a dictionary of "
@@ -954,8 +994,8 @@ class FlockerConfiguration(object):
                             application_name=application_name)
                 _check_type(value=value, types=types.StringTypes,
                             description="Environment variable '{key}' "
-                                        "must be a string".format(key=key),
-                            application_name=application_name)
+                                        "must be a string",
+                            application_name=application_name, key=key)
             environment = frozenset(environment.items())
         return environment
 
@@ -981,7 +1021,7 @@ class FlockerConfiguration(object):
                             application_name=application_name)
 
                 try:
-                    local_port = link.pop('local_port')
+                    local_port = link['local_port']
                     _check_type(value=local_port, types=(int,),
                                 description="Link's local port must be an int",
                                 application_name=application_name)
@@ -989,7 +1029,7 @@ class FlockerConfiguration(object):
                     raise ValueError("Missing local port.")
 
                 try:
-                    remote_port = link.pop('remote_port')
+                    remote_port = link['remote_port']
                     _check_type(value=remote_port, types=(int,),
                                 description="Link's remote port "
                                             "must be an int",
@@ -1000,17 +1040,18 @@ class FlockerConfiguration(object):
                 try:
                     # We should normailzie strings to either bytes or unicode
                     # here. https://clusterhq.atlassian.net/browse/FLOC-636
-                    alias = link.pop('alias')
+                    alias = link['alias']
                     _check_type(value=alias, types=types.StringTypes,
                                 description="Link alias must be a string",
                                 application_name=application_name)
                 except KeyError:
                     raise ValueError("Missing alias.")
 
-                if link:
+                unrecognised = set(link) - _LINK_KEYS
+                if unrecognised:
                     raise ValueError(
                         "Unrecognised keys: {keys}.".format(
-                            keys=', '.join(sorted(link))))
+                            keys=', '.join(sorted(unrecognised))))
                 links.append(Link(local_port=local_port,
                                   remote_port=remote_port,
                                   alias=alias))
@@ -1022,6 +1063,102 @@ class FlockerConfiguration(object):
 
         return frozenset(links)
 
+    def _parse_network(self, application_name, network, ports):
+        """
+        Validate and parse the ``network`` of an application.
+
+        :param unicode application_name: The name of the application.
+        :param network: The configured ``network``, ``'host'`` or
+            ``'bridge'``.
+        :param list ports: The application's ``Port`` instances.
+
+        :raises ConfigurationError: if the network is not recognised, or is
+            ``'host'`` and a port's internal and external port numbers
+            differ.
+
+        :returns: ``True`` if the application uses the network stack of the
+            host, otherwise ``False``.
+        """
+        if network not in ('host', 'bridge'):
+            raise ConfigurationError(
+                ("Application '{application_name}' has a config error. "
+                 "Invalid network '{network}'. Use one of: bridge, host.")
+                .format(application_name=application_name, network=network))
+        if network == 'bridge':
+            return False
+        for port in ports:
+            if port.internal_port != port.external_port:
+                raise ConfigurationError(
+                    ("Application '{application_name}' has a config error. "
+                     "Invalid ports specification. Ports of an application "
+                     "using the host network must have the same internal "
+                     "and external port, got {internal} and {external}.")
+                    .format(application_name=application_name,
+                            internal=port.internal_port,
+                            external=port.external_port))
+        return True
+
+    def _parse_volume_properties(self, configured_properties):
+        """
+        Validate and parse the ``properties`` of the volume portion of a
+        Flocker configuration.
+
+        YAML boolean values are accepted in place of ``on`` and ``off`` and the
+        ``recordsize`` may be given in the same format as ``maximum_size``.
+        Values are normalized to the form ZFS reports them in so that the
+        properties of deployed volumes compare equal to their configuration.
+
+        :param dict configured_properties: The 'properties' portion of the
+            parsed volume config.
+
+        :returns: A ``frozenset`` of ``(unicode, unicode)`` tuples.
+
+        :raises: ValueError on any parsing error.
+        """
+        if not isinstance(configured_properties, dict):
+            raise ValueError(
+                "properties: Must be a dictionary, got {type}.".format(
+                    type=type(configured_properties).__name__))
+        properties = set()
+        for name, value in configured_properties.items():
+            if name == 'recordsize':
+                if isinstance(value, (int, long)):
+                    value = unicode(value)
+                try:
+                    recordsize = parse_storage_string(value)
+                except ValueError as e:
+                    raise ValueError(
+                        'properties: recordsize: {msg}'.format(msg=e.message))
+                if (recordsize < MINIMUM_RECORDSIZE or
+                        recordsize > MAXIMUM_RECORDSIZE or
+                        recordsize & (recordsize - 1)):
+                    raise ValueError(
+                        "properties: recordsize: Must be a power of two "
+                        "between {minimum} and {maximum} bytes.".format(
+                            minimum=MINIMUM_RECORDSIZE,
+                            maximum=MAXIMUM_RECORDSIZE))
+                value = unicode(recordsize)
+            elif name in FLOCKER_VOLUME_PROPERTY_VALUES:
+                if value is True:
+                    value = 'on'
+                elif value is False:
+                    value = 'off'
+                allowed = FLOCKER_VOLUME_PROPERTY_VALUES[name]
+                if (not isinstance(value, types.StringTypes) or
+                        value not in allowed):
+                    raise ValueError(
+                        "properties: {name}: Value '{value}' is not one "
+                        "of: {allowed}.".format(
+                            name=name, value=value,
+                            allowed=', '.join(sorted(allowed))))
+                value = unicode(value)
+            else:
+                raise ValueError(
+                    "properties: Unrecognised property: {name}.".format(
+                        name=name))
+            properties.add((unicode(name), value))
+        return frozenset(properties)
+
     def _parse_volume(self, configured_volume, application_name):
         """
         Validate and parse the volume portion of a Flocker configuration.
@@ -1035,14 +1172,14 @@ class FlockerConfiguration(object):
 
         :raises: ValueError on any parsing error.
         """
-        try:
-            maximum_size = configured_volume.pop('maximum_size')
-        except KeyError:
-            maximum_size = None
-        except AttributeError:
+        if not isinstance(configured_volume, dict):
             raise ValueError(
                 "Unexpected value: " + str(configured_volume)
             )
+        try:
+            maximum_size = configured_volume['maximum_size']
+        except KeyError:
+            maximum_size = None
         else:
             try:
                 maximum_size = parse_storage_string(maximum_size)
@@ -1055,6 +1192,13 @@ class FlockerConfiguration(object):
         except KeyError:
             raise ValueError("Missing mountpoint.")
 
+        if isinstance(mountpoint, unicode):
+            # Configuration which has been through JSON has only unicode
+            # strings.
+            try:
+                mountpoint = mountpoint.encode("ascii")
+            except UnicodeEncodeError:
+                pass
         if not isinstance(mountpoint, str):
             raise ValueError(
                 "Mountpoint \"{path}\" contains non-ASCII "
@@ -1069,19 +1213,21 @@ class FlockerConfiguration(object):
                     path=mountpoint
                 )
             )
-        configured_volume.pop('mountpoint')
-        if configured_volume:
+        properties = self._parse_volume_properties(
+            configured_volume.get('properties', {}))
+        unrecognised = set(configured_volume) - _VOLUME_KEYS
+        if unrecognised:
             raise ValueError(
                 "Unrecognised keys: {keys}.".format(
-                    keys=', '.join(sorted(
-                        configured_volume.keys()))
+                    keys=', '.join(sorted(unrecognised))
                 ))
         mountpoint = FilePath(mountpoint)
 
         volume = AttachedVolume(
             name=application_name,
             mountpoint=mountpoint,
-            maximum_size=maximum_size
+            maximum_size=maximum_size,
+            properties=properties,
             )
 
         return volume
@@ -1091,38 +1237,50 @@ class FlockerConfiguration(object):
         Validate and parse a given application configuration from flocker's
         configuration format.
 
+        The configuration is only read, never modified, so the same parsed
+        YAML can be parsed again.
+
         :raises ConfigurationError: if there are validation errors.
         """
         self._validate_configuration_keys()
+        # Large configurations tend to run many applications from the same
+        # few images, so only parse each image name once.
+        images = {}
         for application_name, config in (
                 self._application_configuration['applications'].items()):
             self._validate_application_keys(application_name, config)
             image_name = config['image']
             try:
-                image = DockerImage.from_string(image_name)
-            except ValueError as e:
-                raise ConfigurationError(
-                    ("Application '{application_name}' has a config error. "
-                     "Invalid Docker image name. {message}").format(
-                        application_name=application_name, message=e.message)
-                )
+                image = images[image_name]
+            except KeyError:
+                try:
+                    image = DockerImage.from_string(image_name)
+                except ValueError as e:
+                    raise ConfigurationError(
+                        ("Application '{application_name}' has a config "
+                         "error. Invalid Docker image name. {message}")
+                        .format(application_name=application_name,
+                                message=e.message)
+                    )
+                images[image_name] = image
 
             ports = []
             try:
-                for port in config.pop('ports', []):
+                for port in config.get('ports', []):
                     try:
-                        internal_port = port.pop('internal')
+                        internal_port = port['internal']
                     except KeyError:
                         raise ValueError("Missing internal port.")
                     try:
-                        external_port = port.pop('external')
+                        external_port = port['external']
                     except KeyError:
                         raise ValueError("Missing external port.")
 
-                    if port:
+                    unrecognised = set(port) - _PORT_KEYS
+                    if unrecognised:
                         raise ValueError(
                             "Unrecognised keys: {keys}.".format(
-                                keys=', '.join(sorted(port.keys()))))
+                                keys=', '.join(sorted(unrecognised))))
                     ports.append(Port(internal_port=internal_port,
                                       external_port=external_port))
             except ValueError as e:
@@ -1133,13 +1291,15 @@ class FlockerConfiguration(object):
                 )
 
             links = self._parse_link_configuration(
-                application_name, config.pop('links', []))
+                application_name, config.get('links', []))
+
+            host_network = self._parse_network(
+                application_name, config.get('network', 'bridge'), ports)
 
             volume = None
             if "volume" in config:
                 try:
-                    configured_volume = config.pop('volume')
-                    volume = self._parse_volume(configured_volume,
+                    volume = self._parse_volume(config['volume'],
                                                 application_name)
                 except ValueError as e:
                     raise ConfigurationError(
@@ -1179,12 +1339,13 @@ class FlockerConfiguration(object):
                 environment=environment,
                 memory_limit=mem_limit,
                 cpu_shares=cpu_shares,
+                host_network=host_network,
             )
 
             if 'restart_policy' in config:
                 attributes['restart_policy'] = self._parse_restart_policy(
                     application_name=application_name,
-                    config=config.pop('restart_policy')
+                    config=config['restart_policy']
                 )
 
             self._applications[application_name] = Application(**attributes)
@@ -1289,6 +1450,33 @@ def current_from_configuration(current_configuration):
     return Deployment(nodes=frozenset(nodes))
 
 
+def volume_configuration(current_configuration):
+    """
+    Reduce a current cluster configuration to the applications which have
+    volumes.
+
+    This is all a node needs to know about the other nodes in the cluster to
+    work out which volumes are moving to or from it, so it is a smaller
+    substitute for their full configuration.
+
+    :param dict current_configuration: Map of node names to application
+        maps, as accepted by ``current_from_configuration``.
+
+    :return: A ``dict`` in the same format including only the applications
+        which have volumes.
+    """
+    result = {}
+    for hostname, configuration in current_configuration.items():
+        reduced = configuration.copy()
+        reduced["applications"] = {
+            name: application
+            for (name, application)
+            in configuration.get("applications", {}).items()
+            if "volume" in application}
+        result[hostname] = reduced
+    return result
+
+
 def marshal_configuration(state):
     """
     Generate representation of a node's applications using only simple Python
@@ -1312,3 +1500,108 @@ def marshal_configuration(state):
         "applications": result,
         "used_ports": sorted(state.used_ports),
     }
+
+
+def configuration_token(configuration):
+    """
+    Identify a node configuration by a hash of its content.
+
+    :param dict configuration: A node configuration as returned by
+        ``marshal_configuration``.
+
+    :return: ``bytes``, a token which is equal for equal configurations.
+    """
+    return sha256(json.dumps(configuration, sort_keys=True)).hexdigest()
+
+
+def state_report(since, previous, current):
+    """
+    Describe the current configuration of a node to a requester which already
+    knows an earlier one, using as little space as possible.
+
+    :param bytes since: The token of the configuration the requester knows.
+    :param dict previous: The last configuration reported by the node, as a
+        ``dict`` with ``token`` and ``state`` keys, or ``None``.
+    :param dict current: The current configuration of the node, as returned
+        by ``marshal_configuration``.
+
+    :return: A ``dict`` which always includes the ``token`` of the current
+        configuration, and one of: ``unchanged`` if it is the one the
+        requester knows; the ``changes`` and ``removed`` applications
+        relative to ``since`` if that is the previous configuration; or the
+        full ``state`` otherwise.
+    """
+    token = configuration_token(current)
+    if since == token:
+        return {"token": token, "unchanged": True}
+    if previous is None or previous["token"] != since:
+        return {"token": token, "state": current}
+    previous_applications = previous["state"]["applications"]
+    changes = {key: value for (key, value) in current.items()
+               if key != "applications"}
+    changes["applications"] = {
+        name: application
+        for (name, application) in current["applications"].items()
+        if previous_applications.get(name) != application}
+    removed = set(previous_applications) - set(current["applications"])
+    return {"token": token, "since": since, "changes": changes,
+            "removed": sorted(removed)}
+
+
+def apply_state_report(known, report):
+    """
+    Find the configuration of a node described by a report from
+    ``state_report``.
+
+    :param dict known: The configuration of the node known by the requester,
+        as a ``dict`` with ``token`` and ``state`` keys, or ``None``.
+    :param dict report: The report.
+
+    :raise ValueError: If the report is relative to a configuration other than
+        ``known``.
+
+    :return: The configuration as a ``dict`` with ``token`` and ``state``
+        keys.
+    """
+    if "state" in report:
+        return {"token": report["token"], "state": report["state"]}
+    base = report.get("since", report["token"])
+    if known is None or known["token"] != base:
+        raise ValueError(
+            "State report is relative to an unknown configuration.")
+    if report.get("unchanged"):
+        return known
+    state = known["state"].copy()
+    state.update(report["changes"])
+    applications = known["state"]["applications"].copy()
+    applications.update(report["changes"]["applications"])
+    for name in report["removed"]:
+        del applications[name]
+    state["applications"] = applications
+    return {"token": report["token"], "state": state}
+
+
+def dump_state_json(state):
+    """
+    Serialize a node configuration, or a report as returned by
+    ``state_report``, as compact JSON.
+
+    :param dict state: The configuration or report.
+
+    :return: ``bytes`` which ``json.loads`` parses back to ``state``, with
+        all strings as ``unicode``.
+    """
+    # With ``separators`` ``json.dumps`` returns ``unicode`` if there is any
+    # in ``state``, though it only contains ASCII.
+    return json.dumps(state, separators=(",", ":")).encode("ascii")
+
+
+# Map the names of the formats ``flocker-reportstate`` can describe a node
+# in to the functions which serialize a configuration or report in that
+# format.  Both have the same structure.  YAML is meant for people to read;
+# JSON is much faster to produce and parse, so that is what
+# ``flocker-deploy`` asks for.
+STATE_FORMATS = {
+    "yaml": safe_dump,
+    "json": dump_state_json,
+}
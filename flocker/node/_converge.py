@@ -0,0 +1,164 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_converge -*-
+
+"""
+Keep a node converged on its desired configuration from within a
+long-running process.
+"""
+
+from twisted.application.service import Service
+from twisted.internet.defer import Deferred, maybeDeferred
+
+from eliot import Logger, writeFailure
+
+
+# How often, in seconds, a node is converged again on the configuration it
+# was last given, repairing anything which has drifted from it since.
+DEFAULT_CONVERGENCE_INTERVAL = 30.0
+
+
+class ConvergenceService(Service):
+    """
+    Converge a node on the configuration it was most recently given, and
+    again every ``interval`` seconds after that.
+
+    Unlike ``flocker-changestate``, which starts a new process for every
+    change, the ``Deployer`` and the volume service and resolver it uses
+    stay up between convergences.  Only one convergence runs at a time;
+    configuration given while one is running is converged on as soon as it
+    finishes.
+
+    Once a configuration has been converged on, later convergences take its
+    desired state as the current state of the cluster too, so that volumes
+    are only handed off once.
+
+    Each convergence starts by invalidating what the ``Deployer``'s network
+    remembers about the proxies on the node, so that proxies removed by
+    something other than flocker are noticed and created again.
+
+    :ivar Deployer deployer: The ``Deployer`` which changes the node.
+    :ivar float interval: The number of seconds to wait after one
+        convergence finishes before converging again.
+    :ivar _desired: ``None`` until configured, then a three-tuple of the
+        arguments to ``Deployer.change_node_state``: the desired
+        ``Deployment``, the current cluster ``Deployment`` and the hostname.
+    :ivar list _waiting: The ``Deferred``\ s returned by ``configure`` which
+        fire when the next convergence finishes.
+    :ivar _converging: The ``Deferred`` of the running convergence, or
+        ``None``.
+    :ivar _delayed: The ``IDelayedCall`` of the next convergence, or
+        ``None``.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, deployer,
+                 interval=DEFAULT_CONVERGENCE_INTERVAL):
+        """
+        :param IReactorTime reactor: The reactor to schedule convergence
+            with.
+        :param Deployer deployer: See ``deployer``.
+        :param float interval: See ``interval``.
+        """
+        self._reactor = reactor
+        self.deployer = deployer
+        self.interval = interval
+        self._desired = None
+        self._waiting = []
+        self._converging = None
+        self._delayed = None
+
+    def configure(self, desired_state, current_cluster_state, hostname):
+        """
+        Converge on a new configuration.
+
+        :param Deployment desired_state: The intended configuration of all
+            nodes.
+        :param Deployment current_cluster_state: The current configuration
+            of all nodes.
+        :param unicode hostname: The hostname of this node.
+
+        :return: A ``Deferred`` which fires with ``None`` once the node has
+            been converged on this configuration, or fails if that could not
+            be done.  If the service is not running it does not fire until
+            the service is started.
+        """
+        self._desired = (desired_state, current_cluster_state, hostname)
+        waiting = Deferred()
+        self._waiting.append(waiting)
+        if self.running and self._converging is None:
+            self._converge()
+        return waiting
+
+    def known_nodes(self):
+        """
+        :return: A ``frozenset`` of the ``unicode`` hostnames of the nodes in
+            the configuration most recently given, which is empty until the
+            service has been configured.
+        """
+        if self._desired is None:
+            return frozenset()
+        return frozenset(node.hostname for node in self._desired[0].nodes)
+
+    def startService(self):
+        Service.startService(self)
+        if self._desired is not None:
+            self._converge()
+
+    def stopService(self):
+        """
+        Stop converging.
+
+        :return: A ``Deferred`` which fires once the running convergence, if
+            any, has finished.
+        """
+        Service.stopService(self)
+        if self._delayed is not None:
+            self._delayed.cancel()
+            self._delayed = None
+        if self._converging is None:
+            return None
+        stopped = Deferred()
+        self._converging.addBoth(lambda _: stopped.callback(None))
+        return stopped
+
+    def _converge(self):
+        """
+        Converge on the most recently given configuration, then schedule the
+        next convergence.
+        """
+        if self._delayed is not None and self._delayed.active():
+            self._delayed.cancel()
+        self._delayed = None
+        waiting, self._waiting = self._waiting, []
+        desired = self._desired
+        desired_state, current_cluster_state, hostname = desired
+        self.deployer.network.invalidate()
+        self._converging = maybeDeferred(
+            self.deployer.change_node_state,
+            desired_state=desired_state,
+            current_cluster_state=current_cluster_state,
+            hostname=hostname)
+
+        def converged(_):
+            if self._desired is desired:
+                self._desired = (desired_state, desired_state, hostname)
+            for d in waiting:
+                d.callback(None)
+
+        def failed(reason):
+            writeFailure(reason, self.logger, u"flocker:node:converge")
+            for d in waiting:
+                d.errback(reason)
+
+        def finished(_):
+            self._converging = None
+            if not self.running:
+                return
+            if self._waiting:
+                self._converge()
+            else:
+                self._delayed = self._reactor.callLater(
+                    self.interval, self._converge)
+        self._converging.addCallbacks(converged, failed)
+        self._converging.addCallback(finished)
+        return self._converging
@@ -7,11 +7,16 @@ Deploy applications on nodes.
 
 from zope.interface import Interface, implementer
 
-from characteristic import attributes
+from characteristic import attributes, Attribute
 
-from twisted.internet.defer import gatherResults, fail, succeed
+from eliot import Logger, writeFailure
 
-from ._docker import DockerClient, PortMap, Environment, Volume as DockerVolume
+from twisted.internet.defer import gatherResults, succeed
+
+from ._docker import (
+    DockerClient, PortMap, Environment, Volume as DockerVolume,
+    Link as DockerLink,
+)
 from ._model import (
     Application, VolumeChanges, AttachedVolume, VolumeHandoff,
     NodeState, DockerImage, Port, Link
@@ -89,8 +94,89 @@ class InParallel(object):
             [change.run(deployer) for change in self.changes])
 
 
+@attributes(["link", "application_name", "internal_port"])
+class LocalLink(object):
+    """
+    A link whose target application runs on the same node as the linking
+    application, so it can be wired directly to the target's container
+    instead of through a proxy.
+
+    :ivar Link link: The link.
+    :ivar unicode application_name: The name of the target application.
+    :ivar int internal_port: The port inside the target's container which
+        the link's ``remote_port`` is mapped to.
+    """
+
+
+def _local_links(node_applications):
+    """
+    Find the links of the applications on a node whose targets run on the
+    same node.
+
+    Docker refuses to create a container linked to one which does not exist
+    yet, so links which would close a cycle between the applications are
+    left out.  Those links go through the node's address instead, as links
+    to applications on other nodes do.  Applications are considered in
+    order of name so that the same links are left out every time.
+
+    :param node_applications: The ``Application``\ s running on the node.
+
+    :return: A ``dict`` mapping the name of each application to a
+        ``frozenset`` of its ``LocalLink``\ s.
+    """
+    # Docker cannot link containers which use the network stack of the host.
+    # Their links go through the node's address, where such applications
+    # bind their ports directly.
+    targets = {}
+    for application in node_applications:
+        if application.host_network:
+            continue
+        for port in application.ports:
+            targets[port.external_port] = (
+                application.name, port.internal_port)
+    result = {}
+    for application in sorted(node_applications, key=lambda app: app.name):
+        local_links = set()
+        if not application.host_network:
+            for link in sorted(application.links):
+                if link.remote_port not in targets:
+                    continue
+                target, internal_port = targets[link.remote_port]
+                if target == application.name or _reaches(
+                        result, target, application.name):
+                    continue
+                local_links.add(LocalLink(
+                    link=link, application_name=target,
+                    internal_port=internal_port))
+        result[application.name] = frozenset(local_links)
+    return result
+
+
+def _reaches(local_links, start, end):
+    """
+    :param dict local_links: Map application names to their ``LocalLink``\ s.
+    :param unicode start: The name of an application.
+    :param unicode end: The name of another application.
+
+    :return: Whether ``start`` is linked to ``end``, directly or through
+        other applications.
+    """
+    seen = set()
+    pending = [start]
+    while pending:
+        name = pending.pop()
+        if name == end:
+            return True
+        if name not in seen:
+            seen.add(name)
+            pending.extend(local_link.application_name
+                           for local_link in local_links.get(name, ()))
+    return False
+
+
 @implementer(IStateChange)
-@attributes(["application", "hostname"])
+@attributes(["application", "hostname",
+             Attribute("local_links", default_value=frozenset())])
 class StartApplication(object):
     """
     Launch the supplied application as a container.
@@ -99,6 +185,11 @@ class StartApplication(object):
         start.
 
     :ivar unicode hostname: The hostname of the application is running on.
+
+    :ivar frozenset local_links: ``LocalLink``\ s for those of the
+        application's links whose targets run on the same node.  These are
+        made into Docker links to the target's container, which avoids the
+        NAT rules that links through ``hostname`` would pass through.
     """
     def run(self, deployer):
         application = self.application
@@ -118,36 +209,60 @@ class StartApplication(object):
         else:
             port_maps = []
 
-        environment = {}
-
-        for link in application.links:
-            environment.update(_link_environment(
-                protocol=u"tcp",
-                alias=link.alias,
-                local_port=link.local_port,
-                hostname=self.hostname,
-                remote_port=link.remote_port,
-                ))
+        local_links = {
+            local_link.link: local_link for local_link in self.local_links}
+        # Links which are not local go through the address of this node.
+        if set(application.links) - set(local_links):
+            resolving = deployer.resolve(self.hostname)
+        else:
+            resolving = succeed(self.hostname)
+
+        def start(address):
+            environment = {}
+            docker_links = []
+
+            for link in application.links:
+                if link in local_links:
+                    local_link = local_links[link]
+                    docker_links.append(DockerLink(
+                        unit_name=local_link.application_name,
+                        alias=link.alias))
+                    hostname = link.alias
+                    remote_port = local_link.internal_port
+                else:
+                    hostname = unicode(address)
+                    remote_port = link.remote_port
+                environment.update(_link_environment(
+                    protocol=u"tcp",
+                    alias=link.alias,
+                    local_port=link.local_port,
+                    hostname=hostname,
+                    remote_port=remote_port,
+                    ))
 
-        if application.environment is not None:
-            environment.update(application.environment)
+            if application.environment is not None:
+                environment.update(application.environment)
 
-        if environment:
-            docker_environment = Environment(
-                variables=frozenset(environment.iteritems()))
-        else:
-            docker_environment = None
-
-        return deployer.docker_client.add(
-            application.name,
-            application.image.full_name,
-            ports=port_maps,
-            environment=docker_environment,
-            volumes=volumes,
-            mem_limit=application.memory_limit,
-            cpu_shares=application.cpu_shares,
-            restart_policy=application.restart_policy,
-        )
+            if environment:
+                docker_environment = Environment(
+                    variables=frozenset(environment.iteritems()))
+            else:
+                docker_environment = None
+
+            return deployer.docker_client.add(
+                application.name,
+                application.image.full_name,
+                ports=port_maps,
+                environment=docker_environment,
+                volumes=volumes,
+                mem_limit=application.memory_limit,
+                cpu_shares=application.cpu_shares,
+                restart_policy=application.restart_policy,
+                links=docker_links,
+                host_network=application.host_network,
+            )
+        resolving.addCallback(start)
+        return resolving
 
 
 def _link_environment(protocol, alias, local_port, hostname, remote_port):
@@ -200,7 +315,8 @@ class CreateVolume(object):
     def run(self, deployer):
         volume = deployer.volume_service.get(
             name=_to_volume_name(self.volume.name),
-            size=VolumeSize(maximum_size=self.volume.maximum_size)
+            size=VolumeSize(maximum_size=self.volume.maximum_size,
+                            properties=self.volume.properties)
         )
         return deployer.volume_service.create(volume)
 
@@ -216,11 +332,29 @@ class ResizeVolume(object):
     def run(self, deployer):
         volume = deployer.volume_service.get(
             name=_to_volume_name(self.volume.name),
-            size=VolumeSize(maximum_size=self.volume.maximum_size)
+            size=VolumeSize(maximum_size=self.volume.maximum_size,
+                            properties=self.volume.properties)
         )
         return deployer.volume_service.set_maximum_size(volume)
 
 
+@implementer(IStateChange)
+@attributes(["volume"])
+class SetVolumeProperties(object):
+    """
+    Set the tunable properties of an existing locally-owned volume.
+
+    :ivar AttachedVolume volume: Volume to tune.
+    """
+    def run(self, deployer):
+        volume = deployer.volume_service.get(
+            name=_to_volume_name(self.volume.name),
+            size=VolumeSize(maximum_size=self.volume.maximum_size,
+                            properties=self.volume.properties)
+        )
+        return deployer.volume_service.set_properties(volume)
+
+
 @implementer(IStateChange)
 @attributes(["volume"])
 class WaitForVolume(object):
@@ -235,7 +369,8 @@ class WaitForVolume(object):
 
 
 @implementer(IStateChange)
-@attributes(["volume", "hostname"])
+@attributes(["volume", "hostname",
+             Attribute("snapshot", default_value=None)])
 class HandoffVolume(object):
     """
     A volume handoff that needs to be performed from this node to another
@@ -246,32 +381,70 @@ class HandoffVolume(object):
     :ivar AttachedVolume volume: The volume to hand off.
     :ivar bytes hostname: The hostname of the node to which the volume is
          meant to be handed off.
+    :ivar Snapshot snapshot: An existing snapshot of the volume to push, or
+        ``None`` to take a new one.
     """
     def run(self, deployer):
         service = deployer.volume_service
         destination = standard_node(self.hostname)
         return service.handoff(service.get(_to_volume_name(self.volume.name)),
-                               RemoteVolumeManager(destination))
+                               RemoteVolumeManager(destination),
+                               self.snapshot)
 
 
 @implementer(IStateChange)
-@attributes(["volume", "hostname"])
+@attributes(["volume", "hostname",
+             Attribute("snapshot", default_value=None)])
 class PushVolume(object):
     """
     A volume push that needs to be performed from this node to another
-    node.
+    node ahead of handing the volume off.
 
-    See :cls:`flocker.volume.VolumeService.push` for more details.
+    The volume is pushed repeatedly until little enough data is being written
+    to it that the final push during the handoff will be quick.  See
+    :cls:`flocker.volume.VolumeService.precopy` for more details.
 
     :ivar AttachedVolume volume: The volume to push.
     :ivar bytes hostname: The hostname of the node to which the volume is
          meant to be pushed.
+    :ivar Snapshot snapshot: An existing snapshot of the volume to push, or
+        ``None`` to take a new one.
     """
     def run(self, deployer):
         service = deployer.volume_service
         destination = standard_node(self.hostname)
-        return service.push(service.get(_to_volume_name(self.volume.name)),
-                            RemoteVolumeManager(destination))
+        return service.precopy(
+            service.get(_to_volume_name(self.volume.name)),
+            RemoteVolumeManager(destination),
+            self.snapshot)
+
+
+@implementer(IStateChange)
+@attributes(["changes"])
+class SharedSnapshot(object):
+    """
+    Run several ``PushVolume`` or ``HandoffVolume`` changes in parallel,
+    all of them pushing from one snapshot of their volumes taken at once.
+
+    This takes a single snapshot for the whole batch rather than one per
+    volume, and the pushed volumes are consistent with each other.
+
+    :ivar changes: A ``list`` of ``PushVolume`` or ``HandoffVolume``
+        instances.
+    """
+    def run(self, deployer):
+        service = deployer.volume_service
+        snapshotting = service.snapshot([
+            service.get(_to_volume_name(change.volume.name))
+            for change in self.changes])
+
+        def snapshotted(snapshot):
+            return InParallel(changes=[
+                type(change)(volume=change.volume, hostname=change.hostname,
+                             snapshot=snapshot)
+                for change in self.changes]).run(deployer)
+        snapshotting.addCallback(snapshotted)
+        return snapshotting
 
 
 @implementer(IStateChange)
@@ -283,20 +456,124 @@ class SetProxies(object):
     :ivar ports: A collection of ``Port`` objects.
     """
     def run(self, deployer):
-        results = []
-        # XXX: The proxy manipulation operations are blocking. Convert to a
-        # non-blocking API. See https://clusterhq.atlassian.net/browse/FLOC-320
-        for proxy in deployer.network.enumerate_proxies():
-            try:
-                deployer.network.delete_proxy(proxy)
-            except:
-                results.append(fail())
-        for proxy in self.ports:
-            try:
-                deployer.network.create_proxy_to(proxy.ip, proxy.port)
-            except:
-                results.append(fail())
-        return gather_deferreds(results)
+        proxies = list(self.ports)
+        resolving = gatherResults(
+            [deployer.resolve(proxy.ip) for proxy in proxies])
+
+        def resolved(addresses):
+            # XXX: The proxy manipulation operations are blocking. Convert to
+            # a non-blocking API. See
+            # https://clusterhq.atlassian.net/browse/FLOC-320
+            deployer.network.set_proxies([
+                Proxy(ip=address, port=proxy.port)
+                for proxy, address in zip(proxies, addresses)])
+        resolving.addCallback(resolved)
+        return resolving
+
+
+class UsedPorts(object):
+    """
+    The TCP ports in use on a node, discovered from an ``INetwork`` only when
+    they are first needed.
+
+    Discovering used ports means inspecting every listening socket on the
+    node, which most users of ``NodeState`` never look at.  This behaves like
+    the ``frozenset`` it stands in for when iterated, tested for membership or
+    compared.
+
+    :ivar INetwork _network: The network to ask.
+    :ivar frozenset _bound: Ports known to be bound directly by applications
+        on the node, which are in use even if nothing listens on them yet.
+    :ivar frozenset _ports: The discovered ports, or ``None`` if they have
+        not been needed yet.
+    """
+    def __init__(self, network, bound=frozenset()):
+        self._network = network
+        self._bound = bound
+        self._ports = None
+
+    def _get(self):
+        if self._ports is None:
+            self._ports = frozenset(
+                self._network.enumerate_used_ports() | self._bound)
+        return self._ports
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __contains__(self, port):
+        return port in self._get()
+
+    def __eq__(self, other):
+        if isinstance(other, UsedPorts):
+            other = other._get()
+        return self._get() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._get())
+
+    def __repr__(self):
+        return "<UsedPorts %r>" % (self._get(),)
+
+
+def _started(change):
+    """
+    :param change: A ``StartApplication``, or a ``Sequentially`` which stops
+        and then starts an application.
+
+    :return: The ``StartApplication`` in ``change``.
+    """
+    if isinstance(change, Sequentially):
+        return change.changes[-1]
+    return change
+
+
+def _in_link_order(changes):
+    """
+    Arrange for applications to be started after the applications on the
+    same node which they are directly linked to.
+
+    :param list changes: ``StartApplication`` changes, or ``Sequentially``
+        changes which stop and then start an application.
+
+    :return: A ``list`` of ``InParallel`` changes to run one after the other.
+    """
+    phases = []
+    remaining = list(changes)
+    while remaining:
+        starting = {_started(change).application.name for change in remaining}
+        ready = [
+            change for change in remaining
+            if not starting & {
+                local_link.application_name
+                for local_link in _started(change).local_links}]
+        if not ready:
+            # ``_local_links`` leaves out links which would close a cycle,
+            # so this only guards against looping forever.
+            ready = remaining
+        phases.append(InParallel(changes=ready))
+        remaining = [change for change in remaining if change not in ready]
+    return phases
+
+
+def _in_parallel_pushes(changes):
+    """
+    Run some ``PushVolume`` or ``HandoffVolume`` changes in parallel, sharing
+    a snapshot between them if there is more than one.
+
+    :param list changes: The changes to run.
+
+    :return: An ``IStateChange`` provider.
+    """
+    if len(changes) > 1:
+        return SharedSnapshot(changes=changes)
+    return InParallel(changes=changes)
 
 
 class Deployer(object):
@@ -308,8 +585,13 @@ class Deployer(object):
         deployment operations. Default ``DockerClient``.
     :ivar INetwork network: The network routing API to use in
         deployment operations. Default is iptables-based implementation.
+    :ivar resolver: The ``CachingResolver`` used to find the addresses of
+        nodes.  Default ``None`` means hostnames are used as they are given.
     """
-    def __init__(self, volume_service, docker_client=None, network=None):
+    logger = Logger()
+
+    def __init__(self, volume_service, docker_client=None, network=None,
+                 resolver=None):
         if docker_client is None:
             docker_client = DockerClient()
         self.docker_client = docker_client
@@ -317,6 +599,27 @@ class Deployer(object):
             network = make_host_network()
         self.network = network
         self.volume_service = volume_service
+        self.resolver = resolver
+
+    def resolve(self, hostname):
+        """
+        Find the address of a node.
+
+        :param unicode hostname: The hostname of the node.
+
+        :return: A ``Deferred`` that fires with the address of the node, or
+            with ``hostname`` itself if there is no resolver or the hostname
+            cannot be resolved.
+        """
+        if self.resolver is None:
+            return succeed(hostname)
+        d = self.resolver.resolve(hostname)
+
+        def failed(reason):
+            writeFailure(reason, self.logger, u"flocker:node:resolve")
+            return hostname
+        d.addErrback(failed)
+        return d
 
     def discover_node_configuration(self):
         """
@@ -334,8 +637,7 @@ class Deployer(object):
             managed_volumes = dict()
             for volume in volumes:
                 if volume.node_id == self.volume_service.node_id:
-                    managed_volumes[volume.name.dataset_id] = (
-                        volume.size.maximum_size)
+                    managed_volumes[volume.name.dataset_id] = volume.size
             return managed_volumes
         volumes.addCallback(map_volumes_to_size)
         d = gatherResults([self.docker_client.list(), volumes])
@@ -344,13 +646,18 @@ class Deployer(object):
             units, available_volumes = result
             running = []
             not_running = []
+            units_by_name = {unit.name: unit for unit in units}
             for unit in units:
                 image = DockerImage.from_string(unit.container_image)
                 if unit.name in available_volumes:
                     # XXX we only support one volume per container at this time
                     # https://clusterhq.atlassian.net/browse/FLOC-49
                     volume = AttachedVolume.from_unit(unit).pop()
-                    volume.maximum_size = available_volumes[unit.name]
+                    size = available_volumes[unit.name]
+                    volume = AttachedVolume(
+                        name=volume.name, mountpoint=volume.mountpoint,
+                        maximum_size=size.maximum_size,
+                        properties=size.properties)
                 else:
                     volume = None
                 ports = []
@@ -360,6 +667,13 @@ class Deployer(object):
                         external_port=portmap.external_port
                     ))
                 links = []
+                # Links wired directly to a container on this node point at
+                # the port inside that container; map them back to the
+                # external port the link was configured with.
+                docker_links = {
+                    link.alias.upper().replace(u"-", u"_"): link.unit_name
+                    for link in unit.links
+                }
                 if unit.environment:
                     environment_dict = unit.environment.to_dict()
                     for label, value in environment_dict.items():
@@ -371,9 +685,15 @@ class Deployer(object):
                         except ValueError:
                             continue
                         if (pad_a, pad_b, pad_c) == (b"PORT", b"TCP", b"PORT"):
+                            remote_port = int(value)
+                            target = units_by_name.get(docker_links.get(alias))
+                            if target is not None:
+                                for portmap in target.ports:
+                                    if portmap.internal_port == remote_port:
+                                        remote_port = portmap.external_port
                             links.append(Link(
                                 local_port=local_port,
-                                remote_port=int(value),
+                                remote_port=remote_port,
                                 alias=alias,
                             ))
                 application = Application(
@@ -383,15 +703,22 @@ class Deployer(object):
                     volume=volume,
                     links=frozenset(links),
                     restart_policy=unit.restart_policy,
+                    host_network=unit.host_network,
                 )
                 if unit.activation_state == u"active":
                     running.append(application)
                 else:
                     not_running.append(application)
+            # Applications using the host network bind their ports on this
+            # node themselves, whether or not they are listening right now.
+            bound = frozenset(
+                portmap.external_port
+                for unit in units if unit.host_network
+                for portmap in unit.ports)
             return NodeState(
                 running=running,
                 not_running=not_running,
-                used_ports=self.network.enumerate_used_ports()
+                used_ports=UsedPorts(self.network, bound)
             )
         d.addCallback(applications_from_units)
         return d
@@ -426,22 +753,29 @@ class Deployer(object):
         """
         phases = []
 
-        desired_proxies = set()
+        desired_node = desired_state.nodes_by_hostname.get(hostname)
         desired_node_applications = []
-        for node in desired_state.nodes:
-            if node.hostname == hostname:
-                desired_node_applications = node.applications
-            else:
-                for application in node.applications:
-                    for port in application.ports:
-                        # XXX: also need to do DNS resolution. See
-                        # https://clusterhq.atlassian.net/browse/FLOC-322
-                        desired_proxies.add(Proxy(ip=node.hostname,
-                                                  port=port.external_port))
-        if desired_proxies != set(self.network.enumerate_proxies()):
-            phases.append(SetProxies(ports=desired_proxies))
-
-        d = self.discover_node_configuration()
+        if desired_node is not None:
+            desired_node_applications = desired_node.applications
+        desired_proxies = [
+            Proxy(ip=port_hostname, port=port)
+            for (port, port_hostnames)
+            in desired_state.hostnames_by_port.items()
+            for port_hostname in port_hostnames
+            if port_hostname != hostname]
+        # The network knows proxies by address, so the hostnames have to be
+        # resolved before they can be compared with it.
+        d = gatherResults(
+            [self.resolve(proxy.ip) for proxy in desired_proxies])
+
+        def compare_proxies(addresses):
+            resolved = {
+                Proxy(ip=address, port=proxy.port)
+                for proxy, address in zip(desired_proxies, addresses)}
+            if resolved != set(self.network.enumerate_proxies()):
+                phases.append(SetProxies(ports=frozenset(desired_proxies)))
+        d.addCallback(compare_proxies)
+        d.addCallback(lambda _: self.discover_node_configuration())
 
         def find_differences(current_node_state):
             current_node_applications = current_node_state.running
@@ -462,8 +796,16 @@ class Deployer(object):
             stop_names = {app.name for app in all_applications}.difference(
                 desired_local_state)
 
+            desired_local_links = _local_links(desired_node_applications)
+            current_local_links = _local_links(current_node_applications)
+
+            def start(app):
+                return StartApplication(
+                    application=app, hostname=hostname,
+                    local_links=desired_local_links[app.name])
+
             start_containers = [
-                StartApplication(application=app, hostname=hostname)
+                start(app)
                 for app in desired_node_applications
                 if app.name in start_names
             ]
@@ -473,8 +815,7 @@ class Deployer(object):
             ]
             restart_containers = [
                 Sequentially(changes=[StopApplication(application=app),
-                                      StartApplication(application=app,
-                                                       hostname=hostname)])
+                                      start(app)])
                 for app in desired_node_applications
                 if app.name in not_running
             ]
@@ -491,16 +832,38 @@ class Deployer(object):
             for application_name in applications_to_inspect:
                 inspect_desired = desired_applications_dict[application_name]
                 inspect_current = current_applications_dict[application_name]
-                if inspect_desired != inspect_current:
+                # An application whose link targets have moved on to or off
+                # this node needs to be restarted to be wired to them
+                # directly or through a proxy.
+                rewired = (desired_local_links[application_name] !=
+                           current_local_links[application_name])
+                if inspect_desired != inspect_current or rewired:
                     changes = [
                         StopApplication(application=inspect_current),
-                        StartApplication(application=inspect_desired,
-                                         hostname=hostname)
+                        start(inspect_desired),
                     ]
                     sequence = Sequentially(changes=changes)
                     if sequence not in restart_containers:
                         restart_containers.append(sequence)
 
+            # Docker links are to a particular container, so applications
+            # linked directly to one which is being replaced must be
+            # restarted after it.
+            replaced = {
+                _started(change).application.name
+                for change in restart_containers}
+            for application_name in applications_to_inspect - replaced:
+                inspect_desired = desired_applications_dict[application_name]
+                inspect_current = current_applications_dict[application_name]
+                targets = {
+                    local_link.application_name for local_link in
+                    desired_local_links[application_name]}
+                if targets & (replaced | stop_names):
+                    restart_containers.append(Sequentially(changes=[
+                        StopApplication(application=inspect_current),
+                        start(inspect_desired),
+                    ]))
+
             # Find any applications with volumes that are moving to or from
             # this node - or that are being newly created by this new
             # configuration.
@@ -511,6 +874,10 @@ class Deployer(object):
                 phases.append(InParallel(changes=[
                     ResizeVolume(volume=volume)
                     for volume in volumes.resizing]))
+            if volumes.tuning:
+                phases.append(InParallel(changes=[
+                    SetVolumeProperties(volume=volume)
+                    for volume in volumes.tuning]))
 
             # Do an initial push of all volumes that are going to move, so
             # that the final push which happens during handoff is a quick
@@ -518,7 +885,7 @@ class Deployer(object):
             # application downtime caused by the time it takes to copy
             # data.
             if volumes.going:
-                phases.append(InParallel(changes=[
+                phases.append(_in_parallel_pushes([
                     PushVolume(volume=handoff.volume,
                                hostname=handoff.hostname)
                     for handoff in volumes.going]))
@@ -526,7 +893,7 @@ class Deployer(object):
             if stop_containers:
                 phases.append(InParallel(changes=stop_containers))
             if volumes.going:
-                phases.append(InParallel(changes=[
+                phases.append(_in_parallel_pushes([
                     HandoffVolume(volume=handoff.volume,
                                   hostname=handoff.hostname)
                     for handoff in volumes.going]))
@@ -540,13 +907,20 @@ class Deployer(object):
                 phases.append(InParallel(changes=[
                     ResizeVolume(volume=volume)
                     for volume in volumes.coming]))
+                # Received data streams do not carry properties along with
+                # them so any tuning has to be applied again.
+                tuned_coming = [
+                    volume for volume in volumes.coming if volume.properties]
+                if tuned_coming:
+                    phases.append(InParallel(changes=[
+                        SetVolumeProperties(volume=volume)
+                        for volume in tuned_coming]))
             if volumes.creating:
                 phases.append(InParallel(changes=[
                     CreateVolume(volume=volume)
                     for volume in volumes.creating]))
             start_restart = start_containers + restart_containers
-            if start_restart:
-                phases.append(InParallel(changes=start_restart))
+            phases.extend(_in_link_order(start_restart))
 
         d.addCallback(find_differences)
         d.addCallback(lambda _: Sequentially(changes=phases))
@@ -600,63 +974,140 @@ def find_volume_changes(hostname, current_state, desired_state):
     :param Deployment desired_state: The new state of the cluster towards which
         the changes are working.
     """
-    desired_volumes = {node.hostname: set(application.volume for application
-                                          in node.applications
-                                          if application.volume)
-                       for node in desired_state.nodes}
-    current_volumes = {node.hostname: set(application.volume for application
-                                          in node.applications
-                                          if application.volume)
-                       for node in current_state.nodes}
-    local_desired_volumes = desired_volumes.get(hostname, set())
-    local_desired_volume_names = set(volume.name for volume in
-                                     local_desired_volumes)
-    local_current_volume_names = set(volume.name for volume in
-                                     current_volumes.get(hostname, set()))
-    remote_current_volume_names = set()
-    for volume_hostname, current in current_volumes.items():
-        if volume_hostname != hostname:
-            remote_current_volume_names |= set(
-                volume.name for volume in current)
+    local_desired_volumes = _node_volumes(
+        desired_state.nodes_by_hostname.get(hostname))
+    local_current_volumes = _node_volumes(
+        current_state.nodes_by_hostname.get(hostname))
+    desired_volumes = desired_state.volumes_by_name
+    current_volumes = current_state.volumes_by_name
 
     # If a volume exists locally and is desired anywhere on the cluster, and
     # the desired volume is a different maximum_size to the existing volume,
     # the existing local volume should be resized before any other action
     # is taken on it.
+    # Likewise if its tunable properties differ it should be retuned.
+    # If it is desired on another node, add a VolumeHandoff for it to
+    # `going`.
     resizing = set()
-    for _, desired in desired_volumes.items():
-        for volume in desired:
-            if volume.name in local_current_volume_names:
-                for existing_volume in current_volumes[hostname]:
-                    if existing_volume.name == volume.name:
-                        if existing_volume.maximum_size != volume.maximum_size:
-                            resizing.add(volume)
-
-    # Look at each application volume that is going to be running
-    # elsewhere and is currently running here, and add a VolumeHandoff for
-    # it to `going`.
+    tuning = set()
     going = set()
-    for volume_hostname, desired in desired_volumes.items():
+    for existing_volume in local_current_volumes:
+        if existing_volume.name not in desired_volumes:
+            continue
+        volume_hostname, volume = desired_volumes[existing_volume.name]
+        if existing_volume.maximum_size != volume.maximum_size:
+            resizing.add(volume)
+        if existing_volume.properties != volume.properties:
+            tuning.add(volume)
         if volume_hostname != hostname:
-            for volume in desired:
-                if volume.name in local_current_volume_names:
-                    going.add(VolumeHandoff(volume=volume,
-                                            hostname=volume_hostname))
+            going.add(VolumeHandoff(volume=volume, hostname=volume_hostname))
 
     # Look at each application volume that is going to be started on this
     # node.  If it was running somewhere else, we want that Volume to be
-    # in `coming`.
-    coming_names = local_desired_volume_names.intersection(
-        remote_current_volume_names)
-    coming = set(volume for volume in local_desired_volumes
-                 if volume.name in coming_names)
-
-    # For each application volume that is going to be started on this node
-    # that was not running anywhere previously, make sure that Volume is
-    # in `creating`.
-    creating_names = local_desired_volume_names.difference(
-        local_current_volume_names | remote_current_volume_names)
-    creating = set(volume for volume in local_desired_volumes
-                   if volume.name in creating_names)
+    # in `coming`.  If it was not running anywhere previously, make sure
+    # that Volume is in `creating`.
+    coming = set()
+    creating = set()
+    for volume in local_desired_volumes:
+        if volume.name not in current_volumes:
+            creating.add(volume)
+        elif current_volumes[volume.name][0] != hostname:
+            coming.add(volume)
     return VolumeChanges(going=going, coming=coming,
-                         creating=creating, resizing=resizing)
+                         creating=creating, resizing=resizing,
+                         tuning=tuning)
+
+
+def _node_volumes(node):
+    """
+    :param node: A ``Node`` or ``None``.
+
+    :return: A ``set`` of the ``AttachedVolume``\ s of the applications on
+        ``node``.
+    """
+    if node is None:
+        return set()
+    return {application.volume for application in node.applications or ()
+            if application.volume is not None}
+
+
+def find_affected_nodes(desired_state, current_cluster_state,
+                        not_running, proxied_ports):
+    """
+    Find the nodes which ``Deployer.change_node_state`` may need to change to
+    get from the current state of the cluster to the desired state.
+
+    A node is affected if:
+
+    * an application is to be started, stopped or reconfigured on it, or one
+      of its applications is not running and so needs restarting;
+    * a volume is moving to or from it, or is to be created, resized or
+      retuned on it, according to ``find_volume_changes``;
+    * the ports it proxies to other nodes differ from the ones it should,
+      or the nodes they should go to have changed.
+
+    :param Deployment desired_state: The intended configuration of all
+        nodes.
+    :param Deployment current_cluster_state: The current configuration of
+        all nodes.
+    :param dict not_running: Map hostnames to the names of the applications
+        on those nodes which are not running.  Nodes which are not included
+        have no such applications.
+    :param dict proxied_ports: Map hostnames to the ports those nodes
+        currently proxy to other nodes.  Nodes which are not included are
+        assumed to be affected.
+
+    :return: A ``frozenset`` of the hostnames of the affected nodes in
+        ``desired_state``.
+    """
+    nowhere = frozenset()
+    desired_ports = desired_state.hostnames_by_port
+    current_ports = current_cluster_state.hostnames_by_port
+    # Each node proxies to the ports of the applications on every other
+    # node, so only the ports whose nodes change can change what any node
+    # proxies to.
+    moved_ports = [
+        (desired_ports.get(port, nowhere), current_ports.get(port, nowhere))
+        for port in set(desired_ports) | set(current_ports)
+        if desired_ports.get(port) != current_ports.get(port)]
+    affected = set()
+    for node in desired_state.nodes:
+        hostname = node.hostname
+        desired_applications = frozenset(node.applications or ())
+        current_node = current_cluster_state.nodes_by_hostname.get(hostname)
+        if current_node is None or hostname not in proxied_ports:
+            affected.add(hostname)
+            continue
+        if desired_applications != frozenset(current_node.applications or ()):
+            affected.add(hostname)
+            continue
+        desired_names = {
+            application.name for application in desired_applications}
+        if desired_names & set(not_running.get(hostname, ())):
+            affected.add(hostname)
+            continue
+        volumes = find_volume_changes(
+            hostname, current_cluster_state, desired_state)
+        if (volumes.going or volumes.coming or volumes.creating or
+                volumes.resizing or volumes.tuning):
+            affected.add(hostname)
+            continue
+        # A moved port only leaves this node's proxies alone if the other
+        # nodes using it are the same.
+        this_node = frozenset([hostname])
+        if any(desired_hostnames - this_node != current_hostnames - this_node
+               for (desired_hostnames, current_hostnames) in moved_ports):
+            affected.add(hostname)
+            continue
+        # The node should proxy every port used on another node, which is
+        # every port except those only its own applications use.
+        reported = set(proxied_ports[hostname])
+        local_ports = {
+            port.external_port for application in desired_applications
+            for port in application.ports
+            if desired_ports.get(port.external_port) == this_node}
+        if (len(reported) != len(desired_ports) - len(local_ports) or
+                any(desired_ports.get(port, this_node) == this_node
+                    for port in reported)):
+            affected.add(hostname)
+    return frozenset(affected)
@@ -7,20 +7,17 @@ Docker API client.
 
 from __future__ import absolute_import
 
+from httplib import NOT_FOUND, INTERNAL_SERVER_ERROR
 from time import sleep
 
 from zope.interface import Interface, implementer
 
-from docker import Client
-from docker.errors import APIError
-
 from characteristic import attributes, Attribute
 
 from twisted.python.components import proxyForInterface
 from twisted.python.filepath import FilePath
 from twisted.internet.defer import succeed, fail
 from twisted.internet.threads import deferToThread
-from twisted.web.http import NOT_FOUND, INTERNAL_SERVER_ERROR
 
 from flocker.node._model import RestartNever, RestartAlways, RestartOnFailure
 
@@ -60,6 +57,21 @@ class Volume(object):
     """
 
 
+@attributes(["unit_name", "alias"])
+class Link(object):
+    """
+    A Docker link from one container to another on the same node.
+
+    Docker makes the linked container reachable from the linking container
+    directly over the Docker bridge, using ``alias`` as its hostname.
+
+    :ivar unicode unit_name: The name of the unit being linked to.
+
+    :ivar unicode alias: The hostname by which the linking container can
+        reach the linked container.
+    """
+
+
 @attributes(["name", "container_name", "activation_state",
              Attribute("container_image", default_value=None),
              Attribute("ports", default_value=()),
@@ -68,6 +80,8 @@ class Volume(object):
              Attribute("mem_limit", default_value=None),
              Attribute("cpu_shares", default_value=None),
              Attribute("restart_policy", default_value=RestartNever()),
+             Attribute("links", default_value=frozenset()),
+             Attribute("host_network", default_value=False),
              ])
 class Unit(object):
     """
@@ -115,6 +129,13 @@ class Unit(object):
         is probably 1024).
 
     :ivar IRestartPolicy restart_policy: The restart policy of the container.
+
+    :ivar frozenset links: The ``Link`` instances describing the other units
+        this unit's container is linked to.
+
+    :ivar bool host_network: Whether the unit's container uses the network
+        stack of the host.  If so, each of the ``ports`` maps a port to
+        itself since the container binds it on the host directly.
     """
 
 
@@ -129,7 +150,8 @@ class IDockerClient(Interface):
     """
 
     def add(unit_name, image_name, ports=None, environment=None, volumes=(),
-            mem_limit=None, cpu_shares=None, restart_policy=RestartNever()):
+            mem_limit=None, cpu_shares=None, restart_policy=RestartNever(),
+            links=(), host_network=False):
         """
         Install and start a new unit.
 
@@ -166,6 +188,15 @@ class IDockerClient(Interface):
         :param IRestartPolicy restart_policy: The restart policy of the
             container.
 
+        :param links: A sequence of ``Link`` instances describing units to
+            link the new unit's container to.  Those units must already
+            exist.
+
+        :param bool host_network: If ``True`` the container uses the network
+            stack of the host instead of its own.  The internal ports of
+            ``ports`` are then bound directly on the host and the external
+            ports must be the same.
+
         :return: ``Deferred`` that fires on success, or errbacks with
             :class:`AlreadyExists` if a unit by that name already exists.
 
@@ -224,7 +255,7 @@ class FakeDockerClient(object):
 
     def add(self, unit_name, image_name, ports=frozenset(), environment=None,
             volumes=frozenset(), mem_limit=None, cpu_shares=None,
-            restart_policy=RestartNever()):
+            restart_policy=RestartNever(), links=(), host_network=False):
         if unit_name in self._units:
             return fail(AlreadyExists(unit_name))
         self._units[unit_name] = Unit(
@@ -238,6 +269,8 @@ class FakeDockerClient(object):
             mem_limit=mem_limit,
             cpu_shares=cpu_shares,
             restart_policy=restart_policy,
+            links=frozenset(links),
+            host_network=host_network,
         )
         return succeed(None)
 
@@ -268,6 +301,9 @@ class PortMap(object):
 # Basic namespace for Flocker containers:
 BASE_NAMESPACE = u"flocker--"
 BASE_DOCKER_API_URL = u'unix://var/run/docker.sock'
+# The environment variable recording the ports of a container which uses
+# the network stack of the host.
+HOST_PORTS_VARIABLE = u"FLOCKER_HOST_PORTS"
 
 
 @implementer(IDockerClient)
@@ -279,11 +315,16 @@ class DockerClient(object):
     use a thread pool. See https://clusterhq.atlassian.net/browse/FLOC-718
     for using a custom thread pool.
 
+    docker-py (and the requests library it uses) is only imported once it
+    is needed, since importing it is a large part of the startup time of
+    the commands which never talk to Docker, such as ``flocker-deploy``.
+
     :ivar unicode namespace: A namespace prefix to add to container names
         so we don't clobber other applications interacting with Docker.
     """
     def __init__(self, namespace=BASE_NAMESPACE,
                  base_url=BASE_DOCKER_API_URL):
+        from docker import Client
         self.namespace = namespace
         self._client = Client(version="1.15", base_url=base_url)
 
@@ -330,6 +371,30 @@ class DockerClient(object):
                     ports.append(portmap)
         return ports
 
+    def _parse_host_ports(self, data):
+        """
+        Parse the ports of a container which uses the network stack of the
+        host.
+
+        Docker only knows which ports such a container exposes, and those
+        include every port its image exposes, so ``add`` records the ports
+        it was given in the ``HOST_PORTS_VARIABLE`` environment variable,
+        e.g. ``FLOCKER_HOST_PORTS=3306,8080``.
+
+        :param list data: The ``Config.Env`` portion of a container's state
+            as returned by inspecting the container, or ``None``.
+
+        :return list: A list of ``PortMap`` instances, each mapping a
+            recorded port to the same port on the host.
+        """
+        for variable in data or []:
+            name, _, value = variable.partition(u"=")
+            if name == HOST_PORTS_VARIABLE:
+                return [PortMap(internal_port=int(port),
+                                external_port=int(port))
+                        for port in value.split(u",") if port]
+        return []
+
     def _parse_restart_policy(self, data):
         """
         Parse the restart policy from the configuration of a Docker container
@@ -361,6 +426,30 @@ class DockerClient(object):
         except KeyError:
             raise ValueError("Unknown restart policy: %r" % (data[u"Name"],))
 
+    def _parse_links(self, data):
+        """
+        Parse the links of a container into ``Link`` instances.
+
+        Docker describes each link like ``/flocker--db:/flocker--app/db``:
+        the name of the linked container followed by the linking container's
+        name and the link's alias.  Links to containers outside this client's
+        namespace are ignored.
+
+        :param list data: The ``Links`` from the container's ``HostConfig``,
+            or ``None``.
+
+        :return: A ``list`` of ``Link`` instances.
+        """
+        links = []
+        for description in data or []:
+            target, path = description.split(u":", 1)
+            target = target.lstrip(u"/")
+            if not target.startswith(self.namespace):
+                continue
+            links.append(Link(unit_name=target[len(self.namespace):],
+                              alias=path.rsplit(u"/", 1)[-1]))
+        return links
+
     def _serialize_restart_policy(self, restart_policy):
         """
         Serialize the restart policy from an ``IRestartPolicy`` to the format
@@ -388,7 +477,8 @@ class DockerClient(object):
 
     def add(self, unit_name, image_name, ports=None, environment=None,
             volumes=(), mem_limit=None, cpu_shares=None,
-            restart_policy=RestartNever()):
+            restart_policy=RestartNever(), links=(), host_network=False):
+        from docker.errors import APIError
         container_name = self._to_container_name(unit_name)
 
         if environment is not None:
@@ -397,6 +487,22 @@ class DockerClient(object):
             ports = []
 
         restart_policy_dict = self._serialize_restart_policy(restart_policy)
+        if host_network:
+            # The container binds its ports on the host itself, so there is
+            # nothing for Docker to publish.
+            network_mode = u"host"
+            port_bindings = {}
+            environment = dict(environment or {})
+            environment[HOST_PORTS_VARIABLE] = u",".join(
+                unicode(port) for port in
+                sorted(p.external_port for p in ports))
+        else:
+            network_mode = None
+            port_bindings = {p.internal_port: p.external_port for p in ports}
+        container_links = {
+            self._to_container_name(link.unit_name): link.alias
+            for link in links
+        }
 
         def _create():
             config = self._client._container_config(
@@ -412,17 +518,22 @@ class DockerClient(object):
                                 volume.container_path.path)
                 for volume in volumes
             ]
-            port_bindings = {}
-            for p in ports:
-                key = u'%s/tcp' % (p.internal_port,)
-                port_bindings[key] = [
-                    {u"HostPort": unicode(p.external_port)},
-                ]
             config[u'HostConfig'] = {
                 u'Binds': binds,
-                u'PortBindings': port_bindings,
+                u'PortBindings': {
+                    u'%s/tcp' % (internal_port,): [
+                        {u"HostPort": unicode(external_port)},
+                    ]
+                    for internal_port, external_port in port_bindings.items()
+                },
                 u'RestartPolicy': restart_policy_dict,
+                u'Links': [
+                    u'{}:{}'.format(name, alias)
+                    for name, alias in container_links.items()
+                ],
             }
+            if network_mode is not None:
+                config[u'HostConfig'][u'NetworkMode'] = network_mode
             self._client.create_container_from_config(
                 config=config, name=container_name)
 
@@ -449,9 +560,10 @@ class DockerClient(object):
                                       {u"bind": volume.container_path.path,
                                        u"ro": False}
                                       for volume in volumes},
-                               port_bindings={p.internal_port: p.external_port
-                                              for p in ports},
-                               restart_policy=restart_policy_dict)
+                               port_bindings=port_bindings,
+                               restart_policy=restart_policy_dict,
+                               links=container_links,
+                               network_mode=network_mode)
         d = deferToThread(_add)
 
         def _extract_error(failure):
@@ -472,6 +584,7 @@ class DockerClient(object):
 
         :return: ``True`` if unit exists, otherwise ``False``.
         """
+        from docker.errors import APIError
         try:
             self._client.inspect_container(container_name)
             return True
@@ -483,6 +596,7 @@ class DockerClient(object):
         return deferToThread(self._blocking_exists, container_name)
 
     def remove(self, unit_name):
+        from docker.errors import APIError
         container_name = self._to_container_name(unit_name)
 
         def _remove():
@@ -523,6 +637,8 @@ class DockerClient(object):
         return d
 
     def list(self):
+        from docker.errors import APIError
+
         def _list():
             result = set()
             ids = [d[u"Id"] for d in
@@ -541,8 +657,13 @@ class DockerClient(object):
                          else u"inactive")
                 name = data[u"Name"]
                 image = data[u"Config"][u"Image"]
+                host_network = (
+                    data[u"HostConfig"].get(u"NetworkMode") == u"host")
                 port_bindings = data[u"HostConfig"][u"PortBindings"]
-                if port_bindings is not None:
+                if host_network:
+                    ports = self._parse_host_ports(
+                        data[u"Config"].get(u"Env"))
+                elif port_bindings is not None:
                     ports = self._parse_container_ports(port_bindings)
                 else:
                     ports = list()
@@ -570,6 +691,7 @@ class DockerClient(object):
                 mem_limit = None if mem_limit == 0 else mem_limit
                 restart_policy = self._parse_restart_policy(
                     data[U"HostConfig"][u"RestartPolicy"])
+                links = self._parse_links(data[u"HostConfig"].get(u"Links"))
                 result.add(Unit(
                     name=name,
                     container_name=self._to_container_name(name),
@@ -579,7 +701,9 @@ class DockerClient(object):
                     volumes=frozenset(volumes),
                     mem_limit=mem_limit,
                     cpu_shares=cpu_shares,
-                    restart_policy=restart_policy)
+                    restart_policy=restart_policy,
+                    links=frozenset(links),
+                    host_network=host_network)
                 )
             return result
         return deferToThread(_list)
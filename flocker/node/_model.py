@@ -9,6 +9,85 @@ from characteristic import attributes, Attribute
 from zope.interface import Interface, implementer
 
 
+def _cached_hash(cls):
+    """
+    Make a ``characteristic`` record type remember its hash.
+
+    The hash ``characteristic`` gives a record is computed from all of its
+    attributes, and so from everything nested in them, every time it is
+    needed.  Deployments are compared and put in sets and dictionaries a
+    lot, so instead the hash of each record is computed once and kept in its
+    ``_hash`` slot.  Records whose hashes have both been computed and differ
+    are also unequal without comparing their attributes.  Equality never
+    computes a hash itself, so records with unhashable attributes such as
+    lists still compare by value.
+
+    Instances of ``cls`` must therefore not be changed once created; create
+    a new one with the different attributes instead.
+
+    :param type cls: A class decorated with ``attributes`` which has a
+        ``_hash`` slot.
+
+    :return: ``cls``
+    """
+    compute_hash = cls.__hash__
+    equal = cls.__eq__
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = compute_hash(self)
+            return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is self.__class__:
+            try:
+                if self._hash != other._hash:
+                    return False
+            except AttributeError:
+                pass
+        return equal(self, other)
+
+    def __ne__(self, other):
+        result = __eq__(self, other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    cls.__hash__ = __hash__
+    cls.__eq__ = __eq__
+    cls.__ne__ = __ne__
+    return cls
+
+
+class _memoized_index(object):
+    """
+    A property of an immutable record which is computed the first time it is
+    used and then kept in a slot named after it with a leading underscore.
+
+    :ivar build: A one-argument callable which computes the value of the
+        property from the record.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.slot = "_" + build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            value = self.build(instance)
+            setattr(instance, self.slot, value)
+            return value
+
+
+@_cached_hash
 @attributes(["repository", "tag"], defaults=dict(tag=u'latest'))
 class DockerImage(object):
     """
@@ -19,6 +98,7 @@ class DockerImage(object):
     :ivar unicode full_name: A readonly property which combines the repository
         and tag in a format that can be passed to `docker run`.
     """
+    __slots__ = ("repository", "tag", "_hash")
 
     @property
     def full_name(self):
@@ -50,8 +130,9 @@ class DockerImage(object):
         return cls(**kwargs)
 
 
-@attributes(["name", "mountpoint", "maximum_size"],
-            defaults=dict(maximum_size=None))
+@_cached_hash
+@attributes(["name", "mountpoint", "maximum_size", "properties"],
+            defaults=dict(maximum_size=None, properties=frozenset()))
 class AttachedVolume(object):
     """
     A volume attached to an application to be deployed.
@@ -66,7 +147,13 @@ class AttachedVolume(object):
 
     :ivar int maximum_size: The maximum size in bytes of this volume, or
         ``None`` if there is no specified limit.
+
+    :ivar frozenset properties: A ``frozenset`` of ``(unicode, unicode)``
+        tuples giving the ZFS tuning properties (eg ``recordsize`` or
+        ``compression``) for this volume.  Properties which are not included
+        use the storage pool's defaults.
     """
+    __slots__ = ("name", "mountpoint", "maximum_size", "properties", "_hash")
 
     @classmethod
     def from_unit(cls, unit):
@@ -147,6 +234,7 @@ class RestartOnFailure(object):
                     "got %r" % (self.maximum_retry_count,))
 
 
+@_cached_hash
 @attributes(["name", "image",
              Attribute("ports", default_value=frozenset()),
              Attribute("volume", default_value=None),
@@ -154,7 +242,8 @@ class RestartOnFailure(object):
              Attribute("environment", default_value=None),
              Attribute("memory_limit", default_value=None),
              Attribute("cpu_shares", default_value=None),
-             Attribute("restart_policy", default_value=RestartNever())])
+             Attribute("restart_policy", default_value=RestartNever()),
+             Attribute("host_network", default_value=False)])
 class Application(object):
     """
     A single `application <http://12factor.net/>`_ to be deployed.
@@ -186,9 +275,18 @@ class Application(object):
 
     :ivar IRestartPolicy restart_policy: The restart policy for this
         application.
+
+    :ivar bool host_network: If ``True`` the application shares the network
+        stack of its node instead of having its own, so its ports are bound
+        directly on the node rather than published through Docker.  Each of
+        its ports must then have the same internal and external port number.
     """
+    __slots__ = ("name", "image", "ports", "volume", "links", "environment",
+                 "memory_limit", "cpu_shares", "restart_policy",
+                 "host_network", "_hash")
 
 
+@_cached_hash
 @attributes(["hostname", "applications"])
 class Node(object):
     """
@@ -202,8 +300,10 @@ class Node(object):
     :ivar frozenset applications: A ``frozenset`` of ``Application`` instances
         describing the applications which are to run on this ``Node``.
     """
+    __slots__ = ("hostname", "applications", "_hash")
 
 
+@_cached_hash
 @attributes(["nodes"])
 class Deployment(object):
     """
@@ -213,9 +313,61 @@ class Deployment(object):
 
     :ivar frozenset nodes: A ``frozenset`` containing ``Node`` instances
         describing the configuration of each cooperating node.
+
+    The remaining public attributes are indexes of ``nodes`` which are built
+    the first time they are used.  They must not be modified.
     """
+    __slots__ = ("nodes", "_hash", "_nodes_by_hostname",
+                 "_applications_by_name", "_volumes_by_name",
+                 "_hostnames_by_port")
+
+    @_memoized_index
+    def nodes_by_hostname(self):
+        """
+        A ``dict`` mapping the hostname of each node to its ``Node``.
+        """
+        return {node.hostname: node for node in self.nodes}
 
+    @_memoized_index
+    def applications_by_name(self):
+        """
+        A ``dict`` mapping the name of each application to a two-tuple of
+        the ``Node`` it is on and the ``Application``.
+        """
+        return {application.name: (node, application)
+                for node in self.nodes
+                for application in node.applications or ()}
 
+    @_memoized_index
+    def volumes_by_name(self):
+        """
+        A ``dict`` mapping the name of each application volume to a
+        two-tuple of the hostname of the node it is on and the
+        ``AttachedVolume``.
+        """
+        return {application.volume.name: (node.hostname, application.volume)
+                for node in self.nodes
+                for application in node.applications or ()
+                if application.volume is not None}
+
+    @_memoized_index
+    def hostnames_by_port(self):
+        """
+        A ``dict`` mapping each external port of an application to a
+        ``frozenset`` of the hostnames of the nodes with an application
+        using it.  Applications on different nodes may use the same
+        external port.
+        """
+        hostnames = {}
+        for node in self.nodes:
+            for application in node.applications or ():
+                for port in application.ports:
+                    hostnames.setdefault(port.external_port, set()).add(
+                        node.hostname)
+        return {port: frozenset(names) for port, names in hostnames.items()}
+
+
+@_cached_hash
 @attributes(['internal_port', 'external_port'])
 class Port(object):
     """
@@ -225,8 +377,10 @@ class Port(object):
     :ivar int internal_port: The port number exposed by the application.
     :ivar int external_port: The port number exposed to the outside world.
     """
+    __slots__ = ("internal_port", "external_port", "_hash")
 
 
+@_cached_hash
 @attributes(['local_port', 'remote_port', 'alias'])
 class Link(object):
     """
@@ -242,6 +396,7 @@ class Link(object):
     :ivar unicode alias: Environment variable prefix to use for exposing
         connection information.
     """
+    __slots__ = ("local_port", "remote_port", "alias", "_hash")
 
 
 @attributes(["volume", "hostname"])
@@ -258,7 +413,8 @@ class VolumeHandoff(object):
     """
 
 
-@attributes(["going", "coming", "creating", "resizing"])
+@attributes(["going", "coming", "creating", "resizing", "tuning"],
+            defaults=dict(tuning=frozenset()))
 class VolumeChanges(object):
     """
     ``VolumeChanges`` describes the volume-related changes necessary to change
@@ -280,6 +436,11 @@ class VolumeChanges(object):
         node resize any existing volumes that are desired somewhere on the
         cluster and locally exist with a different maximum_size to the desired
         maximum_size. These must be resized.
+
+    :ivar frozenset tuning: The ``AttachedVolume``\ s necessary to let this
+        node retune any existing volumes that are desired somewhere on the
+        cluster and locally exist with different properties to the desired
+        properties.  These must have their properties set.
     """
 
 
@@ -294,5 +455,6 @@ class NodeState(object):
     :ivar not_running: A ``list`` of ``Application`` instances on this
         node that are currently shutting down or stopped.
     :ivar used_ports: A ``frozenset`` of ``int``\ s giving the TCP port numbers
-        in use (by anything) on this node.
+        in use (by anything) on this node, or an equivalent object which only
+        discovers them when first used.
     """
@@ -0,0 +1,153 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.node.test.test_httpapi -*-
+
+"""
+A HTTP REST API for giving ``flocker-serve`` the configuration to converge
+its node on.
+"""
+
+from yaml.error import YAMLError
+
+from werkzeug.exceptions import HTTPException, NotFound
+
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.application.internet import StreamServerEndpointService
+
+from klein import Klein
+
+from ..common import safe_load
+from ..restapi import structured
+from ..restapi._error import makeBadRequest
+from ..volume.httpapi import DatasetAPIUser
+from ._config import (
+    ConfigurationError, FlockerConfiguration, model_from_configuration,
+    current_from_configuration,
+)
+
+# The body of a request to ``/v1/configuration``, which has the same
+# configurations ``flocker-changestate`` is given.
+CONFIGURATION_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "object",
+    "properties": {
+        "hostname": {"type": "string"},
+        "deployment": {"type": "string"},
+        "application": {"type": "string"},
+        "current": {"type": "array", "items": {"type": "object"}},
+    },
+    "required": ["hostname", "deployment", "application", "current"],
+    "additionalProperties": False,
+}
+
+
+class ConvergenceAPIUser(object):
+    """
+    A user accessing the API to configure a node.
+
+    :ivar ConvergenceService convergence: The service converging the node.
+    """
+    app = Klein()
+
+    def __init__(self, convergence):
+        """
+        :param ConvergenceService convergence: See ``convergence``.
+        """
+        self.convergence = convergence
+
+    @app.route("/v1/configuration", methods=["POST"])
+    @structured(CONFIGURATION_SCHEMA, {})
+    def configure(self, hostname, deployment, application, current):
+        """
+        Converge the node on a new configuration.
+
+        :param unicode hostname: The hostname of the node.
+        :param unicode deployment: The YAML deployment configuration.
+        :param unicode application: The YAML application configuration.
+        :param list current: The parts of the current configuration of the
+            cluster, as given to ``flocker-changestate``.  Later parts hold
+            more complete configuration for the nodes they cover.
+
+        :return: A ``Deferred`` which fires with ``None`` once the node has
+            converged on the configuration.
+        """
+        try:
+            deployment = safe_load(deployment)
+            application = safe_load(application)
+        except YAMLError as e:
+            raise makeBadRequest(
+                description=u"Configuration could not be parsed as YAML.",
+                error=str(e).decode("utf-8"))
+        current_config = {}
+        for part in current:
+            current_config.update(part)
+        try:
+            desired = model_from_configuration(
+                applications=FlockerConfiguration(application).applications(),
+                deployment_configuration=deployment)
+            current = current_from_configuration(current_config)
+        except ConfigurationError as e:
+            raise makeBadRequest(
+                description=u"Configuration is not valid.",
+                error=str(e).decode("utf-8"))
+        return self.convergence.configure(desired, current, hostname)
+
+
+class _AppsResource(Resource):
+    """
+    Serve the routes of several Klein applications from one site.
+
+    Each request is rendered by the first application with a route for its
+    path, or by the last one if none has.
+    """
+    isLeaf = True
+
+    def __init__(self, apps):
+        """
+        :param list apps: The bound ``Klein`` applications.
+        """
+        Resource.__init__(self)
+        self._apps = apps
+
+    def render(self, request):
+        for app in self._apps[:-1]:
+            try:
+                app.url_map.bind(b"").match(request.path, request.method)
+            except NotFound:
+                continue
+            except HTTPException:
+                # A redirect or a disallowed method still means this
+                # application has the route, so it should respond.
+                pass
+            return app.resource().render(request)
+        return self._apps[-1].resource().render(request)
+
+
+def api_resource(convergence, volume_service):
+    """
+    Create the resource ``flocker-serve`` serves: the configuration API and
+    the dataset API, which only moves datasets to the nodes of the
+    configuration the node was last given.
+
+    :param ConvergenceService convergence: The service converging the node.
+    :param VolumeService volume_service: The service managing the node's
+        datasets.
+    """
+    return _AppsResource([
+        ConvergenceAPIUser(convergence).app,
+        DatasetAPIUser(
+            volume_service, known_nodes=convergence.known_nodes).app,
+    ])
+
+
+def create_api_service(endpoint, convergence, volume_service):
+    """
+    Create a Twisted Service that serves the API on the given endpoint.
+
+    :param endpoint: The ``IStreamServerEndpoint`` to listen on.
+    :param ConvergenceService convergence: The service converging the node.
+    :param VolumeService volume_service: The service managing the node's
+        datasets.
+    """
+    return StreamServerEndpointService(
+        endpoint, Site(api_resource(convergence, volume_service)))
@@ -2,19 +2,20 @@
 # -*- test-case-name: flocker.node.test.test_script -*-
 
 """
-The command-line ``flocker-changestate`` and ``flocker-reportstate``
-tools.
+The command-line ``flocker-changestate``, ``flocker-reportstate`` and
+``flocker-serve`` tools.
 """
 
+import json
 import sys
 
+from twisted.python.filepath import FilePath
 from twisted.python.usage import Options, UsageError
 from twisted.internet.defer import Deferred, maybeDeferred
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.application.service import MultiService
 
 
-from yaml import safe_load, safe_dump
 from yaml.error import YAMLError
 
 from zope.interface import implementer
@@ -23,12 +24,15 @@ from ._config import marshal_configuration
 
 from ..volume.service import (
     ICommandLineVolumeScript, VolumeScript)
-from ..volume.httpapi import create_api_service
 from ..volume.script import flocker_volume_options
+from ..common import safe_load, split_frames
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner)
+from ..route import (
+    make_caching_resolver, make_host_network, make_nftables_network)
 from . import (ConfigurationError, model_from_configuration, Deployer,
-               FlockerConfiguration, current_from_configuration)
+               FlockerConfiguration, current_from_configuration,
+               state_report, STATE_FORMATS)
 
 __all__ = [
     "flocker_changestate_main",
@@ -36,9 +40,66 @@ __all__ = [
     "flocker_serve_main",
 ]
 
+# Where ``flocker-reportstate`` remembers the configuration it last reported
+# with ``--since``.
+DEFAULT_STATE_CACHE = FilePath(b"/var/lib/flocker/reportstate.json")
+
+# The ways the node commands can configure proxies, by the name given to
+# ``--network-backend``, as functions creating an ``INetwork`` provider.
+NETWORK_BACKENDS = {
+    "iptables": make_host_network,
+    "nftables": make_nftables_network,
+}
+
+
+def flocker_network_options(cls):
+    """
+    A class decorator to add the ``--network-backend`` option, choosing one
+    of ``NETWORK_BACKENDS``, to flocker commands.
+
+    :param cls: The class to decorate.
+    :return: The decorated class.
+    """
+    original_parameters = getattr(cls, "optParameters", [])
+    cls.optParameters = original_parameters + [
+        ["network-backend", None, "iptables",
+         "How to configure proxies to other nodes: one of " +
+         ", ".join(sorted(NETWORK_BACKENDS)) + "."],
+    ]
+
+    original_postOptions = cls.postOptions
+
+    def postOptions(self):
+        if self["network-backend"] not in NETWORK_BACKENDS:
+            raise UsageError(
+                "Unknown network backend {!r}, use one of: {}.".format(
+                    self["network-backend"],
+                    ", ".join(sorted(NETWORK_BACKENDS))))
+        original_postOptions(self)
+
+    cls.postOptions = postOptions
+
+    return cls
+
+
+def _network(network, options):
+    """
+    :param network: The ``INetwork`` provider a script was created with, or
+        ``None``.
+    :param options: The options decorated with ``flocker_network_options``
+        the script was run with.
+
+    :return: ``network`` if given, otherwise a new ``INetwork`` provider of
+        the backend chosen by the options.
+    """
+    if network is not None:
+        return network
+    return NETWORK_BACKENDS[options["network-backend"]]()
+
 
 @flocker_standard_options
 @flocker_volume_options
+@flocker_network_options
 class ChangeStateOptions(Options):
     """
     Command line options for ``flocker-changestate`` management tool.
@@ -59,19 +120,60 @@ class ChangeStateOptions(Options):
 
     * hostname: The hostname of this node. Used by the node to identify which
         applications from deployment_configuration should be running.
+
+    With --stdin only the hostname is given on the command line and the
+    configurations are read from standard input instead, which avoids limits
+    on the length of the command line.
     """
     synopsis = ("Usage: flocker-changestate [OPTIONS] "
-                "<deployment configuration> <application configuration> "
-                "<cluster configuration> <hostname>")
+                "[<deployment configuration> <application configuration> "
+                "<cluster configuration>] <hostname>")
+
+    optFlags = [
+        ["stdin", None,
+         "Read the configurations from standard input, framed as written "
+         "by flocker-deploy, instead of from the command line."],
+    ]
+
+    _stdin = sys.stdin
+
+    def _read_stdin(self):
+        """
+        Read the configurations from standard input.
+
+        Standard input holds four frames: the deployment configuration, the
+        application configuration, the configuration of the applications with
+        volumes on every node (see ``volume_configuration``) and the full
+        current configuration of this node (and possibly others).  The first
+        two are YAML as written by the user, the others are JSON.
+
+        :return: A three-tuple of the deployment and application
+            configuration as YAML ``bytes`` and a ``tuple`` of the parts of
+            the current cluster configuration as JSON ``bytes``.
+        """
+        try:
+            frames = split_frames(self._stdin.read())
+        except ValueError as e:
+            raise UsageError(
+                "Configuration could not be read from standard input: " +
+                str(e))
+        if len(frames) != 4:
+            raise UsageError(
+                "Expected 4 configurations on standard input, got {}.".format(
+                    len(frames)))
+        deployment_config, application_config, volumes, nodes = frames
+        return deployment_config, application_config, (volumes, nodes)
 
-    def parseArgs(self, deployment_config, application_config, current_config,
-                  hostname):
+    def parseArgs(self, *arguments):
         """
         Parse `deployment_config`, `application_config` and `current_config`
         strings as YAML, and into a :class:`Deployment` instance. Assign
         the resulting instance to this `Options` dictionary. Decode a
         supplied hostname as ASCII and assign to a `hostname` key.
 
+        The arguments are either the following four or, with ``--stdin``,
+        only ``hostname``:
+
         :param bytes deployment_config: The YAML string describing the desired
             deployment configuration.
 
@@ -86,6 +188,21 @@ class ChangeStateOptions(Options):
         :raises UsageError: If the configuration files cannot be parsed as YAML
             or if the hostname can not be decoded as ASCII.
         """
+        if self["stdin"]:
+            if len(arguments) != 1:
+                raise UsageError("Wrong number of arguments.")
+            [hostname] = arguments
+            deployment_config, application_config, current_config = (
+                self._read_stdin())
+            load_current, current_format = json.loads, "JSON"
+        else:
+            if len(arguments) != 4:
+                raise UsageError("Wrong number of arguments.")
+            (deployment_config, application_config, current_config,
+             hostname) = arguments
+            current_config = (current_config,)
+            load_current, current_format = safe_load, "YAML"
+
         try:
             deployment_config = safe_load(deployment_config)
         except YAMLError as e:
@@ -99,11 +216,17 @@ class ChangeStateOptions(Options):
                 "Application config could not be parsed as YAML:\n\n" + str(e)
             )
         try:
-            current_config = safe_load(current_config)
-        except YAMLError as e:
+            # Later parts hold more complete configuration for the nodes
+            # they cover:
+            parts = [load_current(part) for part in current_config]
+        except (YAMLError, ValueError) as e:
             raise UsageError(
-                "Current config could not be parsed as YAML:\n\n" + str(e)
+                "Current config could not be parsed as {}:\n\n".format(
+                    current_format) + str(e)
             )
+        current_config = parts[0]
+        for part in parts[1:]:
+            current_config.update(part)
         try:
             self['hostname'] = hostname.decode('ascii')
         except UnicodeDecodeError:
@@ -136,16 +259,24 @@ class ChangeStateScript(object):
 
     :ivar DockerClient _docker_client: See the ``docker_client`` parameter to
         ``__init__``.
+    :ivar INetwork _network: See the ``network`` parameter to ``__init__``.
     """
-    def __init__(self, docker_client=None):
+    def __init__(self, docker_client=None, network=None):
         """
         :param DockerClient docker_client: The object to use to talk to the
             Docker server.
+
+        :param INetwork network: The object to use to interact with the node's
+            network configuration, or ``None`` to use the backend chosen with
+            ``--network-backend``.
         """
         self._docker_client = docker_client
+        self._network = network
 
     def main(self, reactor, options, volume_service):
-        deployer = Deployer(volume_service, self._docker_client)
+        deployer = Deployer(volume_service, self._docker_client,
+                            _network(self._network, options),
+                            resolver=make_caching_resolver(reactor))
         return deployer.change_node_state(
             desired_state=options['deployment'],
             current_cluster_state=options['current'],
@@ -162,6 +293,7 @@ def flocker_changestate_main():
 
 @flocker_standard_options
 @flocker_volume_options
+@flocker_network_options
 class ReportStateOptions(Options):
     """
     Command line options for ``flocker-reportstate`` management tool.
@@ -170,9 +302,34 @@ class ReportStateOptions(Options):
     longdesc = """\
     flocker-reportstate is called by flocker-deploy to get the configuration of
     a node.
+
+    With --since, the configuration is instead described relative to the
+    configuration identified by the given token: it is either unchanged, or
+    only the applications which changed since are included if that is the
+    configuration most recently reported, or it is included in full
+    otherwise.  A token is always included for use in the next call.
+
+    The configuration is written as YAML by default.  --format json writes
+    the same structure as JSON instead, which is much faster for programs
+    to produce and parse.
     """
     synopsis = ("Usage: flocker-reportstate [OPTIONS]")
 
+    optParameters = [
+        ["since", None, None,
+         "The token of the configuration of this node last reported to "
+         "the caller."],
+        ["format", None, "yaml",
+         "The format to write the configuration in: one of " +
+         ", ".join(sorted(STATE_FORMATS)) + "."],
+    ]
+
+    def postOptions(self):
+        if self["format"] not in STATE_FORMATS:
+            raise UsageError(
+                "Unknown format {!r}, use one of: {}.".format(
+                    self["format"], ", ".join(sorted(STATE_FORMATS))))
+
 
 @implementer(ICommandLineVolumeScript)
 class ReportStateScript(object):
@@ -184,22 +341,71 @@ class ReportStateScript(object):
     """
     _stdout = sys.stdout
 
-    def __init__(self, docker_client=None, network=None):
+    def __init__(self, docker_client=None, network=None,
+                 state_cache=DEFAULT_STATE_CACHE):
         """
         :param DockerClient docker_client: The object to use to talk to the
             Docker server.
 
         :param INetwork network: The object to use to interact with the node's
-            network configuration.
+            network configuration, or ``None`` to use the backend chosen with
+            ``--network-backend``.
+
+        :param FilePath state_cache: The file in which to keep the
+            configuration most recently reported with ``--since``.
         """
         self._docker_client = docker_client
         self._network = network
+        self._state_cache = state_cache
+
+    def _report(self, configuration, since):
+        """
+        Describe a configuration relative to the one identified by ``since``,
+        and remember it for next time.
+
+        :param dict configuration: The current configuration of the node.
+        :param bytes since: The token given with ``--since``.
+
+        :return: A report as returned by ``state_report``.
+        """
+        previous = None
+        if self._state_cache.exists():
+            previous = json.loads(self._state_cache.getContent())
+        report = state_report(since, previous, configuration)
+        if previous is None or previous["token"] != report["token"]:
+            if not self._state_cache.parent().exists():
+                self._state_cache.parent().makedirs()
+            self._state_cache.setContent(json.dumps(
+                {"token": report["token"], "state": configuration}))
+        return report
+
+    def _describe(self, state, network):
+        """
+        Describe the state of this node.
+
+        :param NodeState state: The discovered state of this node.
+        :param INetwork network: The network configuration of this node.
+
+        :return: The configuration returned by ``marshal_configuration``,
+            with the names of the applications which are ``not_running`` and
+            the ``proxied_ports`` added so that ``flocker-deploy`` can tell
+            whether this node needs changing (see ``find_affected_nodes``).
+        """
+        configuration = marshal_configuration(state)
+        configuration["not_running"] = sorted(
+            application.name for application in state.not_running)
+        configuration["proxied_ports"] = sorted(
+            proxy.port for proxy in network.enumerate_proxies())
+        return configuration
 
     def main(self, reactor, options, volume_service):
-        deployer = Deployer(volume_service, self._docker_client, self._network)
+        deployer = Deployer(volume_service, self._docker_client,
+                            _network(self._network, options))
         d = deployer.discover_node_configuration()
-        d.addCallback(marshal_configuration)
-        d.addCallback(safe_dump)
+        d.addCallback(self._describe, deployer.network)
+        if options["since"] is not None:
+            d.addCallback(self._report, options["since"])
+        d.addCallback(STATE_FORMATS[options["format"]])
         d.addCallback(self._stdout.write)
         return d
 
@@ -254,28 +460,35 @@ def _main_for_service(reactor, service):
 
 @flocker_standard_options
 @flocker_volume_options
+@flocker_network_options
 class ServeOptions(Options):
     """
     Command line options for ``flocker-serve`` cluster management process.
     """
     optParameters = [
-        ["port", "p", 4523, "The port to listen on.", int],
+        ["port", "p", 4523,
+         "The port to listen on.  Only connections from the node itself are "
+         "accepted, so flocker-deploy reaches it over SSH.", int],
         ]
 
 
 class _ServeService(MultiService):
     """
-    Service for running a ``VolumeService`` and HTTP API service.
+    Service for running a ``VolumeService``, HTTP API service and
+    ``ConvergenceService``.
     """
-    def __init__(self, volume_service, http_service):
+    def __init__(self, volume_service, http_service, convergence_service):
         """
         :param volume_service: The volume service to run.
 
         :param http_service: The HTTP API service to run.
+
+        :param convergence_service: The convergence service to run.
         """
         MultiService.__init__(self)
         volume_service.setServiceParent(self)
         http_service.setServiceParent(self)
+        convergence_service.setServiceParent(self)
 
     def stopService(self):
         """
@@ -297,13 +510,47 @@ class _ServeService(MultiService):
 @implementer(ICommandLineVolumeScript)
 class ServeScript(object):
     """
-    A command to start a long-running process to manage volumes on one node of
-    a Flocker cluster.
+    A command to start a long-running process to manage volumes and
+    applications on one node of a Flocker cluster.
+
+    The process converges the node on the configuration given to its HTTP
+    API, keeping the ``Deployer`` and its caches between convergences.  The
+    same API also manages the node's datasets directly.  It has no
+    authentication of its own, so it only listens on the loopback interface
+    and is reached over SSH by anyone allowed to run commands on the node.
+
+    :ivar DockerClient _docker_client: See the ``docker_client`` parameter to
+        ``__init__``.
+    :ivar INetwork _network: See the ``network`` parameter to ``__init__``.
     """
+    def __init__(self, docker_client=None, network=None):
+        """
+        :param DockerClient docker_client: The object to use to talk to the
+            Docker server.
+
+        :param INetwork network: The object to use to interact with the node's
+            network configuration, or ``None`` to use the backend chosen with
+            ``--network-backend``.
+        """
+        self._docker_client = docker_client
+        self._network = network
+
     def main(self, reactor, options, volume_service):
+        # The HTTP API pulls in klein, werkzeug and jsonschema, which the
+        # short-lived commands sharing this module have no use for.
+        from ._converge import ConvergenceService
+        from .httpapi import create_api_service
+
+        deployer = Deployer(volume_service, self._docker_client,
+                            _network(self._network, options),
+                            resolver=make_caching_resolver(reactor))
+        convergence_service = ConvergenceService(reactor, deployer)
         api_service = create_api_service(
-            TCP4ServerEndpoint(reactor, options["port"]))
-        parent_service = _ServeService(volume_service, api_service)
+            TCP4ServerEndpoint(
+                reactor, options["port"], interface="127.0.0.1"),
+            convergence_service, volume_service)
+        parent_service = _ServeService(
+            volume_service, api_service, convergence_service)
         return _main_for_service(reactor, parent_service)
 
 
@@ -7,6 +7,7 @@ Tests for ``flocker.node._config``.
 from __future__ import unicode_literals, absolute_import
 
 import copy
+import json
 
 from twisted.python.filepath import FilePath
 from twisted.trial.unittest import SynchronousTestCase
@@ -17,8 +18,10 @@ from .._config import (
     model_from_configuration, FigConfiguration,
     applications_to_flocker_yaml, parse_storage_string, ApplicationMarshaller,
     FLOCKER_RESTART_POLICY_POLICY_TO_NAME, ApplicationConfigurationError,
-    _parse_restart_policy,
+    _parse_restart_policy, volume_configuration, configuration_token,
+    state_report, apply_state_report,
 )
+from .._deploy import find_volume_changes
 from .._model import (
     Application, AttachedVolume, DockerImage, Deployment, Node, Port, Link,
     NodeState, RestartNever, RestartAlways, RestartOnFailure
@@ -1113,6 +1116,36 @@ class ApplicationsFromConfigurationTests(SynchronousTestCase):
     Tests for ``FlockerConfiguration.applications`` and the private methods
     that it calls.
     """
+    def test_configuration_unchanged(self):
+        """
+        ``FlockerConfiguration.applications`` does not modify the
+        configuration it parses, so the same configuration parses to the
+        same applications again.
+        """
+        config = {
+            'version': 1,
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'environment': {'MYSQL_USER': 'admin'},
+                    'ports': [{'internal': 3306, 'external': 3307}],
+                    'links': [{'local_port': 80, 'remote_port': 8080,
+                               'alias': 'site'}],
+                    'volume': {'mountpoint': b'/var/lib/mysql',
+                               'maximum_size': '1G',
+                               'properties': {'compression': 'lz4'}},
+                    'restart_policy': {'name': 'on-failure',
+                                       'maximum_retry_count': 3},
+                    'network': 'bridge',
+                },
+            },
+        }
+        original = copy.deepcopy(config)
+        applications = FlockerConfiguration(config).applications()
+        self.assertEqual(
+            (original, applications),
+            (config, FlockerConfiguration(config).applications()))
+
     def test_error_on_environment_var_not_stringtypes(self):
         """
         ``Configuration._applications.from_configuration`` raises a
@@ -1280,6 +1313,117 @@ class ApplicationsFromConfigurationTests(SynchronousTestCase):
         self.assertEqual(applications['mysql-hybridcluster'].cpu_shares,
                          512)
 
+    def test_default_network(self):
+        """
+        ``FlockerConfiguration.applications`` returns an ``Application`` which
+        does not use the host network if no network was specified in the
+        configuration.
+        """
+        config = {
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                }
+            },
+            'version': 1
+        }
+        parser = FlockerConfiguration(config)
+        applications = parser.applications()
+        self.assertFalse(applications['mysql-hybridcluster'].host_network)
+
+    def test_application_with_host_network(self):
+        """
+        ``FlockerConfiguration.applications`` returns an ``Application`` which
+        uses the host network if the configuration has a network of ``host``.
+        """
+        config = {
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'network': 'host',
+                    'ports': [dict(internal=3306, external=3306)],
+                }
+            },
+            'version': 1
+        }
+        parser = FlockerConfiguration(config)
+        applications = parser.applications()
+        self.assertEqual(
+            Application(
+                name='mysql-hybridcluster',
+                image=DockerImage(repository='clusterhq/mysql', tag='latest'),
+                ports=frozenset([Port(internal_port=3306,
+                                      external_port=3306)]),
+                links=frozenset(),
+                host_network=True),
+            applications['mysql-hybridcluster'])
+
+    def test_application_with_bridge_network(self):
+        """
+        ``FlockerConfiguration.applications`` returns an ``Application`` which
+        does not use the host network if the configuration has a network of
+        ``bridge``.
+        """
+        config = {
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'network': 'bridge',
+                }
+            },
+            'version': 1
+        }
+        parser = FlockerConfiguration(config)
+        applications = parser.applications()
+        self.assertFalse(applications['mysql-hybridcluster'].host_network)
+
+    def test_error_on_unknown_network(self):
+        """
+        ``FlockerConfiguration._parse`` raises a ``ConfigurationError`` if the
+        supplied configuration has a network which is not recognised.
+        """
+        config = {
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'network': 'overlay',
+                }
+            },
+            'version': 1
+        }
+        parser = FlockerConfiguration(config)
+        exception = self.assertRaises(ConfigurationError, parser._parse)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid network 'overlay'. Use one of: bridge, host.",
+            exception.message)
+
+    def test_error_on_host_network_port_mismatch(self):
+        """
+        ``FlockerConfiguration._parse`` raises a ``ConfigurationError`` if an
+        application using the host network has a port whose internal and
+        external port numbers differ, since the application binds the port on
+        the host itself.
+        """
+        config = {
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'network': 'host',
+                    'ports': [dict(internal=3306, external=3307)],
+                }
+            },
+            'version': 1
+        }
+        parser = FlockerConfiguration(config)
+        exception = self.assertRaises(ConfigurationError, parser._parse)
+        self.assertEqual(
+            "Application 'mysql-hybridcluster' has a config error. "
+            "Invalid ports specification. Ports of an application using "
+            "the host network must have the same internal and external "
+            "port, got 3306 and 3307.",
+            exception.message)
+
     def test_not_valid_on_application_not_dict(self):
         """
         ``FlockerConfiguration.is_valid_format`` returns ``False`` if the
@@ -1882,6 +2026,113 @@ class ApplicationsFromConfigurationTests(SynchronousTestCase):
                           ps("1024G"),
                           ps("1T")))
 
+    def test_volume_properties(self):
+        """
+        A volume ``properties`` config value is parsed into the
+        ``properties`` of the ``AttachedVolume``, normalized to the form ZFS
+        reports them in.
+        """
+        config = dict(
+            version=1,
+            applications={
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql:v1.0.0',
+                    'volume': {'mountpoint': b'/var/lib/mysql',
+                               'properties': {
+                                   'recordsize': b'16K',
+                                   'compression': b'lz4',
+                                   'atime': False,
+                                   'logbias': b'throughput',
+                                   'primarycache': b'metadata',
+                               }},
+                },
+            }
+        )
+        parser = FlockerConfiguration(config)
+        volume_config = config['applications']['mysql-hybridcluster']['volume']
+        volume = parser._parse_volume(volume_config, 'mysql-hybridcluster')
+        self.assertEqual(
+            volume.properties,
+            frozenset([(u'recordsize', u'16384'),
+                       (u'compression', u'lz4'),
+                       (u'atime', u'off'),
+                       (u'logbias', u'throughput'),
+                       (u'primarycache', u'metadata')]))
+
+    def test_volume_properties_default(self):
+        """
+        A volume without a ``properties`` config value is parsed into an
+        ``AttachedVolume`` with no properties.
+        """
+        parser = FlockerConfiguration({})
+        volume = parser._parse_volume(
+            {'mountpoint': b'/var/lib/mysql'}, 'mysql-hybridcluster')
+        self.assertEqual(volume.properties, frozenset())
+
+    def assert_invalid_volume_properties(self, properties, message):
+        """
+        Assert that the given volume ``properties`` config value results in a
+        ``ConfigurationError`` with the given message.
+
+        :param properties: The ``properties`` config value.
+        :param bytes message: The expected error message, following the
+            volume specification prefix.
+        """
+        config = dict(
+            version=1,
+            applications={
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql:v1.0.0',
+                    'volume': {'mountpoint': b'/var/lib/mysql',
+                               'properties': properties},
+                },
+            }
+        )
+        parser = FlockerConfiguration(config)
+        e = self.assertRaises(ConfigurationError, parser.applications)
+        self.assertEqual(
+            e.message,
+            "Application 'mysql-hybridcluster' has a config error. Invalid "
+            "volume specification. " + message)
+
+    def test_invalid_volume_properties_not_dict(self):
+        """
+        A volume ``properties`` config value that is not a dictionary results
+        in a ``ConfigurationError``.
+        """
+        self.assert_invalid_volume_properties(
+            [b'compression'],
+            "properties: Must be a dictionary, got list.")
+
+    def test_invalid_volume_properties_unknown(self):
+        """
+        A volume ``properties`` config value naming a property which is not
+        tunable results in a ``ConfigurationError``.
+        """
+        self.assert_invalid_volume_properties(
+            {'mountpoint': b'/foo'},
+            "properties: Unrecognised property: mountpoint.")
+
+    def test_invalid_volume_properties_value(self):
+        """
+        A volume property with a value ZFS does not accept for it results in
+        a ``ConfigurationError``.
+        """
+        self.assert_invalid_volume_properties(
+            {'logbias': b'fast'},
+            "properties: logbias: Value 'fast' is not one of: "
+            "latency, throughput.")
+
+    def test_invalid_volume_properties_recordsize(self):
+        """
+        A volume ``recordsize`` property which is not a power of two results
+        in a ``ConfigurationError``.
+        """
+        self.assert_invalid_volume_properties(
+            {'recordsize': 3000},
+            "properties: recordsize: Must be a power of two between 512 and "
+            "131072 bytes.")
+
     def test_ports_missing_internal(self):
         """
         ``Configuration.applications`` raises a
@@ -2711,6 +2962,27 @@ class MarshalConfigurationTests(SynchronousTestCase):
     """
     Tests for ``Configuration.marshal_configuration``.
     """
+    def test_host_network(self):
+        """
+        An application using the host network is marshalled with a network
+        of ``host``, which ``FlockerConfiguration`` parses back into the same
+        application.
+        """
+        application = Application(
+            name='mysql-hybridcluster',
+            image=DockerImage(repository='flocker/mysql', tag='v1.0.0'),
+            ports=frozenset([Port(internal_port=3306, external_port=3306)]),
+            links=frozenset(),
+            host_network=True,
+        )
+        result = marshal_configuration(
+            NodeState(running=[application], not_running=[]))
+        del result['used_ports']
+        self.assertEqual(
+            ('host', {'mysql-hybridcluster': application}),
+            (result['applications']['mysql-hybridcluster']['network'],
+             FlockerConfiguration(result).applications()))
+
     def test_no_applications(self):
         """
         A dict with a version and empty applications list are returned if no
@@ -2923,6 +3195,38 @@ class MarshalConfigurationTests(SynchronousTestCase):
         }
         self.assertEqual(expected, result)
 
+    def test_application_with_volume_includes_properties(self):
+        """
+        If the supplied applications have a volume with properties, the
+        resulting yaml will also include the volume properties.
+        """
+        applications = [
+            Application(
+                name='mysql-hybridcluster',
+                image=DockerImage(repository='flocker/mysql', tag='v1.0.0'),
+                ports=frozenset(),
+                volume=AttachedVolume(
+                    name='mysql-hybridcluster',
+                    mountpoint=FilePath(b'/var/mysql/data'),
+                    properties=frozenset([(u'compression', u'lz4')]))
+            )
+        ]
+        result = marshal_configuration(
+            NodeState(running=applications, not_running=[]))
+        expected = {
+            'used_ports': [],
+            'applications': {
+                'mysql-hybridcluster': {
+                    'volume': {'mountpoint': b'/var/mysql/data',
+                               'properties': {u'compression': u'lz4'}},
+                    'image': u'flocker/mysql:v1.0.0',
+                    'restart_policy': {'name': 'never'},
+                }
+            },
+            'version': 1,
+        }
+        self.assertEqual(expected, result)
+
     def test_running_and_not_running_applications(self):
         """
         Both the ``running`` and ``not_running`` application lists are
@@ -3043,6 +3347,24 @@ class CurrentFromConfigurationTests(SynchronousTestCase):
     """
     Tests for ``current_from_configuration``.
     """
+    def test_json_configuration(self):
+        """
+        ``current_from_configuration`` accepts configuration which has been
+        through JSON, which has only ``unicode`` strings.
+        """
+        config = {'example.com': {
+            'version': 1,
+            'applications': {
+                'mysql-hybridcluster': {
+                    'image': 'clusterhq/mysql',
+                    'volume': {'mountpoint': b'/var/lib/mysql'},
+                },
+            },
+        }}
+        self.assertEqual(
+            current_from_configuration(copy.deepcopy(config)),
+            current_from_configuration(json.loads(json.dumps(config))))
+
     def test_deployment(self):
         """
         ``current_from_configuration`` creates a ``Deployment`` object with
@@ -3172,6 +3494,78 @@ def check_marshalled_restart_policy(test_case, policy_type, **attributes):
     )
 
 
+class VolumeConfigurationTests(SynchronousTestCase):
+    """
+    Tests for ``volume_configuration``.
+    """
+    def test_volumes_only(self):
+        """
+        ``volume_configuration`` keeps only the applications with volumes on
+        each node, and the rest of each node's configuration.
+        """
+        database = {'image': 'clusterhq/postgres',
+                    'volume': {'mountpoint': b'/var/lib/postgresql'}}
+        config = {
+            'node1.example.com': {
+                'version': 1,
+                'applications': {
+                    'site': {'image': 'clusterhq/site'},
+                    'database': database,
+                },
+                'used_ports': [80],
+            },
+            'node2.example.com': {
+                'version': 1,
+                'applications': {'site': {'image': 'clusterhq/site'}},
+            },
+        }
+        self.assertEqual(
+            {'node1.example.com': {'version': 1,
+                                   'applications': {'database': database},
+                                   'used_ports': [80]},
+             'node2.example.com': {'version': 1, 'applications': {}}},
+            volume_configuration(config))
+
+    def test_same_volume_changes(self):
+        """
+        A node finds the same volume changes whether the other nodes'
+        configuration is reduced by ``volume_configuration`` or not.
+        """
+        database = {'image': 'clusterhq/postgres',
+                    'volume': {'mountpoint': b'/var/lib/postgresql'}}
+        site = {'image': 'clusterhq/site'}
+        current = {
+            'node1.example.com': {
+                'version': 1,
+                'applications': {'site': site, 'database': database},
+            },
+            'node2.example.com': {
+                'version': 1,
+                'applications': {},
+            },
+        }
+        # The database moves to node2:
+        desired = current_from_configuration({
+            'node1.example.com': {
+                'version': 1,
+                'applications': {'site': site},
+            },
+            'node2.example.com': {
+                'version': 1,
+                'applications': {'database': database},
+            },
+        })
+        reduced = volume_configuration(current)
+        reduced['node2.example.com'] = current['node2.example.com']
+        self.assertEqual(
+            find_volume_changes(
+                'node2.example.com', current_from_configuration(current),
+                desired),
+            find_volume_changes(
+                'node2.example.com', current_from_configuration(reduced),
+                desired))
+
+
 class ApplicationMarshallerConvertRestartPolicyTests(SynchronousTestCase):
     """
     Tests for ``ApplicationMarshaller.convert_restart_policy``.
@@ -3238,3 +3632,113 @@ class ApplicationConfigurationErrorTests(SynchronousTestCase):
             ),
             unicode(e)
         )
+
+
+class ConfigurationTokenTests(SynchronousTestCase):
+    """
+    Tests for ``configuration_token``.
+    """
+    def test_equal(self):
+        """
+        Equal configurations have equal tokens, regardless of the order of
+        their keys.
+        """
+        first = {'version': 1, 'applications': {'a': {}, 'b': {}}}
+        second = {'applications': {'b': {}, 'a': {}}, 'version': 1}
+        self.assertEqual(
+            configuration_token(first), configuration_token(second))
+
+    def test_different(self):
+        """
+        Different configurations have different tokens.
+        """
+        self.assertNotEqual(
+            configuration_token({'version': 1, 'applications': {}}),
+            configuration_token({'version': 2, 'applications': {}}))
+
+
+class StateReportTests(SynchronousTestCase):
+    """
+    Tests for ``state_report`` and ``apply_state_report``.
+    """
+    previous_state = {
+        'version': 1,
+        'applications': {
+            'site': {'image': 'clusterhq/site:1'},
+            'cache': {'image': 'clusterhq/cache'},
+            'database': {'image': 'clusterhq/db'},
+        },
+        'used_ports': [80],
+    }
+
+    current_state = {
+        'version': 1,
+        'applications': {
+            'site': {'image': 'clusterhq/site:2'},
+            'database': {'image': 'clusterhq/db'},
+            'queue': {'image': 'clusterhq/queue'},
+        },
+        'used_ports': [80, 5672],
+    }
+
+    def entry(self, state):
+        return {'token': configuration_token(state), 'state': state}
+
+    def test_unchanged(self):
+        """
+        If the configuration is the one identified by ``since``, the report
+        only says it is unchanged.
+        """
+        current = self.entry(self.current_state)
+        report = state_report(current['token'], None, self.current_state)
+        self.assertEqual(
+            ({'token': current['token'], 'unchanged': True}, current),
+            (report, apply_state_report(current, report)))
+
+    def test_changes(self):
+        """
+        If ``since`` identifies the previous configuration, the report only
+        includes the applications which changed or were removed, from which
+        ``apply_state_report`` reconstructs the current configuration.
+        """
+        previous = self.entry(self.previous_state)
+        report = state_report(
+            previous['token'], previous, self.current_state)
+        self.assertEqual(
+            ({'site': {'image': 'clusterhq/site:2'},
+              'queue': {'image': 'clusterhq/queue'}},
+             ['cache'],
+             self.entry(self.current_state)),
+            (report['changes']['applications'], report['removed'],
+             apply_state_report(previous, report)))
+
+    def test_unknown_since(self):
+        """
+        If ``since`` does not identify the previous configuration, the report
+        includes the full configuration.
+        """
+        previous = self.entry(self.previous_state)
+        report = state_report(b'none', previous, self.current_state)
+        self.assertEqual(
+            (self.current_state, self.entry(self.current_state)),
+            (report['state'], apply_state_report(None, report)))
+
+    def test_no_previous(self):
+        """
+        If there is no previous configuration, the report includes the full
+        configuration.
+        """
+        report = state_report(b'none', None, self.current_state)
+        self.assertEqual(self.current_state, report['state'])
+
+    def test_apply_unknown_base(self):
+        """
+        ``apply_state_report`` raises ``ValueError`` if the report is
+        relative to a configuration other than the known one.
+        """
+        previous = self.entry(self.previous_state)
+        report = state_report(
+            previous['token'], previous, self.current_state)
+        self.assertRaises(
+            ValueError, apply_state_report,
+            self.entry(self.current_state), report)
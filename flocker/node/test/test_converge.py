@@ -0,0 +1,254 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node._converge``.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from ...route import Proxy, make_memory_network
+from ...route import _iptables
+from ...route._iptables import HostNetwork, HostPreparation
+from ...volume.testtools import create_volume_service
+from .._converge import ConvergenceService
+from .._deploy import Deployer
+from .._docker import FakeDockerClient
+from .._model import Application, Deployment, DockerImage, Node, Port
+
+
+class ControllableDeployer(object):
+    """
+    A ``Deployer`` whose ``change_node_state`` results are fired by the test.
+
+    :ivar list calls: Two-tuples of the arguments ``change_node_state`` was
+        called with, as a ``dict``, and the ``Deferred`` it returned.
+    :ivar network: The ``INetwork`` provider of the node.
+    """
+    def __init__(self):
+        self.calls = []
+        self.network = make_memory_network()
+
+    def change_node_state(self, desired_state, current_cluster_state,
+                          hostname):
+        result = Deferred()
+        self.calls.append((dict(desired_state=desired_state,
+                                current_cluster_state=current_cluster_state,
+                                hostname=hostname), result))
+        return result
+
+
+def deployment(hostname):
+    """
+    :return: A ``Deployment`` with a single node without applications.
+    """
+    return Deployment(nodes=frozenset([
+        Node(hostname=hostname, applications=frozenset())]))
+
+
+DESIRED = deployment(u"node1.example.com")
+CURRENT = deployment(u"node2.example.com")
+
+
+class ConvergenceServiceTests(SynchronousTestCase):
+    """
+    Tests for ``ConvergenceService``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.deployer = ControllableDeployer()
+        self.service = ConvergenceService(
+            self.clock, self.deployer, interval=10)
+
+    def test_configure_converges(self):
+        """
+        ``ConvergenceService.configure`` calls
+        ``Deployer.change_node_state`` with the given configuration when the
+        service is running.
+        """
+        self.service.startService()
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.assertEqual(
+            [dict(desired_state=DESIRED, current_cluster_state=CURRENT,
+                  hostname=u"node1.example.com")],
+            [arguments for (arguments, _) in self.deployer.calls])
+
+    def test_known_nodes(self):
+        """
+        ``ConvergenceService.known_nodes`` returns the hostnames of the nodes
+        in the most recently given desired configuration.
+        """
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.service.configure(
+            Deployment(nodes=DESIRED.nodes | CURRENT.nodes), CURRENT,
+            u"node1.example.com")
+        self.assertEqual(
+            frozenset([u"node1.example.com", u"node2.example.com"]),
+            self.service.known_nodes())
+
+    def test_known_nodes_unconfigured(self):
+        """
+        ``ConvergenceService.known_nodes`` returns an empty ``frozenset``
+        before the service is configured.
+        """
+        self.assertEqual(frozenset(), self.service.known_nodes())
+
+    def test_configure_before_start(self):
+        """
+        Configuration given before the service starts is converged on when
+        it starts.
+        """
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        calls_before = len(self.deployer.calls)
+        self.service.startService()
+        self.assertEqual((0, 1), (calls_before, len(self.deployer.calls)))
+
+    def test_configure_result(self):
+        """
+        The ``Deferred`` returned by ``ConvergenceService.configure`` fires
+        with ``None`` once the convergence has finished.
+        """
+        self.service.startService()
+        result = self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.assertNoResult(result)
+        self.deployer.calls[0][1].callback(None)
+        self.assertIs(None, self.successResultOf(result))
+
+    def test_configure_failure(self):
+        """
+        The ``Deferred`` returned by ``ConvergenceService.configure`` fails
+        if the convergence fails.
+        """
+        self.service.startService()
+        result = self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.deployer.calls[0][1].errback(ZeroDivisionError())
+        self.failureResultOf(result, ZeroDivisionError)
+
+    def test_one_at_a_time(self):
+        """
+        Configuration given while a convergence is running is converged on,
+        with the most recent configuration only, once it finishes.
+        """
+        self.service.startService()
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.service.configure(CURRENT, CURRENT, u"node1.example.com")
+        newest = self.service.configure(DESIRED, DESIRED, u"node2.example.com")
+        calls_before = len(self.deployer.calls)
+        self.deployer.calls[0][1].callback(None)
+        self.assertEqual(
+            (1, [dict(desired_state=DESIRED, current_cluster_state=DESIRED,
+                      hostname=u"node2.example.com")], False),
+            (calls_before,
+             [arguments for (arguments, _) in self.deployer.calls[1:]],
+             newest.called))
+
+    def test_converge_again(self):
+        """
+        The node is converged again ``interval`` seconds after a convergence
+        finishes, taking the desired configuration as the current one.
+        """
+        self.service.startService()
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.deployer.calls[0][1].callback(None)
+        self.clock.advance(9)
+        calls_before = len(self.deployer.calls)
+        self.clock.advance(1)
+        self.assertEqual(
+            (1, [dict(desired_state=DESIRED, current_cluster_state=DESIRED,
+                      hostname=u"node1.example.com")]),
+            (calls_before,
+             [arguments for (arguments, _) in self.deployer.calls[1:]]))
+
+    def test_retry_after_failure(self):
+        """
+        After a convergence fails the same configuration is converged on
+        again ``interval`` seconds later.
+        """
+        self.service.startService()
+        self.service.configure(
+            DESIRED, CURRENT, u"node1.example.com").addErrback(lambda _: None)
+        self.deployer.calls[0][1].errback(ZeroDivisionError())
+        self.clock.advance(10)
+        self.assertEqual(
+            [dict(desired_state=DESIRED, current_cluster_state=CURRENT,
+                  hostname=u"node1.example.com")],
+            [arguments for (arguments, _) in self.deployer.calls[1:]])
+
+    def test_stop_cancels(self):
+        """
+        Once the service is stopped the node is not converged again.
+        """
+        self.service.startService()
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        self.deployer.calls[0][1].callback(None)
+        self.service.stopService()
+        self.clock.advance(10)
+        self.assertEqual(
+            ([], 1), (self.clock.getDelayedCalls(), len(self.deployer.calls)))
+
+    def test_stop_waits(self):
+        """
+        ``ConvergenceService.stopService`` returns a ``Deferred`` which fires
+        once the running convergence has finished.
+        """
+        self.service.startService()
+        self.service.configure(DESIRED, CURRENT, u"node1.example.com")
+        stopping = self.service.stopService()
+        self.assertNoResult(stopping)
+        self.deployer.calls[0][1].callback(None)
+        self.assertEqual(
+            (None, []),
+            (self.successResultOf(stopping), self.clock.getDelayedCalls()))
+
+
+class DriftTests(SynchronousTestCase):
+    """
+    Tests for ``ConvergenceService`` repairing changes made to the node by
+    something other than flocker.
+    """
+    def setUp(self):
+        # The proxies configured on the system, which iptables would report.
+        self.system = set()
+        self.patch(_iptables, "enumerate_proxies", lambda: list(self.system))
+        self.patch(_iptables, "apply_proxies", self._apply_proxies)
+        conf = FilePath(self.mktemp())
+        conf.child(b"default").makedirs()
+        conf.descendant([b"default", b"forwarding"]).setContent(b"1\n")
+        conf.descendant([b"default", b"route_localnet"]).setContent(b"1\n")
+        self.clock = Clock()
+        self.service = ConvergenceService(
+            self.clock,
+            Deployer(create_volume_service(self),
+                     docker_client=FakeDockerClient(),
+                     network=HostNetwork(preparation=HostPreparation(conf))),
+            interval=10)
+
+    def _apply_proxies(self, logger, create, delete, run_iptables_restore):
+        self.system.difference_update(delete)
+        self.system.update(create)
+
+    def test_proxies_restored(self):
+        """
+        Proxies removed from the system behind the service's back are created
+        again by the next convergence.
+        """
+        site = Application(
+            name=u"site", image=DockerImage.from_string(u"clusterhq/site"),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]))
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u"192.0.2.1", applications=frozenset()),
+            Node(hostname=u"192.0.2.2", applications=frozenset([site]))]))
+        self.service.startService()
+        self.addCleanup(self.service.stopService)
+        self.successResultOf(
+            self.service.configure(desired, desired, u"192.0.2.1"))
+        expected = {Proxy(ip=IPAddress("192.0.2.2"), port=8080)}
+        configured = set(self.system)
+        # For example an iptables flush.
+        self.system.clear()
+        self.clock.advance(10)
+        self.assertEqual((expected, expected), (configured, self.system))
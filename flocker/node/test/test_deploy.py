@@ -6,10 +6,13 @@ Tests for ``flocker.node._deploy``.
 
 from uuid import uuid4
 
+from ipaddr import IPAddress
+
 from zope.interface.verify import verifyObject
 from zope.interface import implementer
 
 from twisted.internet.defer import fail, FirstError, succeed, Deferred
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.filepath import FilePath
 
@@ -19,15 +22,20 @@ from .. import (
 from .._deploy import (
     IStateChange, Sequentially, InParallel, StartApplication, StopApplication,
     CreateVolume, WaitForVolume, HandoffVolume, SetProxies, PushVolume,
-    ResizeVolume, _link_environment, _to_volume_name)
+    ResizeVolume, SetVolumeProperties, SharedSnapshot, LocalLink,
+    _link_environment, _to_volume_name, find_affected_nodes,
+    find_volume_changes)
 from .._model import AttachedVolume
 from .._docker import (
     FakeDockerClient, AlreadyExists, Unit, PortMap, Environment,
-    DockerClient, Volume as DockerVolume)
+    DockerClient, Volume as DockerVolume, Link as DockerLink)
 from ...route import Proxy, make_memory_network
+from ...route._resolve import CachingResolver
+from ...route.testtools import FakeResolver
 from ...route._iptables import HostNetwork
 from ...volume.service import Volume, VolumeName
 from ...volume._model import VolumeSize
+from ...volume.filesystems.zfs import Snapshot
 from ...volume.testtools import create_volume_service
 from ...volume._ipc import RemoteVolumeManager, standard_node
 
@@ -132,6 +140,10 @@ HandoffVolumeIStateChangeTests = make_istatechange_tests(
 PushVolumeIStateChangeTests = make_istatechange_tests(
     PushVolume, dict(volume=1, hostname=b"123"),
     dict(volume=2, hostname=b"123"))
+SetVolumePropertiesIStateChangeTests = make_istatechange_tests(
+    SetVolumeProperties, dict(volume=1), dict(volume=2))
+SharedSnapshotIStateChangeTests = make_istatechange_tests(
+    SharedSnapshot, dict(changes=[1]), dict(changes=[2]))
 
 
 NOT_CALLED = object()
@@ -463,6 +475,78 @@ class StartApplicationTests(SynchronousTestCase):
             fake_docker._units[application_name].environment
         )
 
+    def test_links_resolved(self):
+        """
+        ``StartApplication.run()`` uses the address of this node, found using
+        the deployer's resolver, in the environment variables for links.
+        """
+        volume_service = create_volume_service(self)
+        fake_docker = FakeDockerClient()
+        resolver = CachingResolver(
+            reactor=Clock(),
+            resolver=FakeResolver({b'node1.example.com': b'192.0.2.1'}))
+        deployer = Deployer(volume_service, fake_docker, resolver=resolver)
+
+        application_name = u'site-example.com'
+        application = Application(
+            name=application_name,
+            image=DockerImage(repository=u'clusterhq/postgresql',
+                              tag=u'9.3.5'),
+            links=frozenset([Link(alias="alias", local_port=80,
+                                  remote_port=8080)]))
+
+        StartApplication(application=application,
+                         hostname=u"node1.example.com").run(deployer)
+
+        variables = frozenset({
+            'ALIAS_PORT_80_TCP': 'tcp://192.0.2.1:8080',
+            'ALIAS_PORT_80_TCP_ADDR': '192.0.2.1',
+            'ALIAS_PORT_80_TCP_PORT': '8080',
+            'ALIAS_PORT_80_TCP_PROTO': 'tcp',
+        }.iteritems())
+        self.assertEqual(
+            Environment(variables=variables),
+            fake_docker._units[application_name].environment
+        )
+
+    def test_local_links(self):
+        """
+        ``StartApplication.run()`` links the application's container directly
+        to the containers of targets of its ``local_links`` and passes
+        environment variables to connect to the port inside the target's
+        container.
+        """
+        volume_service = create_volume_service(self)
+        fake_docker = FakeDockerClient()
+        deployer = Deployer(volume_service, fake_docker)
+
+        application_name = u'site-example.com'
+        link = Link(alias="alias", local_port=80, remote_port=8080)
+        application = Application(
+            name=application_name,
+            image=DockerImage(repository=u'clusterhq/postgresql',
+                              tag=u'9.3.5'),
+            links=frozenset([link]))
+
+        StartApplication(
+            application=application, hostname="node1.example.com",
+            local_links=frozenset([LocalLink(
+                link=link, application_name=u"target", internal_port=80)]),
+        ).run(deployer)
+
+        variables = frozenset({
+            'ALIAS_PORT_80_TCP': 'tcp://alias:80',
+            'ALIAS_PORT_80_TCP_ADDR': 'alias',
+            'ALIAS_PORT_80_TCP_PORT': '80',
+            'ALIAS_PORT_80_TCP_PROTO': 'tcp',
+        }.iteritems())
+        unit = fake_docker._units[application_name]
+        self.assertEqual(
+            (Environment(variables=variables),
+             frozenset([DockerLink(unit_name=u"target", alias="alias")])),
+            (unit.environment, unit.links)
+        )
+
     def test_volumes(self):
         """
         ``StartApplication.run()`` passes the appropriate volume arguments to
@@ -575,6 +659,32 @@ class StartApplicationTests(SynchronousTestCase):
             fake_docker._units[application_name].restart_policy,
         )
 
+    def test_host_network(self):
+        """
+        ``StartApplication.run()`` tells ``DockerClient.add`` to use the host
+        network for an ``Application`` which uses it.
+        """
+        fake_docker = FakeDockerClient()
+        deployer = Deployer(create_volume_service(self), fake_docker)
+
+        application_name = u'site-example.com'
+        application = Application(
+            name=application_name,
+            image=DockerImage(repository=u'clusterhq/postgresql',
+                              tag=u'9.3.5'),
+            ports=frozenset([Port(internal_port=5432, external_port=5432)]),
+            host_network=True,
+        )
+
+        StartApplication(application=application,
+                         hostname=u"node1.example.com").run(deployer)
+
+        unit = fake_docker._units[application_name]
+        self.assertEqual(
+            (True, frozenset([PortMap(internal_port=5432,
+                                      external_port=5432)])),
+            (unit.host_network, unit.ports))
+
 
 class LinkEnviromentTests(SynchronousTestCase):
     """
@@ -795,6 +905,39 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
         self.assertEqual(sorted(applications),
                          sorted(self.successResultOf(d).running))
 
+    def test_discover_application_with_local_links(self):
+        """
+        An ``Application`` whose links were wired directly to another container
+        on the node is discovered with the links' original remote ports.
+        """
+        fake_docker = FakeDockerClient()
+        link = Link(local_port=5432, remote_port=50432, alias='POSTGRES')
+        postgres = Application(
+            name=u'postgres-example',
+            image=DockerImage.from_string(u'clusterhq/postgres:latest'),
+            ports=frozenset([Port(internal_port=5432, external_port=50432)]))
+        wordpress = Application(
+            name=u'wordpress-example',
+            image=DockerImage.from_string(u'clusterhq/wordpress:latest'),
+            links=frozenset([link]))
+        api = Deployer(
+            self.volume_service,
+            docker_client=fake_docker,
+            network=self.network
+        )
+        StartApplication(
+            hostname='node1.example.com', application=postgres).run(api)
+        StartApplication(
+            hostname='node1.example.com', application=wordpress,
+            local_links=frozenset([LocalLink(
+                link=link, application_name=u'postgres-example',
+                internal_port=5432)])
+        ).run(api)
+        d = api.discover_node_configuration()
+
+        self.assertEqual(sorted([postgres, wordpress]),
+                         sorted(self.successResultOf(d).running))
+
     def test_discover_application_with_ports(self):
         """
         An ``Application`` with ``Port`` objects is discovered from a ``Unit``
@@ -950,6 +1093,50 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
         self.assertEqual(sorted(applications),
                          sorted(self.successResultOf(d).running))
 
+    def test_discover_locally_owned_volume_with_properties(self):
+        """
+        Locally owned volumes are added to ``Application`` as an
+        ``AttachedVolume`` whose ``properties`` correspond to the tunable
+        properties of the existing volume.
+        """
+        properties = frozenset([(u"compression", u"lz4")])
+        unit = Unit(name=u'site-example.com',
+                    container_name=u'site-example.com',
+                    container_image=u"clusterhq/wordpress:latest",
+                    volumes=frozenset(
+                        [DockerVolume(
+                            node_path=FilePath(b'/tmp/volume1'),
+                            container_path=FilePath(b'/var/lib/data')
+                        )]
+                    ),
+                    activation_state=u'active')
+
+        self.successResultOf(self.volume_service.create(
+            self.volume_service.get(
+                _to_volume_name(u"site-example.com"),
+                size=VolumeSize(maximum_size=None, properties=properties)
+            )
+        ))
+
+        api = Deployer(
+            self.volume_service,
+            docker_client=FakeDockerClient(units={unit.name: unit}),
+            network=self.network
+        )
+        d = api.discover_node_configuration()
+
+        self.assertEqual(
+            [Application(
+                name=unit.name,
+                image=DockerImage.from_string(unit.container_image),
+                volume=AttachedVolume(
+                    name=unit.name,
+                    mountpoint=FilePath(b'/var/lib/data'),
+                    properties=properties,
+                )
+            )],
+            self.successResultOf(d).running)
+
     def test_discover_remotely_owned_volumes_ignored(self):
         """
         Remotely owned volumes are not added to the discovered ``Application``
@@ -1035,6 +1222,65 @@ class DeployerDiscoverNodeConfigurationTests(SynchronousTestCase):
             state
         )
 
+    def test_discover_used_ports_lazily(self):
+        """
+        The used ports are only discovered from the deployer's ``INetwork``
+        provider when the ``used_ports`` attribute of the ``NodeState`` is
+        used, and only once.
+        """
+        network = make_memory_network(used_ports=frozenset([1, 3]))
+        calls = []
+        original = network.enumerate_used_ports
+
+        def enumerate_used_ports():
+            calls.append(None)
+            return original()
+        network.enumerate_used_ports = enumerate_used_ports
+
+        api = Deployer(
+            create_volume_service(self),
+            docker_client=FakeDockerClient(),
+            network=network
+        )
+        state = self.successResultOf(api.discover_node_configuration())
+        before = len(calls)
+        ports = sorted(state.used_ports)
+        self.assertIn(3, state.used_ports)
+        self.assertEqual((0, [1, 3], 1), (before, ports, len(calls)))
+
+    def test_discover_host_network(self):
+        """
+        An ``Application`` using the host network is discovered from a
+        ``Unit`` using it, and its ports are reported as used even if nothing
+        is listening on them yet.
+        """
+        unit = Unit(name=u'site-example.com',
+                    container_name=u'site-example.com',
+                    container_image=u'clusterhq/wordpress:latest',
+                    ports=frozenset([PortMap(internal_port=80,
+                                             external_port=80)]),
+                    activation_state=u'active',
+                    host_network=True)
+        api = Deployer(
+            create_volume_service(self),
+            docker_client=FakeDockerClient(units={unit.name: unit}),
+            network=make_memory_network(used_ports=frozenset([22])),
+        )
+        state = self.successResultOf(api.discover_node_configuration())
+        self.assertEqual(
+            NodeState(
+                running=[Application(
+                    name=u'site-example.com',
+                    image=DockerImage.from_string(
+                        u'clusterhq/wordpress:latest'),
+                    ports=frozenset([Port(internal_port=80,
+                                          external_port=80)]),
+                    links=frozenset(),
+                    host_network=True)],
+                not_running=[],
+                used_ports=frozenset([22, 80])),
+            state)
+
     def test_discover_application_restart_policy(self):
         """
         An ``Application`` with the appropriate ``IRestartPolicy`` is
@@ -1129,6 +1375,61 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         expected = Sequentially(changes=[SetProxies(ports=frozenset([proxy]))])
         self.assertEqual(expected, self.successResultOf(d))
 
+    def test_proxy_per_node(self):
+        """
+        When applications on more than one other node use the same external
+        port, ``Deployer.calculate_necessary_state_changes`` returns a
+        ``SetProxies`` with a ``Proxy`` to each of those nodes.
+        """
+        api = Deployer(create_volume_service(self),
+                       docker_client=FakeDockerClient(),
+                       network=make_memory_network())
+        port = Port(internal_port=3306, external_port=1001)
+        image = DockerImage.from_string(u'clusterhq/mysql')
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([Application(
+                     name=u'mysql1', image=image,
+                     ports=frozenset([port]))])),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset([Application(
+                     name=u'mysql2', image=image,
+                     ports=frozenset([port]))])),
+        ]))
+        d = api.calculate_necessary_state_changes(
+            desired_state=desired, current_cluster_state=EMPTY,
+            hostname=u'node3.example.com')
+        expected = Sequentially(changes=[SetProxies(ports=frozenset([
+            Proxy(ip=u'node1.example.com', port=1001),
+            Proxy(ip=u'node2.example.com', port=1001)]))])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_proxy_already_resolved(self):
+        """
+        When the network already has proxies to the resolved addresses of the
+        desired nodes, ``Deployer.calculate_necessary_state_changes`` does
+        not return a ``SetProxies``.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(ip=IPAddress(u'192.0.2.1'), port=1001)
+        resolver = CachingResolver(
+            reactor=Clock(),
+            resolver=FakeResolver({b'node1.example.com': b'192.0.2.1'}))
+        api = Deployer(create_volume_service(self),
+                       docker_client=FakeDockerClient(),
+                       network=network, resolver=resolver)
+        desired = Deployment(nodes=frozenset([
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset([Application(
+                     name=u'mysql',
+                     image=DockerImage.from_string(u'clusterhq/mysql'),
+                     ports=frozenset([Port(internal_port=3306,
+                                           external_port=1001)]))]))]))
+        d = api.calculate_necessary_state_changes(
+            desired_state=desired, current_cluster_state=EMPTY,
+            hostname=u'node2.example.com')
+        self.assertEqual(Sequentially(changes=[]), self.successResultOf(d))
+
     def test_proxy_empty(self):
         """
         ``Deployer.calculate_necessary_state_changes`` returns a
@@ -1467,6 +1768,74 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         ])
         self.assertEqual(expected, changes)
 
+    def test_volume_handoffs_share_snapshot(self):
+        """
+        ``Deployer.calculate_necessary_state_changes`` specifies that the
+        volumes of several applications moving from this node to another node
+        are pushed and handed off sharing a single snapshot.
+        """
+        other_name = b"other-clusterhq"
+        other_application = Application(
+            name=other_name,
+            image=DockerImage.from_string(b"psql-clusterhq"),
+            volume=AttachedVolume(
+                name=other_name,
+                mountpoint=APPLICATION_WITH_VOLUME_MOUNTPOINT,
+            ),
+            links=frozenset(),
+        )
+        units = [
+            Unit(name=name, container_name=name,
+                 container_image=APPLICATION_WITH_VOLUME_IMAGE,
+                 activation_state=u'active')
+            for name in [APPLICATION_WITH_VOLUME_NAME, other_name]]
+        docker = FakeDockerClient(
+            units=dict((unit.name, unit) for unit in units))
+
+        node = Node(
+            hostname=u"node1.example.com",
+            applications=frozenset({DISCOVERED_APPLICATION_WITH_VOLUME,
+                                    other_application}),
+        )
+        another_node = Node(
+            hostname=u"node2.example.com",
+            applications=frozenset(),
+        )
+        current = Deployment(nodes=frozenset([node, another_node]))
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=node.hostname,
+                 applications=frozenset()),
+            Node(hostname=another_node.hostname,
+                 applications=frozenset({APPLICATION_WITH_VOLUME,
+                                         other_application})),
+        }))
+
+        api = Deployer(
+            create_volume_service(self), docker_client=docker,
+            network=make_memory_network()
+        )
+        calculating = api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=current,
+            hostname=node.hostname,
+        )
+        changes = self.successResultOf(calculating)
+
+        volumes = [
+            AttachedVolume(name=name,
+                           mountpoint=APPLICATION_WITH_VOLUME_MOUNTPOINT)
+            for name in [APPLICATION_WITH_VOLUME_NAME, other_name]]
+        push, stop, handoff = changes.changes
+        self.assertEqual(
+            (SharedSnapshot, set(PushVolume(volume=volume,
+                                            hostname=another_node.hostname)
+                                 for volume in volumes),
+             SharedSnapshot, set(HandoffVolume(volume=volume,
+                                               hostname=another_node.hostname)
+                                 for volume in volumes)),
+            (type(push), set(push.changes),
+             type(handoff), set(handoff.changes)))
+
     def test_no_volume_changes(self):
         """
         ``Deployer.calculate_necessary_state_changes`` specifies no work for
@@ -1613,6 +1982,82 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
             )])
         self.assertEqual(expected, changes)
 
+    def test_volume_properties_changed(self):
+        """
+        ``Deployer.calculate_necessary_state_changes`` specifies that a volume
+        will have its properties set if an application which was previously
+        running on this node continues to run on this node but specifies
+        volume properties that differ from those of the existing volume. The
+        Application will also be restarted.
+        """
+        tuned_volume = AttachedVolume(
+            name=APPLICATION_WITH_VOLUME_NAME,
+            mountpoint=APPLICATION_WITH_VOLUME_MOUNTPOINT,
+            properties=frozenset([(u"recordsize", u"8192")]),
+        )
+        APPLICATION_WITH_VOLUME_PROPERTIES = Application(
+            name=APPLICATION_WITH_VOLUME_NAME,
+            image=DockerImage.from_string(APPLICATION_WITH_VOLUME_IMAGE),
+            volume=tuned_volume,
+            links=frozenset(),
+        )
+        unit = Unit(
+            name=APPLICATION_WITH_VOLUME_NAME,
+            container_name=APPLICATION_WITH_VOLUME_NAME,
+            container_image=APPLICATION_WITH_VOLUME_IMAGE,
+            volumes=frozenset([DockerVolume(
+                container_path=APPLICATION_WITH_VOLUME_MOUNTPOINT,
+                node_path=b'/tmp')]),
+            activation_state=u'active'
+        )
+        docker = FakeDockerClient(units={unit.name: unit})
+
+        current_node = Node(
+            hostname=u"node1.example.com",
+            applications=frozenset({APPLICATION_WITH_VOLUME}),
+        )
+        desired_node = Node(
+            hostname=u"node1.example.com",
+            applications=frozenset({APPLICATION_WITH_VOLUME_PROPERTIES}),
+        )
+
+        current = Deployment(nodes=frozenset([current_node]))
+        desired = Deployment(nodes=frozenset([desired_node]))
+
+        volume_service = create_volume_service(self)
+        self.successResultOf(volume_service.create(
+            volume_service.get(
+                _to_volume_name(APPLICATION_WITH_VOLUME_NAME))
+            )
+        )
+
+        api = Deployer(
+            volume_service, docker_client=docker,
+            network=make_memory_network()
+        )
+
+        calculating = api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=current,
+            hostname=current_node.hostname,
+        )
+
+        changes = self.successResultOf(calculating)
+        expected = Sequentially(changes=[
+            InParallel(
+                changes=[SetVolumeProperties(volume=tuned_volume)]
+            ),
+            InParallel(
+                changes=[Sequentially(
+                    changes=[
+                        StopApplication(application=APPLICATION_WITH_VOLUME),
+                        StartApplication(
+                            application=APPLICATION_WITH_VOLUME_PROPERTIES,
+                            hostname=u'node1.example.com')
+                    ])]
+            )])
+        self.assertEqual(expected, changes)
+
     def test_volume_resized_before_move(self):
         """
         ``Deployer.calculate_necessary_state_changes`` specifies that a volume
@@ -2199,6 +2644,234 @@ class DeployerCalculateNecessaryStateChangesTests(SynchronousTestCase):
         self.assertEqual(expected, self.successResultOf(d))
 
 
+class LocalLinkStateChangesTests(SynchronousTestCase):
+    """
+    Tests for ``Deployer.calculate_necessary_state_changes`` when applications
+    are linked to applications on the same node.
+    """
+    def setUp(self):
+        self.link = Link(
+            local_port=5432, remote_port=50432, alias='POSTGRES')
+        self.postgres = Application(
+            name=u'postgres-example',
+            image=DockerImage.from_string(u'clusterhq/postgres:latest'),
+            ports=frozenset([Port(internal_port=5432, external_port=50432)]))
+        self.wordpress = Application(
+            name=u'wordpress-example',
+            image=DockerImage.from_string(u'clusterhq/wordpress:latest'),
+            links=frozenset([self.link]))
+        self.local_links = frozenset([LocalLink(
+            link=self.link, application_name=self.postgres.name,
+            internal_port=5432)])
+        self.api = Deployer(
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=make_memory_network()
+        )
+
+    def test_started_after_target(self):
+        """
+        An application linked to an application on the same node is started
+        with a ``LocalLink`` for it, after the target has been started.
+        """
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({self.wordpress, self.postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            InParallel(changes=[
+                StartApplication(application=self.postgres,
+                                 hostname=u'node1.example.com')]),
+            InParallel(changes=[
+                StartApplication(application=self.wordpress,
+                                 hostname=u'node1.example.com',
+                                 local_links=self.local_links)]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_mutual_links(self):
+        """
+        When two applications on the same node are linked to each other, the
+        link which would close the cycle is left out of the ``LocalLink``\ s
+        and goes through the node's address, so that the application it
+        belongs to can be started first.
+        """
+        back_link = Link(local_port=80, remote_port=8080, alias='WORDPRESS')
+        postgres = Application(
+            name=self.postgres.name, image=self.postgres.image,
+            ports=self.postgres.ports, links=frozenset([back_link]))
+        wordpress = Application(
+            name=self.wordpress.name, image=self.wordpress.image,
+            ports=frozenset([Port(internal_port=80, external_port=8080)]),
+            links=self.wordpress.links)
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({wordpress, postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            InParallel(changes=[
+                StartApplication(application=wordpress,
+                                 hostname=u'node1.example.com')]),
+            InParallel(changes=[
+                StartApplication(
+                    application=postgres, hostname=u'node1.example.com',
+                    local_links=frozenset([LocalLink(
+                        link=back_link, application_name=wordpress.name,
+                        internal_port=80)]))]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_host_network_not_linked(self):
+        """
+        Docker cannot link to an application using the host network, so an
+        application linked to one on the same node is started without a
+        ``LocalLink`` and reaches it through the node's address.
+        """
+        postgres = Application(
+            name=self.postgres.name, image=self.postgres.image,
+            ports=frozenset([Port(internal_port=50432,
+                                  external_port=50432)]),
+            host_network=True)
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({self.wordpress, postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            InParallel(changes=[
+                StartApplication(application=postgres,
+                                 hostname=u'node1.example.com'),
+                StartApplication(application=self.wordpress,
+                                 hostname=u'node1.example.com')]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_target_moved_away(self):
+        """
+        When the target of a link moves to another node the linking
+        application is restarted without a ``LocalLink`` so that it uses the
+        proxy to the target's new node.
+        """
+        StartApplication(hostname=u'node1.example.com',
+                         application=self.postgres).run(self.api)
+        StartApplication(hostname=u'node1.example.com',
+                         application=self.wordpress,
+                         local_links=self.local_links).run(self.api)
+
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({self.wordpress})),
+            Node(hostname=u'node2.example.com',
+                 applications=frozenset({self.postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            SetProxies(ports=frozenset([
+                Proxy(ip=u'node2.example.com', port=50432)])),
+            InParallel(changes=[
+                StopApplication(application=self.postgres)]),
+            InParallel(changes=[Sequentially(changes=[
+                StopApplication(application=self.wordpress),
+                StartApplication(application=self.wordpress,
+                                 hostname=u'node1.example.com'),
+            ])]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_target_moved_here(self):
+        """
+        When the target of a link moves to the linking application's node, the
+        linking application is restarted with a ``LocalLink`` after the target
+        has been started.
+        """
+        StartApplication(hostname=u'node1.example.com',
+                         application=self.wordpress).run(self.api)
+
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({self.wordpress, self.postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            InParallel(changes=[
+                StartApplication(application=self.postgres,
+                                 hostname=u'node1.example.com')]),
+            InParallel(changes=[Sequentially(changes=[
+                StopApplication(application=self.wordpress),
+                StartApplication(application=self.wordpress,
+                                 hostname=u'node1.example.com',
+                                 local_links=self.local_links),
+            ])]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+    def test_target_replaced(self):
+        """
+        When the target of a local link is restarted, the linking application
+        is restarted after it so that it is linked to the new container.
+        """
+        old_postgres = Application(
+            name=self.postgres.name,
+            image=DockerImage.from_string(u'clusterhq/postgres:9.3'),
+            ports=self.postgres.ports)
+        StartApplication(hostname=u'node1.example.com',
+                         application=old_postgres).run(self.api)
+        StartApplication(hostname=u'node1.example.com',
+                         application=self.wordpress,
+                         local_links=self.local_links).run(self.api)
+
+        desired = Deployment(nodes=frozenset({
+            Node(hostname=u'node1.example.com',
+                 applications=frozenset({self.wordpress, self.postgres})),
+        }))
+        d = self.api.calculate_necessary_state_changes(
+            desired_state=desired,
+            current_cluster_state=EMPTY,
+            hostname=u'node1.example.com'
+        )
+
+        expected = Sequentially(changes=[
+            InParallel(changes=[Sequentially(changes=[
+                StopApplication(application=old_postgres),
+                StartApplication(application=self.postgres,
+                                 hostname=u'node1.example.com'),
+            ])]),
+            InParallel(changes=[Sequentially(changes=[
+                StopApplication(application=self.wordpress),
+                StartApplication(application=self.wordpress,
+                                 hostname=u'node1.example.com',
+                                 local_links=self.local_links),
+            ])]),
+        ])
+        self.assertEqual(expected, self.successResultOf(d))
+
+
 class SetProxiesTests(SynchronousTestCase):
     """
     Tests for ``SetProxies``.
@@ -2264,68 +2937,93 @@ class SetProxiesTests(SynchronousTestCase):
             set(fake_network.enumerate_proxies())
         )
 
-    def test_delete_proxy_errors_as_errbacks(self):
+    def test_unchanged_proxies_untouched(self):
         """
-        Exceptions raised in `delete_proxy` operations are reported as
-        failures in the returned deferred.
+        Proxies which exist and are still required are neither deleted nor
+        re-created; only the difference is applied.
         """
         fake_network = make_memory_network()
-        fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
-        fake_network.delete_proxy = lambda proxy: 1/0
+        existing = fake_network.create_proxy_to(ip=u'192.0.2.100', port=3306)
+        removed = fake_network.create_proxy_to(ip=u'192.0.2.101', port=8080)
+        added = Proxy(ip=u'192.0.2.102', port=5432)
+
+        created = []
+        deleted = []
+        original_create = fake_network.create_proxy_to
+        original_delete = fake_network.delete_proxy
+
+        def create_proxy_to(ip, port):
+            created.append(Proxy(ip=ip, port=port))
+            return original_create(ip, port)
+
+        def delete_proxy(proxy):
+            deleted.append(proxy)
+            return original_delete(proxy)
+
+        fake_network.create_proxy_to = create_proxy_to
+        fake_network.delete_proxy = delete_proxy
 
         api = Deployer(
             create_volume_service(self), docker_client=FakeDockerClient(),
             network=fake_network)
 
-        d = SetProxies(ports=[]).run(api)
-        exception = self.failureResultOf(d, FirstError)
-        self.assertIsInstance(
-            exception.value.subFailure.value,
-            ZeroDivisionError
-        )
-        self.flushLoggedErrors(ZeroDivisionError)
+        d = SetProxies(ports=[existing, added]).run(api)
+        self.successResultOf(d)
+        self.assertEqual(([added], [removed]), (created, deleted))
 
-    def test_create_proxy_errors_as_errbacks(self):
+    def test_hostnames_resolved(self):
         """
-        Exceptions raised in `create_proxy_to` operations are reported as
-        failures in the returned deferred.
+        The hostnames of the nodes proxied to are resolved to addresses using
+        the deployer's resolver.
         """
         fake_network = make_memory_network()
-        fake_network.create_proxy_to = lambda ip, port: 1/0
-
+        resolver = CachingResolver(
+            reactor=Clock(),
+            resolver=FakeResolver({b'node2.example.com': b'192.0.2.2'}))
         api = Deployer(
             create_volume_service(self), docker_client=FakeDockerClient(),
-            network=fake_network)
+            network=fake_network, resolver=resolver)
 
-        d = SetProxies(ports=[Proxy(ip=u'192.0.2.100', port=3306)]).run(api)
-        exception = self.failureResultOf(d, FirstError)
-        self.assertIsInstance(
-            exception.value.subFailure.value,
-            ZeroDivisionError
+        d = SetProxies(
+            ports=[Proxy(ip=u'node2.example.com', port=3306)]).run(api)
+        self.successResultOf(d)
+        self.assertEqual(
+            [Proxy(ip=IPAddress(u'192.0.2.2'), port=3306)],
+            fake_network.enumerate_proxies()
         )
-        self.flushLoggedErrors(ZeroDivisionError)
 
-    def test_create_proxy_errors_all_logged(self):
+    def test_unresolvable_hostnames(self):
         """
-        Exceptions raised in `create_proxy_to` operations are all logged.
+        A hostname which cannot be resolved is used as it is.
         """
         fake_network = make_memory_network()
-        fake_network.create_proxy_to = lambda ip, port: 1/0
-
+        resolver = CachingResolver(reactor=Clock(), resolver=FakeResolver({}))
         api = Deployer(
             create_volume_service(self), docker_client=FakeDockerClient(),
-            network=fake_network)
+            network=fake_network, resolver=resolver)
 
         d = SetProxies(
-            ports=[Proxy(ip=u'192.0.2.100', port=3306),
-                   Proxy(ip=u'192.0.2.101', port=3306),
-                   Proxy(ip=u'192.0.2.102', port=3306)]
-        ).run(api)
+            ports=[Proxy(ip=u'node2.example.com', port=3306)]).run(api)
+        self.successResultOf(d)
+        self.assertEqual(
+            [Proxy(ip=u'node2.example.com', port=3306)],
+            fake_network.enumerate_proxies()
+        )
 
-        self.failureResultOf(d, FirstError)
+    def test_errors_as_errbacks(self):
+        """
+        Exceptions raised by ``INetwork.set_proxies`` are reported as failures
+        in the returned deferred.
+        """
+        fake_network = make_memory_network()
+        fake_network.set_proxies = lambda proxies: 1/0
 
-        failures = self.flushLoggedErrors(ZeroDivisionError)
-        self.assertEqual(3, len(failures))
+        api = Deployer(
+            create_volume_service(self), docker_client=FakeDockerClient(),
+            network=fake_network)
+
+        d = SetProxies(ports=[Proxy(ip=u'192.0.2.100', port=3306)]).run(api)
+        self.failureResultOf(d, ZeroDivisionError)
 
 
 class DeployerChangeNodeStateTests(SynchronousTestCase):
@@ -2569,7 +3267,7 @@ class HandoffVolumeTests(SynchronousTestCase):
 
         result = []
 
-        def _handoff(volume, destination):
+        def _handoff(volume, destination, snapshot):
             result.extend([volume, destination])
         self.patch(volume_service, "handoff", _handoff)
         deployer = Deployer(volume_service,
@@ -2593,7 +3291,7 @@ class HandoffVolumeTests(SynchronousTestCase):
         result = Deferred()
         volume_service = create_volume_service(self)
         self.patch(volume_service, "handoff",
-                   lambda volume, destination: result)
+                   lambda volume, destination, snapshot: result)
         deployer = Deployer(volume_service,
                             docker_client=FakeDockerClient(),
                             network=make_memory_network())
@@ -2605,23 +3303,91 @@ class HandoffVolumeTests(SynchronousTestCase):
         self.assertIs(handoff_result, result)
 
 
+class SharedSnapshotTests(SynchronousTestCase):
+    """
+    Tests for ``SharedSnapshot``.
+    """
+    def test_pushes_share_snapshot(self):
+        """
+        ``SharedSnapshot.run()`` takes one snapshot of the volumes of all of
+        its changes and then runs each change using that snapshot.
+        """
+        volume_service = create_volume_service(self)
+        snapshot = Snapshot(name=b"batch")
+        snapshotted = []
+        pushed = []
+
+        def _snapshot(volumes):
+            snapshotted.append(volumes)
+            return succeed(snapshot)
+
+        def _precopy(volume, destination, snapshot):
+            pushed.append((volume, snapshot))
+            return succeed(None)
+
+        def _handoff(volume, destination, snapshot):
+            pushed.append((volume, snapshot))
+            return succeed(None)
+        self.patch(volume_service, "snapshot", _snapshot)
+        self.patch(volume_service, "precopy", _precopy)
+        self.patch(volume_service, "handoff", _handoff)
+        deployer = Deployer(volume_service,
+                            docker_client=FakeDockerClient(),
+                            network=make_memory_network())
+        change = SharedSnapshot(changes=[
+            PushVolume(volume=AttachedVolume(name=u"first",
+                                             mountpoint=FilePath(u"/var")),
+                       hostname=b"dest.example.com"),
+            HandoffVolume(volume=AttachedVolume(name=u"second",
+                                                mountpoint=FilePath(u"/var")),
+                          hostname=b"dest.example.com"),
+        ])
+        self.successResultOf(change.run(deployer))
+        volumes = [volume_service.get(_to_volume_name(name))
+                   for name in [u"first", u"second"]]
+        self.assertEqual(
+            ([volumes], [(volume, snapshot) for volume in volumes]),
+            (snapshotted, pushed))
+
+    def test_snapshot_failure(self):
+        """
+        If the snapshot cannot be taken ``SharedSnapshot.run()`` returns a
+        ``Deferred`` that fails and no changes are run.
+        """
+        volume_service = create_volume_service(self)
+        pushed = []
+        self.patch(volume_service, "snapshot",
+                   lambda volumes: fail(ZeroDivisionError()))
+        self.patch(volume_service, "precopy",
+                   lambda *args: pushed.append(args))
+        deployer = Deployer(volume_service,
+                            docker_client=FakeDockerClient(),
+                            network=make_memory_network())
+        change = SharedSnapshot(changes=[
+            PushVolume(volume=AttachedVolume(name=u"first",
+                                             mountpoint=FilePath(u"/var")),
+                       hostname=b"dest.example.com")])
+        self.failureResultOf(change.run(deployer), ZeroDivisionError)
+        self.assertEqual([], pushed)
+
+
 class PushVolumeTests(SynchronousTestCase):
     """
     Tests for ``PushVolume``.
     """
     def test_push(self):
         """
-        ``PushVolume.run()`` pushes the named volume to the given destination
-        node.
+        ``PushVolume.run()`` pre-copies the named volume to the given
+        destination node.
         """
         volume_service = create_volume_service(self)
         hostname = b"dest.example.com"
 
         result = []
 
-        def _push(volume, destination):
+        def _precopy(volume, destination, snapshot):
             result.extend([volume, destination])
-        self.patch(volume_service, "push", _push)
+        self.patch(volume_service, "precopy", _precopy)
         deployer = Deployer(volume_service,
                             docker_client=FakeDockerClient(),
                             network=make_memory_network())
@@ -2638,12 +3404,12 @@ class PushVolumeTests(SynchronousTestCase):
     def test_return(self):
         """
         ``PushVolume.run()`` returns the result of
-        ``VolumeService.push``.
+        ``VolumeService.precopy``.
         """
         result = Deferred()
         volume_service = create_volume_service(self)
-        self.patch(volume_service, "push",
-                   lambda volume, destination: result)
+        self.patch(volume_service, "precopy",
+                   lambda volume, destination, snapshot: result)
         deployer = Deployer(volume_service,
                             docker_client=FakeDockerClient(),
                             network=make_memory_network())
@@ -2653,3 +3419,239 @@ class PushVolumeTests(SynchronousTestCase):
             hostname=b"dest.example.com")
         push_result = push.run(deployer)
         self.assertIs(push_result, result)
+
+
+class SetVolumePropertiesTests(SynchronousTestCase):
+    """
+    Tests for ``SetVolumeProperties``.
+    """
+    def test_sets_properties(self):
+        """
+        ``SetVolumeProperties.run()`` sets the properties of the named volume
+        to those of the ``AttachedVolume``.
+        """
+        properties = frozenset([(u"atime", u"off")])
+        volume_service = create_volume_service(self)
+        self.successResultOf(volume_service.create(
+            volume_service.get(_to_volume_name(u"myvol"))))
+        deployer = Deployer(volume_service,
+                            docker_client=FakeDockerClient(),
+                            network=make_memory_network())
+        change = SetVolumeProperties(
+            volume=AttachedVolume(name=u"myvol",
+                                  mountpoint=FilePath(u"/var"),
+                                  properties=properties))
+        self.successResultOf(change.run(deployer))
+        expected_volume = volume_service.get(
+            _to_volume_name(u"myvol"),
+            size=VolumeSize(maximum_size=None, properties=properties))
+        self.assertIn(
+            expected_volume,
+            list(self.successResultOf(volume_service.enumerate())))
+
+    def test_return(self):
+        """
+        ``SetVolumeProperties.run()`` returns the result of
+        ``VolumeService.set_properties``.
+        """
+        result = Deferred()
+        volume_service = create_volume_service(self)
+        self.patch(volume_service, "set_properties", lambda volume: result)
+        deployer = Deployer(volume_service,
+                            docker_client=FakeDockerClient(),
+                            network=make_memory_network())
+        change = SetVolumeProperties(
+            volume=AttachedVolume(name=u"myvol",
+                                  mountpoint=FilePath(u"/var")))
+        self.assertIs(change.run(deployer), result)
+
+
+class FindAffectedNodesTests(SynchronousTestCase):
+    """
+    Tests for ``find_affected_nodes``.
+    """
+    site = Application(
+        name=u"site", image=DockerImage.from_string(u"clusterhq/site"),
+        ports=frozenset([Port(internal_port=80, external_port=8080)]))
+    database = Application(
+        name=u"database", image=DockerImage.from_string(u"clusterhq/db"),
+        volume=AttachedVolume(name=u"database",
+                              mountpoint=FilePath(b"/var/lib/db")))
+    cache = Application(
+        name=u"cache", image=DockerImage.from_string(u"clusterhq/cache"))
+
+    def deployment(self, **applications):
+        """
+        :param applications: Map the names of nodes ``node1``, ``node2`` and
+            ``node3`` to the applications on them.
+
+        :return: A ``Deployment`` with those nodes.
+        """
+        return Deployment(nodes=frozenset(
+            Node(hostname=hostname + u".example.com",
+                 applications=frozenset(applications.get(hostname, ())))
+            for hostname in (u"node1", u"node2", u"node3")))
+
+    def proxied_ports(self, deployment):
+        """
+        :return: The ``proxied_ports`` argument for a cluster whose proxies
+            match ``deployment``.
+        """
+        return {
+            node.hostname: [
+                port.external_port
+                for other in deployment.nodes if other != node
+                for application in other.applications
+                for port in application.ports]
+            for node in deployment.nodes}
+
+    def affected(self, current, desired, not_running=None,
+                 proxied_ports=None):
+        if proxied_ports is None:
+            proxied_ports = self.proxied_ports(current)
+        return find_affected_nodes(
+            desired, current, not_running or {}, proxied_ports)
+
+    def test_unchanged(self):
+        """
+        No nodes are affected if the desired state is the current state.
+        """
+        current = self.deployment(node1=[self.site], node2=[self.database])
+        self.assertEqual(frozenset(), self.affected(current, current))
+
+    def test_application_added(self):
+        """
+        A node where an application without ports is to be started is the
+        only affected node.
+        """
+        current = self.deployment(node1=[self.site])
+        desired = self.deployment(node1=[self.site], node2=[self.cache])
+        self.assertEqual(
+            frozenset([u"node2.example.com"]),
+            self.affected(current, desired))
+
+    def test_application_changed(self):
+        """
+        A node where an application's configuration is to change is affected.
+        """
+        current = self.deployment(node1=[self.cache])
+        desired = self.deployment(node1=[Application(
+            name=u"cache",
+            image=DockerImage.from_string(u"clusterhq/cache:2"))])
+        self.assertEqual(
+            frozenset([u"node1.example.com"]),
+            self.affected(current, desired))
+
+    def test_not_running(self):
+        """
+        A node where a desired application is not running is affected.
+        """
+        current = self.deployment(node1=[self.cache])
+        self.assertEqual(
+            frozenset([u"node1.example.com"]),
+            self.affected(current, current,
+                          not_running={u"node1.example.com": [u"cache"]}))
+
+    def test_ports_changed(self):
+        """
+        If an application with ports is added, every other node is affected
+        since it proxies to those ports, as well as the node itself.
+        """
+        current = self.deployment(node1=[self.cache])
+        desired = self.deployment(node1=[self.cache, self.site])
+        self.assertEqual(
+            frozenset([u"node1.example.com", u"node2.example.com",
+                       u"node3.example.com"]),
+            self.affected(current, desired))
+
+    def test_shared_port_unchanged(self):
+        """
+        No nodes are affected if applications on different nodes use the
+        same external port and nothing changes.
+        """
+        other_site = Application(
+            name=u"other-site", image=self.site.image, ports=self.site.ports)
+        current = self.deployment(node1=[self.site], node2=[other_site])
+        self.assertEqual(frozenset(), self.affected(current, current))
+
+    def test_shared_port_removed(self):
+        """
+        If one of the applications on different nodes using the same
+        external port is removed, every node is affected since they proxy
+        to it.
+        """
+        other_site = Application(
+            name=u"other-site", image=self.site.image, ports=self.site.ports)
+        current = self.deployment(node1=[self.site], node2=[other_site])
+        desired = self.deployment(node1=[self.site])
+        self.assertEqual(
+            frozenset([u"node1.example.com", u"node2.example.com",
+                       u"node3.example.com"]),
+            self.affected(current, desired))
+
+    def test_proxies_missing(self):
+        """
+        A node which does not proxy the ports it should, such as a node new
+        to the cluster, is affected.
+        """
+        current = self.deployment(node1=[self.site])
+        proxied_ports = self.proxied_ports(current)
+        proxied_ports[u"node3.example.com"] = []
+        self.assertEqual(
+            frozenset([u"node3.example.com"]),
+            self.affected(current, current, proxied_ports=proxied_ports))
+
+    def test_proxies_unknown(self):
+        """
+        A node whose proxies are unknown is affected.
+        """
+        current = self.deployment(node1=[self.site])
+        proxied_ports = self.proxied_ports(current)
+        del proxied_ports[u"node2.example.com"]
+        self.assertEqual(
+            frozenset([u"node2.example.com"]),
+            self.affected(current, current, proxied_ports=proxied_ports))
+
+    def test_no_current_state(self):
+        """
+        A node with no current state is affected.
+        """
+        current = Deployment(nodes=frozenset())
+        desired = self.deployment()
+        self.assertEqual(
+            frozenset(node.hostname for node in desired.nodes),
+            self.affected(current, desired, proxied_ports={}))
+
+    def test_volume_changes(self):
+        """
+        The nodes affected by a volume-having application moving are exactly
+        those for which ``find_volume_changes`` finds changes.
+        """
+        current = self.deployment(node1=[self.database], node3=[self.cache])
+        desired = self.deployment(node2=[self.database], node3=[self.cache])
+        with_changes = set()
+        for node in desired.nodes:
+            changes = find_volume_changes(node.hostname, current, desired)
+            if changes.going or changes.coming or changes.creating:
+                with_changes.add(node.hostname)
+        self.assertEqual(
+            (frozenset([u"node1.example.com", u"node2.example.com"]),
+             with_changes),
+            (self.affected(current, desired), with_changes))
+
+    def test_volume_resized(self):
+        """
+        A node where ``find_volume_changes`` finds a volume to resize is
+        affected.
+        """
+        resized = Application(
+            name=u"database", image=self.database.image,
+            volume=AttachedVolume(name=u"database",
+                                  mountpoint=FilePath(b"/var/lib/db"),
+                                  maximum_size=1024 ** 3))
+        current = self.deployment(node1=[self.database])
+        desired = self.deployment(node1=[resized])
+        changes = find_volume_changes(u"node1.example.com", current, desired)
+        self.assertEqual(
+            (frozenset([u"node1.example.com"]), 1),
+            (self.affected(current, desired), len(changes.resizing)))
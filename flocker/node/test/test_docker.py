@@ -10,7 +10,7 @@ from twisted.python.filepath import FilePath
 from ...testtools import random_name, make_with_init_tests
 from .._docker import (
     IDockerClient, FakeDockerClient, AlreadyExists, PortMap, Unit,
-    Environment, Volume)
+    Environment, Volume, Link, DockerClient)
 
 from .._model import RestartAlways, RestartNever, RestartOnFailure
 
@@ -227,6 +227,71 @@ def make_idockerclient_tests(fixture):
             return self.assert_restart_policy_round_trips(
                 RestartOnFailure(maximum_retry_count=5))
 
+        def test_add_with_links(self):
+            """
+            ``DockerClient.add`` when creating a container linked to another
+            unit creates a container which is listed with those links.
+            """
+            client = fixture(self)
+            target = random_name()
+            name = random_name()
+            self.addCleanup(client.remove, target)
+            self.addCleanup(client.remove, name)
+            link = Link(unit_name=target, alias=u"target")
+            d = client.add(target, u"openshift/busybox-http-app")
+            d.addCallback(lambda _: client.add(
+                name, u"openshift/busybox-http-app", links=[link]))
+            d.addCallback(lambda _: client.list())
+
+            def got_list(units):
+                unit = [unit for unit in units if unit.name == name][0]
+                self.assertEqual(frozenset([link]), unit.links)
+            d.addCallback(got_list)
+            return d
+
+        def test_add_with_host_network(self):
+            """
+            ``DockerClient.add`` when creating a container which uses the
+            host network creates a container which is listed as using it,
+            with each of its ports mapped to the same port on the host.
+            """
+            client = fixture(self)
+            name = random_name()
+            self.addCleanup(client.remove, name)
+            ports = [PortMap(internal_port=8080, external_port=8080)]
+            d = client.add(name, u"openshift/busybox-http-app", ports=ports,
+                           host_network=True)
+            d.addCallback(lambda _: client.list())
+
+            def got_list(units):
+                unit = [unit for unit in units if unit.name == name][0]
+                self.assertEqual(
+                    (True, frozenset(ports)),
+                    (unit.host_network, unit.ports))
+            d.addCallback(got_list)
+            return d
+
+        def test_host_network_image_ports(self):
+            """
+            The ports of a container which uses the host network are only
+            those it was added with, not ones exposed by its image which
+            were not asked for.
+            """
+            client = fixture(self)
+            name = random_name()
+            self.addCleanup(client.remove, name)
+            # The image exposes port 8080.
+            ports = [PortMap(internal_port=8081, external_port=8081)]
+            d = client.add(name, u"openshift/busybox-http-app", ports=ports,
+                           host_network=True)
+            d.addCallback(lambda _: client.list())
+
+            def got_list(units):
+                unit = [unit for unit in units if unit.name == name][0]
+                self.assertEqual(frozenset(ports), unit.ports)
+            d.addCallback(got_list)
+            return d
+
     return IDockerClientTests
 
 
@@ -353,7 +418,8 @@ class UnitTests(TestCase):
             "volumes=[<Volume(node_path=FilePath('/tmp'), "
             "container_path=FilePath('/blah'))>], "
             "mem_limit=None, cpu_shares=None, "
-            "restart_policy=<RestartNever()>)>",
+            "restart_policy=<RestartNever()>, links=frozenset([]), "
+            "host_network=False)>",
 
             repr(Unit(name=u'site-example.com',
                       container_name=u'flocker--site-example.com',
@@ -415,3 +481,68 @@ class VolumeInitTests(
     """
     Tests for ``Volume.__init__``.
     """
+
+
+class ParseLinksTests(TestCase):
+    """
+    Tests for ``DockerClient._parse_links``.
+    """
+    def test_no_links(self):
+        """
+        A container without links has no ``Link``\ s.
+        """
+        self.assertEqual([], DockerClient()._parse_links(None))
+
+    def test_links(self):
+        """
+        Each link of a container is parsed into a ``Link`` naming the linked
+        unit and the link's alias.
+        """
+        client = DockerClient(namespace=u"flocker--")
+        self.assertEqual(
+            [Link(unit_name=u"db", alias=u"postgres")],
+            client._parse_links([u"/flocker--db:/flocker--app/postgres"]))
+
+    def test_other_namespace(self):
+        """
+        Links to containers outside the client's namespace are ignored.
+        """
+        client = DockerClient(namespace=u"flocker--")
+        self.assertEqual(
+            [], client._parse_links([u"/other:/flocker--app/other"]))
+
+
+class ParseHostPortsTests(TestCase):
+    """
+    Tests for ``DockerClient._parse_host_ports``.
+    """
+    def test_no_environment(self):
+        """
+        A container without environment variables has no ``PortMap``\ s.
+        """
+        self.assertEqual([], DockerClient()._parse_host_ports(None))
+
+    def test_not_recorded(self):
+        """
+        A container whose ports were not recorded has no ``PortMap``\ s.
+        """
+        self.assertEqual(
+            [], DockerClient()._parse_host_ports([u"PATH=/bin"]))
+
+    def test_no_ports(self):
+        """
+        A container recorded as having no ports has no ``PortMap``\ s.
+        """
+        self.assertEqual(
+            [], DockerClient()._parse_host_ports([u"FLOCKER_HOST_PORTS="]))
+
+    def test_ports(self):
+        """
+        Each recorded port of a container is mapped to the same port on the
+        host.
+        """
+        self.assertEqual(
+            [PortMap(internal_port=3306, external_port=3306),
+             PortMap(internal_port=8080, external_port=8080)],
+            DockerClient()._parse_host_ports(
+                [u"PATH=/bin", u"FLOCKER_HOST_PORTS=3306,8080"]))
@@ -0,0 +1,294 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.node.httpapi``.
+"""
+
+from io import BytesIO
+
+from zope.interface.verify import verifyObject
+
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+from twisted.test.proto_helpers import MemoryReactor
+from twisted.internet.defer import fail, succeed
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.web.client import FileBodyProducer, readBody
+from twisted.web.http import BAD_REQUEST, INTERNAL_SERVER_ERROR, NOT_FOUND, OK
+from twisted.web.http_headers import Headers
+from twisted.web.server import Site
+from twisted.application.service import IService
+
+from ...restapi.testtools import (
+    MemoryAgent, buildIntegrationTests, dumps, loads, goodResult)
+from ...volume.service import VolumeName
+from ...volume.testtools import create_volume_service
+
+from .. import (
+    Application, Deployment, DockerImage, Node, current_from_configuration,
+)
+from ..httpapi import ConvergenceAPIUser, api_resource, create_api_service
+
+DEPLOYMENT_CONFIG = u"""\
+version: 1
+nodes:
+  node1.example.com: [mysql-hybridcluster]
+"""
+
+APPLICATION_CONFIG = u"""\
+version: 1
+applications:
+  mysql-hybridcluster:
+    image: hybridlogic/mysql5.9
+"""
+
+CURRENT_CONFIG = {
+    u"node2.example.com": {
+        u"applications": {
+            u"site-hybridcluster": {u"image": u"hybridlogic/site:latest"},
+        },
+        u"version": 1,
+    },
+}
+
+CURRENT_NODE_CONFIG = {
+    u"node1.example.com": {u"applications": {}, u"version": 1},
+}
+
+
+class FakeConvergence(object):
+    """
+    A ``ConvergenceService`` which records the configurations it is given.
+
+    :ivar list configured: Three-tuples of the arguments ``configure`` was
+        called with.
+    :ivar result: The ``Deferred`` to return from ``configure``.
+    :ivar nodes: The ``frozenset`` to return from ``known_nodes``.
+    """
+    def __init__(self):
+        self.configured = []
+        self.result = succeed(None)
+        self.nodes = frozenset()
+
+    def known_nodes(self):
+        return self.nodes
+
+    def configure(self, desired_state, current_cluster_state, hostname):
+        self.configured.append(
+            (desired_state, current_cluster_state, hostname))
+        return self.result
+
+
+class APITestsMixin(object):
+    """
+    Integration tests for the configuration API.
+    """
+    def configure(self, body):
+        """
+        Post a configuration to the API.
+
+        :param dict body: The JSON request body.
+
+        :return: A ``Deferred`` which fires with a two-tuple of the response
+            code and the decoded response body.
+        """
+        requesting = self.agent.request(
+            b"POST", b"/v1/configuration",
+            Headers({b"content-type": [b"application/json"]}),
+            FileBodyProducer(BytesIO(dumps(body))))
+
+        def got_response(response):
+            reading = readBody(response)
+            reading.addCallback(lambda body: (response.code, loads(body)))
+            return reading
+        requesting.addCallback(got_response)
+        return requesting
+
+    def body(self, **kwargs):
+        """
+        :return: A valid request body, updated with ``kwargs``.
+        """
+        body = dict(hostname=u"node1.example.com",
+                    deployment=DEPLOYMENT_CONFIG,
+                    application=APPLICATION_CONFIG,
+                    current=[CURRENT_CONFIG, CURRENT_NODE_CONFIG])
+        body.update(kwargs)
+        return body
+
+    def test_configure(self):
+        """
+        Posting a configuration converges the node on it and responds with
+        ``null``.
+        """
+        configuring = self.configure(self.body())
+        expected = (
+            Deployment(nodes=frozenset([Node(
+                hostname=u"node1.example.com",
+                applications=frozenset([Application(
+                    name=u"mysql-hybridcluster",
+                    image=DockerImage.from_string(
+                        u"hybridlogic/mysql5.9")),
+                ]))])),
+            current_from_configuration(
+                dict(CURRENT_CONFIG, **CURRENT_NODE_CONFIG)),
+            u"node1.example.com",
+        )
+        configuring.addCallback(lambda result: self.assertEqual(
+            ((OK, goodResult(None)), [expected]),
+            (result, self.convergence.configured)))
+        return configuring
+
+    def test_convergence_failed(self):
+        """
+        If the node fails to converge the response is an internal server
+        error.
+        """
+        self.convergence.result = fail(ZeroDivisionError())
+        configuring = self.configure(self.body())
+        configuring.addCallback(lambda result: self.assertEqual(
+            (INTERNAL_SERVER_ERROR, True), (result[0], result[1][u"error"])))
+        return configuring
+
+    def assertRejected(self, body):
+        """
+        Assert that posting a configuration is rejected as a bad request and
+        the node is not converged.
+
+        :param dict body: The JSON request body.
+
+        :return: A ``Deferred`` which fires when the check has been made.
+        """
+        configuring = self.configure(body)
+        configuring.addCallback(lambda result: self.assertEqual(
+            (BAD_REQUEST, True, []),
+            (result[0], result[1][u"error"], self.convergence.configured)))
+        return configuring
+
+    def test_missing_configuration(self):
+        """
+        A request without all of the configurations is rejected.
+        """
+        body = self.body()
+        del body["current"]
+        return self.assertRejected(body)
+
+    def test_invalid_yaml(self):
+        """
+        A request with a configuration which is not YAML is rejected.
+        """
+        return self.assertRejected(self.body(deployment=u"{["))
+
+    def test_invalid_configuration(self):
+        """
+        A request with a configuration which is not valid is rejected.
+        """
+        return self.assertRejected(self.body(deployment=(
+            u"version: 1\nnodes:\n  node1.example.com: [unknown]\n")))
+
+
+def fixture(test):
+    """
+    Create the API for a test, with a ``FakeConvergence`` as its
+    ``convergence`` attribute.
+    """
+    test.convergence = FakeConvergence()
+    return ConvergenceAPIUser(test.convergence).app
+
+
+RealTestsAPI, MemoryTestsAPI = buildIntegrationTests(
+    APITestsMixin, "API", fixture)
+
+
+class APIResourceTests(TestCase):
+    """
+    Tests for ``api_resource``.
+    """
+    def setUp(self):
+        self.convergence = FakeConvergence()
+        self.volume_service = create_volume_service(self)
+        self.agent = MemoryAgent(api_resource(
+            self.convergence, self.volume_service))
+
+    def test_configuration(self):
+        """
+        The resource serves the configuration API.
+        """
+        requesting = self.agent.request(
+            b"POST", b"/v1/configuration",
+            Headers({b"content-type": [b"application/json"]}),
+            FileBodyProducer(BytesIO(dumps(dict(
+                hostname=u"node1.example.com",
+                deployment=DEPLOYMENT_CONFIG,
+                application=APPLICATION_CONFIG,
+                current=[CURRENT_CONFIG])))))
+        requesting.addCallback(lambda response: self.assertEqual(
+            (OK, 1), (response.code, len(self.convergence.configured))))
+        return requesting
+
+    def test_datasets(self):
+        """
+        The resource serves the dataset API of ``flocker.volume.httpapi``.
+        """
+        requesting = self.agent.request(b"GET", b"/v1/datasets")
+        requesting.addCallback(readBody)
+        requesting.addCallback(lambda body: self.assertEqual(
+            goodResult([]), loads(body)))
+        return requesting
+
+    def test_datasets_known_nodes(self):
+        """
+        The dataset API only pushes datasets to the nodes the convergence
+        service knows of.
+        """
+        self.convergence.nodes = frozenset([u"node1.example.com"])
+        self.successResultOf(self.volume_service.create(
+            self.volume_service.get(
+                VolumeName(namespace=u"default", dataset_id=u"x"))))
+        requesting = self.agent.request(
+            b"POST", b"/v1/datasets/default/x/push",
+            Headers({b"content-type": [b"application/json"]}),
+            FileBodyProducer(BytesIO(dumps(
+                {u"destination": u"node2.example.com"}))))
+        requesting.addCallback(readBody)
+        requesting.addCallback(lambda body: self.assertEqual(
+            u"The destination is not a node of the cluster.",
+            loads(body)[u"result"][u"description"]))
+        return requesting
+
+    def test_not_found(self):
+        """
+        The resource responds with not found for paths neither API has.
+        """
+        requesting = self.agent.request(b"GET", b"/v1/nothing")
+        requesting.addCallback(lambda response: self.assertEqual(
+            NOT_FOUND, response.code))
+        return requesting
+
+
+class CreateAPIServiceTests(SynchronousTestCase):
+    """
+    Tests for ``create_api_service``.
+    """
+    def test_returns_service(self):
+        """
+        ``create_api_service`` returns an object providing ``IService``.
+        """
+        reactor = MemoryReactor()
+        endpoint = TCP4ServerEndpoint(reactor, 6789)
+        verifyObject(IService, create_api_service(
+            endpoint, FakeConvergence(), create_volume_service(self)))
+
+    def test_listens_endpoint(self):
+        """
+        ``create_api_service`` returns a service that listens using the given
+        endpoint with a HTTP server.
+        """
+        reactor = MemoryReactor()
+        endpoint = TCP4ServerEndpoint(reactor, 6789)
+        service = create_api_service(
+            endpoint, FakeConvergence(), create_volume_service(self))
+        self.addCleanup(service.stopService)
+        service.startService()
+        server = reactor.tcpServers[0]
+        port = server[0]
+        factory = server[1].__class__
+        self.assertEqual((port, factory), (6789, Site))
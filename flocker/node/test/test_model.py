@@ -3,11 +3,12 @@
 """
 Tests for ``flocker.node._model``.
 """
+from twisted.python.filepath import FilePath
 from twisted.trial.unittest import SynchronousTestCase
 
 from ...testtools import make_with_init_tests
 from .._model import (
-    Application, DockerImage, Node, Deployment,
+    Application, AttachedVolume, DockerImage, Link, Node, Deployment, Port,
     RestartOnFailure, RestartAlways, RestartNever,
 )
 
@@ -103,11 +104,106 @@ class ApplicationTests(SynchronousTestCase):
             "<Application(name=u'site-example.com', image=None, ports=None, "
             "volume=None, links=frozenset([]), environment=None, "
             "memory_limit=None, cpu_shares=None, "
-            "restart_policy=<RestartNever()>)>",
+            "restart_policy=<RestartNever()>, host_network=False)>",
             repr(application)
         )
 
 
+class CachedHashTests(SynchronousTestCase):
+    """
+    Tests for the hashing and comparison of the record types decorated with
+    ``_cached_hash``.
+    """
+    def application(self, **kwargs):
+        return Application(
+            name=u'site-example.com',
+            image=DockerImage(repository=u'clusterhq/site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080)]),
+            links=frozenset([Link(local_port=3306, remote_port=3306,
+                                  alias=u'db')]),
+            volume=AttachedVolume(name=u'site-example.com',
+                                  mountpoint=FilePath(b'/var/lib/site')),
+            **kwargs)
+
+    def test_hash_cached(self):
+        """
+        The hash of a record is only computed once.
+        """
+        application = self.application()
+        first = hash(application)
+        # Records must not be changed, but changing one shows that its hash
+        # is not computed again:
+        application.memory_limit = 100
+        self.assertEqual(
+            (first, False),
+            (hash(application), first == hash(self.application(
+                memory_limit=100))))
+
+    def test_equal(self):
+        """
+        Records with equal attributes are equal and have the same hash.
+        """
+        first, second = self.application(), self.application()
+        self.assertEqual(
+            (True, False, hash(first)),
+            (first == second, first != second, hash(second)))
+
+    def test_not_equal(self):
+        """
+        Records with different attributes are not equal.
+        """
+        first = self.application()
+        second = self.application(memory_limit=100)
+        self.assertEqual(
+            (False, True), (first == second, first != second))
+
+    def test_unhashable_attributes(self):
+        """
+        Records with list attributes, which cannot be hashed, are compared by
+        value.
+        """
+        def application(memory_limit=None):
+            return Application(
+                name=u'site-example.com',
+                image=DockerImage(repository=u'clusterhq/site'),
+                ports=[Port(internal_port=80, external_port=8080)],
+                links=[Link(local_port=3306, remote_port=3306, alias=u'db')],
+                volume=AttachedVolume(
+                    name=u'site-example.com',
+                    mountpoint=FilePath(b'/var/lib/site'),
+                    properties=[(u'recordsize', u'8K')]),
+                memory_limit=memory_limit)
+        self.assertEqual(
+            (True, False, False, True),
+            (application() == application(), application() != application(),
+             application() == application(100),
+             application() != application(100)))
+
+    def test_other_type(self):
+        """
+        A record is not equal to an object of another type.
+        """
+        self.assertEqual(
+            (False, True),
+            (self.application() == object(), self.application() != object()))
+
+    def test_no_dict(self):
+        """
+        The records keep their attributes in slots rather than an instance
+        dictionary.
+        """
+        application = self.application()
+        node = Node(hostname=u'example.com',
+                    applications=frozenset([application]))
+        deployment = Deployment(nodes=frozenset([node]))
+        self.assertEqual(
+            [False] * 7,
+            [hasattr(record, '__dict__') for record in [
+                deployment, node, application, application.image,
+                application.volume, list(application.ports)[0],
+                list(application.links)[0]]])
+
+
 class NodeInitTests(make_with_init_tests(
         record_type=Node,
         kwargs=dict(hostname=u'example.com', applications=frozenset([
@@ -132,6 +228,107 @@ class DeploymentInitTests(make_with_init_tests(
     """
 
 
+class DeploymentIndexTests(SynchronousTestCase):
+    """
+    Tests for the indexes of ``Deployment``.
+    """
+    def setUp(self):
+        self.volume = AttachedVolume(
+            name=u'mysql-clusterhq', mountpoint=FilePath(b'/var/lib/mysql'))
+        self.mysql = Application(
+            name=u'mysql-clusterhq', image=DockerImage.from_string(u'mysql'),
+            ports=frozenset([Port(internal_port=3306, external_port=3307)]),
+            volume=self.volume)
+        self.site = Application(
+            name=u'site-clusterhq.com',
+            image=DockerImage.from_string(u'site'),
+            ports=frozenset([Port(internal_port=80, external_port=8080),
+                             Port(internal_port=443, external_port=8443)]))
+        self.node1 = Node(hostname=u'node1.example.com',
+                          applications=frozenset([self.mysql]))
+        self.node2 = Node(hostname=u'node2.example.com',
+                          applications=frozenset([self.site]))
+        self.node3 = Node(hostname=u'node3.example.com', applications=None)
+        self.deployment = Deployment(
+            nodes=frozenset([self.node1, self.node2, self.node3]))
+
+    def test_nodes_by_hostname(self):
+        """
+        ``Deployment.nodes_by_hostname`` maps hostnames to ``Node``\ s.
+        """
+        self.assertEqual(
+            {u'node1.example.com': self.node1,
+             u'node2.example.com': self.node2,
+             u'node3.example.com': self.node3},
+            self.deployment.nodes_by_hostname)
+
+    def test_applications_by_name(self):
+        """
+        ``Deployment.applications_by_name`` maps application names to the
+        ``Node`` and ``Application``.
+        """
+        self.assertEqual(
+            {u'mysql-clusterhq': (self.node1, self.mysql),
+             u'site-clusterhq.com': (self.node2, self.site)},
+            self.deployment.applications_by_name)
+
+    def test_volumes_by_name(self):
+        """
+        ``Deployment.volumes_by_name`` maps volume names to the hostname
+        and ``AttachedVolume``.
+        """
+        self.assertEqual(
+            {u'mysql-clusterhq': (u'node1.example.com', self.volume)},
+            self.deployment.volumes_by_name)
+
+    def test_hostnames_by_port(self):
+        """
+        ``Deployment.hostnames_by_port`` maps external ports to the
+        hostnames of the nodes using them.
+        """
+        self.assertEqual(
+            {3307: frozenset([u'node1.example.com']),
+             8080: frozenset([u'node2.example.com']),
+             8443: frozenset([u'node2.example.com'])},
+            self.deployment.hostnames_by_port)
+
+    def test_hostnames_by_shared_port(self):
+        """
+        ``Deployment.hostnames_by_port`` maps an external port used by
+        applications on more than one node to all of their hostnames.
+        """
+        other_mysql = Application(
+            name=u'other-mysql', image=self.mysql.image,
+            ports=self.mysql.ports)
+        deployment = Deployment(nodes=frozenset([
+            self.node1, Node(hostname=u'node2.example.com',
+                             applications=frozenset([other_mysql]))]))
+        self.assertEqual(
+            {3307: frozenset([u'node1.example.com', u'node2.example.com'])},
+            deployment.hostnames_by_port)
+
+    def test_memoized(self):
+        """
+        Each index is only built once.
+        """
+        self.assertEqual(
+            [True] * 4,
+            [getattr(self.deployment, name) is
+             getattr(self.deployment, name)
+             for name in ['nodes_by_hostname', 'applications_by_name',
+                          'volumes_by_name', 'hostnames_by_port']])
+
+    def test_equality(self):
+        """
+        Built indexes do not affect the equality or hash of a
+        ``Deployment``.
+        """
+        other = Deployment(nodes=self.deployment.nodes)
+        self.deployment.nodes_by_hostname
+        self.assertEqual((self.deployment, hash(self.deployment)),
+                         (other, hash(other)))
+
+
 class RestartOnFailureTests(SynchronousTestCase):
     """
     Tests for ``RestartOnFailure``.
@@ -4,6 +4,7 @@
 Tests for :module:`flocker.node.script`.
 """
 
+import json
 from StringIO import StringIO
 
 from zope.interface import implementer
@@ -11,16 +12,21 @@ from zope.interface import implementer
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.internet.interfaces import IReactorCore
 from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.python.usage import UsageError
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service
 from twisted.web.server import Site
 
+from ipaddr import IPAddress
 from yaml import safe_dump, safe_load
-from ...testtools import StandardOptionsTestsMixin
+from ...common import encode_frame, join_frames
+from ...testtools import StandardOptionsTestsMixin, assert_not_imported
 from ...volume.testtools import make_volume_options_tests
 from ...route import make_memory_network
+from ...route._nftables import NFTablesNetwork
+from ...route.testtools import FakeResolver
 
 from ..script import (
     ServeOptions, ServeScript,
@@ -28,6 +34,7 @@ from ..script import (
     ReportStateOptions, ReportStateScript)
 from .._docker import FakeDockerClient, Unit
 from .._deploy import Deployer
+from .._converge import ConvergenceService
 from .._model import Application, Deployment, DockerImage, Node, AttachedVolume
 
 from ...volume.testtools import create_volume_service
@@ -75,15 +82,64 @@ class ChangeStateScriptMainTests(SynchronousTestCase):
         expected_hostname = b'node1.example.com'
         options = dict(deployment=expected_deployment,
                        current=expected_current,
-                       hostname=expected_hostname)
+                       hostname=expected_hostname,
+                       **{"network-backend": "iptables"})
+        reactor = Clock()
+        reactor.resolver = FakeResolver({})
         script.main(
-            reactor=object(), options=options, volume_service=Service())
+            reactor=reactor, options=options, volume_service=Service())
 
         self.assertEqual(
             [(expected_deployment, expected_current, expected_hostname)],
             change_node_state_calls
         )
 
+    def test_main_resolves_hostnames(self):
+        """
+        ``ChangeStateScript.main`` gives the ``Deployer`` a resolver which
+        uses the reactor's resolver.
+        """
+        script = ChangeStateScript()
+        deployers = []
+        self.patch(
+            Deployer, 'change_node_state',
+            lambda self, **kwargs: deployers.append(self))
+
+        reactor = Clock()
+        reactor.resolver = FakeResolver({b'node2.example.com': b'192.0.2.2'})
+        options = dict(deployment=object(), current=object(),
+                       hostname=b'node1.example.com',
+                       **{"network-backend": "iptables"})
+        script.main(
+            reactor=reactor, options=options, volume_service=Service())
+
+        [deployer] = deployers
+        self.assertEqual(
+            IPAddress(u'192.0.2.2'),
+            self.successResultOf(deployer.resolve(u'node2.example.com')))
+
+    def test_main_network_backend(self):
+        """
+        ``ChangeStateScript.main`` gives the ``Deployer`` a network of the
+        backend chosen with ``--network-backend``.
+        """
+        script = ChangeStateScript()
+        deployers = []
+        self.patch(
+            Deployer, 'change_node_state',
+            lambda self, **kwargs: deployers.append(self))
+
+        reactor = Clock()
+        reactor.resolver = FakeResolver({})
+        options = dict(deployment=object(), current=object(),
+                       hostname=b'node1.example.com',
+                       **{"network-backend": "nftables"})
+        script.main(
+            reactor=reactor, options=options, volume_service=Service())
+
+        [deployer] = deployers
+        self.assertIsInstance(deployer.network, NFTablesNetwork)
+
 
 class StandardChangeStateOptionsTests(
         make_volume_options_tests(
@@ -316,6 +372,100 @@ class ChangeStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
             str(e)
         )
 
+    def parse_stdin(self, stdin, arguments=(b'node1.example.com',)):
+        """
+        Parse ``--stdin`` options with some standard input.
+
+        :param bytes stdin: The standard input.
+        :param arguments: The other command line arguments.
+
+        :return: The parsed ``ChangeStateOptions``.
+        """
+        options = self.options()
+        options._stdin = StringIO(stdin)
+        options.parseOptions([b'--stdin'] + list(arguments))
+        return options
+
+    def test_stdin(self):
+        """
+        With ``--stdin``, the deployment and application configuration are
+        read from standard input, and the current configuration is the
+        configuration of the applications with volumes overridden by the
+        full configuration of some of the nodes.
+        """
+        site = {'image': 'clusterhq/site'}
+        volumes = {
+            'node1.example.com': {'applications': {}, 'version': 1},
+            'node2.example.com': {'applications': {}, 'version': 1},
+        }
+        nodes = {
+            'node1.example.com': {'applications': {'site': site},
+                                  'version': 1},
+        }
+        stdin = join_frames(map(encode_frame, [
+            safe_dump({"nodes": {'node1.example.com': ['site']},
+                       "version": 1}),
+            safe_dump({"applications": {'site': site}, "version": 1}),
+            json.dumps(volumes),
+            json.dumps(nodes),
+        ]))
+        options = self.parse_stdin(stdin)
+        application = Application(
+            name='site', image=DockerImage.from_string('clusterhq/site'),
+            ports=frozenset(), links=frozenset())
+        self.assertEqual(
+            (Deployment(nodes=frozenset([
+                Node(hostname='node1.example.com',
+                     applications=frozenset([application]))])),
+             Deployment(nodes=frozenset([
+                 Node(hostname='node1.example.com',
+                      applications=frozenset([application])),
+                 Node(hostname='node2.example.com',
+                      applications=frozenset())])),
+             'node1.example.com'),
+            (options['deployment'], options['current'],
+             options['hostname']))
+
+    def test_stdin_hostname_only(self):
+        """
+        With ``--stdin``, a ``UsageError`` is raised if anything other than a
+        hostname is given on the command line.
+        """
+        stdin = join_frames(
+            [encode_frame(b'{}') for i in range(4)])
+        self.assertRaises(
+            UsageError, self.parse_stdin, stdin,
+            [b'{}', b'{}', b'{}', b'node1.example.com'])
+
+    def test_stdin_bad_frames(self):
+        """
+        With ``--stdin``, a ``UsageError`` is raised if standard input is not
+        a stream of frames.
+        """
+        e = self.assertRaises(UsageError, self.parse_stdin, b'{}')
+        self.assertTrue(str(e).startswith(
+            'Configuration could not be read from standard input'))
+
+    def test_stdin_wrong_number_of_frames(self):
+        """
+        With ``--stdin``, a ``UsageError`` is raised if standard input does
+        not hold exactly four frames.
+        """
+        stdin = join_frames([encode_frame(b'{}')])
+        self.assertRaises(UsageError, self.parse_stdin, stdin)
+
+    def test_stdin_invalid_current_json(self):
+        """
+        With ``--stdin``, a ``UsageError`` is raised if the current
+        configuration read from standard input is not valid JSON.
+        """
+        stdin = join_frames(map(encode_frame, [
+            b'{nodes: {}, version: 1}', b'{applications: {}, version: 1}',
+            b'{}', b"{nodes: {}}"]))
+        e = self.assertRaises(UsageError, self.parse_stdin, stdin)
+        self.assertTrue(
+            str(e).startswith('Current config could not be parsed as JSON'))
+
 
 class StandardReportStateOptionsTests(
         make_volume_options_tests(ReportStateOptions)):
@@ -350,6 +500,32 @@ class ReportStateOptionsTests(StandardOptionsTestsMixin, SynchronousTestCase):
         )
         self.assertEqual(str(e), b"Wrong number of arguments.")
 
+    def test_default_format(self):
+        """
+        By default the configuration is written as YAML.
+        """
+        options = self.options()
+        options.parseOptions([])
+        self.assertEqual("yaml", options["format"])
+
+    def test_json_format(self):
+        """
+        ``--format json`` selects JSON.
+        """
+        options = self.options()
+        options.parseOptions([b"--format", b"json"])
+        self.assertEqual("json", options["format"])
+
+    def test_unknown_format(self):
+        """
+        If an unknown format is given, a ``UsageError`` is raised.
+        """
+        options = self.options()
+        e = self.assertRaises(
+            UsageError, options.parseOptions, [b"--format", b"xml"])
+        self.assertEqual(
+            str(e), b"Unknown format 'xml', use one of: json, yaml.")
+
 
 class ReportStateScriptMainTests(SynchronousTestCase):
     """
@@ -379,6 +555,8 @@ class ReportStateScriptMainTests(SynchronousTestCase):
 
         expected = {
             'used_ports': sorted(used_ports),
+            'not_running': ['site-example.net'],
+            'proxied_ports': [],
             'applications': {
                 'site-example.net': {
                     'image': unit2.container_image,
@@ -396,10 +574,114 @@ class ReportStateScriptMainTests(SynchronousTestCase):
         content = StringIO()
         self.patch(script, '_stdout', content)
         script.main(
-            reactor=object(), options=[],
+            reactor=object(), options={"since": None, "format": "yaml"},
             volume_service=create_volume_service(self))
         self.assertEqual(safe_load(content.getvalue()), expected)
 
+    def test_json_output(self):
+        """
+        With the ``json`` format, ``ReportStateScript.main`` writes the same
+        node state as JSON.
+        """
+        outputs = []
+        for format in ["yaml", "json"]:
+            network = make_memory_network(used_ports=frozenset([1, 10]))
+            network.create_proxy_to(IPAddress("10.0.0.2"), 8080)
+            script = ReportStateScript(
+                FakeDockerClient(units={}), network)
+            content = StringIO()
+            self.patch(script, '_stdout', content)
+            script.main(
+                reactor=object(), options={"since": None, "format": format},
+                volume_service=create_volume_service(self))
+            outputs.append(content.getvalue())
+        self.assertEqual(safe_load(outputs[0]), json.loads(outputs[1]))
+
+    def test_proxied_ports(self):
+        """
+        The output of ``ReportStateScript.main`` includes the ports proxied to
+        other nodes.
+        """
+        network = make_memory_network()
+        network.create_proxy_to(IPAddress("10.0.0.2"), 8080)
+        network.create_proxy_to(IPAddress("10.0.0.3"), 3306)
+        script = ReportStateScript(FakeDockerClient(units={}), network)
+        content = StringIO()
+        self.patch(script, '_stdout', content)
+        script.main(
+            reactor=object(), options={"since": None, "format": "yaml"},
+            volume_service=create_volume_service(self))
+        self.assertEqual(
+            [3306, 8080], safe_load(content.getvalue())["proxied_ports"])
+
+
+class ReportStateSinceTests(SynchronousTestCase):
+    """
+    Tests for ``ReportStateScript.main`` with ``--since``.
+    """
+    def setUp(self):
+        self.state_cache = FilePath(self.mktemp()).child(b"state.json")
+        self.docker = FakeDockerClient(units={})
+        self.volume_service = create_volume_service(self)
+
+    def report(self, since):
+        """
+        Run the script with ``--since``.
+
+        :return: The parsed report written to standard output.
+        """
+        script = ReportStateScript(
+            self.docker, make_memory_network(), state_cache=self.state_cache)
+        content = StringIO()
+        self.patch(script, '_stdout', content)
+        options = ReportStateOptions()
+        options.parseOptions([b"--since", since])
+        script.main(reactor=object(), options=options,
+                    volume_service=self.volume_service)
+        return safe_load(content.getvalue())
+
+    def add_unit(self, name):
+        self.docker._units[name] = Unit(
+            name=name, container_name=name,
+            container_image=u'clusterhq/%s:latest' % (name,),
+            activation_state=u'active')
+
+    def test_full(self):
+        """
+        With an unknown token, the full configuration is reported with its
+        token, and remembered.
+        """
+        self.add_unit(u'site-example.com')
+        report = self.report(b"none")
+        self.assertEqual(
+            ([u'site-example.com'], True),
+            (report["state"]["applications"].keys(),
+             self.state_cache.exists()))
+
+    def test_unchanged(self):
+        """
+        With the token of the current configuration, the configuration is
+        reported as unchanged.
+        """
+        first = self.report(b"none")
+        self.assertEqual(
+            {"token": first["token"], "unchanged": True},
+            self.report(first["token"]))
+
+    def test_changes(self):
+        """
+        With the token of the configuration last reported, only the changes
+        since are reported.
+        """
+        self.add_unit(u'site-example.com')
+        first = self.report(b"none")
+        self.add_unit(u'db-example.com')
+        second = self.report(first["token"])
+        self.assertEqual(
+            ([u'db-example.com'], [], first["token"]),
+            (second["changes"]["applications"].keys(), second["removed"],
+             second["since"]))
+
 
 # TODO: This should be provided by Twisted (also it should be more complete
 # instead of 1/3rd done).
@@ -415,6 +697,7 @@ class MemoryCoreReactor(MemoryReactor):
     def __init__(self):
         MemoryReactor.__init__(self)
         self._triggers = {}
+        self.resolver = FakeResolver({})
 
     def addSystemEventTrigger(self, phase, eventType, callable, *args, **kw):
         event = self._triggers.setdefault(eventType, _ThreePhaseEvent())
@@ -453,7 +736,8 @@ class ServeScriptMainTests(SynchronousTestCase):
     def setUp(self):
         self.reactor = MemoryCoreReactor()
         self.service = Service()
-        self.script = ServeScript()
+        self.script = ServeScript(
+            docker_client=FakeDockerClient(), network=make_memory_network())
 
     def main(self, reactor, service):
         options = ServeOptions()
@@ -533,6 +817,81 @@ class ServeScriptMainTests(SynchronousTestCase):
         factory = server[1].__class__
         self.assertEqual((port, factory), (8001, Site))
 
+    def test_http_api_server_local_only(self):
+        """
+        ``ServeScript.main`` only listens for HTTP connections on the
+        loopback interface, since the API does not authenticate its users.
+        """
+        self.script.main(self.reactor, {"port": 8001}, self.service)
+        self.assertEqual(b"127.0.0.1", self.reactor.tcpServers[0][3])
+
+    def test_deployer(self):
+        """
+        ``ServeScript.main`` starts a ``ConvergenceService`` whose
+        ``Deployer`` uses the volume service it was called with and the
+        Docker client and network the script was created with.
+        """
+        self.main(self.reactor, self.service)
+        [convergence] = [
+            service for service in self.service.parent
+            if isinstance(service, ConvergenceService)]
+        deployer = convergence.deployer
+        self.assertEqual(
+            (self.service, self.script._docker_client, self.script._network,
+             True),
+            (deployer.volume_service, deployer.docker_client,
+             deployer.network, convergence.running))
+
+    def test_network_backend(self):
+        """
+        When ``ServeScript`` is not given a network, ``ServeScript.main``
+        starts a ``ConvergenceService`` whose ``Deployer`` uses a network of
+        the backend chosen with ``--network-backend``.
+        """
+        script = ServeScript(docker_client=FakeDockerClient())
+        options = ServeOptions()
+        options.parseOptions([b"--network-backend", b"nftables"])
+        script.main(self.reactor, options, self.service)
+        [convergence] = [
+            service for service in self.service.parent
+            if isinstance(service, ConvergenceService)]
+        self.assertIsInstance(convergence.deployer.network, NFTablesNetwork)
+
+
+class NetworkOptionsTests(SynchronousTestCase):
+    """
+    Tests for the ``--network-backend`` option added by
+    ``flocker_network_options``.
+    """
+    def test_default(self):
+        """
+        The default network backend is ``iptables``.
+        """
+        options = ReportStateOptions()
+        options.parseOptions([])
+        self.assertEqual("iptables", options["network-backend"])
+
+    def test_nftables(self):
+        """
+        The ``nftables`` network backend can be chosen.
+        """
+        options = ServeOptions()
+        options.parseOptions([b"--network-backend", b"nftables"])
+        self.assertEqual("nftables", options["network-backend"])
+
+    def test_unknown(self):
+        """
+        A ``UsageError`` is raised if the network backend is not one of
+        ``NETWORK_BACKENDS``.
+        """
+        options = ReportStateOptions()
+        e = self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--network-backend", b"pf"])
+        self.assertEqual(
+            "Unknown network backend 'pf', use one of: iptables, nftables.",
+            str(e))
+
 
 class StandardServeOptionsTests(
         make_volume_options_tests(ServeOptions)):
@@ -554,3 +913,20 @@ class StandardServeOptionsTests(
         options = ServeOptions()
         options.parseOptions(["--port", 1234])
         self.assertEqual(options["port"], 1234)
+
+
+class ImportTests(SynchronousTestCase):
+    """
+    Tests for what importing ``flocker.node.script`` loads.
+    """
+    def test_lazy_imports(self):
+        """
+        Importing ``flocker.node.script``, as ``flocker-changestate`` and
+        ``flocker-reportstate`` do every time they are run, loads neither
+        docker-py nor the HTTP API and its dependencies, which only the
+        commands which use them import.
+        """
+        assert_not_imported(
+            self, b"flocker.node.script",
+            [b"docker", b"requests", b"klein", b"werkzeug", b"jsonschema",
+             b"treq", b"twisted.web"])
@@ -16,10 +16,15 @@ this allows easy, transparent migration of containers between any of the
 cooperating nodes.
 """
 
-__all__ = ["INetwork", "make_host_network", "make_memory_network", "Proxy"]
+__all__ = [
+    "INetwork", "make_host_network", "make_memory_network",
+    "make_nftables_network", "Proxy", "make_caching_resolver",
+]
 
 
 from ._interfaces import INetwork
 from ._iptables import make_host_network
 from ._memory import make_memory_network
+from ._nftables import make_nftables_network
 from ._model import Proxy
+from ._resolve import make_caching_resolver
@@ -39,6 +39,18 @@ class INetwork(Interface):
             :py:meth:`enumerate_proxies`.
         """
 
+    def set_proxies(proxies):
+        """
+        Make the configured proxies exactly ``proxies``.
+
+        Only the difference between the existing proxies and ``proxies`` is
+        applied: proxies which exist and are still wanted are left alone.
+
+        :param proxies: An iterable of objects like those returned by
+            :py:meth:`create_proxy_to`, each with ``ip`` and ``port``
+            attributes.
+        """
+
     def enumerate_proxies():
         """
         Retrieve configured proxy information.
@@ -47,6 +59,14 @@ class INetwork(Interface):
             proxies.
         """
 
+    def invalidate():
+        """
+        Forget anything remembered about the system's network configuration,
+        so that it is inspected again the next time it is needed.  This lets
+        a long-running process notice proxies which were changed by
+        something else.
+        """
+
     def enumerate_used_ports():
         """
         Retrieve information about port numbers which are in use.
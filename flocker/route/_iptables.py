@@ -8,16 +8,20 @@ Manipulate network routing behavior on a node using ``iptables``.
 from __future__ import unicode_literals
 
 import shlex
-from subprocess import check_call, check_output
+from subprocess import (
+    PIPE, Popen, CalledProcessError, check_call, check_output,
+)
 
 from zope.interface import implementer
 from ipaddr import IPAddress
 from characteristic import attributes
 from eliot import Logger
-from psutil import net_connections
 from twisted.python.filepath import FilePath
 
-from ._logging import CREATE_PROXY_TO, DELETE_PROXY, IPTABLES
+from ._logging import (
+    CREATE_PROXY_TO, DELETE_PROXY, IPTABLES, IPTABLES_RESTORE, PREPARE_HOST,
+    SET_PROXIES,
+)
 from ._interfaces import INetwork
 from ._model import Proxy
 
@@ -48,162 +52,321 @@ def iptables(logger, argv):
         check_call([b"iptables"] + argv)
 
 
-def create_proxy_to(logger, ip, port):
+def proxy_rules(proxy):
     """
-    :see: ``HostNetwork.create_proxy_to``
+    Describe the ``nat`` table rules which together implement a proxy.
+
+    :param Proxy proxy: The proxy to describe.
+
+    :return: A ``list`` of two-tuples.  The first element of each is the name
+        of a chain and the second is a ``list`` of ``bytes`` giving the rule
+        specification to use in that chain.
     """
-    action = CREATE_PROXY_TO(
-        logger=logger, target_ip=ip, target_port=port)
-
-    with action:
-        encoded_ip = unicode(ip).encode("ascii")
-        encoded_port = unicode(port).encode("ascii")
-
-        # The first goal is to configure "Destination NAT" (DNAT).  We're just
-        # going to rewrite the destination address of traffic arriving on the
-        # specified port so it looks like it is destined for the specified ip
-        # instead of destined for "us".  This gets the packets delivered to the
-        # right destination.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # Destination NAT has to happen "pre"-routing so that the normal
-            # routing rules on the machine will use the re-written destination
-            # address and get the packet to that new destination.  Accomplish
-            # this by appending the rule to the PREROUTING chain.
-            b"--append", b"PREROUTING",
-
-            # Only re-route traffic with a destination port matching the one we
-            # were told to manipulate.  It is also necessary to specify TCP (or
-            # UDP) here since that is the layer of the network stack that
-            # defines ports.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # And only re-route traffic directed at this host.  Traffic
-            # originating on this host directed at some random other host that
-            # happens to be on the same port should be left alone.
-            b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-
-            # Tag it as a flocker-created rule so we can recognize it later.
-            b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
-
-            # If the filter matched, jump to the DNAT chain to handle doing the
-            # actual packet mangling.  DNAT is a built-in chain that already
-            # knows how to do this.  Pass an argument to the DNAT chain so it
-            # knows how to mangle the packet - rewrite the destination IP of
-            # the address to the target we were told to use.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
-
-        # Bonus round!  Having performed DNAT (changing the destination) during
-        # prerouting we are now prepared to send the packet on somewhere else.
-        # On its way out of this system it is also necessary to further
-        # modify and then track that packet.  We want it to look like it
-        # comes from us (the downstream client will be *very* confused if
-        # the node we're passing the packet on to replies *directly* to them;
-        # and by confused I mean it will be totally broken, of course) so we
-        # also need to "masquerade" in the postrouting chain.  This changes
-        # the source address (ip and port) of the packet to the address of
-        # the external interface the packet is exiting upon. Doing SNAT here
-        # would be a little bit more efficient because the kernel could avoid
-        # looking up the external interface's address for every single packet.
-        # But it requires this code to know that address and it requires that
-        # if it ever changes the rule gets updated and it may require some
-        # steps to do port allocation (not sure what they are yet).  So we'll
-        # just masquerade for now.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As described above, this transformation happens after routing
-            # decisions have been made and the packet is on its way out of the
-            # system.  Therefore, append the rule to the POSTROUTING chain.
-            b"--append", b"POSTROUTING",
-
-            # We'll stick to matching the same kinds of packets we matched in
-            # the earlier stage.  We might want to change the factoring of this
-            # code to avoid the duplication - particularly in case we want to
-            # change the specifics of the filter.
-            #
-            # This omits the LOCAL addrtype check, though, because at this
-            # point the packet is definitely leaving this host.
-            b"--protocol", b"tcp", b"--destination-port", encoded_port,
-
-            # Do the masquerading.
-            b"--jump", b"MASQUERADE",
-        ])
-
-        # Secret level!!  Traffic that originates *on* the host bypasses the
-        # PREROUTING chain.  Instead, it passes through the OUTPUT chain.  If
-        # we want connections from localhost to the forwarded port to be
-        # affected then we need a rule in the OUTPUT chain to do the same kind
-        # of DNAT that we did in the PREROUTING chain.
-        iptables(logger, [
-            # All NAT stuff happens in the netfilter NAT table.
-            b"--table", b"nat",
-
-            # As mentioned, this rule is for the OUTPUT chain.
-            b"--append", b"OUTPUT",
-
-            # Matching the exact same kinds of packets as the PREROUTING rule
-            # matches.
-            b"--protocol", b"tcp",
-            b"--destination-port", encoded_port,
-            b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-
-            # Do the same DNAT as we did in the rule for the PREROUTING chain.
-            b"--jump", b"DNAT", b"--to-destination", encoded_ip,
-        ])
-
-        # The network stack only considers forwarding traffic when certain
-        # system configuration is in place.
+    encoded_ip = unicode(proxy.ip).encode("ascii")
+    encoded_port = unicode(proxy.port).encode("ascii")
+
+    # The first goal is to configure "Destination NAT" (DNAT).  We're just
+    # going to rewrite the destination address of traffic arriving on the
+    # specified port so it looks like it is destined for the specified ip
+    # instead of destined for "us".  This gets the packets delivered to the
+    # right destination.
+    #
+    # All NAT stuff happens in the netfilter NAT table.  Destination NAT has
+    # to happen "pre"-routing so that the normal routing rules on the machine
+    # will use the re-written destination address and get the packet to that
+    # new destination.  Accomplish this by putting the rule in the PREROUTING
+    # chain.
+    prerouting = (b"PREROUTING", [
+        # Only re-route traffic with a destination port matching the one we
+        # were told to manipulate.  It is also necessary to specify TCP (or
+        # UDP) here since that is the layer of the network stack that defines
+        # ports.
+        b"--protocol", b"tcp", b"--destination-port", encoded_port,
+
+        # And only re-route traffic directed at this host.  Traffic
+        # originating on this host directed at some random other host that
+        # happens to be on the same port should be left alone.
+        b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+
+        # Tag it as a flocker-created rule so we can recognize it later.
+        b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
+
+        # If the filter matched, jump to the DNAT chain to handle doing the
+        # actual packet mangling.  DNAT is a built-in chain that already knows
+        # how to do this.  Pass an argument to the DNAT chain so it knows how
+        # to mangle the packet - rewrite the destination IP of the address to
+        # the target we were told to use.
+        b"--jump", b"DNAT", b"--to-destination", encoded_ip,
+    ])
+
+    # Bonus round!  Having performed DNAT (changing the destination) during
+    # prerouting we are now prepared to send the packet on somewhere else.  On
+    # its way out of this system it is also necessary to further modify and
+    # then track that packet.  We want it to look like it comes from us (the
+    # downstream client will be *very* confused if the node we're passing the
+    # packet on to replies *directly* to them; and by confused I mean it will
+    # be totally broken, of course) so we also need to "masquerade" in the
+    # postrouting chain.  This changes the source address (ip and port) of the
+    # packet to the address of the external interface the packet is exiting
+    # upon. Doing SNAT here would be a little bit more efficient because the
+    # kernel could avoid looking up the external interface's address for
+    # every single packet.  But it requires this code to know that address
+    # and it requires that if it ever changes the rule gets updated and it may
+    # require some steps to do port allocation (not sure what they are yet).
+    # So we'll just masquerade for now.
+    #
+    # As described above, this transformation happens after routing decisions
+    # have been made and the packet is on its way out of the system.
+    # Therefore, the rule goes in the POSTROUTING chain.
+    postrouting = (b"POSTROUTING", [
+        # We'll stick to matching the same kinds of packets we matched in the
+        # earlier stage.
         #
-        # https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt
-        # will explain the meaning of these in (very slightly) more detail.
-        conf = FilePath(b"/proc/sys/net/ipv4/conf")
-        descendant = conf.descendant([b"default", b"forwarding"])
-        with descendant.open("wb") as forwarding:
-            forwarding.write(b"1")
-
-        # In order to have the OUTPUT chain DNAT rule affect routing decisions,
-        # we also need to tell the system to make routing decisions about
-        # traffic from or to localhost.
-        for path in conf.children():
-            with path.child(b"route_localnet").open("wb") as route_localnet:
-                route_localnet.write(b"1")
+        # This omits the LOCAL addrtype check, though, because at this point
+        # the packet is definitely leaving this host.
+        b"--protocol", b"tcp", b"--destination-port", encoded_port,
+
+        # Do the masquerading.
+        b"--jump", b"MASQUERADE",
+    ])
+
+    # Secret level!!  Traffic that originates *on* the host bypasses the
+    # PREROUTING chain.  Instead, it passes through the OUTPUT chain.  If we
+    # want connections from localhost to the forwarded port to be affected
+    # then we need a rule in the OUTPUT chain to do the same kind of DNAT that
+    # we did in the PREROUTING chain.
+    output = (b"OUTPUT", [
+        # Matching the exact same kinds of packets as the PREROUTING rule
+        # matches.
+        b"--protocol", b"tcp",
+        b"--destination-port", encoded_port,
+        b"--match", b"addrtype", b"--dst-type", b"LOCAL",
+
+        # Do the same DNAT as we did in the rule for the PREROUTING chain.
+        b"--jump", b"DNAT", b"--to-destination", encoded_ip,
+    ])
+
+    return [prerouting, postrouting, output]
+
+
+def create_proxy_to(logger, ip, port, run_iptables=iptables):
+    """
+    :see: ``HostNetwork.create_proxy_to``
 
-        return Proxy(ip=ip, port=port)
+    :param run_iptables: The function to use to run ``iptables``, with the
+        same signature as ``iptables``.
+    """
+    with CREATE_PROXY_TO(logger=logger, target_ip=ip, target_port=port):
+        proxy = Proxy(ip=ip, port=port)
+        for chain, rule in proxy_rules(proxy):
+            run_iptables(
+                logger, [b"--table", b"nat", b"--append", chain] + rule)
+        return proxy
 
 
-def delete_proxy(logger, proxy):
+def delete_proxy(logger, proxy, run_iptables=iptables):
     """
     :see: ``HostNetwork.delete_proxy``
-    """
-    ip = unicode(proxy.ip).encode("ascii")
-    port = unicode(proxy.port).encode("ascii")
-
-    commands = [
-        [b"--table", b"nat",
-         b"--delete", b"PREROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--match", b"comment", b"--comment", FLOCKER_COMMENT_MARKER,
-         b"--jump", b"DNAT", b"--to-destination", ip],
-        [b"--table", b"nat",
-         b"--delete", b"POSTROUTING",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--jump", b"MASQUERADE"],
-        [b"--table", b"nat",
-         b"--delete", b"OUTPUT",
-         b"--protocol", b"tcp", b"--destination-port", port,
-         b"--match", b"addrtype", b"--dst-type", b"LOCAL",
-         b"--jump", b"DNAT", b"--to-destination", ip],
-    ]
 
+    :param run_iptables: The function to use to run ``iptables``, with the
+        same signature as ``iptables``.
+    """
     with DELETE_PROXY(logger, target_ip=proxy.ip, target_port=proxy.port):
-        for argv in commands:
-            iptables(logger, argv)
+        for chain, rule in proxy_rules(proxy):
+            run_iptables(
+                logger, [b"--table", b"nat", b"--delete", chain] + rule)
+
+
+class HostPreparation(object):
+    """
+    The configuration of the network stack which proxies depend on.
+
+    The network stack only considers forwarding traffic when certain system
+    configuration is in place, and the DNAT rule in the OUTPUT chain only
+    affects routing decisions if the system makes routing decisions about
+    traffic from or to localhost.
+    https://www.kernel.org/doc/Documentation/networking/ip-sysctl.txt will
+    explain the meaning of these in (very slightly) more detail.
+
+    The configuration only needs to be written once: interfaces created later
+    take their settings from ``default``.  After that, ``prepare`` only
+    checks that forwarding has not been turned off again.
+
+    :ivar FilePath _conf: The ``/proc/sys/net/ipv4/conf`` directory.
+    :ivar bool _prepared: Whether the configuration has been put in place.
+    """
+    def __init__(self, conf):
+        self._conf = conf
+        self._prepared = False
+
+    def _forwarding(self):
+        return self._conf.descendant([b"default", b"forwarding"])
+
+    def _settings(self):
+        """
+        :return: A ``list`` of ``FilePath`` instances for all of the settings
+            which must be enabled.
+        """
+        return [self._forwarding()] + [
+            path.child(b"route_localnet") for path in self._conf.children()]
+
+    def in_place(self):
+        """
+        :return: ``True`` if all of the settings are enabled, otherwise
+            ``False``.
+        """
+        return all(
+            setting.getContent().strip() == b"1"
+            for setting in self._settings())
+
+    def prepare(self, logger):
+        """
+        Enable the settings, unless they are known to be enabled already.
+        """
+        if self._prepared:
+            if self._forwarding().getContent().strip() == b"1":
+                return
+            self._prepared = False
+
+        with PREPARE_HOST(logger=logger):
+            if not self.in_place():
+                for setting in self._settings():
+                    with setting.open("wb") as f:
+                        f.write(b"1")
+            self._prepared = True
+
+
+# The preparation of this host, shared by everything in this process which
+# creates proxies.
+HOST_PREPARATION = HostPreparation(FilePath(b"/proc/sys/net/ipv4/conf"))
+
+
+def _quote_restore_argument(argument):
+    """
+    Quote one argument of a rule for inclusion in ``iptables-restore`` input.
+
+    ``iptables-restore`` splits lines on whitespace but honours double quotes,
+    which is all the quoting the arguments generated by ``proxy_rules`` need.
+    """
+    if b" " in argument:
+        return b'"' + argument + b'"'
+    return argument
+
+
+def restore_input(create, delete):
+    """
+    Generate ``iptables-restore`` input which creates and deletes proxies in
+    a single transaction.
+
+    :param create: An iterable of ``Proxy`` instances to create.
+    :param delete: An iterable of ``Proxy`` instances to delete.
+
+    :return: ``bytes`` suitable for ``iptables-restore --noflush``.
+    """
+    lines = [b"*nat"]
+    for operation, proxies in [(b"-D", delete), (b"-A", create)]:
+        for proxy in proxies:
+            for chain, rule in proxy_rules(proxy):
+                lines.append(b" ".join(
+                    [operation, chain] + map(_quote_restore_argument, rule)))
+    lines.append(b"COMMIT")
+    return b"\n".join(lines) + b"\n"
+
+
+def iptables_restore(logger, data):
+    """
+    Run ``iptables-restore --noflush`` with the given input.
+
+    The kernel applies everything in ``data`` atomically: if any rule cannot
+    be added or deleted then none of the changes take effect.
+
+    :param bytes data: The input to feed to ``iptables-restore``.
+
+    :raise CalledProcessError: If ``iptables-restore`` fails.
+    """
+    argv = [b"iptables-restore", b"--noflush"]
+    with IPTABLES_RESTORE(logger=logger, lines=data.count(b"\n")):
+        process = Popen(argv, stdin=PIPE)
+        process.communicate(data)
+        if process.returncode:
+            raise CalledProcessError(process.returncode, argv)
+
+
+def normalize_proxy(proxy):
+    """
+    Convert the ``ip`` of a ``Proxy`` to an ``IPAddress`` so that it can be
+    compared with the proxies read back from the system.
+    """
+    try:
+        ip = IPAddress(unicode(proxy.ip))
+    except ValueError:
+        return proxy
+    return Proxy(ip=ip, port=proxy.port)
+
+
+def apply_proxies(logger, create, delete,
+                  run_iptables_restore=iptables_restore):
+    """
+    Create and delete some proxies in a single ``iptables-restore``
+    transaction.
+
+    :param list create: The ``Proxy`` instances to create.
+    :param list delete: The ``Proxy`` instances to delete.
+    :param run_iptables_restore: The function to use to run
+        ``iptables-restore``, with the same signature as
+        ``iptables_restore``.
+    """
+    with SET_PROXIES(logger=logger, created=len(create),
+                     deleted=len(delete)):
+        if create or delete:
+            run_iptables_restore(logger, restore_input(create, delete))
+
+
+# The value of the ``st`` column of /proc/net/tcp for a listening socket.
+TCP_LISTEN = b"0A"
+
+
+def parse_listening_ports(table):
+    """
+    Find the listening ports in the content of ``/proc/net/tcp`` or
+    ``/proc/net/tcp6``.
+
+    :param bytes table: The content of one of those files.
+
+    :return: A ``set`` of ``int`` port numbers.
+    """
+    ports = set()
+    # The first line is a header.
+    for line in table.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 4 or fields[3] != TCP_LISTEN:
+            continue
+        # The local address is the second field, like 0100007F:0CEA.
+        ports.add(int(fields[1].rsplit(b":", 1)[1], 16))
+    return ports
+
+
+def listening_ports(proc_net=FilePath(b"/proc/net")):
+    """
+    Find the ports on which TCP servers on this node are listening.
+
+    Only listening sockets are considered, which avoids inspecting every
+    socket on the node.
+
+    :param FilePath proc_net: The directory containing the kernel's ``tcp``
+        and ``tcp6`` tables.
+
+    :return: A ``set`` of ``int`` port numbers.
+    """
+    ports = set()
+    for name in [b"tcp", b"tcp6"]:
+        try:
+            table = proc_net.child(name).getContent()
+        except IOError:
+            # There is no tcp6 table if IPv6 is disabled.
+            continue
+        ports |= parse_listening_ports(table)
+    return ports
 
 
 def enumerate_proxies():
@@ -306,16 +469,49 @@ def parse_iptables_options(argv):
 class HostNetwork(object):
     """
     An ``INetwork`` implementation based on ``iptables``.
+
+    :ivar _run_iptables: The function to use to run ``iptables``.
+    :ivar _run_iptables_restore: The function to use to run
+        ``iptables-restore``.
+    :ivar HostPreparation _preparation: The network configuration to put in
+        place before any proxy is created.
     """
     logger = Logger()
 
+    def __init__(self, run_iptables=iptables,
+                 run_iptables_restore=iptables_restore,
+                 preparation=HOST_PREPARATION):
+        self._run_iptables = run_iptables
+        self._run_iptables_restore = run_iptables_restore
+        self._preparation = preparation
+        self._proxies = None
+
+    def _known_proxies(self):
+        """
+        :return: The ``set`` of proxies which exist, read from the system only
+            the first time it is needed.
+        """
+        if self._proxies is None:
+            self._proxies = set(enumerate_proxies())
+        return self._proxies
+
     def create_proxy_to(self, ip, port):
         """
         Configure iptables to proxy TCP traffic on the given port.
 
         :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
         """
-        return create_proxy_to(self.logger, ip, port)
+        proxies = self._known_proxies()
+        self._preparation.prepare(self.logger)
+        try:
+            proxy = create_proxy_to(
+                self.logger, ip, port, run_iptables=self._run_iptables)
+        except:
+            # Some of the rules may have been added.
+            self._proxies = None
+            raise
+        proxies.add(normalize_proxy(proxy))
+        return proxy
 
     def delete_proxy(self, proxy):
         """
@@ -323,9 +519,52 @@ class HostNetwork(object):
 
         :see: :meth:`INetwork.delete_proxy` for parameter documentation.
         """
-        return delete_proxy(self.logger, proxy)
+        proxies = self._known_proxies()
+        try:
+            delete_proxy(
+                self.logger, proxy, run_iptables=self._run_iptables)
+        except:
+            # Some of the rules may have been deleted.
+            self._proxies = None
+            raise
+        proxies.discard(normalize_proxy(proxy))
+
+    def set_proxies(self, proxies):
+        """
+        Apply the difference between the existing and the desired proxies in
+        a single ``iptables-restore`` transaction.
+
+        :see: :meth:`INetwork.set_proxies` for parameter documentation.
+        """
+        current = self._known_proxies()
+        desired = set(normalize_proxy(proxy) for proxy in proxies)
+        create = sorted(desired - current)
+        if create:
+            self._preparation.prepare(self.logger)
+        apply_proxies(
+            self.logger, create, sorted(current - desired),
+            run_iptables_restore=self._run_iptables_restore)
+        self._proxies = desired
+
+    def enumerate_proxies(self):
+        """
+        Report the proxies which exist.  The system's iptables configuration
+        is only inspected the first time, or the first time after
+        ``invalidate``; after that the proxies created and deleted by this
+        object are tracked as they change.
 
-    enumerate_proxies = staticmethod(enumerate_proxies)
+        :see: :meth:`INetwork.enumerate_proxies` for parameter documentation.
+        """
+        return list(self._known_proxies())
+
+    def invalidate(self):
+        """
+        Forget the tracked proxies, so that the system's iptables
+        configuration is read again.
+
+        :see: :meth:`INetwork.invalidate` for parameter documentation.
+        """
+        self._proxies = None
 
     def enumerate_used_ports(self):
         """
@@ -335,18 +574,11 @@ class HostNetwork(object):
         :see: :meth:`INetwork.enumerate_used_ports` for parameter
             documentation.
         """
-        listening = set(
-            conn.laddr[1]
-            for conn
-            in net_connections(kind='tcp')
-        )
         proxied = set(
             proxy.port
             for proxy in self.enumerate_proxies()
         )
-        # net_connections won't tell us about ports bound by sockets that
-        # haven't entered the TCP state graph yet.
-        return frozenset(listening | proxied)
+        return frozenset(listening_ports() | proxied)
 
 
 def make_host_network():
@@ -58,3 +58,48 @@ DELETE_PROXY = ActionType(
     [TARGET_IP, TARGET_PORT],
     [],
     u"Flocker is deleting an existing proxy.")
+
+
+LINES = Field.forTypes(
+    u"lines", [int],
+    u"The number of lines of input given to iptables-restore.")
+
+
+CREATED = Field.forTypes(
+    u"created", [int],
+    u"The number of proxies being created.")
+
+
+DELETED = Field.forTypes(
+    u"deleted", [int],
+    u"The number of proxies being deleted.")
+
+
+IPTABLES_RESTORE = ActionType(
+    _system(u"iptables_restore"),
+    [LINES],
+    [],
+    u"A batch of iptables rule changes which Flocker is applying to the "
+    u"system in one transaction.")
+
+
+SET_PROXIES = ActionType(
+    _system(u"set_proxies"),
+    [CREATED, DELETED],
+    [],
+    u"Flocker is changing the configured proxies to a new set.")
+
+
+NFT = ActionType(
+    _system(u"nft"),
+    [ARGV],
+    [],
+    u"An nft command which Flocker is executing against the system.")
+
+
+PREPARE_HOST = ActionType(
+    _system(u"prepare_host"),
+    [],
+    [],
+    u"Flocker is enabling the system network configuration which proxies "
+    u"depend on.")
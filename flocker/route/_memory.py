@@ -33,9 +33,19 @@ class MemoryNetwork(object):
     def delete_proxy(self, proxy):
         self._proxies.remove(proxy)
 
+    def set_proxies(self, proxies):
+        desired = set(Proxy(ip=proxy.ip, port=proxy.port) for proxy in proxies)
+        for proxy in self._proxies - desired:
+            self.delete_proxy(proxy)
+        for proxy in desired - self._proxies:
+            self.create_proxy_to(proxy.ip, proxy.port)
+
     def enumerate_proxies(self):
         return list(self._proxies)
 
+    def invalidate(self):
+        pass
+
     def enumerate_used_ports(self):
         proxy_ports = frozenset(proxy.port for proxy in self._proxies)
         return proxy_ports | self._used_ports
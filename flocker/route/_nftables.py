@@ -0,0 +1,261 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_nftables -*-
+
+"""
+Manipulate network routing behavior on a node using an ``nftables`` map.
+
+Unlike the ``iptables`` implementation, which adds three rules for every
+proxy, this keeps a fixed set of rules which look up the destination of each
+new connection in a map keyed on the destination port.  Netfilter evaluates
+such a lookup in constant time regardless of how many proxies exist, and
+adding or removing a proxy is a single update of the map.
+"""
+
+from __future__ import unicode_literals
+
+import re
+from subprocess import PIPE, Popen, CalledProcessError
+
+from zope.interface import implementer
+from ipaddr import IPAddress
+from eliot import Logger
+
+from ._logging import CREATE_PROXY_TO, DELETE_PROXY, NFT, SET_PROXIES
+from ._interfaces import INetwork
+from ._iptables import HOST_PREPARATION, listening_ports, normalize_proxy
+from ._model import Proxy
+
+TABLE = b"flocker"
+
+PROXIES_MAP = b"proxies"
+
+PROXIED_PORTS_SET = b"proxied_ports"
+
+# The fixed rule set.  The PREROUTING and OUTPUT chains rewrite the
+# destination of traffic directed at this host (including traffic originating
+# on it) to the address found in the proxies map.  The POSTROUTING chain
+# masquerades forwarded traffic so replies come back through this host.  See
+# ``flocker.route._iptables.proxy_rules`` for the reasoning behind each
+# of these.
+_RULESET = [
+    b"add table ip {table}",
+    b"add map ip {table} {map} {{ type inet_service : ipv4_addr ; }}",
+    b"add set ip {table} {set} {{ type inet_service ; }}",
+    b"add chain ip {table} prerouting "
+    b"{{ type nat hook prerouting priority -100 ; }}",
+    b"add chain ip {table} output "
+    b"{{ type nat hook output priority -100 ; }}",
+    b"add chain ip {table} postrouting "
+    b"{{ type nat hook postrouting priority 100 ; }}",
+    b"add rule ip {table} prerouting "
+    b"fib daddr type local dnat to tcp dport map @{map}",
+    b"add rule ip {table} output "
+    b"fib daddr type local dnat to tcp dport map @{map}",
+    b"add rule ip {table} postrouting tcp dport @{set} masquerade",
+]
+
+RULESET = b"".join(
+    command.format(table=TABLE, map=PROXIES_MAP, set=PROXIED_PORTS_SET) +
+    b"\n" for command in _RULESET)
+
+_ELEMENTS = re.compile(br"elements\s*=\s*\{([^}]*)\}")
+
+
+def element_commands(operation, proxies):
+    """
+    Generate ``nft`` commands which add or remove the map and set elements
+    for some proxies.
+
+    :param bytes operation: ``b"add"`` or ``b"delete"``.
+    :param proxies: A ``list`` of ``Proxy`` instances.
+
+    :return: A ``list`` of ``bytes``, each an ``nft`` command.
+    """
+    if not proxies:
+        return []
+    mappings = b", ".join(
+        b"%d : %s" % (proxy.port, unicode(proxy.ip).encode("ascii"))
+        for proxy in proxies)
+    ports = b", ".join(b"%d" % (proxy.port,) for proxy in proxies)
+    return [
+        b"%s element ip %s %s { %s }" % (
+            operation, TABLE, PROXIES_MAP, mappings),
+        b"%s element ip %s %s { %s }" % (
+            operation, TABLE, PROXIED_PORTS_SET, ports),
+    ]
+
+
+def parse_map_elements(output):
+    """
+    Parse the output of ``nft -nn list map`` for the proxies map.
+
+    :param bytes output: The output of ``nft``.
+
+    :return: A ``list`` of ``Proxy`` instances, one for each element.
+    """
+    match = _ELEMENTS.search(output)
+    if match is None:
+        return []
+    proxies = []
+    for element in match.group(1).split(b","):
+        port, ip = element.split(b":")
+        proxies.append(Proxy(ip=IPAddress(ip.strip()), port=int(port)))
+    return proxies
+
+
+@implementer(INetwork)
+class NFTablesNetwork(object):
+    """
+    An ``INetwork`` implementation based on an ``nftables`` map.
+
+    :ivar bytes _nft: The ``nft`` executable to run.
+    :ivar bool _initialized: Whether the fixed rule set is known to exist.
+    :ivar HostPreparation _preparation: The network configuration to put in
+        place before any proxy is created.
+    """
+    logger = Logger()
+
+    def __init__(self, nft, preparation=HOST_PREPARATION):
+        self._nft = nft
+        self._preparation = preparation
+        self._initialized = False
+
+    def _run(self, argv, script=None):
+        """
+        Run ``nft``.
+
+        :param list argv: Arguments to pass to ``nft``.
+        :param bytes script: If not ``None``, commands to feed to ``nft -f
+            -``, which applies all of them in one transaction.
+
+        :raise CalledProcessError: If ``nft`` fails, with the error it wrote
+            as the ``output`` attribute.
+        :return: The output of ``nft`` as ``bytes``.
+        """
+        if script is not None:
+            argv = [b"-f", b"-"] + argv
+        argv = [self._nft] + argv
+        with NFT(logger=self.logger, argv=argv):
+            process = Popen(argv, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            output, error = process.communicate(script)
+            if process.returncode:
+                raise CalledProcessError(process.returncode, argv, error)
+            return output
+
+    def _list(self):
+        """
+        :return: The output of listing the proxies map, or ``None`` if it
+            does not exist.
+        """
+        try:
+            return self._run(
+                [b"-nn", b"list", b"map", b"ip", TABLE, PROXIES_MAP])
+        except CalledProcessError:
+            return None
+
+    def _initialize(self):
+        """
+        Create the fixed rule set if it does not exist yet.
+        """
+        if self._initialized:
+            return
+        if self._list() is None:
+            self._run([], RULESET)
+        self._initialized = True
+
+    def _apply(self, create, delete):
+        """
+        Add and remove the elements for some proxies in one transaction.
+        """
+        self._initialize()
+        if create:
+            self._preparation.prepare(self.logger)
+        commands = (
+            element_commands(b"delete", delete) +
+            element_commands(b"add", create))
+        self._run([], b"".join(command + b"\n" for command in commands))
+
+    def create_proxy_to(self, ip, port):
+        """
+        Add an element to the proxies map.
+
+        :see: :meth:`INetwork.create_proxy_to` for parameter documentation.
+        """
+        with CREATE_PROXY_TO(
+                logger=self.logger, target_ip=ip, target_port=port):
+            proxy = Proxy(ip=ip, port=port)
+            self._apply([proxy], [])
+            return proxy
+
+    def delete_proxy(self, proxy):
+        """
+        Remove an element from the proxies map.
+
+        :see: :meth:`INetwork.delete_proxy` for parameter documentation.
+        """
+        with DELETE_PROXY(
+                logger=self.logger, target_ip=proxy.ip,
+                target_port=proxy.port):
+            self._apply([], [proxy])
+
+    def set_proxies(self, proxies):
+        """
+        Apply the difference between the existing and the desired proxies as
+        a single update of the proxies map.
+
+        :see: :meth:`INetwork.set_proxies` for parameter documentation.
+        """
+        current = set(self.enumerate_proxies())
+        desired = set(normalize_proxy(proxy) for proxy in proxies)
+        create = sorted(desired - current)
+        delete = sorted(current - desired)
+
+        with SET_PROXIES(logger=self.logger, created=len(create),
+                         deleted=len(delete)):
+            if create or delete:
+                self._apply(create, delete)
+
+    def enumerate_proxies(self):
+        """
+        Read the proxies from the proxies map.
+
+        :see: :meth:`INetwork.enumerate_proxies` for parameter documentation.
+        """
+        output = self._list()
+        if output is None:
+            return []
+        return parse_map_elements(output)
+
+    def invalidate(self):
+        """
+        Forget that the fixed rule set exists, so that it is created again
+        if it has been removed.  The proxies map is read every time it is
+        needed anyway.
+
+        :see: :meth:`INetwork.invalidate` for parameter documentation.
+        """
+        self._initialized = False
+
+    def enumerate_used_ports(self):
+        """
+        Find all ports that are in use on this node by normal TCP servers or by
+        proxies managed by this object.
+
+        :see: :meth:`INetwork.enumerate_used_ports` for parameter
+            documentation.
+        """
+        proxied = set(
+            proxy.port
+            for proxy in self.enumerate_proxies()
+        )
+        return frozenset(listening_ports() | proxied)
+
+
+def make_nftables_network(nft=b"nft"):
+    """
+    Create a new ``INetwork`` provider which will configure proxies on the
+    underlying system using an ``nftables`` map.
+
+    :param bytes nft: The ``nft`` executable to use.
+    """
+    return NFTablesNetwork(nft=nft)
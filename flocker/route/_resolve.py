@@ -0,0 +1,116 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.route.test.test_resolve -*-
+
+"""
+Resolution of node hostnames to addresses, with caching.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.python.failure import Failure
+
+# How long, in seconds, to remember the address of a hostname.
+DEFAULT_TTL = 60
+
+# How long, in seconds, to remember that a hostname could not be resolved.
+DEFAULT_NEGATIVE_TTL = 5
+
+
+class CachingResolver(object):
+    """
+    Resolve hostnames to addresses, remembering the answers for a while so
+    that repeatedly resolving the same hostnames does not repeatedly depend
+    on the system resolver.
+
+    Failed lookups are remembered too, for a shorter time, so that a hostname
+    which cannot be resolved does not cause a lookup every time it is used.
+    Concurrent requests for a hostname which is being looked up share that
+    lookup.
+
+    :ivar _reactor: An ``IReactorTime`` provider used to expire answers.
+    :ivar _resolver: The ``IResolverSimple`` provider used to look up
+        hostnames.
+    :ivar _ttl: How long, in seconds, to remember an address.
+    :ivar _negative_ttl: How long, in seconds, to remember a failure.
+    :ivar dict _cache: Map hostnames to two-tuples of the time at which the
+        answer expires and either the ``IPAddress`` or the ``Failure`` of the
+        lookup.
+    :ivar dict _pending: Map hostnames being looked up to ``list``\ s of
+        ``Deferred``\ s waiting for the answer.
+    """
+    def __init__(self, reactor, resolver, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self._reactor = reactor
+        self._resolver = resolver
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._cache = {}
+        self._pending = {}
+
+    def resolve(self, hostname):
+        """
+        Find the address of a hostname.
+
+        :param unicode hostname: The hostname to resolve.  If this is already
+            an address it is returned without any lookup.
+
+        :return: A ``Deferred`` that fires with an ``IPAddress``, or fails if
+            the hostname could not be resolved.
+        """
+        try:
+            return succeed(IPAddress(hostname))
+        except ValueError:
+            pass
+
+        cached = self._cache.get(hostname)
+        if cached is not None:
+            expires, result = cached
+            if expires > self._reactor.seconds():
+                if isinstance(result, Failure):
+                    return fail(result)
+                return succeed(result)
+            del self._cache[hostname]
+
+        waiting = Deferred()
+        if hostname in self._pending:
+            self._pending[hostname].append(waiting)
+            return waiting
+
+        self._pending[hostname] = [waiting]
+        lookup = self._resolver.getHostByName(hostname.encode("idna"))
+        lookup.addCallbacks(
+            self._resolved, self._failed,
+            callbackArgs=(hostname,), errbackArgs=(hostname,))
+        return waiting
+
+    def _resolved(self, address, hostname):
+        """
+        Remember and deliver the address of a hostname.
+        """
+        address = IPAddress(address)
+        self._cache[hostname] = (self._reactor.seconds() + self._ttl, address)
+        for waiting in self._pending.pop(hostname):
+            waiting.callback(address)
+
+    def _failed(self, reason, hostname):
+        """
+        Remember and deliver the failure to look up a hostname.
+        """
+        self._cache[hostname] = (
+            self._reactor.seconds() + self._negative_ttl, reason)
+        for waiting in self._pending.pop(hostname):
+            waiting.errback(reason)
+
+
+def make_caching_resolver(reactor, resolver=None):
+    """
+    Create a new ``CachingResolver``.
+
+    :param reactor: The reactor to use for timing.
+    :param resolver: The ``IResolverSimple`` provider to use for lookups.
+        Default ``None`` means the reactor's resolver.
+    """
+    if resolver is None:
+        resolver = reactor.resolver
+    return CachingResolver(reactor=reactor, resolver=resolver)
@@ -8,7 +8,7 @@ from zope.interface.verify import verifyObject
 from ipaddr import IPAddress
 from twisted.trial.unittest import SynchronousTestCase
 
-from .. import INetwork
+from .. import INetwork, Proxy
 
 
 def make_proxying_tests(make_network):
@@ -108,4 +108,57 @@ def make_proxying_tests(make_network):
                 IPAddress("10.0.0.3"), port_number)
             self.assertIn(port_number, self.network.enumerate_used_ports())
 
+        def test_set_proxies_creates(self):
+            """
+            :py:meth:`INetwork.set_proxies` creates the given proxies when none
+            exist.
+            """
+            proxies = [
+                Proxy(ip=IPAddress("10.0.0.1"), port=1001),
+                Proxy(ip=IPAddress("10.0.0.2"), port=1002),
+            ]
+            self.network.set_proxies(proxies)
+            self.assertEqual(
+                sorted(proxies), sorted(self.network.enumerate_proxies()))
+
+        def test_set_proxies_deletes(self):
+            """
+            :py:meth:`INetwork.set_proxies` deletes existing proxies which are
+            not given to it.
+            """
+            self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+            self.network.set_proxies([])
+            self.assertEqual([], self.network.enumerate_proxies())
+
+        def test_set_proxies_keeps(self):
+            """
+            :py:meth:`INetwork.set_proxies` leaves existing proxies which are
+            given to it in place while applying the other changes.
+            """
+            kept = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+            self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+            added = Proxy(ip=IPAddress("10.0.0.3"), port=1003)
+            self.network.set_proxies([kept, added])
+            self.assertEqual(
+                sorted([kept, added]),
+                sorted(self.network.enumerate_proxies()))
+
+        def test_set_proxies_unchanged(self):
+            """
+            :py:meth:`INetwork.set_proxies` given exactly the existing proxies
+            leaves the configuration unchanged.
+            """
+            proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+            self.network.set_proxies([proxy])
+            self.assertEqual([proxy], self.network.enumerate_proxies())
+
+        def test_invalidate(self):
+            """
+            :py:meth:`INetwork.invalidate` does not change the proxies which
+            are enumerated.
+            """
+            proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+            self.network.invalidate()
+            self.assertEqual([proxy], self.network.enumerate_proxies())
+
     return ProxyingTests
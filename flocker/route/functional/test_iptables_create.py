@@ -14,14 +14,17 @@ from unittest import skipUnless
 from subprocess import check_call
 
 from ipaddr import IPAddress, IPNetwork
+from eliot import MemoryLogger
 from eliot.testing import LoggedAction, validateLogging, assertHasAction
 
 from twisted.trial.unittest import TestCase
 from twisted.python.procutils import which
 
 from ...testtools import if_root
-from .. import make_host_network
-from .._logging import CREATE_PROXY_TO, DELETE_PROXY, IPTABLES
+from .. import make_host_network, Proxy
+from .._logging import (
+    CREATE_PROXY_TO, DELETE_PROXY, IPTABLES, IPTABLES_RESTORE, SET_PROXIES,
+)
 from .networktests import make_proxying_tests
 
 try:
@@ -404,6 +407,67 @@ class DeleteTests(TestCase):
             actual)
 
 
+def one_restore_logged(case, logger):
+    """
+    Assert that a ``SET_PROXIES`` action ran a single ``IPTABLES_RESTORE``
+    action and no individual ``IPTABLES`` actions.
+    """
+    assertHasAction(case, logger, SET_PROXIES, succeeded=True)
+    case.assertEqual(
+        (1, []),
+        (len(LoggedAction.ofType(logger.messages, IPTABLES_RESTORE)),
+         LoggedAction.ofType(logger.messages, IPTABLES)))
+
+
+class SetProxiesTests(TestCase):
+    """
+    Tests for applying a complete set of proxies at once.
+    """
+    @_dependency_skip
+    @_environment_skip
+    def setUp(self):
+        self.addCleanup(create_network_namespace().restore)
+        self.network = make_host_network()
+
+    @validateLogging(one_restore_logged)
+    def test_single_transaction(self, logger):
+        """
+        :py:meth:`HostNetwork.set_proxies` applies all of its changes using a
+        single ``iptables-restore`` invocation.
+        """
+        self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        self.patch(self.network, "logger", logger)
+        self.network.set_proxies([
+            Proxy(ip=IPAddress("10.1.2.4"), port=port)
+            for port in range(20000, 20010)])
+
+    def test_same_rules_as_create(self):
+        """
+        The rules added by :py:meth:`HostNetwork.set_proxies` are the same as
+        those added by :py:meth:`HostNetwork.create_proxy_to`.
+        """
+        original_rules = get_iptables_rules()
+        proxy = self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        expected = get_iptables_rules()
+        self.network.delete_proxy(proxy)
+        self.assertEqual(original_rules, get_iptables_rules())
+
+        self.network.set_proxies([proxy])
+        self.assertEqual(expected, get_iptables_rules())
+
+    def test_nothing_to_do(self):
+        """
+        :py:meth:`HostNetwork.set_proxies` does not run ``iptables-restore``
+        when the existing proxies are already the desired ones.
+        """
+        proxy = self.network.create_proxy_to(IPAddress("10.1.2.3"), 12345)
+        logger = MemoryLogger()
+        self.patch(self.network, "logger", logger)
+        self.network.set_proxies([proxy])
+        self.assertEqual(
+            [], LoggedAction.ofType(logger.messages, IPTABLES_RESTORE))
+
+
 class UsedPortsTests(TestCase):
     """
     Tests for enumeration of used ports.
@@ -450,9 +514,9 @@ class UsedPortsTests(TestCase):
 
     def test_client_ports(self):
         """
-        If a socket is bound to a port and connected to a server then the
-        client port is included in ``HostNetwork.enumerate_used_ports``\ s
-        return value.
+        The port of a socket which is connected to a server but not listening
+        is not included in ``HostNetwork.enumerate_used_ports``\ s return
+        value: only listening sockets are considered.
         """
         network = make_host_network()
         listener = socket()
@@ -469,5 +533,5 @@ class UsedPortsTests(TestCase):
         except error:
             pass
 
-        self.assertIn(
+        self.assertNotIn(
             client.getsockname()[1], network.enumerate_used_ports())
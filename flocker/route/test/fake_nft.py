@@ -0,0 +1,151 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+A fake ``nft`` executable which understands just enough of the ``nft``
+command language to exercise ``flocker.route._nftables``.
+
+It is run as ``python fake_nft.py <state file> <nft arguments>``.  The state
+of the fake ruleset and the number of times the fake has been run are kept in
+the state file as JSON.  Like ``nft -f``, a script either applies completely
+or not at all.
+"""
+
+import json
+import re
+import sys
+
+_COMMANDS = [
+    (re.compile(r"add table ip (\w+)$"), "add_table"),
+    (re.compile(r"add map ip (\w+) (\w+) \{.*\}$"), "add_map"),
+    (re.compile(r"add set ip (\w+) (\w+) \{.*\}$"), "add_set"),
+    (re.compile(r"add chain ip (\w+) (\w+) \{.*\}$"), "add_chain"),
+    (re.compile(r"add rule ip (\w+) (\w+) (.*)$"), "add_rule"),
+    (re.compile(r"(add|delete) element ip (\w+) (\w+) \{ (.*) \}$"),
+     "element"),
+]
+
+
+class NFTError(Exception):
+    """
+    A command could not be applied.
+    """
+
+
+def _table(state, name):
+    try:
+        return state["tables"][name]
+    except KeyError:
+        raise NFTError("No such table: %s" % (name,))
+
+
+def add_table(state, name):
+    state["tables"].setdefault(
+        name, {"maps": {}, "sets": {}, "chains": {}})
+
+
+def add_map(state, table, name):
+    _table(state, table)["maps"].setdefault(name, {})
+
+
+def add_set(state, table, name):
+    _table(state, table)["sets"].setdefault(name, [])
+
+
+def add_chain(state, table, name):
+    _table(state, table)["chains"].setdefault(name, [])
+
+
+def add_rule(state, table, chain, rule):
+    try:
+        _table(state, table)["chains"][chain].append(rule)
+    except KeyError:
+        raise NFTError("No such chain: %s" % (chain,))
+
+
+def element(state, operation, table, name, elements):
+    table = _table(state, table)
+    elements = [value.strip() for value in elements.split(",")]
+    if name in table["maps"]:
+        container = table["maps"][name]
+        for value in elements:
+            key, mapped = [part.strip() for part in value.split(":")]
+            if operation == "add":
+                container[key] = mapped
+            elif key in container:
+                del container[key]
+            else:
+                raise NFTError("No such element: %s" % (key,))
+    elif name in table["sets"]:
+        container = table["sets"][name]
+        for value in elements:
+            if operation == "add":
+                if value not in container:
+                    container.append(value)
+            elif value in container:
+                container.remove(value)
+            else:
+                raise NFTError("No such element: %s" % (value,))
+    else:
+        raise NFTError("No such map or set: %s" % (name,))
+
+
+def apply_script(state, script):
+    for line in script.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for pattern, handler in _COMMANDS:
+            match = pattern.match(line)
+            if match is not None:
+                globals()[handler](state, *match.groups())
+                break
+        else:
+            raise NFTError("Could not process rule: %s" % (line,))
+
+
+def list_map(state, table, name):
+    try:
+        elements = _table(state, table)["maps"][name]
+    except KeyError:
+        raise NFTError("No such file or directory")
+    output = ["table ip %s {" % (table,), "\tmap %s {" % (name,),
+              "\t\ttype inet_service : ipv4_addr"]
+    if elements:
+        output.append("\t\telements = { %s }" % (", ".join(
+            "%s : %s" % (key, value)
+            for key, value in sorted(elements.items())),))
+    output.extend(["\t}", "}"])
+    return "\n".join(output) + "\n"
+
+
+def main(state_path, argv):
+    try:
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+    except IOError:
+        state = {"tables": {}, "runs": 0}
+    state["runs"] += 1
+
+    output = ""
+    status = 0
+    try:
+        if argv[:2] == ["-f", "-"]:
+            changed = json.loads(json.dumps(state))
+            apply_script(changed, sys.stdin.read())
+            state = changed
+        elif argv[:3] == ["-nn", "list", "map"] and argv[3] == "ip":
+            output = list_map(state, argv[4], argv[5])
+        else:
+            raise NFTError("Unsupported arguments: %r" % (argv,))
+    except NFTError as e:
+        sys.stderr.write("Error: %s\n" % (e,))
+        status = 1
+
+    with open(state_path, "w") as state_file:
+        json.dump(state, state_file)
+    sys.stdout.write(output)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,435 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Unit tests for :py:mod:`flocker.route._iptables`.
+"""
+
+import shlex
+
+from ipaddr import IPAddress
+
+from eliot import Logger
+from eliot.testing import validateLogging, assertHasAction
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Proxy
+from .. import _iptables
+from .._logging import PREPARE_HOST
+from .._iptables import (
+    FLOCKER_COMMENT_MARKER, HostNetwork, HostPreparation, listening_ports,
+    parse_listening_ports, proxy_rules, restore_input,
+)
+
+
+def make_conf(case, interfaces):
+    """
+    Create a directory like ``/proc/sys/net/ipv4/conf`` with all of the
+    settings disabled.
+
+    :param TestCase case: The test which will use the directory.
+    :param list interfaces: The names of the interfaces, besides
+        ``default``, to create.
+
+    :return: The ``FilePath`` of the directory.
+    """
+    conf = FilePath(case.mktemp())
+    for name in [b"default"] + interfaces:
+        interface = conf.child(name)
+        interface.makedirs()
+        interface.child(b"forwarding").setContent(b"0\n")
+        interface.child(b"route_localnet").setContent(b"0\n")
+    return conf
+
+
+class RecordingIPTables(object):
+    """
+    A fake for ``iptables`` and ``iptables_restore`` which records the
+    arguments it was called with instead of changing the system.
+
+    :ivar list calls: The ``argv`` or input of each call, in order.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, logger, argv):
+        self.calls.append(argv)
+
+
+class ProxyRulesTests(SynchronousTestCase):
+    """
+    Tests for ``proxy_rules``.
+    """
+    def test_chains(self):
+        """
+        A proxy is implemented by one rule in each of the ``PREROUTING``,
+        ``POSTROUTING`` and ``OUTPUT`` chains.
+        """
+        rules = proxy_rules(Proxy(ip=IPAddress("10.0.0.1"), port=1234))
+        self.assertEqual(
+            [b"PREROUTING", b"POSTROUTING", b"OUTPUT"],
+            [chain for (chain, rule) in rules])
+
+    def test_marked(self):
+        """
+        The ``PREROUTING`` rule is marked with the flocker comment and
+        directs traffic to the proxy's destination.
+        """
+        proxy = Proxy(ip=IPAddress("10.0.0.1"), port=1234)
+        [prerouting] = [
+            rule for (chain, rule) in proxy_rules(proxy)
+            if chain == b"PREROUTING"]
+        self.assertEqual(
+            (FLOCKER_COMMENT_MARKER, b"10.0.0.1"),
+            (prerouting[prerouting.index(b"--comment") + 1],
+             prerouting[prerouting.index(b"--to-destination") + 1]))
+
+
+class RestoreInputTests(SynchronousTestCase):
+    """
+    Tests for ``restore_input``.
+    """
+    def test_empty(self):
+        """
+        With nothing to create or delete the input is an empty ``nat`` table
+        transaction.
+        """
+        self.assertEqual(b"*nat\nCOMMIT\n", restore_input([], []))
+
+    def test_transaction(self):
+        """
+        The rules for every proxy are enclosed in a single ``nat`` table
+        transaction.
+        """
+        lines = restore_input(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1)],
+            [Proxy(ip=IPAddress("10.0.0.2"), port=2)]).splitlines()
+        self.assertEqual(
+            ([b"*nat"], [b"COMMIT"], 6),
+            (lines[:1], lines[-1:], len(lines) - 2))
+
+    def test_deletes_before_creates(self):
+        """
+        Rules for deleted proxies are removed before rules for new proxies are
+        appended, using the same rule specifications as ``proxy_rules``.
+        """
+        created = Proxy(ip=IPAddress("10.0.0.1"), port=1)
+        deleted = Proxy(ip=IPAddress("10.0.0.2"), port=2)
+        lines = restore_input([created], [deleted]).splitlines()[1:-1]
+        expected = [
+            [b"-D", chain] + rule for (chain, rule) in proxy_rules(deleted)
+        ] + [
+            [b"-A", chain] + rule for (chain, rule) in proxy_rules(created)
+        ]
+        self.assertEqual(expected, [shlex.split(line) for line in lines])
+
+
+# Trimmed examples of the kernel's tables: a listener on 127.0.0.1:3306, a
+# client connection from port 45678 and a listener on 0.0.0.0:4567.
+TCP = b"""\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt
+   0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000
+   1: 0100007F:B26E 0100007F:0CEA 01 00000000:00000000 00:00000000 00000000
+   2: 00000000:11D7 00000000:0000 0A 00000000:00000000 00:00000000 00000000
+"""
+
+# A listener on [::]:8080.
+TCP6 = (
+    b"  sl  local_address                         "
+    b"remote_address                        st\n"
+    b"   0: 00000000000000000000000000000000:1F90 "
+    b"00000000000000000000000000000000:0000 0A\n"
+)
+
+
+class ParseListeningPortsTests(SynchronousTestCase):
+    """
+    Tests for ``parse_listening_ports``.
+    """
+    def test_listening(self):
+        """
+        The local ports of listening sockets are found and the ports of other
+        sockets are ignored.
+        """
+        self.assertEqual({3306, 4567}, parse_listening_ports(TCP))
+
+    def test_ipv6(self):
+        """
+        The ports of IPv6 listening sockets are found.
+        """
+        self.assertEqual({8080}, parse_listening_ports(TCP6))
+
+    def test_header_only(self):
+        """
+        A table with only a header has no listening ports.
+        """
+        self.assertEqual(set(), parse_listening_ports(TCP.splitlines()[0]))
+
+
+class ListeningPortsTests(SynchronousTestCase):
+    """
+    Tests for ``listening_ports``.
+    """
+    def setUp(self):
+        self.proc_net = FilePath(self.mktemp())
+        self.proc_net.makedirs()
+        self.proc_net.child(b"tcp").setContent(TCP)
+
+    def test_ipv4_and_ipv6(self):
+        """
+        Listening ports are found in both the ``tcp`` and ``tcp6`` tables.
+        """
+        self.proc_net.child(b"tcp6").setContent(TCP6)
+        self.assertEqual({3306, 4567, 8080}, listening_ports(self.proc_net))
+
+    def test_no_ipv6(self):
+        """
+        A missing ``tcp6`` table is ignored.
+        """
+        self.assertEqual({3306, 4567}, listening_ports(self.proc_net))
+
+
+class HostNetworkCacheTests(SynchronousTestCase):
+    """
+    Tests for the caching of proxies by ``HostNetwork``.
+    """
+    def setUp(self):
+        self.existing = Proxy(ip=IPAddress("10.0.0.1"), port=1001)
+        self.reads = []
+        self.patch(_iptables, "enumerate_proxies", self._enumerate_proxies)
+        self.patch(
+            _iptables, "create_proxy_to",
+            lambda logger, ip, port, run_iptables: Proxy(ip=ip, port=port))
+        self.patch(
+            _iptables, "delete_proxy",
+            lambda logger, proxy, run_iptables: None)
+        self.applied = []
+        self.patch(
+            _iptables, "apply_proxies",
+            lambda logger, create, delete, run_iptables_restore:
+            self.applied.append((create, delete)))
+        self.network = HostNetwork(
+            preparation=HostPreparation(make_conf(self, [b"eth0"])))
+
+    def _enumerate_proxies(self):
+        self.reads.append(None)
+        return [self.existing]
+
+    def test_read_once(self):
+        """
+        The system configuration is only read the first time proxies are
+        enumerated.
+        """
+        first = self.network.enumerate_proxies()
+        second = self.network.enumerate_proxies()
+        self.assertEqual(
+            ([self.existing], [self.existing], 1),
+            (first, second, len(self.reads)))
+
+    def test_create_tracked(self):
+        """
+        Proxies created by ``HostNetwork.create_proxy_to`` are enumerated
+        without reading the system configuration again.
+        """
+        created = self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+        self.assertEqual(
+            ([self.existing, created], 1),
+            (sorted(self.network.enumerate_proxies()), len(self.reads)))
+
+    def test_delete_tracked(self):
+        """
+        Proxies deleted by ``HostNetwork.delete_proxy`` are no longer
+        enumerated.
+        """
+        self.network.delete_proxy(self.existing)
+        self.assertEqual(
+            ([], 1), (self.network.enumerate_proxies(), len(self.reads)))
+
+    def test_set_proxies_tracked(self):
+        """
+        ``HostNetwork.set_proxies`` applies only the difference from the
+        cached proxies and then enumerates the proxies it was given.
+        """
+        new = Proxy(ip=IPAddress("10.0.0.2"), port=1002)
+        self.network.set_proxies([new])
+        self.assertEqual(
+            ([([new], [self.existing])], [new], 1),
+            (self.applied, self.network.enumerate_proxies(), len(self.reads)))
+
+    def test_unicode_address(self):
+        """
+        Proxies given with a textual address are tracked as ``IPAddress``
+        instances, matching the proxies read from the system.
+        """
+        self.network.set_proxies([Proxy(ip=u"10.0.0.1", port=1001)])
+        self.assertEqual(
+            ([([], [])], [self.existing]),
+            (self.applied, self.network.enumerate_proxies()))
+
+    def test_failure_invalidates(self):
+        """
+        If creating a proxy fails the system configuration is read again the
+        next time proxies are enumerated.
+        """
+        def broken(logger, ip, port, run_iptables):
+            raise ZeroDivisionError()
+        self.patch(_iptables, "create_proxy_to", broken)
+        self.assertRaises(
+            ZeroDivisionError,
+            self.network.create_proxy_to, IPAddress("10.0.0.2"), 1002)
+        self.network.enumerate_proxies()
+        self.assertEqual(2, len(self.reads))
+
+    def test_invalidate(self):
+        """
+        After ``HostNetwork.invalidate`` the system configuration is read
+        again the next time proxies are enumerated, so proxies removed by
+        something else are no longer reported.
+        """
+        self.network.enumerate_proxies()
+        self.existing = Proxy(ip=IPAddress("10.0.0.2"), port=1002)
+        self.network.invalidate()
+        self.assertEqual(
+            ([self.existing], 2),
+            (self.network.enumerate_proxies(), len(self.reads)))
+
+
+class HostPreparationTests(SynchronousTestCase):
+    """
+    Tests for ``HostPreparation``.
+    """
+    def setUp(self):
+        self.conf = make_conf(self, [b"eth0", b"lo"])
+        self.preparation = HostPreparation(self.conf)
+
+    def settings(self):
+        """
+        :return: A ``dict`` mapping the path of each setting below the
+            configuration directory to its content.
+        """
+        return {
+            b"/".join(path.segmentsFrom(self.conf)): path.getContent()
+            for path in self.conf.walk() if path.isfile()}
+
+    def test_not_in_place(self):
+        """
+        ``HostPreparation.in_place`` returns ``False`` if the settings are
+        disabled.
+        """
+        self.assertFalse(self.preparation.in_place())
+
+    def test_prepare(self):
+        """
+        ``HostPreparation.prepare`` enables forwarding by default and
+        ``route_localnet`` on every interface.
+        """
+        self.preparation.prepare(Logger())
+        self.assertEqual(
+            (True, b"1", b"0\n"),
+            (self.preparation.in_place(),
+             self.conf.descendant([b"default", b"forwarding"]).getContent(),
+             self.conf.descendant([b"eth0", b"forwarding"]).getContent()))
+
+    def test_already_in_place(self):
+        """
+        ``HostPreparation.prepare`` does not write the settings if they are
+        already enabled.
+        """
+        self.preparation.prepare(Logger())
+        for path in self.conf.walk():
+            if path.isfile():
+                path.setContent(path.getContent() + b"\n")
+        before = self.settings()
+        HostPreparation(self.conf).prepare(Logger())
+        self.assertEqual(before, self.settings())
+
+    def test_prepared_once(self):
+        """
+        After the settings have been put in place, ``HostPreparation.prepare``
+        does not write them again.
+        """
+        self.preparation.prepare(Logger())
+        self.conf.descendant([b"eth0", b"route_localnet"]).setContent(b"0")
+        self.preparation.prepare(Logger())
+        self.assertEqual(
+            b"0",
+            self.conf.descendant([b"eth0", b"route_localnet"]).getContent())
+
+    def test_forwarding_rechecked(self):
+        """
+        If forwarding has been disabled since the settings were put in
+        place, ``HostPreparation.prepare`` puts them in place again.
+        """
+        self.preparation.prepare(Logger())
+        self.conf.descendant([b"default", b"forwarding"]).setContent(b"0")
+        self.conf.descendant([b"eth0", b"route_localnet"]).setContent(b"0")
+        self.preparation.prepare(Logger())
+        self.assertTrue(self.preparation.in_place())
+
+    @validateLogging(assertHasAction, PREPARE_HOST, True)
+    def test_logged(self, logger):
+        """
+        ``HostPreparation.prepare`` logs an action when it checks the
+        settings.
+        """
+        self.preparation.prepare(logger)
+
+
+class HostNetworkRulesTests(SynchronousTestCase):
+    """
+    Tests for the rules ``HostNetwork`` applies, using recording fakes for
+    ``iptables`` and ``iptables-restore``.
+    """
+    def setUp(self):
+        self.patch(_iptables, "enumerate_proxies", lambda: [])
+        self.conf = make_conf(self, [b"eth0"])
+        self.iptables = RecordingIPTables()
+        self.iptables_restore = RecordingIPTables()
+        self.network = HostNetwork(
+            run_iptables=self.iptables,
+            run_iptables_restore=self.iptables_restore,
+            preparation=HostPreparation(self.conf))
+        self.proxy = Proxy(ip=IPAddress("10.0.0.1"), port=1234)
+
+    def test_create_proxy_to(self):
+        """
+        ``HostNetwork.create_proxy_to`` appends each of the proxy's rules to
+        its chain and prepares the host.
+        """
+        self.network.create_proxy_to(self.proxy.ip, self.proxy.port)
+        self.assertEqual(
+            ([[b"--table", b"nat", b"--append", chain] + rule
+              for (chain, rule) in proxy_rules(self.proxy)], True),
+            (self.iptables.calls,
+             HostPreparation(self.conf).in_place()))
+
+    def test_delete_proxy(self):
+        """
+        ``HostNetwork.delete_proxy`` deletes each of the proxy's rules from
+        its chain.
+        """
+        self.network.delete_proxy(self.proxy)
+        self.assertEqual(
+            [[b"--table", b"nat", b"--delete", chain] + rule
+             for (chain, rule) in proxy_rules(self.proxy)],
+            self.iptables.calls)
+
+    def test_set_proxies(self):
+        """
+        ``HostNetwork.set_proxies`` applies the new proxies with a single
+        ``iptables-restore`` and prepares the host.
+        """
+        self.network.set_proxies([self.proxy])
+        self.assertEqual(
+            ([restore_input([self.proxy], [])], [], True),
+            (self.iptables_restore.calls, self.iptables.calls,
+             HostPreparation(self.conf).in_place()))
+
+    def test_delete_only_not_prepared(self):
+        """
+        ``HostNetwork.set_proxies`` does not prepare the host when it only
+        deletes proxies.
+        """
+        self.network.set_proxies([])
+        self.assertFalse(HostPreparation(self.conf).in_place())
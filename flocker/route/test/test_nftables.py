@@ -0,0 +1,243 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._nftables`.
+"""
+
+import json
+import sys
+from subprocess import CalledProcessError
+
+from ipaddr import IPAddress
+from eliot.testing import LoggedAction, validateLogging, assertHasAction
+
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import make_nftables_network, Proxy
+from .. import _nftables
+from .._logging import NFT, SET_PROXIES
+from .._nftables import element_commands, parse_map_elements
+from ..functional.networktests import make_proxying_tests
+
+FAKE_NFT = FilePath(__file__).sibling(b"fake_nft.py")
+
+
+def make_fake_nft(case):
+    """
+    Create a fake ``nft`` executable for the duration of a test and stop
+    ``NFTablesNetwork`` from touching the real system configuration.
+
+    :param TestCase case: The test which will use the fake.
+
+    :return: A two-tuple of the path of the fake executable and a no-argument
+        callable returning the fake's current state.
+    """
+    case.patch(_nftables.HOST_PREPARATION, "prepare", lambda logger: None)
+    directory = FilePath(case.mktemp())
+    directory.makedirs()
+    state = directory.child(b"state.json")
+    nft = directory.child(b"nft")
+    nft.setContent(b'#!/bin/sh\nexec %s %s %s "$@"\n' % (
+        sys.executable, FAKE_NFT.path, state.path))
+    nft.chmod(0755)
+
+    def get_state():
+        if not state.exists():
+            return {"tables": {}, "runs": 0}
+        return json.loads(state.getContent())
+    return nft.path, get_state
+
+
+class NFTablesProxyTests(make_proxying_tests(None)):
+    """
+    Apply the generic ``INetwork`` test suite to the ``nftables``
+    implementation, driving a fake ``nft``.
+    """
+    def setUp(self):
+        nft, self.state = make_fake_nft(self)
+        self.network = make_nftables_network(nft=nft)
+
+
+class NFTablesNetworkTests(SynchronousTestCase):
+    """
+    Tests for the ``nft`` commands run by ``NFTablesNetwork``.
+    """
+    def setUp(self):
+        self.nft, self.state = make_fake_nft(self)
+        self.network = make_nftables_network(nft=self.nft)
+
+    def test_fixed_rules(self):
+        """
+        The first change creates one rule in each of the prerouting, output and
+        postrouting chains, all of which consult the proxies map or the set of
+        proxied ports.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        chains = self.state()["tables"]["flocker"]["chains"]
+        self.assertEqual(
+            {"prerouting": 1, "output": 1, "postrouting": 1},
+            dict((name, len(rules)) for (name, rules) in chains.items()))
+
+    def test_rules_do_not_grow(self):
+        """
+        Creating more proxies adds map elements but no rules.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        before = self.state()["tables"]["flocker"]["chains"]
+        self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+        self.network.create_proxy_to(IPAddress("10.0.0.3"), 1003)
+        table = self.state()["tables"]["flocker"]
+        self.assertEqual(
+            (before, {"1001": "10.0.0.1", "1002": "10.0.0.2",
+                      "1003": "10.0.0.3"},
+             ["1001", "1002", "1003"]),
+            (table["chains"], table["maps"]["proxies"],
+             table["sets"]["proxied_ports"]))
+
+    def test_existing_rules_reused(self):
+        """
+        A new ``NFTablesNetwork`` does not re-create rules which already exist.
+        """
+        nft = self.network._nft
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        make_nftables_network(nft=nft).create_proxy_to(
+            IPAddress("10.0.0.2"), 1002)
+        chains = self.state()["tables"]["flocker"]["chains"]
+        self.assertEqual(
+            [1, 1, 1], [len(rules) for rules in chains.values()])
+
+    def test_one_update_per_proxy(self):
+        """
+        Once the rules exist, creating a proxy runs ``nft`` just once.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        runs = self.state()["runs"]
+        self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+        self.assertEqual(runs + 1, self.state()["runs"])
+
+    def test_set_proxies_one_update(self):
+        """
+        ``set_proxies`` lists the existing proxies and applies all of the
+        changes with one further run of ``nft``.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+        runs = self.state()["runs"]
+        self.network.set_proxies([
+            Proxy(ip=IPAddress("10.0.0.1"), port=1001),
+            Proxy(ip=IPAddress("10.0.0.3"), port=1003),
+            Proxy(ip=IPAddress("10.0.0.4"), port=1004),
+        ])
+        self.assertEqual(runs + 2, self.state()["runs"])
+
+    def test_set_proxies_nothing_to_do(self):
+        """
+        ``set_proxies`` only lists the existing proxies when they are already
+        the desired ones.
+        """
+        proxy = self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        runs = self.state()["runs"]
+        self.network.set_proxies([proxy])
+        self.assertEqual(runs + 1, self.state()["runs"])
+
+    def test_failure(self):
+        """
+        If ``nft`` fails, ``CalledProcessError`` is raised and no change is
+        made.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        self.assertRaises(
+            CalledProcessError,
+            self.network.delete_proxy,
+            Proxy(ip=IPAddress("10.0.0.2"), port=1002))
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=1001)],
+            self.network.enumerate_proxies())
+
+    def test_empty_without_table(self):
+        """
+        ``enumerate_proxies`` returns an empty ``list`` and does not create any
+        rules when the ``flocker`` table does not exist.
+        """
+        self.assertEqual(
+            ([], {}),
+            (self.network.enumerate_proxies(), self.state()["tables"]))
+
+    def test_invalidate(self):
+        """
+        After ``invalidate``, the fixed rule set is created again if it was
+        removed by something else, such as a flush of the ruleset.
+        """
+        self.network.create_proxy_to(IPAddress("10.0.0.1"), 1001)
+        state = self.state()
+        state["tables"] = {}
+        FilePath(self.nft).sibling(b"state.json").setContent(
+            json.dumps(state))
+        self.network.invalidate()
+        proxy = self.network.create_proxy_to(IPAddress("10.0.0.2"), 1002)
+        self.assertEqual([proxy], self.network.enumerate_proxies())
+
+    @validateLogging(None)
+    def test_logging(self, logger):
+        """
+        ``set_proxies`` logs a ``SET_PROXIES`` action and the ``nft`` commands
+        it runs.
+        """
+        self.patch(self.network, "logger", logger)
+        self.network.set_proxies([Proxy(ip=IPAddress("10.0.0.1"), port=1001)])
+        assertHasAction(
+            self, logger, SET_PROXIES, succeeded=True,
+            startFields={"created": 1, "deleted": 0})
+        self.assertNotEqual([], LoggedAction.ofType(logger.messages, NFT))
+
+
+class ElementCommandsTests(SynchronousTestCase):
+    """
+    Tests for ``element_commands``.
+    """
+    def test_empty(self):
+        """
+        No commands are needed for no proxies.
+        """
+        self.assertEqual([], element_commands(b"add", []))
+
+    def test_commands(self):
+        """
+        One command updates the proxies map and one updates the set of proxied
+        ports, however many proxies there are.
+        """
+        self.assertEqual(
+            [b"delete element ip flocker proxies "
+             b"{ 1 : 10.0.0.1, 2 : 10.0.0.2 }",
+             b"delete element ip flocker proxied_ports { 1, 2 }"],
+            element_commands(b"delete", [
+                Proxy(ip=IPAddress("10.0.0.1"), port=1),
+                Proxy(ip=IPAddress("10.0.0.2"), port=2)]))
+
+
+class ParseMapElementsTests(SynchronousTestCase):
+    """
+    Tests for ``parse_map_elements``.
+    """
+    def test_no_elements(self):
+        """
+        A map without elements contains no proxies.
+        """
+        self.assertEqual([], parse_map_elements(
+            b"table ip flocker {\n\tmap proxies {\n"
+            b"\t\ttype inet_service : ipv4_addr\n\t}\n}\n"))
+
+    def test_elements(self):
+        """
+        Each element of the map, including those ``nft`` wraps onto further
+        lines, is a proxy.
+        """
+        self.assertEqual(
+            [Proxy(ip=IPAddress("10.0.0.1"), port=80),
+             Proxy(ip=IPAddress("10.0.0.2"), port=3306)],
+            parse_map_elements(
+                b"table ip flocker {\n\tmap proxies {\n"
+                b"\t\ttype inet_service : ipv4_addr\n"
+                b"\t\telements = { 80 : 10.0.0.1,\n"
+                b"\t\t\t     3306 : 10.0.0.2 }\n\t}\n}\n"))
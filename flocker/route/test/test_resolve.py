@@ -0,0 +1,134 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Tests for :py:mod:`flocker.route._resolve`.
+"""
+
+from ipaddr import IPAddress
+
+from twisted.internet.error import DNSLookupError
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import make_caching_resolver
+from .._resolve import CachingResolver
+from ..testtools import FakeResolver
+
+
+class CachingResolverTests(SynchronousTestCase):
+    """
+    Tests for ``CachingResolver``.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.lookups = FakeResolver({b"node1.example.com": b"192.0.2.1"})
+        self.resolver = CachingResolver(
+            reactor=self.clock, resolver=self.lookups, ttl=60,
+            negative_ttl=5)
+
+    def test_address(self):
+        """
+        An address is returned as an ``IPAddress`` without being looked up.
+        """
+        result = self.resolver.resolve(u"192.0.2.5")
+        self.assertEqual(
+            (IPAddress("192.0.2.5"), []),
+            (self.successResultOf(result), self.lookups.lookups))
+
+    def test_resolve(self):
+        """
+        A hostname is looked up and its address returned as an ``IPAddress``.
+        """
+        result = self.resolver.resolve(u"node1.example.com")
+        self.assertEqual(IPAddress("192.0.2.1"), self.successResultOf(result))
+
+    def test_cached(self):
+        """
+        A hostname resolved within the TTL is not looked up again.
+        """
+        self.resolver.resolve(u"node1.example.com")
+        self.clock.advance(59)
+        result = self.resolver.resolve(u"node1.example.com")
+        self.assertEqual(
+            (IPAddress("192.0.2.1"), [b"node1.example.com"]),
+            (self.successResultOf(result), self.lookups.lookups))
+
+    def test_expired(self):
+        """
+        A hostname is looked up again once its TTL has passed.
+        """
+        self.resolver.resolve(u"node1.example.com")
+        self.clock.advance(60)
+        self.lookups.addresses[b"node1.example.com"] = b"192.0.2.9"
+        result = self.resolver.resolve(u"node1.example.com")
+        self.assertEqual(
+            (IPAddress("192.0.2.9"), 2),
+            (self.successResultOf(result), len(self.lookups.lookups)))
+
+    def test_failure(self):
+        """
+        A hostname which cannot be resolved results in a failed ``Deferred``.
+        """
+        self.failureResultOf(
+            self.resolver.resolve(u"unknown.example.com"), DNSLookupError)
+
+    def test_negative_cached(self):
+        """
+        A failure to resolve a hostname is remembered for the negative TTL.
+        """
+        self.failureResultOf(self.resolver.resolve(u"unknown.example.com"))
+        self.clock.advance(4)
+        self.failureResultOf(
+            self.resolver.resolve(u"unknown.example.com"), DNSLookupError)
+        self.assertEqual(1, len(self.lookups.lookups))
+
+    def test_negative_expired(self):
+        """
+        A hostname which could not be resolved is looked up again once the
+        negative TTL has passed.
+        """
+        self.failureResultOf(self.resolver.resolve(u"unknown.example.com"))
+        self.clock.advance(5)
+        self.lookups.addresses[b"unknown.example.com"] = b"192.0.2.3"
+        result = self.resolver.resolve(u"unknown.example.com")
+        self.assertEqual(IPAddress("192.0.2.3"), self.successResultOf(result))
+
+    def test_concurrent(self):
+        """
+        Concurrent requests for a hostname which is being looked up share one
+        lookup.
+        """
+        self.lookups.delayed = True
+        first = self.resolver.resolve(u"node1.example.com")
+        second = self.resolver.resolve(u"node1.example.com")
+        self.assertNoResult(first)
+        self.lookups.answer()
+        self.assertEqual(
+            (IPAddress("192.0.2.1"), IPAddress("192.0.2.1"), 1),
+            (self.successResultOf(first), self.successResultOf(second),
+             len(self.lookups.lookups)))
+
+
+class MakeCachingResolverTests(SynchronousTestCase):
+    """
+    Tests for ``make_caching_resolver``.
+    """
+    def test_reactor_resolver(self):
+        """
+        By default hostnames are looked up using the reactor's resolver.
+        """
+        reactor = Clock()
+        reactor.resolver = FakeResolver({b"node1.example.com": b"192.0.2.1"})
+        result = make_caching_resolver(reactor).resolve(u"node1.example.com")
+        self.assertEqual(IPAddress("192.0.2.1"), self.successResultOf(result))
+
+    def test_resolver(self):
+        """
+        A different resolver can be given.
+        """
+        reactor = Clock()
+        reactor.resolver = FakeResolver({})
+        resolver = FakeResolver({b"node1.example.com": b"192.0.2.1"})
+        result = make_caching_resolver(reactor, resolver).resolve(
+            u"node1.example.com")
+        self.assertEqual(IPAddress("192.0.2.1"), self.successResultOf(result))
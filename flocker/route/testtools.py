@@ -0,0 +1,51 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Testing utilities provided by ``flocker.route``.
+"""
+
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred
+from twisted.internet.error import DNSLookupError
+from twisted.internet.interfaces import IResolverSimple
+
+
+@implementer(IResolverSimple)
+class FakeResolver(object):
+    """
+    An ``IResolverSimple`` which answers lookups from a fixed table, either
+    immediately or when told to.
+
+    :ivar dict addresses: Map hostnames to the addresses they resolve to.
+        Hostnames which are not present fail to resolve.
+    :ivar list lookups: The hostnames which have been looked up, in order.
+    :ivar bool delayed: If ``True``, lookups are not answered until
+        ``answer`` is called.
+    :ivar list _waiting: Two-tuples of hostname and ``Deferred`` for lookups
+        which have not been answered yet.
+    """
+    def __init__(self, addresses, delayed=False):
+        self.addresses = addresses
+        self.delayed = delayed
+        self.lookups = []
+        self._waiting = []
+
+    def getHostByName(self, name, timeout=None):
+        self.lookups.append(name)
+        d = Deferred()
+        self._waiting.append((name, d))
+        if not self.delayed:
+            self.answer()
+        return d
+
+    def answer(self):
+        """
+        Answer all of the lookups which are waiting.
+        """
+        waiting, self._waiting = self._waiting, []
+        for name, d in waiting:
+            if name in self.addresses:
+                d.callback(self.addresses[name])
+            else:
+                d.errback(DNSLookupError(name))
@@ -14,7 +14,7 @@ from collections import namedtuple
 from contextlib import contextmanager
 from random import random
 import shutil
-from subprocess import check_call
+from subprocess import check_call, check_output
 from functools import wraps
 from unittest import skipIf
 
@@ -188,6 +188,41 @@ def loop_until(predicate):
     return d
 
 
+def imported_modules(module_name):
+    """
+    Import a module in a new Python process.
+
+    :param bytes module_name: The fully qualified name of the module to
+        import.
+
+    :return: A ``set`` of the names of all modules the import loaded.
+    """
+    output = check_output([
+        sys.executable, b"-c",
+        b"import sys; import " + module_name + b"; "
+        b"print('\\n'.join(name for name in sys.modules "
+        b"if sys.modules[name] is not None))"],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    return set(output.splitlines())
+
+
+def assert_not_imported(case, module_name, unwanted):
+    """
+    Assert that importing a module in a new Python process does not load
+    any of the given modules.
+
+    :param case: The ``TestCase`` to use to fail.
+    :param bytes module_name: The fully qualified name of the module to
+        import.
+    :param unwanted: An iterable of the names of top-level packages or
+        modules which must not be loaded.
+    """
+    loaded = imported_modules(module_name)
+    case.assertEqual(
+        set(), {name for name in unwanted if name in loaded},
+        "{} loaded modules it does not need.".format(module_name))
+
+
 def random_name():
     """Return a short, random name.
 
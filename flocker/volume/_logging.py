@@ -0,0 +1,42 @@
+# Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+
+"""
+Eliot log message types for the volume manager.
+"""
+
+from eliot import Field, MessageType
+
+
+def _system(name):
+    return u"flocker:volume:" + name
+
+
+VOLUME = Field.forTypes(
+    u"volume", [bytes], u"The name of the volume.")
+
+
+ROUND = Field.forTypes(
+    u"round", [int], u"The number of pushes made so far, starting at 1.")
+
+
+WRITTEN = Field.forTypes(
+    u"written", [int, None],
+    u"The number of bytes written to the volume since the latest push, or "
+    u"null if it could not be determined.")
+
+
+DURATION = Field.forTypes(
+    u"duration", [float], u"The time taken, in seconds.")
+
+
+PRECOPY_ROUND = MessageType(
+    _system(u"precopy_round"),
+    [VOLUME, ROUND, WRITTEN],
+    u"A push of a volume ahead of its handoff finished.")
+
+
+HANDOFF = MessageType(
+    _system(u"handoff"),
+    [VOLUME, DURATION],
+    u"A volume was handed off.  Its application is not running anywhere for "
+    u"the duration of the handoff.")
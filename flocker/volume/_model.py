@@ -5,16 +5,32 @@
 Record types for representing volume models.
 """
 
-from characteristic import attributes
+from characteristic import attributes, Attribute
 
 
-@attributes(["maximum_size"], apply_immutable=True)
+# The names of the filesystem properties which may be tuned on a per-volume
+# basis.  Any other filesystem properties are managed by Flocker itself.
+TUNABLE_PROPERTIES = frozenset([
+    u"recordsize", u"compression", u"atime", u"logbias", u"primarycache",
+])
+
+
+@attributes(["maximum_size",
+             Attribute("properties", default_value=frozenset())],
+            apply_immutable=True)
 class VolumeSize(object):
     """
-    A data volume's size.
+    A data volume's size and storage tuning.
 
     :ivar int maximum_size: The upper bound on the amount of data that can be
         stored on this volume, in bytes.  May also be ``None`` to indicate no
         particular upper bound is required (when representing desired
         configuration) or known (when representing deployed configuration).
+
+    :ivar frozenset properties: A ``frozenset`` of ``(unicode, unicode)``
+        tuples mapping the names of filesystem properties (see
+        ``TUNABLE_PROPERTIES``) to the values they should have (when
+        representing desired configuration) or have been explicitly given
+        (when representing deployed configuration).  Properties which are not
+        included use the storage pool's defaults.
     """
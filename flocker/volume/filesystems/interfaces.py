@@ -70,7 +70,23 @@ class IFilesystem(Interface):
             which exist of this filesystem.
         """
 
-    def reader(remote_snapshots=None):
+    def written_since(remote_snapshots):
+        """
+        Determine how much data has been written to the filesystem since the
+        latest snapshot it has in common with a writer.
+
+        A blocking API, for now.
+
+        :param remote_snapshots: An iterable of the snapshots which are
+            available on the writer, ordered from oldest to newest.
+
+        :return: The number of bytes written since the latest common snapshot
+            as an ``int``, or ``None`` if there is no common snapshot (or the
+            amount cannot be determined) and so a complete data stream would
+            be required.
+        """
+
+    def reader(remote_snapshots=None, snapshot=None):
         """
         Context manager that allows reading the contents of the filesystem.
 
@@ -84,6 +100,11 @@ class IFilesystem(Interface):
             possible.  If no value is passed then a complete data stream will
             be generated.
 
+        :param Snapshot snapshot: A snapshot of this filesystem which has
+            already been taken (for example by ``IStoragePool.snapshot``) and
+            whose contents should be read.  If no value is passed then a new
+            snapshot is taken.
+
         :return: A file-like object from whom the filesystem's data can be
             read as ``bytes``.
         """
@@ -149,6 +170,37 @@ class IStoragePool(Interface):
             exception for other problems.
         """
 
+    def set_properties(volume):
+        """
+        Set the tunable properties of a filesystem for the given volume.
+
+        Tunable properties which are not included in the volume's
+        ``size.properties`` revert to the pool's defaults.
+
+        :param volume: The volume whose filesystem properties should be
+            modified.
+        :type volume: :class:`flocker.volume.service.Volume`
+
+        :return: Deferred that fires on filesystem modification with a
+            :class:`IFilesystem` provider, or errbacks if setting the
+            properties failed.
+        """
+
+    def snapshot(volumes):
+        """
+        Take a snapshot of the filesystems of several volumes at once.
+
+        The snapshots are consistent with each other: they all reflect the
+        state of their filesystems at the same point in time.
+
+        :param volumes: The volumes whose filesystems should be snapshotted.
+        :type volumes: ``list`` of :class:`flocker.volume.service.Volume`
+
+        :return: Deferred that fires with a ``Snapshot`` giving the name of
+            the snapshot taken of each filesystem, or errbacks if taking the
+            snapshots failed.
+        """
+
     def clone_to(parent, volume):
         """
         Clone an existing volume to create a new one.
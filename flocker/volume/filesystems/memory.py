@@ -4,10 +4,12 @@
 
 from __future__ import absolute_import
 
+import json
 from errno import ENOENT
 from contextlib import contextmanager
 from tarfile import TarFile
 from io import BytesIO
+from uuid import uuid4
 
 from zope.interface import implementer
 
@@ -100,10 +102,20 @@ class DirectoryFilesystem(object):
                 snapshot.name for snapshot in self._snapshots()] + [name])
         )
 
+    def written_since(self, remote_snapshots):
+        """
+        Pretend snapshots do not record the contents of the filesystem so the
+        amount of data written since one of them is never known.
+        """
+        return None
+
     @contextmanager
-    def reader(self, remote_snapshots=None):
+    def reader(self, remote_snapshots=None, snapshot=None):
         """
         Package up filesystem contents as a tarball.
+
+        Pretend snapshots have no contents of their own so the current
+        contents are packaged regardless of ``snapshot``.
         """
         result = BytesIO()
         tarball = TarFile(fileobj=result, mode="w")
@@ -166,6 +178,25 @@ class FilesystemStoragePool(Service):
         if volume.size.maximum_size is not None:
             root.child(b".size").setContent(
                 u"{0}".format(volume.size.maximum_size).encode("ascii"))
+        self._write_properties(root, volume.size.properties)
+        return succeed(filesystem)
+
+    def _write_properties(self, root, properties):
+        """
+        Record pretend filesystem properties alongside the pretend filesystem.
+
+        :param FilePath root: The directory of the filesystem.
+        :param frozenset properties: The properties to record.
+        """
+        path = root.child(b".properties")
+        if properties:
+            path.setContent(json.dumps(sorted(properties)))
+        elif path.exists():
+            path.remove()
+
+    def set_properties(self, volume):
+        filesystem = self.get(volume)
+        self._write_properties(filesystem.get_path(), volume.size.properties)
         return succeed(filesystem)
 
     def set_maximum_size(self, volume):
@@ -174,10 +205,16 @@ class FilesystemStoragePool(Service):
         if volume.size.maximum_size is not None:
             root.child(b".size").setContent(
                 u"{0}".format(volume.size.maximum_size).encode("ascii"))
-        else:
+        elif root.child(b".size").exists():
             root.child(b".size").remove()
         return succeed(filesystem)
 
+    def snapshot(self, volumes):
+        snapshot = Snapshot(name=bytes(uuid4()))
+        for volume in volumes:
+            self.get(volume).snapshot(snapshot.name)
+        return succeed(snapshot)
+
     def clone_to(self, parent, volume):
         parent = self.get(parent)
         child = self.get(volume)
@@ -219,10 +256,17 @@ class FilesystemStoragePool(Service):
                         path.child(b".size").getContent().decode("ascii"))
                 else:
                     maximum_size = None
+                if path.child(b".properties").exists():
+                    properties = frozenset(
+                        tuple(pair) for pair in json.loads(
+                            path.child(b".properties").getContent()))
+                else:
+                    properties = frozenset()
                 filesystems.add(
                     DirectoryFilesystem(
                         path=path,
-                        size=VolumeSize(maximum_size=maximum_size),
+                        size=VolumeSize(maximum_size=maximum_size,
+                                        properties=properties),
                     )
                 )
         return succeed(filesystems)
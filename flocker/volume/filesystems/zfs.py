@@ -8,12 +8,13 @@ from __future__ import absolute_import
 
 import os
 from contextlib import contextmanager
+from weakref import WeakKeyDictionary
 from uuid import uuid4
 from subprocess import (
     CalledProcessError, STDOUT, PIPE, Popen, check_call, check_output
 )
 
-from characteristic import attributes, with_cmp, with_repr
+from characteristic import Attribute, attributes, with_cmp, with_repr
 
 from zope.interface import implementer
 
@@ -23,7 +24,7 @@ from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.internet.endpoints import ProcessEndpoint, connectProtocol
 from twisted.internet.protocol import Protocol
-from twisted.internet.defer import Deferred, succeed
+from twisted.internet.defer import Deferred, succeed, gatherResults
 from twisted.internet.error import ConnectionDone, ProcessTerminated
 from twisted.application.service import Service
 
@@ -32,7 +33,7 @@ from .interfaces import (
     IFilesystemSnapshots, IStoragePool, IFilesystem,
     FilesystemAlreadyExists)
 
-from .._model import VolumeSize
+from .._model import VolumeSize, TUNABLE_PROPERTIES
 
 
 def random_name():
@@ -75,18 +76,17 @@ class _AccumulatingProtocol(Protocol):
         del self._result
 
 
-def zfs_command(reactor, arguments):
+def _spawn_zfs(reactor, arguments):
     """
-    Asynchronously run the ``zfs`` command-line tool with the given arguments.
+    Launch the ``zfs`` command-line tool with the given arguments.
 
     :param reactor: A ``IReactorProcess`` provider.
 
     :param arguments: A ``list`` of ``bytes``, command-line arguments to
     ``zfs``.
 
-    :return: A :class:`Deferred` firing with the bytes of the result (on
-        exit code 0), or errbacking with :class:`CommandFailed` or
-        :class:`BadArguments` depending on the exit code (1 or 2).
+    :return: A :class:`Deferred` with the same behavior as the one returned by
+        ``zfs_command``.
     """
     endpoint = ProcessEndpoint(reactor, b"zfs", [b"zfs"] + arguments,
                                os.environ)
@@ -95,29 +95,298 @@ def zfs_command(reactor, arguments):
     return d
 
 
+def zfs_command(reactor, arguments):
+    """
+    Asynchronously run the ``zfs`` command-line tool with the given arguments.
+
+    The command is scheduled by the ``_ZFSCommandQueue`` of ``reactor`` so,
+    unless it only reads, it may wait for earlier commands to finish and may
+    be combined with other compatible commands into a single ``zfs``
+    invocation.
+
+    :param reactor: A ``IReactorProcess`` provider.
+
+    :param arguments: A ``list`` of ``bytes``, command-line arguments to
+    ``zfs``.
+
+    :return: A :class:`Deferred` firing with the bytes of the result (on
+        exit code 0), or errbacking with :class:`CommandFailed` or
+        :class:`BadArguments` depending on the exit code (1 or 2).
+    """
+    return _command_queue(reactor).run(arguments)
+
+
 _ZFS_COMMAND = Field.forTypes(
     "zfs_command", [bytes], u"The command which was run.")
 _OUTPUT = Field.forTypes(
     "output", [bytes], u"The output generated by the command.")
 _STATUS = Field.forTypes(
     "status", [int], u"The exit status of the command")
+_COALESCED = Field.forTypes(
+    "coalesced", [int],
+    u"The number of requested commands the command was run on behalf of.")
+_WAIT_TIME = Field.forTypes(
+    "wait_time", [float],
+    u"The number of seconds the oldest of the requested commands spent "
+    u"queued before the command was started.")
+_RUN_TIME = Field.forTypes(
+    "run_time", [float], u"The number of seconds the command took to run.")
 
 
 ZFS_ERROR = MessageType(
     "filesystem:zfs:error", [_ZFS_COMMAND, _OUTPUT, _STATUS],
     u"The zfs command signaled an error.")
 
+ZFS_COMMAND_RUN = MessageType(
+    "filesystem:zfs:command",
+    [_ZFS_COMMAND, _COALESCED, _WAIT_TIME, _RUN_TIME],
+    u"A queued zfs command finished running.")
 
-def _sync_command_error_squashed(arguments, logger):
+
+# Administrative zfs commands contend for pool-wide locks so running several
+# at once is slower than running them one after another.
+DEFAULT_ZFS_CONCURRENCY = 1
+
+# Subcommands which only read, and so are run straight away rather than
+# waiting behind administrative commands.
+_READ_ONLY_COMMANDS = frozenset([b"get", b"list"])
+
+
+def _set_property_names(arguments):
     """
-    Synchronously run a command-line tool with the given arguments.
+    Determine the names of the properties set by a ``zfs set`` command which
+    can be combined with others.
+
+    :param list arguments: ``zfs`` command-line arguments.
+
+    :return: A ``list`` of the property names as ``bytes`` or ``None`` if
+        ``arguments`` are not a plain ``zfs set`` of one dataset.
+    """
+    if len(arguments) < 3 or arguments[0] != b"set":
+        return None
+    assignments = arguments[1:-1]
+    if any(b"=" not in assignment or assignment.startswith(b"-")
+           for assignment in assignments):
+        return None
+    return [assignment.split(b"=", 1)[0] for assignment in assignments]
+
+
+def _snapshot_names(arguments):
+    """
+    Determine the snapshots created by a ``zfs snapshot`` command which can be
+    combined with others.
+
+    :param list arguments: ``zfs`` command-line arguments.
+
+    :return: A ``list`` of the snapshot names as ``bytes`` or ``None`` if
+        ``arguments`` are not a plain ``zfs snapshot`` without options.
+    """
+    if len(arguments) < 2 or arguments[0] != b"snapshot":
+        return None
+    names = arguments[1:]
+    if any(b"@" not in name or name.startswith(b"-") for name in names):
+        return None
+    return names
+
+
+def _pool_of(name):
+    """
+    :param bytes name: The name of a ZFS dataset or snapshot.
+
+    :return: The name of the pool it belongs to as ``bytes``.
+    """
+    return name.split(b"@", 1)[0].split(b"/", 1)[0]
+
+
+def _coalesce(first, second):
+    """
+    Combine two ``zfs`` commands into one which has the effect of running
+    both, in order.
+
+    ``zfs set`` commands on the same dataset which set different properties
+    are combined into one ``zfs set``.  ``zfs snapshot`` commands for
+    snapshots in the same pool are combined into one ``zfs snapshot``, which
+    also makes the snapshots atomic with respect to each other.
+
+    :param list first: ``zfs`` command-line arguments of the earlier command.
+    :param list second: ``zfs`` command-line arguments of the later command.
+
+    :return: The combined command-line arguments or ``None`` if the commands
+        cannot be combined.
+    """
+    first_properties = _set_property_names(first)
+    second_properties = _set_property_names(second)
+    if first_properties is not None and second_properties is not None:
+        if (first[-1] == second[-1] and
+                not set(first_properties) & set(second_properties)):
+            return first[:-1] + second[1:-1] + first[-1:]
+        return None
+
+    first_snapshots = _snapshot_names(first)
+    second_snapshots = _snapshot_names(second)
+    if first_snapshots is not None and second_snapshots is not None:
+        pools = set(_pool_of(name)
+                    for name in first_snapshots + second_snapshots)
+        if (len(pools) == 1 and
+                not set(first_snapshots) & set(second_snapshots)):
+            return first + second[1:]
+    return None
+
+
+@attributes(["arguments", "result", "queued",
+             Attribute("alone", default_value=False)])
+class _QueuedCommand(object):
+    """
+    A ``zfs`` command waiting to be run by a ``_ZFSCommandQueue``.
+
+    :ivar list arguments: ``zfs`` command-line arguments.
+    :ivar Deferred result: Fired with the result of the command.
+    :ivar float queued: When the command was queued, in reactor seconds.
+    :ivar bool alone: Whether the command must be run without being
+        combined with others.
+    """
+
+
+class _ZFSCommandQueue(object):
+    """
+    Run ``zfs`` commands in the order they are requested, no more than a
+    fixed number at a time.
+
+    Commands which are waiting to run are combined with the compatible
+    commands queued directly behind them (see ``_coalesce``), so that a burst
+    of ``zfs set`` or ``zfs snapshot`` requests results in a single ``zfs``
+    process.  Every command combined this way receives the result of that
+    process.  If it fails the commands are run again one at a time, so that
+    only those which fail on their own receive a failure.
+
+    Read-only ``zfs get`` and ``zfs list`` commands are not queued at all,
+    so that listing datasets does not wait for a long ``zfs send`` or
+    ``zfs snapshot``.
+    """
+    logger = Logger()
+
+    def __init__(self, reactor, limit=DEFAULT_ZFS_CONCURRENCY):
+        """
+        :param reactor: A ``IReactorProcess`` and ``IReactorTime`` provider.
+        :param int limit: The maximum number of ``zfs`` processes to run at
+            once.
+        """
+        self._reactor = reactor
+        self._limit = limit
+        self._running = 0
+        self._pending = []
+
+    def run(self, arguments):
+        """
+        Queue a ``zfs`` command to be run.
+
+        :param arguments: A ``list`` of ``bytes``, command-line arguments to
+            ``zfs``.
+
+        :return: A ``Deferred`` as for ``zfs_command``.
+        """
+        command = _QueuedCommand(
+            arguments=arguments, result=Deferred(),
+            queued=self._reactor.seconds())
+        if arguments[:1] and arguments[0] in _READ_ONLY_COMMANDS:
+            self._start(arguments, [command], limited=False)
+        else:
+            self._pending.append(command)
+            self._dispatch()
+        return command.result
+
+    def _dispatch(self):
+        """
+        Start as many of the pending commands as the concurrency limit allows.
+        """
+        while self._pending and self._running < self._limit:
+            batch = [self._pending.pop(0)]
+            arguments = batch[0].arguments
+            while (self._pending and not batch[0].alone and
+                   not self._pending[0].alone):
+                combined = _coalesce(arguments, self._pending[0].arguments)
+                if combined is None:
+                    break
+                arguments = combined
+                batch.append(self._pending.pop(0))
+            self._start(arguments, batch)
+
+    def _start(self, arguments, batch, limited=True):
+        """
+        Run a ``zfs`` process on behalf of some queued commands.
+
+        :param list arguments: ``zfs`` command-line arguments to run.
+        :param list batch: The ``_QueuedCommand`` instances to deliver the
+            result to.
+        :param bool limited: Whether the process counts towards the
+            concurrency limit.
+        """
+        if limited:
+            self._running += 1
+        started = self._reactor.seconds()
+
+        def finished(result):
+            if limited:
+                self._running -= 1
+            ZFS_COMMAND_RUN(
+                zfs_command=b" ".join(arguments),
+                coalesced=len(batch),
+                wait_time=float(started - batch[0].queued),
+                run_time=float(self._reactor.seconds() - started),
+            ).write(self.logger)
+            if isinstance(result, Failure) and len(batch) > 1:
+                # Find out which of the combined commands failed.
+                self._pending[0:0] = [
+                    _QueuedCommand(arguments=command.arguments,
+                                   result=command.result,
+                                   queued=command.queued, alone=True)
+                    for command in batch]
+            else:
+                for command in batch:
+                    if isinstance(result, Failure):
+                        command.result.errback(result)
+                    else:
+                        command.result.callback(result)
+            if limited:
+                self._dispatch()
+
+        _spawn_zfs(self._reactor, arguments).addBoth(finished)
+
+
+_command_queues = WeakKeyDictionary()
+
+
+def _command_queue(reactor):
+    """
+    Get the ``_ZFSCommandQueue`` which schedules ``zfs`` commands run using
+    the given reactor, creating it if necessary.
+
+    :param reactor: A ``IReactorProcess`` provider.
+
+    :return: A ``_ZFSCommandQueue``.
+    """
+    try:
+        return _command_queues[reactor]
+    except KeyError:
+        queue = _command_queues[reactor] = _ZFSCommandQueue(reactor)
+        return queue
+
+
+def _sync_command_output(arguments, logger):
+    """
+    Synchronously run a command-line tool with the given arguments and
+    return what it wrote.
 
     :param arguments: A ``list`` of ``bytes``, command-line arguments to
         execute.
 
     :param eliot.Logger logger: The log writer to use to log errors running the
         zfs command.
+
+    :return: The standard output and error of the command as ``bytes``, or
+        ``None`` if it could not be run or exited with an error status.
     """
+    output = None
     message = None
     log_arguments = b" ".join(arguments)
     try:
@@ -133,6 +402,21 @@ def _sync_command_error_squashed(arguments, logger):
                 zfs_command=log_arguments, output=output, status=status)
     if message is not None:
         message.write(logger)
+        return None
+    return output
+
+
+def _sync_command_error_squashed(arguments, logger):
+    """
+    Synchronously run a command-line tool with the given arguments.
+
+    :param arguments: A ``list`` of ``bytes``, command-line arguments to
+        execute.
+
+    :param eliot.Logger logger: The log writer to use to log errors running the
+        zfs command.
+    """
+    _sync_command_output(arguments, logger)
 
 
 @attributes(["name"])
@@ -232,8 +516,37 @@ class Filesystem(object):
     def get_path(self):
         return self._mountpoint
 
+    def _local_snapshots(self):
+        """
+        Synchronously list the snapshots of this filesystem.
+
+        :return: A ``list`` of ``Snapshot`` instances, ordered from oldest to
+            newest.
+        """
+        return [
+            Snapshot(name=name) for name in
+            _parse_snapshots(
+                check_output([b"zfs"] + _list_snapshots_command(self)),
+                self
+            )]
+
+    def written_since(self, remote_snapshots):
+        """
+        Determine the amount of data written to this filesystem since the
+        latest snapshot it has in common with a writer, using the
+        ``written@<snapshot>`` property.
+        """
+        latest_common_snapshot = _latest_common_snapshot(
+            remote_snapshots, self._local_snapshots())
+        if latest_common_snapshot is None:
+            return None
+        written = check_output([
+            b"zfs", b"get", b"-H", b"-p", b"-o", b"value",
+            b"written@" + latest_common_snapshot.name, self.name])
+        return int(written.strip())
+
     @contextmanager
-    def reader(self, remote_snapshots=None):
+    def reader(self, remote_snapshots=None, snapshot=None):
         """
         Send zfs stream of contents.
 
@@ -241,30 +554,29 @@ class Filesystem(object):
             oldest to newest, which are available on the writer.  The reader
             may generate a partial stream which relies on one of these
             snapshots in order to minimize the data to be transferred.
+
+        :param Snapshot snapshot: An existing snapshot of this filesystem to
+            send, or ``None`` to take a new one.
         """
-        # The existing snapshot code uses Twisted, so we're not using it
-        # in this iteration.  What's worse, though, is that it's not clear
-        # if the current snapshot naming scheme makes any sense, and
-        # moreover it violates abstraction boundaries. So as first pass
-        # I'm just using UUIDs, and hopefully requirements will become
-        # clearer as we iterate.
-        snapshot = b"%s@%s" % (self.name, uuid4())
-        check_call([b"zfs", b"snapshot", snapshot])
+        if snapshot is None:
+            # The existing snapshot code uses Twisted, so we're not using it
+            # in this iteration.  What's worse, though, is that it's not clear
+            # if the current snapshot naming scheme makes any sense, and
+            # moreover it violates abstraction boundaries. So as first pass
+            # I'm just using UUIDs, and hopefully requirements will become
+            # clearer as we iterate.
+            snapshot = b"%s@%s" % (self.name, uuid4())
+            check_call([b"zfs", b"snapshot", snapshot])
+        else:
+            snapshot = b"%s@%s" % (self.name, snapshot.name)
 
         # Determine whether there is a shared snapshot which can be used as the
         # basis for an incremental send.
-        local_snapshots = list(
-            Snapshot(name=name) for name in
-            _parse_snapshots(
-                check_output([b"zfs"] + _list_snapshots_command(self)),
-                self
-            ))
-
         if remote_snapshots is None:
             remote_snapshots = []
 
         latest_common_snapshot = _latest_common_snapshot(
-            remote_snapshots, local_snapshots)
+            remote_snapshots, self._local_snapshots())
 
         if latest_common_snapshot is None:
             identifier = [snapshot]
@@ -431,6 +743,17 @@ def volume_to_dataset(volume):
                        volume.name.to_bytes())
 
 
+# The properties ``StoragePool.startService`` makes sure the root dataset of
+# the pool has, in the order they are set.  The root dataset is read only,
+# and since that makes it impossible to create mountpoints in it for its
+# child datasets it is not mounted either.  This should be fine since we
+# don't ever intend to put any actual data into the root dataset.
+_ROOT_PROPERTIES = [
+    (b"readonly", b"on"),
+    (b"canmount", b"off"),
+]
+
+
 @implementer(IStoragePool)
 @with_repr(["_name"])
 @with_cmp(["_name", "_mount_root"])
@@ -475,18 +798,27 @@ class StoragePool(Service):
         # for StoragePool being an IService implementation).
         # https://clusterhq.atlassian.net/browse/FLOC-635
 
-        # Set the root dataset to be read only; IService.startService
-        # doesn't support Deferred results, and in any case startup can be
-        # synchronous with no ill effects.
-        _sync_command_error_squashed(
-            [b"zfs", b"set", b"readonly=on", self._name], self.logger)
-
-        # If the root dataset is read-only then it's not possible to create
-        # mountpoints in it for its child datasets.  Avoid mounting it to avoid
-        # this problem.  This should be fine since we don't ever intend to put
-        # any actual data into the root dataset.
-        _sync_command_error_squashed(
-            [b"zfs", b"set", b"canmount=off", self._name], self.logger)
+        # IService.startService doesn't support Deferred results, and in any
+        # case startup can be synchronous with no ill effects.  Every
+        # ``flocker-volume`` and ``flocker-changestate`` run starts the pool,
+        # so the properties are read with a single command and only the ones
+        # not already in place are set.  If they can't be read they are all
+        # set, as before.
+        output = _sync_command_output(
+            [b"zfs", b"get", b"-H", b"-o", b"property,value",
+             b",".join(name for (name, value) in _ROOT_PROPERTIES),
+             self._name], self.logger)
+        current = {}
+        if output is not None:
+            for line in output.splitlines():
+                fields = line.split(b"\t")
+                if len(fields) == 2:
+                    current[fields[0]] = fields[1]
+        for name, value in _ROOT_PROPERTIES:
+            if current.get(name) != value:
+                _sync_command_error_squashed(
+                    [b"zfs", b"set", name + b"=" + value, self._name],
+                    self.logger)
 
     def _check_for_out_of_space(self, reason):
         """
@@ -508,6 +840,10 @@ class StoragePool(Service):
                 b"-o", u"refquota={0}".format(
                     volume.size.maximum_size).encode("ascii")
             ])
+        for name, value in sorted(volume.size.properties):
+            properties.extend([
+                b"-o", u"{0}={1}".format(name, value).encode("ascii")
+            ])
         d = zfs_command(self._reactor,
                         [b"create"] + properties + [filesystem.name])
         d.addErrback(self._check_for_out_of_space)
@@ -530,6 +866,42 @@ class StoragePool(Service):
         d.addCallback(lambda _: filesystem)
         return d
 
+    def set_properties(self, volume):
+        filesystem = self.get(volume)
+        desired = dict(volume.size.properties)
+        commands = []
+        for name in sorted(desired):
+            commands.append([
+                b"set",
+                u"{0}={1}".format(name, desired[name]).encode("ascii"),
+                filesystem.name])
+        for name in sorted(TUNABLE_PROPERTIES - set(desired)):
+            # Properties which are no longer wanted go back to whatever value
+            # the pool would otherwise give them.
+            commands.append(
+                [b"inherit", name.encode("ascii"), filesystem.name])
+        # The command queue combines the queued ``set`` commands into one.
+        d = gatherResults(
+            [zfs_command(self._reactor, arguments) for arguments in commands],
+            consumeErrors=True)
+        d.addErrback(lambda failure: failure.value.subFailure)
+        d.addCallback(lambda _: filesystem)
+        return d
+
+    def snapshot(self, volumes):
+        snapshot = Snapshot(name=bytes(uuid4()))
+        if not volumes:
+            return succeed(snapshot)
+        # A single ``zfs snapshot`` with several names takes all of the
+        # snapshots atomically, in one transaction group.
+        d = zfs_command(
+            self._reactor,
+            [b"snapshot"] + [
+                b"%s@%s" % (self.get(volume).name, snapshot.name)
+                for volume in volumes])
+        d.addCallback(lambda _: snapshot)
+        return d
+
     def clone_to(self, parent, volume):
         parent_filesystem = self.get(parent)
         new_filesystem = self.get(volume)
@@ -616,14 +988,16 @@ class StoragePool(Service):
             for entry in filesystems:
                 filesystem = Filesystem(
                     self._name, entry.dataset, FilePath(entry.mountpoint),
-                    VolumeSize(maximum_size=entry.refquota))
+                    VolumeSize(maximum_size=entry.refquota,
+                               properties=entry.properties))
                 result.add(filesystem)
             return result
 
         return listing.addCallback(listed)
 
 
-@attributes(["dataset", "mountpoint", "refquota"], apply_immutable=True)
+@attributes(["dataset", "mountpoint", "refquota", "properties"],
+            apply_immutable=True)
 class _DatasetInfo(object):
     """
     :ivar bytes dataset: The name of the ZFS dataset to which this information
@@ -632,7 +1006,83 @@ class _DatasetInfo(object):
         (where it will be auto-mounted by ZFS).
     :ivar int refquota: The value of the dataset's ``refquota`` property (the
         maximum number of bytes the dataset is allowed to have a reference to).
+    :ivar frozenset properties: The tunable properties (see
+        ``TUNABLE_PROPERTIES``) which have been set locally on the dataset, as
+        ``(unicode, unicode)`` tuples of name and value.
+    """
+
+
+def _list_filesystems_command(pool):
+    """
+    Construct a ``zfs`` command which will output the properties Flocker is
+    interested in for each filesystem in the given pool.
+
+    :param bytes pool: The name of the pool.
+
+    :return list: An argument list (of ``bytes``) which can be passed to
+        ``zfs``.  ``zfs`` is not included as the first element.
     """
+    return [
+        b"get",
+        # Descend the hierarchy to a depth of one (ie, list the direct
+        # children of the pool)
+        b"-d", b"1",
+        # Snapshots are not interesting here.
+        b"-t", b"filesystem",
+        # Omit the output header
+        b"-H",
+        # Output exact, machine-parseable values (eg 65536 instead of 64K)
+        b"-p",
+        # Output one line for each property of each dataset, including where
+        # the value came from so that tuning explicitly applied to a dataset
+        # can be distinguished from inherited defaults.
+        b"-o", b"name,property,value,source",
+        b",".join([b"mountpoint", b"refquota"] + sorted(
+            name.encode("ascii") for name in TUNABLE_PROPERTIES)),
+        # Look at this pool
+        pool]
+
+
+def _parse_filesystems(output, pool):
+    """
+    Parse the output of a ``zfs get`` command (like the one defined by
+    ``_list_filesystems_command``).
+
+    :param bytes output: The output to parse.
+    :param bytes pool: The name of the pool the output describes.
+
+    :return: A ``list`` of ``_DatasetInfo``, one for each child dataset of the
+        pool, in the order they first appear in the output.
+    """
+    order = []
+    datasets = {}
+    for line in output.splitlines():
+        name, prop, value, source = line.split(b'\t')
+        name = name[len(pool) + 1:]
+        if not name:
+            continue
+        if name not in datasets:
+            order.append(name)
+            datasets[name] = dict(mountpoint=None, refquota=None,
+                                  properties=set())
+        info = datasets[name]
+        if prop == b"mountpoint":
+            info["mountpoint"] = value
+        elif prop == b"refquota":
+            refquota = int(value.decode("ascii"))
+            if refquota == 0:
+                refquota = None
+            info["refquota"] = refquota
+        elif source == b"local":
+            info["properties"].add(
+                (prop.decode("ascii"), value.decode("ascii")))
+    return [
+        _DatasetInfo(
+            dataset=dataset,
+            mountpoint=datasets[dataset]["mountpoint"],
+            refquota=datasets[dataset]["refquota"],
+            properties=frozenset(datasets[dataset]["properties"]))
+        for dataset in order]
 
 
 def _list_filesystems(reactor, pool):
@@ -641,34 +1091,8 @@ def _list_filesystems(reactor, pool):
     :param pool: A `flocker.volume.filesystems.interface.IStoragePool`
         provider.
     :return: A ``Deferred`` that fires with an iterator, the elements
-        of which are ``tuples`` containing the name and mountpoint of each
-        filesystem.
-    """
-    listing = zfs_command(
-        reactor,
-        [b"list",
-         # Descend the hierarchy to a depth of one (ie, list the direct
-         # children of the pool)
-         b"-d", b"1",
-         # Omit the output header
-         b"-H",
-         # Output exact, machine-parseable values (eg 65536 instead of 64K)
-         b"-p",
-         # Output each dataset's name, mountpoint and refquota
-         b"-o", b"name,mountpoint,refquota",
-         # Look at this pool
-         pool])
-
-    def listed(output, pool):
-        for line in output.splitlines():
-            name, mountpoint, refquota = line.split(b'\t')
-            name = name[len(pool) + 1:]
-            if name:
-                refquota = int(refquota.decode("ascii"))
-                if refquota == 0:
-                    refquota = None
-                yield _DatasetInfo(
-                    dataset=name, mountpoint=mountpoint, refquota=refquota)
-
-    listing.addCallback(listed, pool)
+        of which are ``_DatasetInfo`` instances describing each filesystem.
+    """
+    listing = zfs_command(reactor, _list_filesystems_command(pool))
+    listing.addCallback(_parse_filesystems, pool)
     return listing
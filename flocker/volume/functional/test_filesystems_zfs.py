@@ -455,6 +455,31 @@ class IncrementalPushTests(TestCase):
         loading.addCallback(loaded)
         return loading
 
+    def test_written_since(self):
+        """
+        ``Filesystem.written_since`` returns zero if nothing has been written
+        to the filesystem since the latest snapshot in common with the writer
+        and a positive number of bytes once data has been written.
+        """
+        pool = build_pool(self)
+        service = service_for_pool(self, pool)
+        volume = service.get(MY_VOLUME)
+        creating = pool.create(volume)
+        creating.addCallback(lambda _: pool.snapshot([volume]))
+
+        def snapshotted(snapshot):
+            filesystem = pool.get(volume)
+            unchanged = filesystem.written_since([snapshot])
+            filesystem.get_path().child(b"some-data").setContent(
+                b"hello world" * 1024)
+            # Make sure the data has been committed to the pool so that it
+            # is reflected in the written property.
+            subprocess.check_call([b"sync"])
+            changed = filesystem.written_since([snapshot])
+            self.assertEqual((0, True), (unchanged, changed > 0))
+        creating.addCallback(snapshotted)
+        return creating
+
 
 class FilesystemTests(TestCase):
     """
@@ -1,36 +1,444 @@
 # Copyright Hybrid Logic Ltd.  See LICENSE file for details.
+# -*- test-case-name: flocker.volume.test.test_httpapi -*-
+
 """
 A HTTP REST API for controlling the Dataset Manager.
 """
 
+from twisted.web.http import CONFLICT, CREATED
 from twisted.web.server import Site
-from twisted.web.resource import Resource
+from twisted.internet.defer import gatherResults, maybeDeferred
 from twisted.application.internet import StreamServerEndpointService
 
 from klein import Klein
 
-from ..restapi import structured
+from eliot import Logger, writeFailure
+
+from ..restapi import structured, EndpointResponse
+from ..restapi._error import BadRequest, ENTITY_NOT_FOUND, makeBadRequest
+from ._model import VolumeSize
+from ._ipc import RemoteVolumeManager, standard_node
+from .service import VolumeName, Volume
+
+# The namespace of datasets whose namespace is not given, which is the one
+# ``flocker-deploy`` puts application volumes in.
+DEFAULT_NAMESPACE = u"default"
+
+_NAME_PROPERTIES = {
+    # ``VolumeName`` does not allow periods in namespaces, and dataset IDs
+    # are limited to the characters Docker allows in container names.
+    "namespace": {"type": "string", "pattern": "^[^.]+$"},
+    "dataset_id": {"type": "string", "pattern": "^[a-zA-Z0-9_.-]+$"},
+}
+_MAXIMUM_SIZE = {"type": ["integer", "null"], "minimum": 1}
+# A hostname or IPv4 address, which in particular cannot be mistaken for an
+# option by ``ssh``.
+_DESTINATION = {"type": "string", "pattern": "^[a-zA-Z0-9][a-zA-Z0-9.-]*$"}
+
+
+def _object_schema(properties, required):
+    """
+    :return: The JSON Schema of an object with only the given properties.
+    """
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": required,
+        "additionalProperties": False,
+    }
+
+
+def _request_schema(properties, required):
+    """
+    :return: The JSON Schema of a request body with only the given
+        properties.
+    """
+    return dict(_object_schema(properties, required),
+                **{"$schema": "http://json-schema.org/draft-04/schema#"})
+
+
+def _bulk_schema(properties, required):
+    """
+    :return: The JSON Schema of the request body of a bulk endpoint, a list
+        of objects naming a dataset with the given additional properties.
+    """
+    item = _object_schema(dict(_NAME_PROPERTIES, **properties),
+                          ["dataset_id"] + required)
+    return _request_schema(
+        {"datasets": {"type": "array", "items": item}}, ["datasets"])
+
+
+CREATE_SCHEMA = _request_schema(
+    dict(_NAME_PROPERTIES, maximum_size=_MAXIMUM_SIZE), ["dataset_id"])
+RESIZE_SCHEMA = _request_schema(
+    {"maximum_size": _MAXIMUM_SIZE}, ["maximum_size"])
+MOVE_SCHEMA = _request_schema({"destination": _DESTINATION}, ["destination"])
+
+BULK_CREATE_SCHEMA = _bulk_schema({"maximum_size": _MAXIMUM_SIZE}, [])
+BULK_RESIZE_SCHEMA = _bulk_schema(
+    {"maximum_size": _MAXIMUM_SIZE}, ["maximum_size"])
+BULK_MOVE_SCHEMA = _bulk_schema({"destination": _DESTINATION}, ["destination"])
+
+DATASET_EXISTS = makeBadRequest(
+    code=CONFLICT, description=u"The dataset already exists.")
+NOT_OWNED = makeBadRequest(
+    code=CONFLICT, description=u"The dataset is not owned by this node.")
+UNKNOWN_NODE = makeBadRequest(
+    description=u"The destination is not a node of the cluster.")
+
+
+def _remote_volume_manager(hostname):
+    """
+    Create the ``IRemoteVolumeManager`` to push datasets to a node with, the
+    same way the ``Deployer`` does.
+
+    :param unicode hostname: The hostname of the node.
+    """
+    return RemoteVolumeManager(standard_node(hostname.encode("ascii")))
+
+
+def _no_nodes():
+    """
+    :return: An empty ``frozenset``, for a node which knows of no others to
+        push datasets to.
+    """
+    return frozenset()
+
+
+def _describe(volume):
+    """
+    :param Volume volume: A volume.
+
+    :return: A JSON-encodable description of the volume.
+    """
+    return {
+        u"namespace": volume.name.namespace,
+        u"dataset_id": volume.name.dataset_id,
+        u"owner": volume.node_id,
+        u"locally_owned": volume.locally_owned(),
+        u"maximum_size": volume.size.maximum_size,
+    }
 
 
 class DatasetAPIUser(object):
     """
     A user accessing the API.
+
+    Every dataset operation has a bulk variant which applies it to a list
+    of datasets, so that many volumes can be created or moved with one
+    request rather than one ``flocker-volume`` process each.  The datasets
+    on the node are listed once per request, whether it names one dataset
+    or many.
+
+    Datasets are only pushed and handed off to the nodes of the cluster,
+    so that the API cannot be used to send them anywhere else.
+
+    :ivar VolumeService volume_service: The service managing the node's
+        datasets.
     """
     app = Klein()
+    logger = Logger()
+
+    def __init__(self, volume_service,
+                 remote_volume_manager=_remote_volume_manager,
+                 known_nodes=_no_nodes):
+        """
+        :param VolumeService volume_service: See ``volume_service``.
+        :param remote_volume_manager: A callable which takes the
+            ``unicode`` hostname of a node and returns the
+            ``IRemoteVolumeManager`` to push datasets to it with.
+        :param known_nodes: A callable which returns a ``frozenset`` of the
+            ``unicode`` hostnames of the nodes of the cluster, the only ones
+            datasets may be pushed or handed off to.
+        """
+        self.volume_service = volume_service
+        self._remote_volume_manager = remote_volume_manager
+        self._known_nodes = known_nodes
+
+    def _volumes(self):
+        """
+        List the datasets on this node.
+
+        :return: A ``Deferred`` which fires with a ``dict`` mapping the
+            ``VolumeName`` of each dataset to its ``Volume``.  If the node
+            has copies of a dataset owned by more than one node, the one it
+            owns itself is chosen.
+        """
+        enumerating = self.volume_service.enumerate()
+
+        def enumerated(volumes):
+            result = {}
+            for volume in volumes:
+                if volume.locally_owned() or volume.name not in result:
+                    result[volume.name] = volume
+            return result
+        enumerating.addCallback(enumerated)
+        return enumerating
+
+    def _find(self, volumes, namespace, dataset_id):
+        """
+        Find a dataset on this node.
+
+        :param dict volumes: The datasets on the node, as returned by
+            ``_volumes``.
+
+        :raises BadRequest: If the node does not have the dataset.
+
+        :return: The ``Volume`` of the dataset.
+        """
+        try:
+            return volumes[
+                VolumeName(namespace=namespace, dataset_id=dataset_id)]
+        except (KeyError, ValueError):
+            raise ENTITY_NOT_FOUND
+
+    def _owned(self, volumes, namespace, dataset_id):
+        """
+        Find a dataset owned by this node.
+
+        :raises BadRequest: If the node does not have the dataset or does
+            not own it.
+
+        :return: The ``Volume`` of the dataset.
+        """
+        volume = self._find(volumes, namespace, dataset_id)
+        if not volume.locally_owned():
+            raise NOT_OWNED
+        return volume
+
+    def _destination(self, hostname):
+        """
+        Find the node to push a dataset to.
+
+        :param unicode hostname: The hostname of the node.
+
+        :raises BadRequest: If the node is not one of the cluster's.
 
-    @app.route("/noop")
+        :return: The ``IRemoteVolumeManager`` to push datasets to it with.
+        """
+        if hostname not in self._known_nodes():
+            raise UNKNOWN_NODE
+        return self._remote_volume_manager(hostname)
+
+    def _create(self, volumes, dataset_id, namespace=DEFAULT_NAMESPACE,
+                maximum_size=None):
+        """
+        Create a dataset owned by this node.
+
+        :return: A ``Deferred`` which fires with the description of the new
+            dataset.
+        """
+        name = VolumeName(namespace=namespace, dataset_id=dataset_id)
+        if name in volumes:
+            raise DATASET_EXISTS
+        volume = self.volume_service.get(
+            name, size=VolumeSize(maximum_size=maximum_size))
+        # Later datasets in the same bulk request must not reuse the name.
+        volumes[name] = volume
+        creating = self.volume_service.create(volume)
+        creating.addCallback(_describe)
+        return creating
+
+    def _resize(self, volumes, dataset_id, maximum_size,
+                namespace=DEFAULT_NAMESPACE):
+        """
+        Change the maximum size of a dataset owned by this node.
+
+        :return: A ``Deferred`` which fires with the description of the
+            resized dataset.
+        """
+        volume = self._owned(volumes, namespace, dataset_id)
+        resized = Volume(
+            node_id=volume.node_id, name=volume.name, service=volume.service,
+            size=VolumeSize(maximum_size=maximum_size,
+                            properties=volume.size.properties))
+        resizing = self.volume_service.set_maximum_size(resized)
+        resizing.addCallback(_describe)
+        return resizing
+
+    def _push(self, volumes, dataset_id, destination,
+              namespace=DEFAULT_NAMESPACE):
+        """
+        Push the data of a dataset owned by this node to another node.
+
+        :return: A ``Deferred`` which fires with ``True`` if data was pushed
+            or ``False`` if the destination already had all of it.
+        """
+        volume = self._owned(volumes, namespace, dataset_id)
+        return maybeDeferred(
+            self.volume_service.push, volume, self._destination(destination))
+
+    def _handoff(self, volumes, dataset_id, destination,
+                 namespace=DEFAULT_NAMESPACE):
+        """
+        Hand a dataset owned by this node off to another node.
+
+        :return: A ``Deferred`` which fires with the description of the
+            dataset once the destination owns it.
+        """
+        volume = self._owned(volumes, namespace, dataset_id)
+        handing_off = self.volume_service.handoff(
+            volume, self._destination(destination))
+        handing_off.addCallback(_describe)
+        return handing_off
+
+    def _one(self, operation, **kwargs):
+        """
+        Apply an operation to one dataset.
+
+        :param operation: One of the dataset operation methods.
+        :param kwargs: The arguments to give it besides the datasets.
+
+        :return: A ``Deferred`` which fires with the result of the
+            operation.
+        """
+        listing = self._volumes()
+        listing.addCallback(lambda volumes: operation(volumes, **kwargs))
+        return listing
+
+    def _bulk(self, operation, datasets):
+        """
+        Apply an operation to many datasets at once.
+
+        :param operation: One of the dataset operation methods.
+        :param list datasets: The arguments to give the operation for each
+            dataset, as ``dict``\ s.
+
+        :return: A ``Deferred`` which fires with a ``list`` with an object
+            for each dataset, in the same order.  Each has an ``error``
+            which is ``false`` if the operation succeeded and ``true`` if it
+            failed, and a ``result`` which is the result of the operation
+            or a description of the error.
+        """
+        def succeeded(result):
+            return {u"error": False, u"result": result}
+
+        def failed(reason):
+            if reason.check(BadRequest):
+                result = reason.value.result
+            else:
+                writeFailure(reason, self.logger, u"flocker:volume:httpapi")
+                result = {u"description": u"The operation failed."}
+            return {u"error": True, u"result": result}
+
+        def apply_all(volumes):
+            results = []
+            for dataset in datasets:
+                applying = maybeDeferred(operation, volumes, **dataset)
+                applying.addCallbacks(succeeded, failed)
+                results.append(applying)
+            return gatherResults(results)
+        listing = self._volumes()
+        listing.addCallback(apply_all)
+        return listing
+
+    @app.route("/v1/datasets", methods=["GET"])
     @structured({}, {})
-    def noop(self):
+    def list_datasets(self):
         """
-        Do nothing.
+        List the datasets on this node, including copies owned by other
+        nodes.
         """
-        return None
+        listing = self._volumes()
+        listing.addCallback(lambda volumes: sorted(
+            (_describe(volume) for volume in volumes.values()),
+            key=lambda dataset: (dataset[u"namespace"],
+                                 dataset[u"dataset_id"])))
+        return listing
 
+    @app.route("/v1/datasets", methods=["POST"])
+    @structured(CREATE_SCHEMA, {})
+    def create_dataset(self, **kwargs):
+        """
+        Create a dataset owned by this node.
+        """
+        creating = self._one(self._create, **kwargs)
+        creating.addCallback(lambda result: EndpointResponse(CREATED, result))
+        return creating
+
+    @app.route("/v1/datasets/<namespace>/<dataset_id>/resize",
+               methods=["POST"])
+    @structured(RESIZE_SCHEMA, {})
+    def resize_dataset(self, **kwargs):
+        """
+        Change the maximum size of a dataset owned by this node.
+        """
+        return self._one(self._resize, **kwargs)
+
+    @app.route("/v1/datasets/<namespace>/<dataset_id>/push", methods=["POST"])
+    @structured(MOVE_SCHEMA, {})
+    def push_dataset(self, **kwargs):
+        """
+        Push the data of a dataset owned by this node to another node.
+        """
+        return self._one(self._push, **kwargs)
+
+    @app.route("/v1/datasets/<namespace>/<dataset_id>/handoff",
+               methods=["POST"])
+    @structured(MOVE_SCHEMA, {})
+    def handoff_dataset(self, **kwargs):
+        """
+        Hand a dataset owned by this node off to another node.
+        """
+        return self._one(self._handoff, **kwargs)
+
+    @app.route("/v1/datasets/<namespace>/<dataset_id>/snapshots",
+               methods=["GET"])
+    @structured({}, {})
+    def list_snapshots(self, namespace, dataset_id):
+        """
+        List the names of the snapshots of a dataset on this node, from
+        oldest to newest.
+        """
+        listing = self._volumes()
+        listing.addCallback(lambda volumes: self._find(
+            volumes, namespace, dataset_id).get_filesystem().snapshots())
+        listing.addCallback(lambda snapshots: [
+            snapshot.name.decode("ascii") for snapshot in snapshots])
+        return listing
 
-def create_api_service(endpoint):
+    @app.route("/v1/bulk/create", methods=["POST"])
+    @structured(BULK_CREATE_SCHEMA, {})
+    def bulk_create(self, datasets):
+        """
+        Create many datasets owned by this node.
+        """
+        return self._bulk(self._create, datasets)
+
+    @app.route("/v1/bulk/resize", methods=["POST"])
+    @structured(BULK_RESIZE_SCHEMA, {})
+    def bulk_resize(self, datasets):
+        """
+        Change the maximum sizes of many datasets owned by this node.
+        """
+        return self._bulk(self._resize, datasets)
+
+    @app.route("/v1/bulk/push", methods=["POST"])
+    @structured(BULK_MOVE_SCHEMA, {})
+    def bulk_push(self, datasets):
+        """
+        Push many datasets owned by this node to other nodes.
+        """
+        return self._bulk(self._push, datasets)
+
+    @app.route("/v1/bulk/handoff", methods=["POST"])
+    @structured(BULK_MOVE_SCHEMA, {})
+    def bulk_handoff(self, datasets):
+        """
+        Hand many datasets owned by this node off to other nodes.
+        """
+        return self._bulk(self._handoff, datasets)
+
+
+def create_api_service(endpoint, volume_service, known_nodes=_no_nodes):
     """
     Create a Twisted Service that serves the API on the given endpoint.
+
+    :param endpoint: The ``IStreamServerEndpoint`` to listen on.
+    :param VolumeService volume_service: The service managing the node's
+        datasets.
+    :param known_nodes: See ``DatasetAPIUser.__init__``.
     """
-    # FLOC-1162 should add an API version prefix and integration with
-    # DatasetAPIUser.
-    return StreamServerEndpointService(endpoint, Site(Resource()))
+    return StreamServerEndpointService(
+        endpoint, Site(DatasetAPIUser(
+            volume_service, known_nodes=known_nodes).app.resource()))
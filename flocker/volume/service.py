@@ -16,6 +16,8 @@ from zope.interface import Interface, implementer
 
 from characteristic import attributes
 
+from eliot import Logger
+
 from twisted.internet.defer import maybeDeferred
 from twisted.internet.task import deferLater
 from twisted.python.filepath import FilePath
@@ -27,6 +29,7 @@ from twisted.internet.defer import fail
 # part of https://clusterhq.atlassian.net/browse/FLOC-64
 from .filesystems.zfs import StoragePool
 from ._model import VolumeSize
+from ._logging import PRECOPY_ROUND, HANDOFF
 from ..common.script import ICommandLineScript
 
 DEFAULT_CONFIG_PATH = FilePath(b"/etc/flocker/volume.json")
@@ -35,6 +38,15 @@ FLOCKER_POOL = b"flocker"
 
 WAIT_FOR_VOLUME_INTERVAL = 0.1
 
+# Pre-copy pushes stop once no more than this many bytes were written while
+# the previous push was running, since the final push can then be expected
+# to be quick.
+PRECOPY_THRESHOLD = 16 * 1024 * 1024
+
+# The most pushes a pre-copy will make, in case the volume is written to
+# faster than it can be pushed.
+PRECOPY_MAX_ROUNDS = 5
+
 
 class CreateConfigurationError(Exception):
     """Create the configuration file failed."""
@@ -96,6 +108,7 @@ class VolumeService(Service):
     :ivar unicode node_id: A unique identifier for this particular node's
         volume manager. Only available once the service has started.
     """
+    logger = Logger()
 
     def __init__(self, config_path, pool, reactor):
         """
@@ -160,6 +173,19 @@ class VolumeService(Service):
         d.addCallback(resized)
         return d
 
+    def set_properties(self, volume):
+        """
+        Change the tunable properties of an existing volume.
+
+        :param Volume volume: The ``Volume`` instance whose
+            ``size.properties`` should be applied in the storage pool.
+
+        :return: A ``Deferred`` that fires with a :class:`Volume`.
+        """
+        d = self.pool.set_properties(volume)
+        d.addCallback(lambda filesystem: volume)
+        return d
+
     def clone_to(self, parent, name):
         """
         Clone a parent ``Volume`` to create a new one.
@@ -280,7 +306,19 @@ class VolumeService(Service):
         enumerating.addCallback(enumerated)
         return enumerating
 
-    def push(self, volume, destination):
+    def snapshot(self, volumes):
+        """
+        Take a consistent snapshot of several volumes at once, for example so
+        they can be pushed together.
+
+        :param volumes: A ``list`` of ``Volume`` instances to snapshot.
+
+        :return: A ``Deferred`` that fires with the ``Snapshot`` taken of
+            each volume's filesystem.
+        """
+        return self.pool.snapshot(volumes)
+
+    def push(self, volume, destination, snapshot=None):
         """
         Push the latest data in the volume to a remote destination.
 
@@ -294,6 +332,14 @@ class VolumeService(Service):
         :param IRemoteVolumeManager destination: The remote volume manager
             to push to.
 
+        :param Snapshot snapshot: A snapshot of the volume previously taken
+            with ``snapshot``, which will be pushed instead of the latest
+            data.
+
+        :return: A ``Deferred`` that fires with ``True`` if data was pushed or
+            ``False`` if the push was a no-op because nothing has been written
+            to the volume since the latest snapshot the destination has.
+
         :raises ValueError: If the uuid of the volume is different than
             our own; only locally-owned volumes can be pushed.
         """
@@ -303,10 +349,15 @@ class VolumeService(Service):
         getting_snapshots = destination.snapshots(volume)
 
         def got_snapshots(snapshots):
+            if snapshots and fs.written_since(snapshots) == 0:
+                # The destination is already current, so don't bother taking
+                # a snapshot and sending an empty incremental stream.
+                return False
             with destination.receive(volume) as receiver:
-                with fs.reader(snapshots) as contents:
+                with fs.reader(snapshots, snapshot) as contents:
                     for chunk in iter(lambda: contents.read(1024 * 1024), b""):
                         receiver.write(chunk)
+            return True
 
         pushing = getting_snapshots.addCallback(got_snapshots)
         return pushing
@@ -355,7 +406,52 @@ class VolumeService(Service):
         volume = Volume(node_id=volume_node_id, name=volume_name, service=self)
         return volume.change_owner(self.node_id)
 
-    def handoff(self, volume, destination):
+    def precopy(self, volume, destination, snapshot=None,
+                threshold=PRECOPY_THRESHOLD, max_rounds=PRECOPY_MAX_ROUNDS):
+        """
+        Iteratively push a locally owned volume to a remote destination in
+        preparation for handing it off, so that the final push made by
+        ``handoff`` while the volume's application is stopped is small.
+
+        Incremental pushes are repeated until the amount of data written to
+        the volume since the previous push (as measured by the filesystem's
+        ``written_since``) is no more than ``threshold``, stops shrinking or
+        cannot be measured, or until ``max_rounds`` pushes have been made.
+
+        :param Volume volume: The volume to push.
+        :param IRemoteVolumeManager destination: The remote volume manager
+            to push to.
+        :param Snapshot snapshot: A snapshot of the volume to use for the
+            first push, as for ``push``.
+        :param int threshold: The number of bytes below which the volume is
+            considered to be current enough.
+        :param int max_rounds: The maximum number of pushes to make.
+
+        :return: A ``Deferred`` that fires when the pushes are done.
+        """
+        filesystem = volume.get_filesystem()
+
+        def push(rounds, previous, snapshot):
+            pushing = maybeDeferred(self.push, volume, destination, snapshot)
+            # Every local snapshot has now been pushed, so the amount written
+            # since the latest of them is what the next push would send.
+            pushing.addCallback(lambda _: filesystem.snapshots())
+            pushing.addCallback(filesystem.written_since)
+
+            def measured(written):
+                PRECOPY_ROUND(
+                    volume=volume.name.to_bytes(), round=rounds,
+                    written=written).write(self.logger)
+                if (written is None or written <= threshold or
+                        rounds >= max_rounds or
+                        (previous is not None and written >= previous)):
+                    return None
+                return push(rounds + 1, written, None)
+            pushing.addCallback(measured)
+            return pushing
+        return push(1, None, snapshot)
+
+    def handoff(self, volume, destination, snapshot=None):
         """
         Handoff a locally owned volume to a remote destination.
 
@@ -367,17 +463,27 @@ class VolumeService(Service):
         :param Volume volume: The volume to handoff.
         :param IRemoteVolumeManager destination: The remote volume manager
             to handoff to.
+        :param Snapshot snapshot: A snapshot of the volume to push as part of
+            the handoff, as for ``push``.
 
         :return: ``Deferred`` that fires when the handoff has finished, or
             errbacks on error (specifcally with a ``ValueError`` if the
             volume is not locally owned).
         """
-        pushing = maybeDeferred(self.push, volume, destination)
+        started = self._reactor.seconds()
+        pushing = maybeDeferred(self.push, volume, destination, snapshot)
 
         def pushed(ignored):
             remote_uuid = destination.acquire(volume)
             return volume.change_owner(remote_uuid)
         changing_owner = pushing.addCallback(pushed)
+
+        def handed_off(result):
+            HANDOFF(volume=volume.name.to_bytes(),
+                    duration=float(self._reactor.seconds() - started),
+                    ).write(self.logger)
+            return result
+        changing_owner.addCallback(handed_off)
         return changing_owner
 
 
@@ -300,6 +300,21 @@ def make_istoragepool_tests(fixture):
             d.addCallback(resized_filesystem)
             return d
 
+        def test_resize_unlimited_volume_unlimited_max_size(self):
+            """
+            A volume without a maximum size can be resized to a maximum size of
+            None, leaving it unlimited.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME)
+
+            d = pool.create(volume)
+            d.addCallback(lambda _: pool.set_maximum_size(volume))
+            d.addCallback(lambda filesystem: self.assertEqual(
+                VolumeSize(maximum_size=None), filesystem.size))
+            return d
+
         def test_resize_volume_invalid_max_size(self):
             """
             If an existing volume is resized to a new maximum size which is
@@ -696,6 +711,60 @@ def make_istoragepool_tests(fixture):
             enumerating.addCallback(enumerated)
             return enumerating
 
+        def test_enumerate_provides_properties(self):
+            """
+            The ``IStoragePool.enumerate`` implementation produces
+            ``IFilesystem`` results which reflect the tunable properties
+            those filesystems were created with.
+            """
+            size = VolumeSize(
+                maximum_size=None,
+                properties=frozenset({(u"compression", u"lz4"),
+                                      (u"recordsize", u"8192")}))
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME, size=size)
+            creating = pool.create(volume)
+
+            def created(ignored):
+                return pool.enumerate()
+            enumerating = creating.addCallback(created)
+
+            def enumerated(result):
+                [filesystem] = result
+                self.assertEqual(size, filesystem.size)
+            enumerating.addCallback(enumerated)
+            return enumerating
+
+        def test_set_properties(self):
+            """
+            ``set_properties`` applies the volume's tunable properties to an
+            existing filesystem, discarding any previously applied properties
+            which are no longer wanted.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volume = service.get(MY_VOLUME, size=VolumeSize(
+                maximum_size=None,
+                properties=frozenset({(u"compression", u"lz4"),
+                                      (u"atime", u"off")})))
+            tuned = VolumeSize(
+                maximum_size=None,
+                properties=frozenset({(u"atime", u"off"),
+                                      (u"logbias", u"throughput")}))
+            creating = pool.create(volume)
+
+            def created(ignored):
+                return pool.set_properties(service.get(MY_VOLUME, size=tuned))
+            setting = creating.addCallback(created)
+            setting.addCallback(lambda _: pool.enumerate())
+
+            def enumerated(result):
+                [filesystem] = result
+                self.assertEqual(tuned, filesystem.size)
+            setting.addCallback(enumerated)
+            return setting
+
         def test_enumerate_spaces(self):
             """
             The ``IStoragePool.enumerate`` implementation doesn't return
@@ -856,6 +925,27 @@ def make_istoragepool_tests(fixture):
             creating.addCallback(created)
             return creating
 
+        def test_snapshot(self):
+            """
+            ``IStoragePool.snapshot`` takes a snapshot with the same name of
+            the filesystem of each of the given volumes.
+            """
+            pool = fixture(self)
+            service = service_for_pool(self, pool)
+            volumes = [service.get(MY_VOLUME), service.get(MY_VOLUME2)]
+            creating = gatherResults(
+                [pool.create(volume) for volume in volumes])
+            creating.addCallback(lambda _: pool.snapshot(volumes))
+
+            def snapshotted(snapshot):
+                listing = gatherResults([
+                    pool.get(volume).snapshots() for volume in volumes])
+                listing.addCallback(
+                    self.assertEqual, [[snapshot], [snapshot]])
+                return listing
+            creating.addCallback(snapshotted)
+            return creating
+
         def test_clone_to_creates_new(self):
             """
             ``IFilesystem.clone_to()`` creates a filesystem for the new
@@ -20,12 +20,15 @@ from ...testtools import (
     FakeProcessReactor, assert_equal_comparison, assert_not_equal_comparison
 )
 
+from ..filesystems import zfs
 from ..filesystems.zfs import (
-    _DatasetInfo,
-    zfs_command, CommandFailed, BadArguments, Filesystem, ZFSSnapshots,
-    _sync_command_error_squashed, _latest_common_snapshot, ZFS_ERROR,
-    Snapshot,
+    _DatasetInfo, _parse_filesystems, _coalesce, _ZFSCommandQueue,
+    ZFS_COMMAND_RUN, zfs_command, CommandFailed, BadArguments, Filesystem,
+    ZFSSnapshots, _sync_command_error_squashed, _sync_command_output,
+    _latest_common_snapshot, ZFS_ERROR, Snapshot, StoragePool,
 )
+from ..service import Volume, VolumeName
+from .._model import VolumeSize
 
 
 class FilesystemTests(SynchronousTestCase):
@@ -104,6 +107,48 @@ class FilesystemTests(SynchronousTestCase):
         )
 
 
+class WrittenSinceTests(SynchronousTestCase):
+    """
+    Tests for ``Filesystem.written_since``.
+    """
+    def setUp(self):
+        self.commands = []
+        self.outputs = {
+            b"list": b"pool/fs@a\npool/fs@b\npool/other@c\n",
+            b"get": b"4096\n",
+        }
+
+        def check_output(arguments):
+            self.commands.append(arguments)
+            return self.outputs[arguments[1]]
+        self.patch(zfs, "check_output", check_output)
+        self.filesystem = Filesystem(b"pool", b"fs")
+
+    def test_written(self):
+        """
+        ``Filesystem.written_since`` returns the value of the
+        ``written@<snapshot>`` property for the latest snapshot the filesystem
+        has in common with the writer.
+        """
+        self.assertEqual(
+            (4096,
+             [b"zfs", b"get", b"-H", b"-p", b"-o", b"value", b"written@a",
+              b"pool/fs"]),
+            (self.filesystem.written_since(
+                [Snapshot(name=b"a"), Snapshot(name=b"c")]),
+             self.commands[-1]))
+
+    def test_no_common_snapshot(self):
+        """
+        ``Filesystem.written_since`` returns ``None`` if the filesystem has no
+        snapshot in common with the writer.
+        """
+        self.assertEqual(
+            (None, [b"list"]),
+            (self.filesystem.written_since([Snapshot(name=b"c")]),
+             [command[1] for command in self.commands]))
+
+
 class ZFSCommandTests(SynchronousTestCase):
     """
     Tests for :func:`zfs_command`.
@@ -163,6 +208,271 @@ class ZFSCommandTests(SynchronousTestCase):
         self.assertEqual(self.failureResultOf(result).value, exception)
 
 
+def _finish(reactor, index, reason=None):
+    """
+    Make the ``zfs`` process at the given index exit.
+
+    :param FakeProcessReactor reactor: The reactor the process was spawned
+        with.
+    :param int index: The index of the process in ``reactor.processes``.
+    :param reason: The ``Failure`` the process ends with, by default a
+        successful exit.
+    """
+    if reason is None:
+        reason = Failure(ProcessDone(0))
+    reactor.processes[index].processProtocol.processEnded(reason)
+
+
+class CoalesceTests(SynchronousTestCase):
+    """
+    Tests for ``_coalesce``.
+    """
+    def test_set_same_dataset(self):
+        """
+        ``zfs set`` commands for different properties of the same dataset are
+        combined into one ``zfs set``.
+        """
+        self.assertEqual(
+            [b"set", b"atime=off", b"compression=lz4", b"logbias=latency",
+             b"pool/fs"],
+            _coalesce([b"set", b"atime=off", b"pool/fs"],
+                      [b"set", b"compression=lz4", b"logbias=latency",
+                       b"pool/fs"]))
+
+    def test_set_different_datasets(self):
+        """
+        ``zfs set`` commands for different datasets are not combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"set", b"atime=off", b"pool/fs"],
+                      [b"set", b"atime=off", b"pool/other"]))
+
+    def test_set_same_property(self):
+        """
+        ``zfs set`` commands which set the same property are not combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"set", b"atime=off", b"pool/fs"],
+                      [b"set", b"atime=on", b"pool/fs"]))
+
+    def test_snapshots(self):
+        """
+        ``zfs snapshot`` commands for snapshots in the same pool are combined
+        into one ``zfs snapshot``.
+        """
+        self.assertEqual(
+            [b"snapshot", b"pool/a@x", b"pool/b@y"],
+            _coalesce([b"snapshot", b"pool/a@x"], [b"snapshot", b"pool/b@y"]))
+
+    def test_snapshots_different_pools(self):
+        """
+        ``zfs snapshot`` commands for snapshots in different pools are not
+        combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"snapshot", b"pool/a@x"],
+                      [b"snapshot", b"other/b@y"]))
+
+    def test_snapshot_options(self):
+        """
+        ``zfs snapshot`` commands with options are not combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"snapshot", b"pool/a@x"],
+                      [b"snapshot", b"-r", b"pool/b@y"]))
+
+    def test_duplicate_snapshot(self):
+        """
+        ``zfs snapshot`` commands for the same snapshot are not combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"snapshot", b"pool/a@x"], [b"snapshot", b"pool/a@x"]))
+
+    def test_other_commands(self):
+        """
+        Other ``zfs`` commands are not combined.
+        """
+        self.assertIs(
+            None,
+            _coalesce([b"inherit", b"atime", b"pool/fs"],
+                      [b"inherit", b"compression", b"pool/fs"]))
+
+
+class ZFSCommandQueueTests(SynchronousTestCase):
+    """
+    Tests for ``_ZFSCommandQueue``.
+    """
+    def test_zfs_command_queued(self):
+        """
+        ``zfs_command`` does not launch a ``zfs`` process until the previous
+        command run using the same reactor has finished.
+        """
+        reactor = FakeProcessReactor()
+        zfs_command(reactor, [b"destroy", b"pool/a"])
+        zfs_command(reactor, [b"destroy", b"pool/b"])
+        self.assertEqual(1, len(reactor.processes))
+        _finish(reactor, 0)
+        self.assertEqual(
+            [b"zfs", b"destroy", b"pool/b"], reactor.processes[1].args)
+
+    def test_read_only_not_queued(self):
+        """
+        ``zfs get`` and ``zfs list`` commands are run straight away, even
+        while other commands are running, and do not hold up the commands
+        queued after them.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        queue.run([b"send", b"pool/a@x"])
+        getting = queue.run([b"get", b"all"])
+        listing = queue.run([b"list"])
+        queue.run([b"destroy", b"pool/b"])
+        _finish(reactor, 1)
+        self.assertEqual(
+            ([[b"zfs", b"send", b"pool/a@x"], [b"zfs", b"get", b"all"],
+              [b"zfs", b"list"]], b"", False),
+            ([process.args for process in reactor.processes],
+             self.successResultOf(getting), listing.called))
+        _finish(reactor, 2)
+        _finish(reactor, 0)
+        self.assertEqual(
+            [b"zfs", b"destroy", b"pool/b"], reactor.processes[3].args)
+
+    def test_limit(self):
+        """
+        ``_ZFSCommandQueue`` runs up to ``limit`` commands at once.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor, limit=2)
+        for i in range(3):
+            queue.run([b"destroy", bytes(i)])
+        self.assertEqual(2, len(reactor.processes))
+        _finish(reactor, 1)
+        self.assertEqual(
+            [b"zfs", b"destroy", b"2"], reactor.processes[2].args)
+
+    def test_coalesced(self):
+        """
+        Compatible commands waiting in the queue are run using a single
+        ``zfs`` process whose result is delivered to each of them.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        queue.run([b"destroy", b"pool/old"])
+        results = [
+            queue.run([b"snapshot", b"pool/a@x"]),
+            queue.run([b"snapshot", b"pool/b@x"]),
+            queue.run([b"snapshot", b"pool/c@x"]),
+        ]
+        _finish(reactor, 0)
+        reactor.processes[1].processProtocol.childDataReceived(1, b"out")
+        _finish(reactor, 1)
+        self.assertEqual(
+            ([b"zfs", b"snapshot", b"pool/a@x", b"pool/b@x", b"pool/c@x"],
+             [b"out"] * 3),
+            (reactor.processes[1].args,
+             [self.successResultOf(result) for result in results]))
+
+    def test_coalesced_contiguous_only(self):
+        """
+        Commands are only combined with the compatible commands directly
+        behind them in the queue, so the order in which commands run is
+        preserved.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        queue.run([b"destroy", b"pool/old"])
+        queue.run([b"set", b"atime=off", b"pool/fs"])
+        queue.run([b"inherit", b"logbias", b"pool/fs"])
+        queue.run([b"set", b"compression=lz4", b"pool/fs"])
+        for index in range(3):
+            _finish(reactor, index)
+        self.assertEqual(
+            [[b"zfs", b"destroy", b"pool/old"],
+             [b"zfs", b"set", b"atime=off", b"pool/fs"],
+             [b"zfs", b"inherit", b"logbias", b"pool/fs"],
+             [b"zfs", b"set", b"compression=lz4", b"pool/fs"]],
+            [process.args for process in reactor.processes])
+
+    def test_coalesced_failure(self):
+        """
+        If a combined command fails, each of the commands it was run on behalf
+        of is run again on its own, before any command queued after them, so
+        only the commands which fail by themselves fail.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        queue.run([b"destroy", b"pool/old"])
+        first = queue.run([b"set", b"atime=off", b"pool/fs"])
+        second = queue.run([b"set", b"compression=bad", b"pool/fs"])
+        queue.run([b"set", b"logbias=latency", b"pool/other"])
+        _finish(reactor, 0)
+        _finish(reactor, 1, Failure(ProcessTerminated(1)))
+        self.assertNoResult(first)
+        _finish(reactor, 2)
+        _finish(reactor, 3, Failure(ProcessTerminated(1)))
+        self.assertEqual(
+            ([[b"zfs", b"set", b"atime=off", b"compression=bad", b"pool/fs"],
+              [b"zfs", b"set", b"atime=off", b"pool/fs"],
+              [b"zfs", b"set", b"compression=bad", b"pool/fs"],
+              [b"zfs", b"set", b"logbias=latency", b"pool/other"]],
+             b""),
+            ([process.args for process in reactor.processes[1:]],
+             self.successResultOf(first)))
+        self.failureResultOf(second, CommandFailed)
+
+    def test_next_after_failure(self):
+        """
+        The next queued command is run after a command fails.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        failing = queue.run([b"destroy", b"pool/a"])
+        queue.run([b"destroy", b"pool/b"])
+        _finish(reactor, 0, Failure(ProcessTerminated(2)))
+        self.failureResultOf(failing, BadArguments)
+        self.assertEqual(
+            [b"zfs", b"destroy", b"pool/b"], reactor.processes[1].args)
+
+    def assert_timing_logged(self, logger):
+        """
+        Validate the timing information logged by ``_ZFSCommandQueue``.
+        """
+        messages = LoggedMessage.ofType(logger.messages, ZFS_COMMAND_RUN)
+        self.assertEqual(
+            [dict(zfs_command=b"destroy pool/old", coalesced=1,
+                  wait_time=0.0, run_time=3.0),
+             dict(zfs_command=b"set atime=off compression=lz4 pool/fs",
+                  coalesced=2, wait_time=2.0, run_time=5.0)],
+            [dict((key, message.message[key]) for key in
+                  [u"zfs_command", u"coalesced", u"wait_time", u"run_time"])
+             for message in messages])
+
+    @validateLogging(assert_timing_logged)
+    def test_timing_logged(self, logger):
+        """
+        The time each ``zfs`` process spends waiting in the queue and
+        running is logged along with the number of requested commands it
+        was run on behalf of.
+        """
+        reactor = FakeProcessReactor()
+        queue = _ZFSCommandQueue(reactor)
+        queue.logger = logger
+        queue.run([b"destroy", b"pool/old"])
+        reactor.advance(1)
+        queue.run([b"set", b"atime=off", b"pool/fs"])
+        queue.run([b"set", b"compression=lz4", b"pool/fs"])
+        reactor.advance(2)
+        _finish(reactor, 0)
+        reactor.advance(5)
+        _finish(reactor, 1)
+
+
 def no_such_executable_logged(case, logger):
     """
     Validate the error logging behavior of ``_sync_command_error_squashed``.
@@ -229,6 +539,96 @@ class SyncCommandTests(SynchronousTestCase):
             Logger())
         self.assertIs(None, result)
 
+    def test_output(self):
+        """
+        ``_sync_command_output`` runs the given command and returns what it
+        wrote.
+        """
+        result = _sync_command_output(
+            [b"python", b"-c", b"import sys; sys.stdout.write('hello')"],
+            Logger())
+        self.assertEqual(b"hello", result)
+
+    @validateLogging(error_status_logged)
+    def test_output_error_exit(self, logger):
+        """
+        If the child process run by ``_sync_command_output`` exits with an
+        error status then the function returns ``None``.
+        """
+        result = _sync_command_output(
+            [b"python", b"-c", b"raise SystemExit(1)"],
+            logger)
+        self.assertIs(None, result)
+
+
+class StoragePoolStartServiceTests(SynchronousTestCase):
+    """
+    Tests for ``StoragePool.startService``.
+    """
+    def start(self, output):
+        """
+        Start a ``StoragePool`` with ``zfs get`` reporting the given
+        properties of the root dataset.
+
+        :param output: The ``bytes`` ``zfs get`` writes, or ``None`` if it
+            fails.
+
+        :return: A ``list`` of the arguments of each command run.
+        """
+        commands = []
+
+        def run(arguments, logger):
+            commands.append(arguments)
+            if arguments[:2] == [b"zfs", b"get"]:
+                return output
+            return b""
+        self.patch(zfs, "_sync_command_output", run)
+        pool = StoragePool(
+            FakeProcessReactor(), b"mypool", FilePath(b"/flocker"))
+        pool.startService()
+        return commands
+
+    def test_properties_missing(self):
+        """
+        ``StoragePool.startService`` makes the root dataset read only and
+        not mountable if it is neither.
+        """
+        self.assertEqual(
+            [[b"zfs", b"get", b"-H", b"-o", b"property,value",
+              b"readonly,canmount", b"mypool"],
+             [b"zfs", b"set", b"readonly=on", b"mypool"],
+             [b"zfs", b"set", b"canmount=off", b"mypool"]],
+            self.start(b"readonly\toff\ncanmount\ton\n"))
+
+    def test_properties_set(self):
+        """
+        ``StoragePool.startService`` sets no properties if the root dataset
+        already has them.
+        """
+        self.assertEqual(
+            [[b"zfs", b"get", b"-H", b"-o", b"property,value",
+              b"readonly,canmount", b"mypool"]],
+            self.start(b"readonly\ton\ncanmount\toff\n"))
+
+    def test_some_properties_set(self):
+        """
+        ``StoragePool.startService`` sets only the properties the root
+        dataset does not already have.
+        """
+        self.assertEqual(
+            [[b"zfs", b"set", b"canmount=off", b"mypool"]],
+            self.start(b"readonly\ton\ncanmount\ton\n")[1:])
+
+    def test_get_fails(self):
+        """
+        If the properties of the root dataset cannot be read
+        ``StoragePool.startService`` sets all of them.
+        """
+        self.assertEqual(
+            [[b"zfs", b"set", b"readonly=on", b"mypool"],
+             [b"zfs", b"set", b"canmount=off", b"mypool"]],
+            self.start(None)[1:])
+
 
 class ZFSSnapshotsTests(SynchronousTestCase):
     """Unit tests for ``ZFSSnapshotsTests``."""
@@ -396,6 +796,7 @@ class DatasetInfoTests(SynchronousTestCase):
             dataset=b"foo",
             mountpoint=b"bar",
             refquota=1234,
+            properties=frozenset(),
         )
 
     def test_immutable_dataset(self):
@@ -418,3 +819,177 @@ class DatasetInfoTests(SynchronousTestCase):
         """
         self.assertRaises(
             AttributeError, setattr, self.info, "refquota", 321)
+
+
+class ParseFilesystemsTests(SynchronousTestCase):
+    """
+    Tests for ``_parse_filesystems``.
+    """
+    def test_root_dataset_skipped(self):
+        """
+        The root dataset of the pool is not included in the result.
+        """
+        output = (
+            b"mypool\tmountpoint\t/mypool\tdefault\n"
+            b"mypool\trefquota\t0\tdefault\n"
+        )
+        self.assertEqual([], _parse_filesystems(output, b"mypool"))
+
+    def test_dataset(self):
+        """
+        The mountpoint and refquota of each child dataset is included in the
+        result.
+        """
+        output = (
+            b"mypool/a\tmountpoint\t/flocker/a\tlocal\n"
+            b"mypool/a\trefquota\t1234\tlocal\n"
+            b"mypool/b\tmountpoint\t/flocker/b\tlocal\n"
+            b"mypool/b\trefquota\t0\tdefault\n"
+        )
+        self.assertEqual(
+            [_DatasetInfo(dataset=b"a", mountpoint=b"/flocker/a",
+                          refquota=1234, properties=frozenset()),
+             _DatasetInfo(dataset=b"b", mountpoint=b"/flocker/b",
+                          refquota=None, properties=frozenset())],
+            _parse_filesystems(output, b"mypool"))
+
+    def test_local_properties(self):
+        """
+        Only tunable properties which have been set locally on a dataset are
+        included in its properties.
+        """
+        output = (
+            b"mypool/a\tmountpoint\t/flocker/a\tlocal\n"
+            b"mypool/a\trefquota\t0\tdefault\n"
+            b"mypool/a\tatime\ton\tdefault\n"
+            b"mypool/a\tcompression\tlz4\tlocal\n"
+            b"mypool/a\trecordsize\t8192\tlocal\n"
+            b"mypool/a\tlogbias\tthroughput\tinherited from mypool\n"
+        )
+        [info] = _parse_filesystems(output, b"mypool")
+        self.assertEqual(
+            frozenset({(u"compression", u"lz4"), (u"recordsize", u"8192")}),
+            info.properties)
+
+
+class StoragePoolTunablePropertiesTests(SynchronousTestCase):
+    """
+    Tests for the handling of tunable properties by ``StoragePool``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(self.reactor, b"mypool", FilePath(b"/flocker"))
+        self.volume = Volume(
+            node_id=u"node", name=VolumeName(namespace=u"ns", dataset_id=u"x"),
+            service=None,
+            size=VolumeSize(
+                maximum_size=None,
+                properties=frozenset({(u"compression", u"lz4"),
+                                      (u"atime", u"off")})))
+        self.patch(Volume, "locally_owned", lambda self: True)
+
+    def _finish(self, index):
+        """
+        Make the ``zfs`` process at the given index exit successfully.
+        """
+        self.reactor.processes[index].processProtocol.processEnded(
+            Failure(ProcessDone(0)))
+
+    def test_create(self):
+        """
+        ``StoragePool.create`` passes the volume's properties to
+        ``zfs create``.
+        """
+        self.pool.create(self.volume)
+        self.assertEqual(
+            [b"zfs", b"create",
+             b"-o", b"mountpoint=/flocker/node.ns.x",
+             b"-o", b"readonly=off",
+             b"-o", b"atime=off",
+             b"-o", b"compression=lz4",
+             b"mypool/node.ns.x"],
+            self.reactor.processes[0].args)
+
+    def test_set_properties(self):
+        """
+        ``StoragePool.set_properties`` sets each of the volume's properties
+        and inherits each of the tunable properties it does not specify.
+        """
+        d = self.pool.set_properties(self.volume)
+        for index in range(5):
+            self._finish(index)
+        self.successResultOf(d)
+        self.assertEqual(
+            [[b"zfs", b"set", b"atime=off", b"mypool/node.ns.x"],
+             [b"zfs", b"set", b"compression=lz4", b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"logbias", b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"primarycache", b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"recordsize", b"mypool/node.ns.x"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_set_properties_coalesced(self):
+        """
+        If ``StoragePool.set_properties`` is called while another ``zfs``
+        command is running, the volume's properties are set using a single
+        ``zfs set``.
+        """
+        zfs_command(self.reactor, [b"destroy", b"mypool/old"])
+        d = self.pool.set_properties(self.volume)
+        for index in range(5):
+            self._finish(index)
+        self.successResultOf(d)
+        self.assertEqual(
+            [[b"zfs", b"destroy", b"mypool/old"],
+             [b"zfs", b"set", b"atime=off", b"compression=lz4",
+              b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"logbias", b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"primarycache", b"mypool/node.ns.x"],
+             [b"zfs", b"inherit", b"recordsize", b"mypool/node.ns.x"]],
+            [process.args for process in self.reactor.processes])
+
+    def test_set_properties_failure(self):
+        """
+        If one of the ``zfs`` commands run by ``StoragePool.set_properties``
+        fails, the ``Deferred`` it returns fails with the same error.
+        """
+        d = self.pool.set_properties(self.volume)
+        self.reactor.processes[0].processProtocol.processEnded(
+            Failure(ProcessTerminated(1)))
+        for index in range(1, 5):
+            self._finish(index)
+        self.failureResultOf(d, CommandFailed)
+
+
+class StoragePoolSnapshotTests(SynchronousTestCase):
+    """
+    Tests for ``StoragePool.snapshot``.
+    """
+    def setUp(self):
+        self.reactor = FakeProcessReactor()
+        self.pool = StoragePool(self.reactor, b"mypool", FilePath(b"/flocker"))
+
+    def test_single_command(self):
+        """
+        ``StoragePool.snapshot`` snapshots all of the given volumes using a
+        single ``zfs snapshot`` and fires with the ``Snapshot`` it took.
+        """
+        volumes = [
+            Volume(node_id=u"node",
+                   name=VolumeName(namespace=u"ns", dataset_id=dataset_id),
+                   service=None)
+            for dataset_id in [u"x", u"y"]]
+        d = self.pool.snapshot(volumes)
+        _finish(self.reactor, 0)
+        snapshot = self.successResultOf(d)
+        self.assertEqual(
+            [[b"zfs", b"snapshot",
+              b"mypool/node.ns.x@" + snapshot.name,
+              b"mypool/node.ns.y@" + snapshot.name]],
+            [process.args for process in self.reactor.processes])
+
+    def test_no_volumes(self):
+        """
+        ``StoragePool.snapshot`` does not run ``zfs`` when given no volumes.
+        """
+        self.successResultOf(self.pool.snapshot([]))
+        self.assertEqual([], self.reactor.processes)
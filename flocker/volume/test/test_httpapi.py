@@ -3,38 +3,401 @@
 Tests for ``flocker.volume.httpapi``.
 """
 
+from io import BytesIO
+
 from zope.interface.verify import verifyObject
 
 from twisted.trial.unittest import SynchronousTestCase
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.web.server import Site
-from twisted.web.client import readBody
+from twisted.web.client import FileBodyProducer, readBody
+from twisted.web.http import (
+    BAD_REQUEST, CONFLICT, CREATED, NOT_FOUND, OK,
+)
+from twisted.web.http_headers import Headers
 from twisted.application.service import IService
 
-from ...restapi.testtools import (
-    buildIntegrationTests, loads, goodResult)
+from ...restapi.testtools import buildIntegrationTests, dumps, loads
+from ...restapi._error import NOT_FOUND_DESCRIPTION
 
+from .._ipc import LocalVolumeManager
+from .._model import VolumeSize
+from ..service import Volume, VolumeName
+from ..testtools import create_volume_service
 from ..httpapi import DatasetAPIUser, create_api_service
 
 
 class APITestsMixin(object):
     """
     Integration tests for the Dataset Manager API.
+
+    The API manages the datasets of ``self.volume_service``.  Datasets are
+    pushed and handed off to ``self.destination``, which the hostnames of
+    the known nodes, ``node2.example.com`` and ``node2``, refer to.
     """
-    def test_noop(self):
+    def request(self, method, path, body=None):
+        """
+        Make a request to the API.
+
+        :param bytes method: The HTTP method.
+        :param bytes path: The path of the endpoint.
+        :param body: The JSON request body, or ``None`` for none.
+
+        :return: A ``Deferred`` which fires with a two-tuple of the response
+            code and the decoded response body.
+        """
+        if body is None:
+            headers = None
+            producer = None
+        else:
+            headers = Headers({b"content-type": [b"application/json"]})
+            producer = FileBodyProducer(BytesIO(dumps(body)))
+        requesting = self.agent.request(method, path, headers, producer)
+
+        def got_response(response):
+            reading = readBody(response)
+            reading.addCallback(lambda body: (response.code, loads(body)))
+            return reading
+        requesting.addCallback(got_response)
+        return requesting
+
+    def assertResponse(self, expected, method, path, body=None):
+        """
+        Assert that a request gets the expected response.
+
+        :param tuple expected: The expected response code and ``result`` of
+            the response body.
+
+        :return: A ``Deferred`` which fires when the check has been made.
+        """
+        requesting = self.request(method, path, body)
+        requesting.addCallback(lambda response: self.assertEqual(
+            expected, (response[0], response[1][u"result"])))
+        return requesting
+
+    def create(self, dataset_id, maximum_size=None):
+        """
+        Create a dataset owned by the node directly.
+        """
+        volume = self.volume_service.get(
+            VolumeName(namespace=u"default", dataset_id=dataset_id),
+            size=VolumeSize(maximum_size=maximum_size))
+        self.successResultOf(self.volume_service.create(volume))
+        return volume
+
+    def dataset(self, dataset_id, maximum_size=None, owner=None):
+        """
+        :return: The description of a dataset in the default namespace.
+        """
+        if owner is None:
+            owner = self.volume_service.node_id
+        return {
+            u"namespace": u"default",
+            u"dataset_id": dataset_id,
+            u"owner": owner,
+            u"locally_owned": owner == self.volume_service.node_id,
+            u"maximum_size": maximum_size,
+        }
+
+    def test_list_empty(self):
+        """
+        ``GET /v1/datasets`` returns an empty list if the node has no
+        datasets.
+        """
+        return self.assertResponse((OK, []), b"GET", b"/v1/datasets")
+
+    def test_list(self):
+        """
+        ``GET /v1/datasets`` describes each dataset on the node, sorted by
+        namespace and dataset ID.
+        """
+        self.create(u"b", maximum_size=1024 * 1024)
+        self.create(u"a")
+        return self.assertResponse(
+            (OK, [self.dataset(u"a"),
+                  self.dataset(u"b", maximum_size=1024 * 1024)]),
+            b"GET", b"/v1/datasets")
+
+    def test_create(self):
+        """
+        ``POST /v1/datasets`` creates a dataset owned by the node and
+        responds with its description.
+        """
+        creating = self.assertResponse(
+            (CREATED, dict(self.dataset(u"x"), namespace=u"ns")),
+            b"POST", b"/v1/datasets",
+            {u"namespace": u"ns", u"dataset_id": u"x"})
+        creating.addCallback(lambda _: self.assertEqual(
+            [VolumeName(namespace=u"ns", dataset_id=u"x")],
+            [volume.name for volume in self.successResultOf(
+                self.volume_service.enumerate())]))
+        return creating
+
+    def test_create_default_namespace(self):
+        """
+        A dataset created without a namespace is put in the ``default``
+        namespace, as application volumes are.
+        """
+        return self.assertResponse(
+            (CREATED, self.dataset(u"x", maximum_size=1024 * 1024)),
+            b"POST", b"/v1/datasets",
+            {u"dataset_id": u"x", u"maximum_size": 1024 * 1024})
+
+    def test_create_exists(self):
+        """
+        Creating a dataset which already exists is rejected as a conflict.
+        """
+        self.create(u"x")
+        requesting = self.request(
+            b"POST", b"/v1/datasets", {u"dataset_id": u"x"})
+        requesting.addCallback(lambda response: self.assertEqual(
+            (CONFLICT, True), (response[0], response[1][u"error"])))
+        return requesting
+
+    def test_create_invalid(self):
+        """
+        Creating a dataset whose namespace includes a period is rejected as
+        a bad request.
+        """
+        requesting = self.request(
+            b"POST", b"/v1/datasets",
+            {u"namespace": u"a.b", u"dataset_id": u"x"})
+        requesting.addCallback(lambda response: self.assertEqual(
+            (BAD_REQUEST, True), (response[0], response[1][u"error"])))
+        return requesting
+
+    def test_resize(self):
+        """
+        ``POST /v1/datasets/<namespace>/<dataset_id>/resize`` changes the
+        maximum size of the dataset.
         """
-        The ``/noop`` commands return JSON-encoded ``null``.
+        self.create(u"x")
+        resizing = self.assertResponse(
+            (OK, self.dataset(u"x", maximum_size=1024 * 1024)),
+            b"POST", b"/v1/datasets/default/x/resize",
+            {u"maximum_size": 1024 * 1024})
+        resizing.addCallback(lambda _: self.assertResponse(
+            (OK, [self.dataset(u"x", maximum_size=1024 * 1024)]),
+            b"GET", b"/v1/datasets"))
+        return resizing
+
+    def test_resize_not_found(self):
+        """
+        Resizing a dataset the node does not have responds with not found.
         """
-        requesting = self.agent.request(b"GET", b"/noop")
-        requesting.addCallback(readBody)
-        requesting.addCallback(lambda body: self.assertEqual(
-            goodResult(None), loads(body)))
+        requesting = self.request(
+            b"POST", b"/v1/datasets/default/x/resize",
+            {u"maximum_size": None})
+        requesting.addCallback(lambda response: self.assertEqual(
+            NOT_FOUND, response[0]))
         return requesting
 
+    def test_push(self):
+        """
+        ``POST /v1/datasets/<namespace>/<dataset_id>/push`` pushes the
+        dataset to the destination, which then has a copy owned by the
+        node.
+        """
+        volume = self.create(u"x")
+        volume.get_filesystem().get_path().child(b"data").setContent(b"xyz")
+        pushing = self.assertResponse(
+            (OK, True), b"POST", b"/v1/datasets/default/x/push",
+            {u"destination": u"node2.example.com"})
+
+        def pushed(_):
+            copy = Volume(node_id=self.volume_service.node_id,
+                          name=volume.name, service=self.destination)
+            self.assertEqual(
+                b"xyz",
+                copy.get_filesystem().get_path().child(
+                    b"data").getContent())
+        pushing.addCallback(pushed)
+        return pushing
+
+    def test_handoff(self):
+        """
+        ``POST /v1/datasets/<namespace>/<dataset_id>/handoff`` hands the
+        dataset off to the destination, which then owns it.
+        """
+        self.create(u"x")
+        return self.assertResponse(
+            (OK, self.dataset(u"x", owner=self.destination.node_id)),
+            b"POST", b"/v1/datasets/default/x/handoff",
+            {u"destination": u"node2.example.com"})
+
+    def test_handoff_not_owned(self):
+        """
+        Handing off a dataset the node does not own is rejected as a
+        conflict.
+        """
+        volume = self.create(u"x")
+        self.successResultOf(
+            volume.change_owner(self.destination.node_id))
+        requesting = self.request(
+            b"POST", b"/v1/datasets/default/x/handoff",
+            {u"destination": u"node2.example.com"})
+        requesting.addCallback(lambda response: self.assertEqual(
+            CONFLICT, response[0]))
+        return requesting
+
+    def test_push_unknown_node(self):
+        """
+        Pushing a dataset to a node which is not one of the cluster's is
+        rejected as a bad request, and nothing is pushed.
+        """
+        self.create(u"x")
+        pushing = self.assertResponse(
+            (BAD_REQUEST,
+             {u"description":
+              u"The destination is not a node of the cluster."}),
+            b"POST", b"/v1/datasets/default/x/push",
+            {u"destination": u"attacker.example.com"})
+        pushing.addCallback(lambda _: self.assertEqual(
+            [], list(self.successResultOf(self.destination.enumerate()))))
+        return pushing
+
+    def test_handoff_invalid_destination(self):
+        """
+        A destination which is not a hostname is rejected as a bad request.
+        """
+        self.create(u"x")
+        requesting = self.request(
+            b"POST", b"/v1/datasets/default/x/handoff",
+            {u"destination": u"-oProxyCommand=true"})
+        requesting.addCallback(lambda response: self.assertEqual(
+            BAD_REQUEST, response[0]))
+        return requesting
+
+    def test_snapshots(self):
+        """
+        ``GET /v1/datasets/<namespace>/<dataset_id>/snapshots`` lists the
+        names of the snapshots of the dataset.
+        """
+        volume = self.create(u"x")
+        snapshot = self.successResultOf(
+            self.volume_service.snapshot([volume]))
+        return self.assertResponse(
+            (OK, [snapshot.name.decode("ascii")]),
+            b"GET", b"/v1/datasets/default/x/snapshots")
+
+    def test_bulk_create(self):
+        """
+        ``POST /v1/bulk/create`` creates each of the datasets, and responds
+        with the result of creating each in the same order.  Datasets which
+        cannot be created do not stop the others.
+        """
+        self.create(u"exists")
+        creating = self.request(b"POST", b"/v1/bulk/create", {u"datasets": [
+            {u"dataset_id": u"a"},
+            {u"dataset_id": u"exists"},
+            {u"dataset_id": u"b", u"maximum_size": 1024 * 1024},
+            {u"dataset_id": u"a"},
+        ]})
+        creating.addCallback(lambda response: self.assertEqual(
+            (OK, [(False, self.dataset(u"a")), (True, None),
+                  (False, self.dataset(u"b", maximum_size=1024 * 1024)),
+                  (True, None)]),
+            (response[0],
+             [(item[u"error"], None if item[u"error"] else item[u"result"])
+              for item in response[1][u"result"]])))
+        creating.addCallback(lambda _: self.assertResponse(
+            (OK, [self.dataset(u"a"),
+                  self.dataset(u"b", maximum_size=1024 * 1024),
+                  self.dataset(u"exists")]),
+            b"GET", b"/v1/datasets"))
+        return creating
+
+    def test_bulk_resize(self):
+        """
+        ``POST /v1/bulk/resize`` changes the maximum size of each of the
+        datasets, and responds with not found for datasets the node does not
+        have.
+        """
+        self.create(u"a")
+        self.create(u"b")
+        return self.assertResponse(
+            (OK, [{u"error": False,
+                   u"result": self.dataset(u"a", maximum_size=1024 * 1024)},
+                  {u"error": True,
+                   u"result": {u"description": NOT_FOUND_DESCRIPTION}},
+                  {u"error": False,
+                   u"result": self.dataset(u"b", maximum_size=None)}]),
+            b"POST", b"/v1/bulk/resize", {u"datasets": [
+                {u"dataset_id": u"a", u"maximum_size": 1024 * 1024},
+                {u"dataset_id": u"c", u"maximum_size": 1024 * 1024},
+                {u"dataset_id": u"b", u"maximum_size": None},
+            ]})
+
+    def test_bulk_push(self):
+        """
+        ``POST /v1/bulk/push`` pushes each of the datasets.
+        """
+        self.create(u"a")
+        self.create(u"b")
+        return self.assertResponse(
+            (OK, [{u"error": False, u"result": True},
+                  {u"error": False, u"result": True}]),
+            b"POST", b"/v1/bulk/push", {u"datasets": [
+                {u"dataset_id": u"a", u"destination": u"node2"},
+                {u"dataset_id": u"b", u"destination": u"node2"},
+            ]})
+
+    def test_bulk_handoff(self):
+        """
+        ``POST /v1/bulk/handoff`` hands off each of the datasets.
+        """
+        self.create(u"a")
+        self.create(u"b")
+        owner = self.destination.node_id
+        return self.assertResponse(
+            (OK, [{u"error": False,
+                   u"result": self.dataset(u"a", owner=owner)},
+                  {u"error": False,
+                   u"result": self.dataset(u"b", owner=owner)}]),
+            b"POST", b"/v1/bulk/handoff", {u"datasets": [
+                {u"dataset_id": u"a", u"destination": u"node2"},
+                {u"dataset_id": u"b", u"destination": u"node2"},
+            ]})
+
+    def test_bulk_handoff_unknown_node(self):
+        """
+        ``POST /v1/bulk/handoff`` responds with an error for datasets whose
+        destination is not a node of the cluster, without stopping the
+        others.
+        """
+        self.create(u"a")
+        self.create(u"b")
+        owner = self.destination.node_id
+        return self.assertResponse(
+            (OK, [{u"error": True,
+                   u"result": {u"description":
+                               u"The destination is not a node of the "
+                               u"cluster."}},
+                  {u"error": False,
+                   u"result": self.dataset(u"b", owner=owner)}]),
+            b"POST", b"/v1/bulk/handoff", {u"datasets": [
+                {u"dataset_id": u"a", u"destination": u"node3"},
+                {u"dataset_id": u"b", u"destination": u"node2"},
+            ]})
+
+
+def fixture(test):
+    """
+    Create the API for a test, managing a new volume service which is the
+    test's ``volume_service`` attribute and pushing to another which is its
+    ``destination`` attribute.
+    """
+    test.volume_service = create_volume_service(test)
+    test.destination = create_volume_service(test)
+    return DatasetAPIUser(
+        test.volume_service,
+        lambda hostname: LocalVolumeManager(test.destination),
+        lambda: frozenset([u"node2.example.com", u"node2"])).app
+
 
 RealTestsAPI, MemoryTestsAPI = buildIntegrationTests(
-    APITestsMixin, "API", lambda test: DatasetAPIUser().app)
+    APITestsMixin, "API", fixture)
 
 
 class CreateAPIServiceTests(SynchronousTestCase):
@@ -47,7 +410,8 @@ class CreateAPIServiceTests(SynchronousTestCase):
         """
         reactor = MemoryReactor()
         endpoint = TCP4ServerEndpoint(reactor, 6789)
-        verifyObject(IService, create_api_service(endpoint))
+        verifyObject(IService, create_api_service(
+            endpoint, create_volume_service(self)))
 
     def test_listens_endpoint(self):
         """
@@ -56,7 +420,7 @@ class CreateAPIServiceTests(SynchronousTestCase):
         """
         reactor = MemoryReactor()
         endpoint = TCP4ServerEndpoint(reactor, 6789)
-        service = create_api_service(endpoint)
+        service = create_api_service(endpoint, create_volume_service(self))
         self.addCleanup(service.stopService)
         service.startService()
         server = reactor.tcpServers[0]
@@ -10,7 +10,7 @@ from twisted.application.service import Service
 from twisted.python.usage import Options
 
 from ...testtools import (
-    StandardOptionsTestsMixin
+    StandardOptionsTestsMixin, assert_not_imported
 )
 from ..testtools import (
     make_volume_options_tests
@@ -61,3 +61,17 @@ class StandardVolumeOptionsTests(make_volume_options_tests(VolumeOptions)):
     """
     Tests for ``VolumeService`` specific arguments of ``VolumeOptions``.
     """
+
+
+class ImportTests(SynchronousTestCase):
+    """
+    Tests for what importing ``flocker.volume.script`` loads.
+    """
+    def test_lazy_imports(self):
+        """
+        Importing ``flocker.volume.script``, as ``flocker-volume`` does every
+        time it is run, loads neither docker-py nor any HTTP libraries.
+        """
+        assert_not_imported(
+            self, b"flocker.volume.script",
+            [b"docker", b"requests", b"klein", b"treq", b"twisted.web"])
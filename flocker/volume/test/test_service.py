@@ -16,10 +16,14 @@ from zope.interface import implementer
 from zope.interface.verify import verifyObject
 
 from twisted.application.service import IService, Service
+from twisted.internet.defer import Deferred, succeed
 from twisted.internet.task import Clock
 from twisted.python.filepath import FilePath, Permissions
 from twisted.trial.unittest import SynchronousTestCase, TestCase
 
+from eliot.testing import (
+    validateLogging, LoggedMessage, assertContainsFields)
+
 from ..service import (
     VolumeService, CreateConfigurationError, Volume, VolumeName,
     WAIT_FOR_VOLUME_INTERVAL, VolumeScript, ICommandLineVolumeScript,
@@ -27,9 +31,10 @@ from ..service import (
     )
 from ..script import VolumeOptions
 
-from ..filesystems.memory import FilesystemStoragePool
-from ..filesystems.zfs import StoragePool
+from ..filesystems.memory import FilesystemStoragePool, DirectoryFilesystem
+from ..filesystems.zfs import StoragePool, Snapshot
 from .._ipc import RemoteVolumeManager, LocalVolumeManager
+from .._logging import PRECOPY_ROUND, HANDOFF
 from ..testtools import create_volume_service
 from ...common import FakeNode
 from ...testtools import (
@@ -138,6 +143,16 @@ class VolumeSizeComparisonTests(TestCase):
         b = VolumeSize(maximum_size=54321)
         assert_not_equal_comparison(self, a, b)
 
+    def test_properties_differ(self):
+        """
+        Two :class:`VolumeSize` instances with different values for the
+        ``properties`` attribute do not compare equal to each other.
+        """
+        a = VolumeSize(maximum_size=12345,
+                       properties=frozenset({(u"compression", u"lz4")}))
+        b = VolumeSize(maximum_size=12345)
+        assert_not_equal_comparison(self, a, b)
+
 
 class VolumeServiceStartupTests(TestCase):
     """
@@ -271,6 +286,26 @@ class VolumeServiceAPITests(TestCase):
         self.assertEqual(created_fs.size, VolumeSize(maximum_size=None))
         self.assertEqual(resized_volume.size, resized_fs.size)
 
+    def test_set_properties_applied(self):
+        """
+        ``set_properties`` returns a ``Deferred`` that fires with the given
+        ``Volume`` once its properties have been applied to the associated
+        filesystem.
+        """
+        pool = FilesystemStoragePool(FilePath(self.mktemp()))
+        service = VolumeService(FilePath(self.mktemp()), pool, reactor=Clock())
+        service.startService()
+        self.successResultOf(service.create(service.get(MY_VOLUME)))
+        volume_size = VolumeSize(
+            maximum_size=None,
+            properties=frozenset({(u"atime", u"off"),
+                                  (u"recordsize", u"8192")}))
+        volume = service.get(MY_VOLUME, size=volume_size)
+        tuned_volume = self.successResultOf(service.set_properties(volume))
+        [filesystem] = self.successResultOf(pool.enumerate())
+        self.assertEqual((volume, volume_size),
+                         (tuned_volume, filesystem.size))
+
     def test_create_result(self):
         """``create()`` returns a ``Deferred`` that fires with a ``Volume``."""
         pool = FilesystemStoragePool(FilePath(self.mktemp()))
@@ -310,6 +345,15 @@ class VolumeServiceAPITests(TestCase):
         size = VolumeSize(maximum_size=100000000)
         self._creation_test(lambda service: service.get(MY_VOLUME, size=size))
 
+    def test_create_filesystem_with_properties(self):
+        """
+        ``create()`` creates the volume's filesystem respecting the specified
+        ``VolumeSize`` properties.
+        """
+        size = VolumeSize(maximum_size=None,
+                          properties=frozenset({(u"compression", u"lz4")}))
+        self._creation_test(lambda service: service.get(MY_VOLUME, size=size))
+
     def test_create_filesystem(self):
         """
         ``create()`` creates the volume's filesystem.
@@ -483,6 +527,83 @@ class VolumeServiceAPITests(TestCase):
             [b"incremental stream based on", b"stuff"],
             writer.getvalue().splitlines()[-2:])
 
+    def test_push_destination_current(self):
+        """
+        If nothing has been written to the volume since the latest snapshot
+        the destination has, pushing it sends nothing and the result is
+        ``False``.
+        """
+        self.patch(DirectoryFilesystem, "written_since",
+                   lambda filesystem, remote_snapshots: 0)
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        # Only `flocker-volume snapshots` is expected to be run.
+        node = FakeNode([b"snap\n"])
+
+        result = self.successResultOf(
+            service.push(volume, RemoteVolumeManager(node)))
+
+        self.assertEqual(
+            (False, b"snapshots"),
+            (result, node.remote_command[3]))
+
+    def test_push_changed(self):
+        """
+        If data has been written to the volume since the latest snapshot the
+        destination has, pushing it sends the data and the result is
+        ``True``.
+        """
+        self.patch(DirectoryFilesystem, "written_since",
+                   lambda filesystem, remote_snapshots: 1024)
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        node = FakeNode([b"snap\n"])
+
+        result = self.successResultOf(
+            service.push(volume, RemoteVolumeManager(node)))
+
+        self.assertEqual((True, b"receive"), (result, node.remote_command[3]))
+
+    def test_push_existing_snapshot(self):
+        """
+        If a snapshot is given, pushing a volume reads the contents of that
+        snapshot of the volume's filesystem.
+        """
+        read_snapshots = []
+
+        @contextmanager
+        def reader(filesystem, remote_snapshots=None, snapshot=None):
+            read_snapshots.append(snapshot)
+            yield BytesIO()
+        self.patch(DirectoryFilesystem, "reader", reader)
+
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        snapshot = Snapshot(name=b"batch")
+        node = FakeNode([b""])
+
+        self.successResultOf(
+            service.push(volume, RemoteVolumeManager(node), snapshot))
+
+        self.assertEqual([snapshot], read_snapshots)
+
+    def test_snapshot(self):
+        """
+        ``VolumeService.snapshot`` snapshots all of the given volumes at once
+        and fires with the resulting ``Snapshot``.
+        """
+        service = create_volume_service(self)
+        volumes = [
+            self.successResultOf(service.create(service.get(name)))
+            for name in [MY_VOLUME, MY_VOLUME2]]
+
+        snapshot = self.successResultOf(service.snapshot(volumes))
+
+        self.assertEqual(
+            [[snapshot], [snapshot]],
+            [self.successResultOf(volume.get_filesystem().snapshots())
+             for volume in volumes])
+
     def test_receive_local_node_id(self):
         """
         If a volume with the same node ID as the service is received,
@@ -654,6 +775,141 @@ class VolumeServiceAPITests(TestCase):
         self.failureResultOf(service.handoff(remote_volume, None),
                              ValueError)
 
+    def _precopy_service(self, written):
+        """
+        Create a ``VolumeService`` with a volume whose filesystem reports the
+        given amounts of data written since each push.
+
+        :param list written: The successive results of ``written_since``.
+
+        :return: A tuple of the service, the volume, and a ``list`` to which
+            the arguments of each push are appended.
+        """
+        written = list(written)
+        self.patch(DirectoryFilesystem, "written_since",
+                   lambda filesystem, remote_snapshots: written.pop(0))
+        service = create_volume_service(self)
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        pushes = []
+
+        def push(*args):
+            pushes.append(args)
+            return succeed(True)
+        self.patch(service, "push", push)
+        return service, volume, pushes
+
+    def test_precopy_until_below_threshold(self):
+        """
+        ``VolumeService.precopy`` pushes the volume repeatedly until the data
+        written since the previous push is no more than the threshold.  Only
+        the first push uses the given snapshot.
+        """
+        service, volume, pushes = self._precopy_service([100, 50, 10, 5])
+        snapshot = Snapshot(name=b"batch")
+        self.successResultOf(
+            service.precopy(volume, None, snapshot, threshold=10))
+        self.assertEqual(
+            [(volume, None, snapshot), (volume, None, None),
+             (volume, None, None)],
+            pushes)
+
+    def test_precopy_stops_when_not_shrinking(self):
+        """
+        ``VolumeService.precopy`` stops pushing the volume once the data
+        written since the previous push stops shrinking.
+        """
+        service, volume, pushes = self._precopy_service([100, 120, 5])
+        self.successResultOf(service.precopy(volume, None, threshold=10))
+        self.assertEqual(2, len(pushes))
+
+    def test_precopy_maximum_rounds(self):
+        """
+        ``VolumeService.precopy`` makes no more than ``max_rounds`` pushes.
+        """
+        service, volume, pushes = self._precopy_service([100, 90, 80, 70])
+        self.successResultOf(
+            service.precopy(volume, None, threshold=10, max_rounds=3))
+        self.assertEqual(3, len(pushes))
+
+    def test_precopy_unmeasurable(self):
+        """
+        ``VolumeService.precopy`` pushes the volume once if the data written
+        since the push cannot be measured.
+        """
+        service, volume, pushes = self._precopy_service([None, 5])
+        self.successResultOf(service.precopy(volume, None))
+        self.assertEqual(1, len(pushes))
+
+    def assert_precopy_rounds_logged(self, logger):
+        """
+        Each pre-copy push is logged with the data written since.
+        """
+        messages = LoggedMessage.ofType(logger.messages, PRECOPY_ROUND)
+        self.assertEqual(
+            [(MY_VOLUME.to_bytes(), 1, 100), (MY_VOLUME.to_bytes(), 2, 5)],
+            [(message.message[u"volume"], message.message[u"round"],
+              message.message[u"written"]) for message in messages])
+
+    @validateLogging(assert_precopy_rounds_logged)
+    def test_precopy_logged(self, logger):
+        """
+        ``VolumeService.precopy`` logs the data written since each push.
+        """
+        service, volume, pushes = self._precopy_service([100, 5])
+        service.logger = logger
+        self.successResultOf(service.precopy(volume, None, threshold=10))
+
+    def assert_handoff_logged(self, logger):
+        """
+        The duration of the handoff is logged.
+        """
+        [message] = LoggedMessage.ofType(logger.messages, HANDOFF)
+        assertContainsFields(
+            self, message.message,
+            {u"volume": MY_VOLUME.to_bytes(), u"duration": 3.0})
+
+    @validateLogging(assert_handoff_logged)
+    def test_handoff_logged(self, logger):
+        """
+        ``VolumeService.handoff()`` logs how long the handoff took, during
+        which the volume's application is not running.
+        """
+        clock = Clock()
+        service = VolumeService(
+            FilePath(self.mktemp()),
+            FilesystemStoragePool(FilePath(self.mktemp())), reactor=clock)
+        service.startService()
+        service.logger = logger
+        volume = self.successResultOf(service.create(service.get(MY_VOLUME)))
+        pushing = Deferred()
+        self.patch(service, "push", lambda *args: pushing)
+
+        class Destination(object):
+            def acquire(self, volume):
+                return u"new-node"
+
+        handing_off = service.handoff(volume, Destination())
+        clock.advance(3)
+        pushing.callback(True)
+        self.successResultOf(handing_off)
+
+    def test_handoff_pushes_snapshot(self):
+        """
+        ``VolumeService.handoff()`` pushes the given snapshot of the volume.
+        """
+        service = create_volume_service(self)
+        pushes = []
+
+        def push(*args):
+            pushes.append(args)
+            return Deferred()
+        self.patch(service, "push", push)
+        volume = service.get(MY_VOLUME)
+        snapshot = Snapshot(name=b"batch")
+        destination = LocalVolumeManager(create_volume_service(self))
+        service.handoff(volume, destination, snapshot)
+        self.assertEqual([(volume, destination, snapshot)], pushes)
+
     def test_handoff_destination_acquires(self):
         """
         ``VolumeService.handoff()`` makes the remote node owner of the volume
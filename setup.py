@@ -86,7 +86,8 @@ setup(
     # This setuptools helper will find everything that looks like a *Python*
     # package (in other words, things that can be imported) which are part of
     # the Flocker package.
-    packages=find_packages(exclude=('admin', 'admin.*')),
+    packages=find_packages(
+        exclude=('admin', 'admin.*', 'benchmark', 'benchmark.*')),
 
     package_data={
         'flocker.node.functional': [
@@ -104,6 +105,7 @@ setup(
             'flocker-changestate = flocker.node.script:flocker_changestate_main',
             'flocker-reportstate = flocker.node.script:flocker_reportstate_main',
             'flocker-serve = flocker.node.script:flocker_serve_main',
+            'flocker-relay = flocker.cli.script:flocker_relay_main',
         ],
     },
 